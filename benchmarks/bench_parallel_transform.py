@@ -0,0 +1,104 @@
+"""
+Benchmark the sharded parallel transform from 1 to N worker processes
+
+Runs every worker count on a uniform user distribution and on a skewed one,
+where a single heavy user owns ``--heavy-share`` of all rows. The heavy
+user's bucket cannot be split, so it caps the speedup of the rules step.
+
+Usage:
+    python benchmarks/bench_parallel_transform.py --rows 2000000 --users 100000
+    python benchmarks/bench_parallel_transform.py --rows 2000000 --max-workers 8 --heavy-share 0.25
+"""
+
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+import transform as tr  # noqa: E402
+from intermediate import write_frame  # noqa: E402
+
+
+def make_raw(directory: str, rows: int, users: int, heavy_share: float, seed: int):
+    """Write api/db extracts; ``heavy_share`` of the rows belong to user 0"""
+    rng = np.random.default_rng(seed)
+    user_ids = rng.integers(1, users, rows)
+    user_ids[rng.random(rows) < heavy_share] = 0
+    start = np.datetime64("2024-01-01T00:00:00", "s").astype(np.int64)
+    times = pd.to_datetime(start + rng.integers(0, 30 * 86400, rows), unit="s")
+    half = rows // 2
+    api = pd.DataFrame({
+        "transaction_id": [f"api-{i}" for i in rng.integers(0, half * 0.95, half)],
+        "user_id": user_ids[:half],
+        "amount": rng.uniform(1e4, 8e7, half).round(2),
+        "currency": "IDR",
+        "timestamp": times[:half].strftime("%Y-%m-%dT%H:%M:%S"),
+        "merchant": rng.choice(["Tokopedia", "Binance", "OVO", "Shopee"], half),
+        "status": "completed",
+        "location": "Jakarta",
+    })
+    n_db = rows - half
+    db = pd.DataFrame({
+        "id": rng.integers(0, n_db * 0.95, n_db),
+        "user_id": user_ids[half:],
+        "account_number": rng.integers(10**9, 10**10, n_db).astype(str),
+        "amount": rng.uniform(1e4, 6e7, n_db).round(2),
+        "transaction_type": rng.choice(["debit", "credit"], n_db),
+        "date": times[half:],
+        "location": "Bali",
+    })
+    api_path, db_path = os.path.join(directory, "api.parquet"), os.path.join(directory, "db.parquet")
+    write_frame(api, api_path)
+    write_frame(db, db_path)
+    return api_path, db_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--buckets", type=int, default=tr.TRANSFORM_BUCKETS)
+    parser.add_argument("--heavy-share", type=float, default=0.2,
+                        help="Share of rows owned by one user in the skewed scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    counts = sorted({1, args.max_workers} | {2 ** i for i in range(1, 8) if 2 ** i < args.max_workers})
+    print(f"rows={args.rows:,} users={args.users:,} buckets={args.buckets} cpus={os.cpu_count()}")
+    print(f"{'scenario':<10} {'workers':>7} {'wall':>8} {'speedup':>8} {'split':>7} {'dedup':>7} "
+          f"{'rules':>7} {'merge':>7}")
+
+    for scenario, share in (("uniform", 0.0), ("skewed", args.heavy_share)):
+        tmpdir = tempfile.mkdtemp(prefix="bench_parallel_")
+        try:
+            api_path, db_path = make_raw(tmpdir, args.rows, args.users, share, args.seed)
+            out_path = os.path.join(tmpdir, "cleaned.parquet")
+            base = None
+            for workers in counts:
+                timings = {}
+                start = time.perf_counter()
+                tr.transform_parallel(api_path, db_path, out_path, workers=workers, buckets=args.buckets,
+                                      spill_dir=tmpdir, timings=timings)
+                wall = time.perf_counter() - start
+                base = base or wall
+                print(f"{scenario:<10} {workers:>7} {wall:>7.2f}s {base / wall:>7.2f}x "
+                      + " ".join(f"{timings[k]:>6.2f}s" for k in ("split", "dedup", "rules", "merge")))
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        if share:
+            print(f"{'':<10} heavy user = {share:.0%} of rows: its bucket is one task, so the rules step "
+                  f"cannot drop below ~{share:.0%} of its 1-worker time")
+
+
+if __name__ == "__main__":
+    main()
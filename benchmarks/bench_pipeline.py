@@ -0,0 +1,217 @@
+"""
+Stage-level pipeline benchmark with regression thresholds
+
+Generates raw API (JSON) and DB (CSV) extracts at each scale, then runs
+every stage on them in a fresh process: extract_api and extract_db (local
+mode), transform (memory mode), data_quality, and load into a local
+database stand-in (SQLite by default, or --db-uri). Each stage records
+wall time, rows/sec and the peak RSS of its process.
+
+Results are written as JSON to --output. With a baseline (--baseline), a
+stage whose wall time or peak RSS exceeds its baseline by more than the
+threshold is a regression and the run exits with status 1. --save-baseline
+stores the current results as the new baseline.
+
+Usage:
+    python benchmarks/bench_pipeline.py --scales 10000,100000 --save-baseline
+    python benchmarks/bench_pipeline.py --scales 10000,100000 --threshold 0.25
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "scripts"))
+
+from generate_synthetic_data import generate  # noqa: E402
+
+RESULTS_FILE = os.path.join(BENCH_DIR, "results", "pipeline.json")
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline", "pipeline.json")
+STAGES = ["extract_api", "extract_db", "transform", "data_quality", "load"]
+
+
+def make_raw(directory: str, rows: int, seed: int):
+    """Write raw API JSON and DB CSV (half the rows each) with the synthetic generator"""
+    os.makedirs(os.path.join(directory, "processed"), exist_ok=True)
+    generate(os.path.join(directory, "raw"), api_rows=rows // 2, db_rows=rows - rows // 2,
+             start="2024-01-01", users=max(1, rows // 20), seed=seed)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process (MB)"""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux melaporkan KB, macOS byte
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_stage(stage: str, directory: str, db_uri: str) -> dict:
+    """Run one stage on the files in ``directory`` (called in a fresh process)"""
+    import logging
+    logging.disable(logging.INFO)
+    raw, processed = os.path.join(directory, "raw"), os.path.join(directory, "processed")
+    api_file, db_file = os.path.join(raw, "api_extracted.parquet"), os.path.join(raw, "db_extracted.parquet")
+    out_file = os.path.join(processed, "cleaned_transactions.parquet")
+
+    start = time.perf_counter()
+    if stage == "extract_api":
+        from extract_api import extract_local
+        rows = extract_local(os.path.join(raw, "api_transactions.json"), api_file)
+    elif stage == "extract_db":
+        from extract_db import extract_csv_mock
+        rows = extract_csv_mock(os.path.join(raw, "db_transactions.csv"), db_file)
+    elif stage == "transform":
+        import transform as tr
+        from intermediate import write_frame
+        from schema import to_storage
+        all_df = tr.transform(tr.read_api(api_file), tr.read_db(db_file))
+        write_frame(to_storage(all_df[tr.OUTPUT_COLUMNS]), out_file, tr.OUTPUT_DTYPES)
+        rows = len(all_df)
+    elif stage == "data_quality":
+        from intermediate import read_frame
+        from data_quality import QualityProfile
+        df = read_frame(out_file)
+        profile = QualityProfile.of(df)
+        profile.results()
+        profile.validate()
+        rows = len(df)
+    elif stage == "load":
+        import load as ld
+        from sqlalchemy import create_engine
+        warehouse = os.path.join(directory, "warehouse.db")
+        if not db_uri and os.path.exists(warehouse):
+            os.remove(warehouse)  # setiap run mulai dari warehouse kosong
+        engine = create_engine(db_uri or f"sqlite:///{warehouse}")
+        ld.ensure_table(engine)
+        rows = ld.load(engine, ld.read_processed(out_file), mode="copy" if db_uri else "insert")["rows"]
+        engine.dispose()
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+    seconds = time.perf_counter() - start
+    return {
+        "rows": int(rows),
+        "seconds": round(seconds, 4),
+        "rows_per_sec": round(rows / seconds, 1) if seconds > 0 else float(rows),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_scale(rows: int, repeat: int, db_uri: str, seed: int) -> list:
+    """All stages at one scale; the fastest of ``repeat`` runs is kept per stage"""
+    results = []
+    ctx = mp.get_context("spawn")
+    directory = tempfile.mkdtemp(prefix="bench_pipeline_")
+    try:
+        make_raw(directory, rows, seed)
+        for stage in STAGES:
+            runs = []
+            for _ in range(repeat):
+                # Proses baru per run: peak RSS milik stage ini saja
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                    runs.append(pool.submit(run_stage, stage, directory, db_uri).result())
+            best = min(runs, key=lambda r: r["seconds"])
+            best["peak_rss_mb"] = max(r["peak_rss_mb"] for r in runs)
+            results.append({"scale": rows, "stage": stage, **best})
+            print(f"{rows:>10,} {stage:<13} {best['rows']:>10,} {best['seconds']:>8.3f}s "
+                  f"{best['rows_per_sec']:>12,.0f} {best['peak_rss_mb']:>9.1f}MB")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def find_regressions(results: list, baseline: list, threshold: float, rss_threshold: float,
+                     min_seconds: float) -> list:
+    """
+    Stages slower or bigger than their baseline by more than the thresholds
+
+    A slowdown smaller than ``min_seconds`` in absolute terms is ignored, so
+    millisecond stages at small scales do not fail on timer noise.
+    """
+    base = {(r["scale"], r["stage"]): r for r in baseline}
+    regressions = []
+    for r in results:
+        b = base.get((r["scale"], r["stage"]))
+        if b is None:
+            continue
+        if r["seconds"] > b["seconds"] * (1 + threshold) and r["seconds"] - b["seconds"] > min_seconds:
+            regressions.append({"scale": r["scale"], "stage": r["stage"], "metric": "seconds",
+                                "baseline": b["seconds"], "current": r["seconds"],
+                                "change": round(r["seconds"] / b["seconds"] - 1, 3)})
+        if r["peak_rss_mb"] > b["peak_rss_mb"] * (1 + rss_threshold):
+            regressions.append({"scale": r["scale"], "stage": r["stage"], "metric": "peak_rss_mb",
+                                "baseline": b["peak_rss_mb"], "current": r["peak_rss_mb"],
+                                "change": round(r["peak_rss_mb"] / b["peak_rss_mb"] - 1, 3)})
+    return regressions
+
+
+def write_json(data: dict, path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="10000,100000", help="Comma-separated row counts")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage (fastest is kept)")
+    parser.add_argument("--db-uri", help="Load target (default: a SQLite file per scale)")
+    parser.add_argument("--output", default=RESULTS_FILE, help="Results JSON")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed wall-time increase over the baseline (0.2 = 20%%)")
+    parser.add_argument("--rss-threshold", type=float, default=0.2,
+                        help="Allowed peak RSS increase over the baseline")
+    parser.add_argument("--min-seconds", type=float, default=0.05,
+                        help="Ignore slowdowns smaller than this many seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    scales = [int(s) for s in args.scales.split(",") if s.strip()]
+    print(f"scales={scales} repeat={args.repeat} cpus={os.cpu_count()} db={args.db_uri or 'sqlite'}")
+    print(f"{'scale':>10} {'stage':<13} {'rows':>10} {'wall':>9} {'rows/s':>12} {'peak_rss':>11}")
+    results = []
+    for rows in scales:
+        results.extend(run_scale(rows, args.repeat, args.db_uri, args.seed))
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "repeat": args.repeat,
+        "results": results,
+        "regressions": [],
+    }
+
+    if args.save_baseline:
+        write_json(report, args.baseline)
+        print(f"Baseline saved → {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        report["regressions"] = find_regressions(results, baseline, args.threshold, args.rss_threshold,
+                                                 args.min_seconds)
+    else:
+        print(f"No baseline at {args.baseline} (run with --save-baseline to create one)")
+
+    write_json(report, args.output)
+    print(f"Results → {args.output}")
+    for r in report["regressions"]:
+        print(f"REGRESSION {r['stage']} @ {r['scale']:,} rows: {r['metric']} "
+              f"{r['baseline']} → {r['current']} ({r['change']:+.0%})")
+    if report["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Load test for the online scoring service: p50/p95/p99 latency and requests/sec
+
+Starts scripts/scoring_service.py in a separate process (unless --url is
+given) and sends --requests transactions from --concurrency concurrent
+clients, each over a pooled keep-alive session.
+
+Usage:
+    python benchmarks/load_test_scoring.py --requests 20000 --concurrency 64
+    python benchmarks/load_test_scoring.py --url http://localhost:8080 --max-wait-ms 0
+"""
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def make_requests(n: int, users: int, seed: int) -> list:
+    rng = np.random.default_rng(seed)
+    start = np.datetime64("2024-01-01T00:00:00", "s")
+    times = start + np.sort(rng.integers(0, 86400, n)).astype("timedelta64[s]")
+    merchants = rng.choice(["Tokopedia", "Binance", "OVO", "Shopee"], n)
+    return [{"transaction_id": f"lt-{i}", "user_id": int(u), "amount": float(a), "merchant": str(m),
+             "currency": "IDR", "event_time": str(t), "source": "API"}
+            for i, (u, a, m, t) in enumerate(zip(rng.integers(0, users, n), rng.uniform(1e4, 8e7, n).round(2),
+                                                  merchants, times))]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_ready(session, url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(f"{url}/health") as resp:
+                if resp.status == 200:
+                    return
+        except OSError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Scoring service at {url} did not become ready")
+        await asyncio.sleep(0.2)
+
+
+async def run_load(url: str, payloads: list, concurrency: int) -> tuple:
+    import aiohttp
+    latencies = np.zeros(len(payloads))
+    flagged = 0
+    next_index = 0
+
+    async def client(session):
+        nonlocal next_index, flagged
+        while next_index < len(payloads):
+            i = next_index
+            next_index += 1
+            start = time.perf_counter()
+            async with session.post(f"{url}/score", json=payloads[i]) as resp:
+                resp.raise_for_status()
+                result = await resp.json()
+            latencies[i] = time.perf_counter() - start
+            flagged += result["is_fraud"]
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await wait_ready(session, url)
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        async with session.get(f"{url}/health") as resp:
+            health = await resp.json()
+    return latencies, elapsed, flagged, health
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Existing service (default: start one locally)")
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--max-batch", type=int, default=256, help="Passed to the local service")
+    parser.add_argument("--max-wait-ms", type=float, default=2, help="Passed to the local service")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    payloads = make_requests(args.requests, args.users, args.seed)
+    server = None
+    url = args.url
+    if not url:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, "scripts", "scoring_service.py"),
+                                   "--host", "127.0.0.1", "--port", str(port),
+                                   "--max-batch", str(args.max_batch), "--max-wait-ms", str(args.max_wait_ms)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        latencies, elapsed, flagged, health = asyncio.run(run_load(url, payloads, args.concurrency))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    ms = latencies * 1000
+    print(f"requests={args.requests:,} concurrency={args.concurrency} users={args.users:,}")
+    print(f"throughput   {args.requests / elapsed:,.0f} req/s ({elapsed:.2f}s)")
+    print(f"latency      p50={np.percentile(ms, 50):.2f}ms  p95={np.percentile(ms, 95):.2f}ms  "
+          f"p99={np.percentile(ms, 99):.2f}ms  max={ms.max():.2f}ms")
+    print(f"batches      {health['batches']:,} (avg {health['requests'] / max(1, health['batches']):.1f}, "
+          f"max {health['max_batch']}) flagged={flagged:,}")
+
+
+if __name__ == "__main__":
+    main()
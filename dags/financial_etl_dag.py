@@ -1,8 +1,13 @@
+import os
+import sys
 from datetime import datetime, timedelta
 from airflow import DAG
-from airflow.operators.bash import BashOperator
+from airflow.operators.python import PythonOperator
+
+# Seluruh pipeline jalan di satu proses lewat scripts/pipeline.py: dua extract paralel,
+# frame diserahkan antar stage di memori (PIPELINE_HANDOFF=files untuk lewat file stage)
+SCRIPTS_DIR = os.path.join(os.getenv("AIRFLOW_HOME", "."), "..", "scripts")
 
-# Jalankan skrip python berurutan untuk kesederhanaan
 DEFAULT_ARGS = {
     "owner": "irgy",
     "depends_on_past": False,
@@ -10,6 +15,16 @@ DEFAULT_ARGS = {
     "retry_delay": timedelta(minutes=10),
 }
 
+
+def run_etl(run_id: str):
+    # Import di dalam task: parsing DAG tidak ikut memuat pandas/SQLAlchemy
+    sys.path.insert(0, SCRIPTS_DIR)
+    from pipeline import run_pipeline
+    # run_id sama untuk semua stage: run manifest (data/metrics/runs) bisa digabung per run.
+    # Retry memakai run_id yang sama, jadi stage yang sudah sukses diambil dari stage cache
+    return run_pipeline(run_id=run_id)
+
+
 with DAG(
     dag_id="financial_etl_dag",
     default_args=DEFAULT_ARGS,
@@ -18,25 +33,8 @@ with DAG(
     catchup=False,
     tags=["etl", "finance"],
 ):
-    extract_api = BashOperator(
-        task_id="extract_api",
-        bash_command="python ${AIRFLOW_HOME}/../scripts/extract_api.py",
-    )
-
-    extract_db = BashOperator(
-        task_id="extract_db",
-        bash_command="python ${AIRFLOW_HOME}/../scripts/extract_db.py",
+    etl_pipeline = PythonOperator(
+        task_id="etl_pipeline",
+        python_callable=run_etl,
+        op_kwargs={"run_id": "{{ ts_nodash }}"},
     )
-
-    transform = BashOperator(
-        task_id="transform",
-        bash_command="python ${AIRFLOW_HOME}/../scripts/transform.py",
-    )
-
-    load = BashOperator(
-        task_id="load",
-        bash_command="python ${AIRFLOW_HOME}/../scripts/load.py",
-    )
-
-    extract_api >> extract_db >> transform >> load
-
@@ -0,0 +1,289 @@
+"""
+Date-range backfill: rebuild the warehouse history day by day
+
+``extract_db.py`` only reads the rolling window and ``load.py`` upserts, so
+history cannot be rebuilt with the daily pipeline. The backfill splits
+``[start, end]`` into one unit per day and runs extract -> transform -> load
+for each unit on a process pool, ``BACKFILL_WORKERS`` days at a time:
+
+- extract: the day's rows of the DB source (a MySQL range query, or a slice
+  of the CSV mock), plus the longest fraud-rule window before midnight so
+  bursts that straddle two days are still counted (those context rows are
+  not loaded)
+- transform: the in-memory transform, without the cross-run event state
+- load: ``load.replace_range`` swaps the day in: one transaction deletes
+  the day's DB rows and bulk inserts the new ones (rollups kept exact)
+
+Only DB rows are rebuilt: the API client has no date-range parameter, so
+API rows already in the warehouse stay as they are.
+
+Progress is checkpointed per range under ``BACKFILL_CHECKPOINT_DIR``: a day
+is recorded once its transaction has committed, and rerunning the same
+range skips the recorded days (``--restart`` ignores the checkpoint). The
+dedup index is cleared before and after a backfill, since replaced rows
+bypass it.
+
+    python scripts/backfill.py --start 2025-01-01 --end 2025-03-31 [--workers 4] [--restart]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+import pandas as pd
+from dotenv import load_dotenv
+
+# Add scripts directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils import setup_logging, RunMetrics
+from intermediate import FrameBuffer
+from schema import to_event_time
+from dedup_index import DedupIndex
+import extract_api as api_stage
+import extract_db as db_stage
+import transform as transform_stage
+import load as load_stage
+import partitions
+
+# Setup logging
+logger = setup_logging()
+
+load_dotenv()
+DATA_DIR = os.getenv("DATA_DIR", "./data")
+# Hari yang diproses bersamaan (satu proses per hari)
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", "2"))
+BACKFILL_CHECKPOINT_DIR = os.getenv("BACKFILL_CHECKPOINT_DIR", os.path.join(DATA_DIR, "state", "backfill"))
+# Baris yang diganti per hari: hanya sumber DB (API tidak punya parameter rentang tanggal)
+BACKFILL_SOURCE = "DB"
+TOTALS = ["extracted", "rows", "deleted", "inserted", "flagged"]
+
+
+def day_units(start: date, end: date) -> List[date]:
+    """Every day from ``start`` to ``end``, both included"""
+    if end < start:
+        raise ValueError(f"Backfill end {end} is before start {start}")
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def day_bounds(day: date) -> tuple:
+    """[midnight, next midnight) of ``day``, as wall time in EVENT_TIMEZONE"""
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+
+def checkpoint_file(start: date, end: date, directory: str = None) -> str:
+    return os.path.join(directory or BACKFILL_CHECKPOINT_DIR, f"backfill_{start:%Y%m%d}_{end:%Y%m%d}.json")
+
+
+def load_checkpoint(path: str) -> dict:
+    """Recorded days of a range ({"start", "end", "days": {date: stats}}), empty when missing"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint: dict, path: str):
+    """Persist the checkpoint atomically"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp, path)
+
+
+def read_csv_source(path: str = None) -> pd.DataFrame:
+    """The CSV mock typed like the DB extract, sorted by date so each day is one slice"""
+    buffer = FrameBuffer()
+    db_stage.extract_csv_mock(path or db_stage.CSV_FILE, buffer)
+    return buffer.frame().sort_values("date", kind="stable").reset_index(drop=True)
+
+
+def _day_slice(source: Optional[pd.DataFrame], day: date, lookback: timedelta) -> Optional[pd.DataFrame]:
+    if source is None:
+        return None
+    start, end = day_bounds(day)
+    lo, hi = source["date"].searchsorted([pd.Timestamp(start - lookback), pd.Timestamp(end)])
+    return source.iloc[lo:hi]
+
+
+def run_day(day: date, db: pd.DataFrame = None, mode: str = load_stage.LOAD_MODE, uri: str = None,
+            table: str = load_stage.FACT_TABLE) -> dict:
+    """
+    Extract, transform and replace one day (runs in a pool process)
+
+    Args:
+        db: The day's DB rows including the lookback (CSV mock slice);
+            extracted from MySQL when None
+        uri: Warehouse URI (default POSTGRES_URI)
+
+    Returns:
+        Dict with extracted, rows, deleted, inserted, flagged and seconds
+    """
+    started = time.perf_counter()
+    start, end = day_bounds(day)
+    if db is None:
+        lookback = transform_stage.FRAUD_RULES.max_window.to_pytimedelta()
+        buffer = FrameBuffer()
+        conn = db_stage.connect_mysql()
+        try:
+            db_stage.extract_range(conn, start - lookback, end, buffer)
+        finally:
+            conn.close()
+        db = buffer.frame()
+
+    flagged = transform_stage.transform(FrameBuffer(api_stage.API_DTYPES).frame(), db)
+    # Baris lookback hanya konteks window rule; yang diganti hanya baris hari ini
+    lo, hi = to_event_time(pd.Series([start, end]))
+    flagged = flagged[(flagged["event_time"] >= lo) & (flagged["event_time"] < hi)]
+
+    engine = load_stage.get_engine(uri)
+    try:
+        stats = load_stage.replace_range(engine, flagged[transform_stage.OUTPUT_COLUMNS], start, end, mode,
+                                         table, BACKFILL_SOURCE)
+    finally:
+        engine.dispose()
+    return {"extracted": len(db), "rows": stats["rows"], "deleted": stats["deleted"],
+            "inserted": stats["inserted"], "flagged": int(flagged["is_fraud"].sum()),
+            "seconds": round(time.perf_counter() - started, 3)}
+
+
+def _clear_dedup_index():
+    """Replaced rows bypass the dedup index: forget it so it is never ahead of the warehouse"""
+    if os.path.exists(load_stage.DEDUP_INDEX_FILE):
+        with DedupIndex(load_stage.DEDUP_INDEX_FILE) as index:
+            index.clear()
+        logger.info(f"Dedup index {load_stage.DEDUP_INDEX_FILE} cleared (the next load refills it)")
+
+
+def _prepare_warehouse(uri: str, days: List[date]):
+    """Fact table, rollups and every month partition of the range, before the workers start"""
+    engine = load_stage.get_engine(uri)
+    try:
+        load_stage.ensure_table(engine)
+        if engine.dialect.name == "postgresql":
+            with engine.begin() as conn:
+                if partitions.is_partitioned(conn, load_stage.FACT_TABLE):
+                    months = partitions.months_of(pd.Series(pd.to_datetime(days)))
+                    partitions.ensure_partitions(conn, load_stage.FACT_TABLE, months)
+    finally:
+        # Koneksi pool tidak boleh ikut ter-fork ke proses worker
+        engine.dispose()
+
+
+def backfill(start: date, end: date, workers: int = BACKFILL_WORKERS, mode: str = load_stage.LOAD_MODE,
+             restart: bool = False, checkpoint_path: str = None, uri: str = None, run_id: str = None) -> dict:
+    """
+    Rebuild the DB rows of every day in ``[start, end]``
+
+    Args:
+        workers: Days processed at the same time (separate processes);
+            1 runs the days one after another in this process
+        restart: Ignore the checkpoint and redo every day
+        checkpoint_path: Checkpoint file (default: one per range in BACKFILL_CHECKPOINT_DIR)
+        uri: Warehouse URI (default POSTGRES_URI)
+
+    Returns:
+        Dict with days, done (this run), skipped (already checkpointed) and
+        the totals of extracted / rows / deleted / inserted / flagged
+    """
+    days = day_units(start, end)
+    path = checkpoint_path or checkpoint_file(start, end)
+    recorded = {} if restart else load_checkpoint(path).get("days", {})
+    checkpoint = {"start": start.isoformat(), "end": end.isoformat(), "days": recorded}
+    todo = [d for d in days if d.isoformat() not in recorded]
+    if len(todo) < len(days):
+        logger.info(f"Resuming backfill {start} .. {end}: {len(days) - len(todo)} of {len(days)} days done")
+    uri = uri or load_stage.POSTGRES_URI
+    _prepare_warehouse(uri, days)
+    source = read_csv_source() if os.path.exists(db_stage.CSV_FILE) else None
+    lookback = transform_stage.FRAUD_RULES.max_window.to_pytimedelta()
+
+    metrics = RunMetrics("backfill", run_id=run_id)
+    totals = dict.fromkeys(TOTALS, 0)
+    failed = {}
+    began = time.perf_counter()
+
+    def finish(day: date, stats: dict):
+        checkpoint["days"][day.isoformat()] = stats
+        save_checkpoint(checkpoint, path)
+        for key in TOTALS:
+            totals[key] += stats[key]
+        done = len(checkpoint["days"]) - (len(days) - len(todo))
+        elapsed = time.perf_counter() - began
+        logger.info(f"[{done}/{len(todo)}] {day}: {stats['rows']} rows ({stats['deleted']} replaced, "
+                    f"{stats['flagged']} flagged) in {stats['seconds']:.2f}s; "
+                    f"ETA {elapsed / done * (len(todo) - done):.0f}s")
+
+    with metrics.run():
+        _clear_dedup_index()
+        with metrics.step("days") as step:
+            pending = list(todo)
+            if workers <= 1:
+                for day in pending:
+                    try:
+                        finish(day, run_day(day, _day_slice(source, day, lookback), mode, uri))
+                    except Exception as e:
+                        logger.error(f"Backfill day {day} failed: {e}")
+                        failed[day] = e
+                        break
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    running = {}
+                    while pending or running:
+                        # Paling banyak `workers` hari di antrean: slice CSV dibuat saat dibutuhkan,
+                        # dan setelah ada yang gagal tidak ada hari baru yang dimulai
+                        while pending and len(running) < workers and not failed:
+                            day = pending.pop(0)
+                            running[pool.submit(run_day, day, _day_slice(source, day, lookback), mode, uri)] = day
+                        if not running:
+                            break
+                        completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                        for future in completed:
+                            day = running.pop(future)
+                            try:
+                                finish(day, future.result())
+                            except Exception as e:
+                                logger.error(f"Backfill day {day} failed: {e}")
+                                failed[day] = e
+            step.rows_in = totals["extracted"]
+            step.rows_out = totals["rows"]
+        _clear_dedup_index()
+        metrics.info.update(start=start.isoformat(), end=end.isoformat(), days=len(days),
+                            skipped=len(days) - len(todo), failed=[d.isoformat() for d in sorted(failed)],
+                            **totals)
+        if failed:
+            first = failed[min(failed)]
+            raise RuntimeError(f"{len(failed)} backfill days failed ({', '.join(map(str, sorted(failed)))}); "
+                               f"rerun the same range to resume") from first
+
+    return {"days": len(days), "done": len(todo), "skipped": len(days) - len(todo), **totals,
+            "checkpoint": path, "seconds": round(time.perf_counter() - began, 3)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the warehouse DB rows of a date range, day by day")
+    parser.add_argument("--start", type=date.fromisoformat, required=True, help="First day (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, required=True, help="Last day, included (YYYY-MM-DD)")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS,
+                        help="Days processed at the same time (1: sequential, in process)")
+    parser.add_argument("--mode", choices=["copy", "insert"], default=load_stage.LOAD_MODE,
+                        help="Bulk insert mode of each day's replace")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore the checkpoint of this range and redo every day")
+    args = parser.parse_args(argv)
+
+    result = backfill(args.start, args.end, args.workers, args.mode, args.restart)
+    print(f"✅ Backfill {args.start} .. {args.end}: {result['done']} days rebuilt "
+          f"({result['skipped']} already done), {result['rows']} rows, {result['deleted']} replaced "
+          f"in {result['seconds']:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
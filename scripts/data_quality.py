@@ -1,120 +1,241 @@
 """
 Data quality checks for ETL pipeline
+
+``QualityProfile`` gathers everything the checks need in one pass over a
+batch: null counts per column, amount min/max/mean and negatives,
+event_time range and future dates, and transaction_id duplicates (kept as
+a set of 64-bit id hashes). Profiles of disjoint chunks merge into
+the profile of their union, so chunked and parallel transforms profile
+each block where it is produced and combine the results.
+
+With ``sample_rate`` < 1 the duplicate check only tracks the transaction
+ids whose hash falls in the sampled range. The choice depends on the id
+alone, so every copy of a sampled id is seen in whatever chunk it lands,
+the duplicate count (scaled by 1 / rate) stays unbiased and merging still
+works. The other checks are vectorized reductions and always exact.
 """
 
+import os
+import sys
+import numpy as np
 import pandas as pd
 import logging
 from typing import Dict, List
 
+# Add scripts directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from schema import EVENT_TIMEZONE, to_event_time, to_float
+
 logger = logging.getLogger(__name__)
 
+# Fraksi transaction_id yang dilacak untuk cek duplikat (1.0 = exact); sama untuk semua chunk satu run
+QUALITY_SAMPLE_RATE = float(os.getenv("QUALITY_SAMPLE_RATE", "1.0"))
+
+REQUIRED_COLUMNS = ['transaction_id', 'user_id', 'amount', 'event_time']
+ALL_CHECKS = ['nulls', 'duplicates', 'ranges', 'types']
+
+
+class QualityProfile:
+    """
+    Mergeable single-pass statistics of a batch of transactions
+
+    Args:
+        sample_rate: Fraction of transaction ids tracked by the duplicate
+            check (profiles can only be merged at the same rate)
+    """
+
+    def __init__(self, sample_rate: float = None):
+        self.sample_rate = QUALITY_SAMPLE_RATE if sample_rate is None else float(sample_rate)
+        if not 0 < self.sample_rate <= 1:
+            raise ValueError(f"sample_rate must be in (0, 1], got {self.sample_rate}")
+        self.rows = 0
+        self.columns: List[str] = []
+        self.dtypes: Dict[str, object] = {}
+        self.nulls: Dict[str, int] = {}
+        self.amount = {"count": 0, "sum": 0.0, "min": np.inf, "max": -np.inf, "negative": 0}
+        self.event_time = {"min": pd.NaT, "max": pd.NaT, "future": 0}
+        # Hash transaction_id (tersampel): _ids unik, _pending menunggu digabung
+        self._tracked = 0
+        self._ids = np.empty(0, dtype=np.uint64)
+        self._pending: List[np.ndarray] = []
+
+    @classmethod
+    def of(cls, df: pd.DataFrame, sample_rate: float = None) -> "QualityProfile":
+        """Profile ``df`` in one pass"""
+        profile = cls(sample_rate)
+        profile.rows = len(df)
+        profile.columns = list(df.columns)
+        profile.dtypes = df.dtypes.to_dict()
+        profile.nulls = {col: int(n) for col, n in df.isna().sum().items()}
+
+        if 'amount' in df.columns:
+            amount = to_float(df['amount'])
+            amount = amount[~np.isnan(amount)]
+            if len(amount):
+                profile.amount = {"count": len(amount), "sum": float(amount.sum()), "min": float(amount.min()),
+                                  "max": float(amount.max()), "negative": int((amount < 0).sum())}
+        if 'event_time' in df.columns:
+            # Sekali parse; frame dari transform sudah bertipe EVENT_TIME_DTYPE (tanpa konversi)
+            times = to_event_time(df['event_time'])
+            profile.event_time = {"min": times.min(), "max": times.max(),
+                                  "future": int((times > pd.Timestamp.now(tz=EVENT_TIMEZONE)).sum())}
+        if 'transaction_id' in df.columns:
+            ids = df['transaction_id'].dropna().to_numpy(dtype=object)
+            # categorize=False: id hampir semuanya unik, factorize dulu hanya menambah biaya
+            hashes = pd.util.hash_array(ids, categorize=False)
+            if profile.sample_rate < 1:
+                hashes = hashes[hashes < np.uint64(int(profile.sample_rate * 2 ** 63) * 2)]
+            profile._tracked = len(hashes)
+            profile._ids = pd.unique(hashes)
+        return profile
+
+    def merge(self, other: "QualityProfile") -> "QualityProfile":
+        """Add the profile of a disjoint chunk (in place) and return self"""
+        if other.sample_rate != self.sample_rate:
+            raise ValueError(f"Cannot merge profiles sampled at {self.sample_rate} and {other.sample_rate}")
+        if not self.columns:
+            # Kolom diambil juga dari chunk kosong: hari tanpa data baru tetap lolos validate()
+            self.columns, self.dtypes = list(other.columns), dict(other.dtypes)
+            self.nulls = {col: 0 for col in other.columns}
+        if not other.rows:
+            return self
+        self.rows += other.rows
+        for col, n in other.nulls.items():
+            self.nulls[col] = self.nulls.get(col, 0) + n
+        a, b = self.amount, other.amount
+        self.amount = {"count": a["count"] + b["count"], "sum": a["sum"] + b["sum"],
+                       "min": min(a["min"], b["min"]), "max": max(a["max"], b["max"]),
+                       "negative": a["negative"] + b["negative"]}
+        times = [t for t in (self.event_time["min"], other.event_time["min"]) if pd.notna(t)]
+        latest = [t for t in (self.event_time["max"], other.event_time["max"]) if pd.notna(t)]
+        self.event_time = {"min": min(times, default=pd.NaT), "max": max(latest, default=pd.NaT),
+                           "future": self.event_time["future"] + other.event_time["future"]}
+        self._tracked += other._tracked
+        self._pending += [other._ids, *other._pending]
+        # Gabung hanya saat pending melebihi set utama: total biaya merge tetap linear (amortized)
+        if sum(len(ids) for ids in self._pending) > len(self._ids):
+            self._consolidate()
+        return self
+
+    def _consolidate(self):
+        if self._pending:
+            self._ids = pd.unique(np.concatenate([self._ids, *self._pending]))
+            self._pending = []
+
+    @property
+    def duplicates(self) -> int:
+        """Tracked rows whose transaction_id was already tracked (in this or a merged chunk)"""
+        self._consolidate()
+        return self._tracked - len(self._ids)
+
+    @property
+    def sampled(self) -> bool:
+        return self.sample_rate < 1
+
+    @property
+    def duplicate_count(self) -> int:
+        """Rows whose transaction_id appeared earlier (estimated when sampled)"""
+        return int(round(self.duplicates / self.sample_rate))
+
+    def results(self, checks: List[str] = None) -> Dict[str, any]:
+        """Quality check results in the ``check_data_quality`` format"""
+        checks = ALL_CHECKS if checks is None else checks
+        results = {'total_rows': self.rows, 'total_columns': len(self.columns), 'checks': {}}
 
-def check_data_quality(df: pd.DataFrame, checks: List[str] = None) -> Dict[str, any]:
+        if 'nulls' in checks:
+            total_nulls = sum(self.nulls.values())
+            results['checks']['nulls'] = {
+                'columns_with_nulls': {col: n for col, n in self.nulls.items() if n > 0},
+                'total_nulls': total_nulls,
+                'null_percentage': round(total_nulls / self.rows * 100, 2) if self.rows else 0
+            }
+            logger.info(f"Null check: {total_nulls} nulls found")
+
+        if 'duplicates' in checks:
+            duplicate_count = self.duplicate_count
+            results['checks']['duplicates'] = {
+                'count': duplicate_count,
+                'percentage': round(duplicate_count / self.rows * 100, 2) if self.rows else 0,
+                'sampled': self.sampled
+            }
+            logger.info(f"Duplicate check: {duplicate_count} duplicate transaction IDs found"
+                        + (f" (estimated from a {self.sample_rate:.0%} sample)" if self.sampled else ""))
+
+        if 'ranges' in checks:
+            range_checks = {}
+            if 'amount' in self.columns:
+                amount = self.amount
+                range_checks['amount'] = {
+                    'min': amount['min'] if amount['count'] else np.nan,
+                    'max': amount['max'] if amount['count'] else np.nan,
+                    'mean': amount['sum'] / amount['count'] if amount['count'] else np.nan,
+                    'negative_count': amount['negative']
+                }
+            if 'event_time' in self.columns:
+                range_checks['event_time'] = {
+                    'min': str(self.event_time['min']),
+                    'max': str(self.event_time['max']),
+                    'future_dates': self.event_time['future']
+                }
+            results['checks']['ranges'] = range_checks
+            logger.info(f"Range check completed for {len(range_checks)} columns")
+
+        if 'types' in checks:
+            results['checks']['types'] = dict(self.dtypes)
+            logger.info(f"Type check: {len(self.dtypes)} columns checked")
+
+        return results
+
+    def validate(self) -> bool:
+        """Raise on missing required columns, warn about nulls, negatives, future dates and duplicates"""
+        logger.info("Starting transaction data validation...")
+        missing_cols = [col for col in REQUIRED_COLUMNS if col not in self.columns]
+        if missing_cols:
+            raise ValueError(f"Missing required columns: {missing_cols}")
+
+        null_required = {col: self.nulls.get(col, 0) for col in REQUIRED_COLUMNS if self.nulls.get(col, 0)}
+        if null_required:
+            logger.warning(f"Null values in required columns: {null_required}")
+        if self.amount['negative'] > 0:
+            logger.warning(f"Found {self.amount['negative']} transactions with negative amounts")
+        if self.event_time['future'] > 0:
+            logger.warning(f"Found {self.event_time['future']} transactions with future dates")
+        if self.duplicates > 0:
+            logger.warning(f"Found {self.duplicate_count} duplicate transaction IDs"
+                           + (" (estimated)" if self.sampled else ""))
+
+        logger.info("Transaction data validation completed")
+        return True
+
+
+def check_data_quality(df: pd.DataFrame, checks: List[str] = None,
+                       profile: QualityProfile = None) -> Dict[str, any]:
     """
     Perform data quality checks on DataFrame
-    
+
     Args:
         df: DataFrame to check
         checks: List of checks to perform (default: all checks)
-    
+        profile: Profile of ``df`` when already computed (skips the pass over ``df``)
+
     Returns:
         Dictionary with quality check results
     """
-    if checks is None:
-        checks = ['nulls', 'duplicates', 'ranges', 'types']
-    
-    results = {
-        'total_rows': len(df),
-        'total_columns': len(df.columns),
-        'checks': {}
-    }
-    
-    # Check for nulls
-    if 'nulls' in checks:
-        null_counts = df.isnull().sum()
-        results['checks']['nulls'] = {
-            'columns_with_nulls': null_counts[null_counts > 0].to_dict(),
-            'total_nulls': null_counts.sum(),
-            'null_percentage': (null_counts.sum() / len(df) * 100).round(2)
-        }
-        logger.info(f"Null check: {results['checks']['nulls']['total_nulls']} nulls found")
-    
-    # Check for duplicates
-    if 'duplicates' in checks:
-        duplicate_count = df.duplicated().sum()
-        results['checks']['duplicates'] = {
-            'count': duplicate_count,
-            'percentage': (duplicate_count / len(df) * 100).round(2) if len(df) > 0 else 0
-        }
-        logger.info(f"Duplicate check: {duplicate_count} duplicates found")
-    
-    # Check for value ranges
-    if 'ranges' in checks:
-        range_checks = {}
-        if 'amount' in df.columns:
-            range_checks['amount'] = {
-                'min': float(df['amount'].min()),
-                'max': float(df['amount'].max()),
-                'mean': float(df['amount'].mean()),
-                'negative_count': int((df['amount'] < 0).sum())
-            }
-        if 'event_time' in df.columns:
-            range_checks['event_time'] = {
-                'min': str(df['event_time'].min()),
-                'max': str(df['event_time'].max()),
-                'future_dates': int((pd.to_datetime(df['event_time']) > pd.Timestamp.now()).sum())
-            }
-        results['checks']['ranges'] = range_checks
-        logger.info(f"Range check completed for {len(range_checks)} columns")
-    
-    # Check for data types
-    if 'types' in checks:
-        results['checks']['types'] = df.dtypes.to_dict()
-        logger.info(f"Type check: {len(df.dtypes)} columns checked")
-    
-    return results
-
-
-def validate_transaction_data(df: pd.DataFrame) -> bool:
+    profile = profile or QualityProfile.of(df)
+    return profile.results(checks)
+
+
+def validate_transaction_data(df: pd.DataFrame, profile: QualityProfile = None) -> bool:
     """
     Validate transaction data meets quality standards
-    
+
     Args:
         df: DataFrame to validate
-    
+        profile: Profile of ``df`` when already computed (skips the pass over ``df``)
+
     Returns:
         True if validation passes, raises exception otherwise
     """
-    logger.info("Starting transaction data validation...")
-    
-    # Required columns
-    required_columns = ['transaction_id', 'user_id', 'amount', 'event_time']
-    missing_cols = [col for col in required_columns if col not in df.columns]
-    if missing_cols:
-        raise ValueError(f"Missing required columns: {missing_cols}")
-    
-    # Check for nulls in required columns
-    null_required = df[required_columns].isnull().sum()
-    if null_required.sum() > 0:
-        logger.warning(f"Null values in required columns: {null_required[null_required > 0].to_dict()}")
-    
-    # Check for negative amounts
-    if 'amount' in df.columns:
-        negative_amounts = (df['amount'] < 0).sum()
-        if negative_amounts > 0:
-            logger.warning(f"Found {negative_amounts} transactions with negative amounts")
-    
-    # Check for future dates
-    if 'event_time' in df.columns:
-        future_dates = (pd.to_datetime(df['event_time']) > pd.Timestamp.now()).sum()
-        if future_dates > 0:
-            logger.warning(f"Found {future_dates} transactions with future dates")
-    
-    # Check for duplicates
-    duplicate_count = df['transaction_id'].duplicated().sum()
-    if duplicate_count > 0:
-        logger.warning(f"Found {duplicate_count} duplicate transaction IDs")
-    
-    logger.info("Transaction data validation completed")
-    return True
-
+    profile = profile or QualityProfile.of(df)
+    return profile.validate()
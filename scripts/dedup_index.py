@@ -0,0 +1,322 @@
+"""
+Cross-run dedup index of loaded transactions
+
+The DB extract re-pulls a 30-day window every day, so most rows of a load
+are already in the warehouse, unchanged. This index remembers every loaded
+transaction_id with the ``row_hash`` of its content and drops those rows
+before they reach the database:
+
+- a Bloom filter over the loaded ids (a bit array in ``<path>.bloom``)
+  answers "definitely not loaded" for new rows without touching the store
+- an exact key store (SQLite, ``transaction_id`` -> row_hash, event_time)
+  settles the rows the filter might have seen; a row is skipped only when
+  its stored hash equals the hash of the incoming row
+
+``filter(df)`` returns the rows to load and remembers them; ``commit()``
+records them as loaded once the warehouse transaction has committed. If
+the process dies in between, the rows are simply loaded again next run:
+the index can only be behind the warehouse, never ahead of it.
+
+The index belongs to one warehouse table. ``bind()`` clears it when it was
+built for another table or the table is empty (recreated or truncated);
+``rebuild()`` recomputes it from the table and ``compact()`` drops keys
+older than the extract window and resizes the filter.
+"""
+
+import os
+import sys
+import logging
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+import sqlite3
+from sqlalchemy import text
+
+# Add scripts directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from schema import CONTENT_COLUMNS, id_hash, row_hash, to_event_time
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "./data")
+DEDUP_INDEX_FILE = os.getenv("DEDUP_INDEX_FILE", os.path.join(DATA_DIR, "state", "loaded_transactions.sqlite"))
+# Ukuran awal Bloom filter dan target false positive; filter diperbesar saat key melebihi kapasitas
+DEDUP_INDEX_CAPACITY = int(os.getenv("DEDUP_INDEX_CAPACITY", "1000000"))
+DEDUP_INDEX_FP_RATE = float(os.getenv("DEDUP_INDEX_FP_RATE", "0.01"))
+# Key dengan event_time lebih tua dari ini (dari event terbaru) dibuang saat compact
+DEDUP_INDEX_RETENTION_DAYS = int(os.getenv("DEDUP_INDEX_RETENTION_DAYS", "45"))
+LOOKUP_BATCH = 50_000
+REBUILD_CHUNK_ROWS = 100_000
+
+
+def _epoch_us(values) -> list:
+    """event_time as UTC epoch microseconds (None for NaT)"""
+    times = to_event_time(values).to_numpy(dtype="datetime64[us]").view(np.int64)
+    nat = np.iinfo(np.int64).min
+    return [None if t == nat else t for t in times.tolist()]
+
+
+class BloomFilter:
+    """
+    Bit-array Bloom filter over 64-bit key hashes (double hashing, k probes)
+
+    Args:
+        capacity: Keys the filter is sized for
+        fp_rate: False positive rate at ``capacity`` keys
+    """
+
+    def __init__(self, capacity: int, fp_rate: float = DEDUP_INDEX_FP_RATE, bits: np.ndarray = None):
+        capacity = max(1, int(capacity))
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.m = max(64, int(-capacity * np.log(fp_rate) / np.log(2) ** 2))
+        self.k = max(1, int(round(self.m / capacity * np.log(2))))
+        size = (self.m + 7) // 8
+        if bits is not None and len(bits) != size:
+            raise ValueError(f"Bloom filter has {len(bits)} bytes, expected {size}")
+        self.bits = bits if bits is not None else np.zeros(size, dtype=np.uint8)
+
+    def _positions(self, hashes: np.ndarray):
+        h1 = hashes & np.uint64(0xFFFFFFFF)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        for i in range(self.k):
+            yield (h1 + np.uint64(i) * h2) % np.uint64(self.m)
+
+    def add(self, hashes: np.ndarray):
+        for pos in self._positions(hashes):
+            # .at: beberapa posisi bisa jatuh di byte yang sama
+            np.bitwise_or.at(self.bits, pos >> np.uint64(3), np.left_shift(1, pos & np.uint64(7)).astype(np.uint8))
+
+    def might_contain(self, hashes: np.ndarray) -> np.ndarray:
+        found = np.ones(len(hashes), dtype=bool)
+        for pos in self._positions(hashes):
+            found &= (self.bits[pos >> np.uint64(3)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1 == 1
+        return found
+
+
+class DedupIndex:
+    """
+    Loaded transaction ids with their content hash: Bloom filter + SQLite
+
+    Args:
+        path: SQLite key store (the filter is kept next to it)
+        capacity: Initial filter capacity
+        fp_rate: Filter false positive rate at capacity
+    """
+
+    def __init__(self, path: str = DEDUP_INDEX_FILE, capacity: int = DEDUP_INDEX_CAPACITY,
+                 fp_rate: float = DEDUP_INDEX_FP_RATE):
+        self.path = path
+        self.bloom_path = path + ".bloom"
+        self.fp_rate = fp_rate
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS loaded (
+              transaction_id  TEXT PRIMARY KEY,
+              row_hash        INTEGER NOT NULL,
+              event_time      INTEGER            -- epoch mikrodetik (UTC), untuk compact
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS loaded_time ON loaded (event_time);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self.conn.commit()
+        self.bloom = self._open_bloom(capacity)
+        self._pending = None
+        self.stats = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """Close without committing (rows of the last ``filter`` are not recorded)"""
+        self.conn.rollback()
+        self.conn.close()
+
+    @property
+    def keys(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM loaded").fetchone()[0]
+
+    def _meta(self, key: str):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value):
+        self.conn.execute("INSERT INTO meta (key, value) VALUES (?, ?) "
+                          "ON CONFLICT (key) DO UPDATE SET value = excluded.value", (key, str(value)))
+
+    def _open_bloom(self, capacity: int) -> BloomFilter:
+        """Saved filter, or one rebuilt from the key store when missing or stale"""
+        saved = self._meta("bloom_capacity")
+        if saved is not None and os.path.exists(self.bloom_path) and self._meta("bloom_keys") == str(self.keys):
+            try:
+                return BloomFilter(int(saved), self.fp_rate, np.fromfile(self.bloom_path, dtype=np.uint8))
+            except ValueError as e:
+                logger.warning(f"Dedup index filter {self.bloom_path} unusable ({e}); rebuilding it")
+        return self._rebuild_bloom(max(capacity, 2 * self.keys))
+
+    def _rebuild_bloom(self, capacity: int) -> BloomFilter:
+        bloom = BloomFilter(capacity, self.fp_rate)
+        cur = self.conn.execute("SELECT transaction_id FROM loaded")
+        while True:
+            rows = cur.fetchmany(LOOKUP_BATCH)
+            if not rows:
+                break
+            bloom.add(id_hash(pd.Series([r[0] for r in rows], dtype=object)))
+        return bloom
+
+    def _save_bloom(self):
+        tmp = self.bloom_path + ".tmp"
+        self.bloom.bits.tofile(tmp)
+        os.replace(tmp, self.bloom_path)
+        self._set_meta("bloom_capacity", self.bloom.capacity)
+        self._set_meta("bloom_keys", self.keys)
+        self.conn.commit()
+
+    def clear(self):
+        """Forget every key (the next load upserts all its rows)"""
+        self.conn.execute("DELETE FROM loaded")
+        self.bloom = BloomFilter(self.bloom.capacity, self.fp_rate)
+        self._save_bloom()
+
+    def bind(self, engine, table: str):
+        """
+        Check that the index was built for ``table`` of this warehouse
+
+        Clears it when it belongs to another warehouse/table or when the
+        table is empty while the index is not (table recreated or truncated).
+        """
+        target = f"{engine.url.render_as_string(hide_password=True)}#{table}"
+        reason = None
+        if self._meta("warehouse") not in (None, target):
+            reason = f"it was built for {self._meta('warehouse')}"
+        elif self.keys:
+            with engine.connect() as conn:
+                if conn.execute(text(f"SELECT 1 FROM {table} LIMIT 1")).first() is None:
+                    reason = f"{table} is empty"
+        if reason:
+            logger.warning(f"Dedup index {self.path} cleared: {reason}")
+            self.clear()
+        self._set_meta("warehouse", target)
+        self.conn.commit()
+
+    def _stored_hashes(self, ids: Iterable[str]) -> pd.Series:
+        """Stored row_hash of the ids found in the key store (indexed by transaction_id)"""
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS probe (transaction_id TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM probe")
+        ids = list(ids)
+        for start in range(0, len(ids), LOOKUP_BATCH):
+            self.conn.executemany("INSERT OR IGNORE INTO probe VALUES (?)",
+                                  ((v,) for v in ids[start:start + LOOKUP_BATCH]))
+        rows = self.conn.execute("""
+            SELECT l.transaction_id, l.row_hash FROM loaded l JOIN probe p ON p.transaction_id = l.transaction_id
+        """).fetchall()
+        self.conn.execute("DELETE FROM probe")
+        return pd.Series([r[1] for r in rows], index=[r[0] for r in rows], dtype="Int64")
+
+    def filter(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Rows of ``df`` that are new or changed since they were last loaded
+
+        ``df`` is deduplicated on transaction_id first (last row wins, as in
+        the upsert). The returned rows are remembered for ``commit()``; the
+        counts are in ``stats``.
+        """
+        if df["transaction_id"].duplicated().any():
+            df = df.drop_duplicates("transaction_id", keep="last")
+        ids = df["transaction_id"].astype(str).to_numpy(dtype=object)
+        # prepare_frame sudah menghitung row_hash (kolom yang sama dengan di warehouse)
+        hashes = df["row_hash"].to_numpy(dtype=np.int64) if "row_hash" in df.columns else row_hash(df)
+        maybe = self.bloom.might_contain(id_hash(df["transaction_id"]))
+
+        # Int64 nullable: hash 64-bit tidak boleh lewat float (NaN untuk id yang tidak ada)
+        known = self._stored_hashes(ids[maybe]).reindex(ids[maybe])
+        found = np.zeros(len(df), dtype=bool)
+        found[maybe] = known.notna().to_numpy()
+        unchanged = np.zeros(len(df), dtype=bool)
+        unchanged[maybe] = known.to_numpy(dtype=np.int64, na_value=0) == hashes[maybe]
+        unchanged &= found
+
+        keep = ~unchanged
+        self._pending = (ids[keep], hashes[keep], _epoch_us(df["event_time"][keep]))
+        self.stats = {
+            "rows": len(df),
+            "skipped": int(unchanged.sum()),
+            "changed": int(found.sum() - unchanged.sum()),
+            "new": int(len(df) - found.sum()),
+            "bloom_negative": int((~maybe).sum()),
+            "bloom_false_positive": int(maybe.sum() - found.sum()),
+        }
+        logger.info(f"Dedup index: skipped {self.stats['skipped']:,} of {len(df):,} rows already loaded "
+                    f"(new={self.stats['new']:,}, changed={self.stats['changed']:,}, "
+                    f"filter negatives={self.stats['bloom_negative']:,}, "
+                    f"false positives={self.stats['bloom_false_positive']:,})")
+        return df.loc[keep]
+
+    def commit(self) -> int:
+        """Record the rows of the last ``filter`` as loaded; returns how many"""
+        if self._pending is None:
+            return 0
+        ids, hashes, times = self._pending
+        self._add(ids, hashes, times)
+        self._pending = None
+        return len(ids)
+
+    def _add(self, ids, hashes, times):
+        self.conn.executemany("""
+            INSERT INTO loaded (transaction_id, row_hash, event_time) VALUES (?, ?, ?)
+            ON CONFLICT (transaction_id) DO UPDATE SET row_hash = excluded.row_hash, event_time = excluded.event_time
+        """, zip(ids.tolist(), hashes.tolist(), times))
+        self.bloom.add(id_hash(pd.Series(ids, dtype=object)))
+        if self.keys > self.bloom.capacity:
+            # Filter penuh: false positive naik, bangun ulang dua kali lebih besar
+            self.bloom = self._rebuild_bloom(2 * self.keys)
+        self._save_bloom()
+
+    def rebuild(self, engine, table: str, chunk_rows: int = REBUILD_CHUNK_ROWS) -> int:
+        """Recompute the index from the rows currently in ``table``; returns the number of keys"""
+        self.conn.execute("DELETE FROM loaded")
+        self.bloom = BloomFilter(self.bloom.capacity, self.fp_rate)
+        columns = ",".join(["transaction_id", *CONTENT_COLUMNS])
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(text(f"SELECT {columns} FROM {table}"))
+            while True:
+                rows = result.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                df = pd.DataFrame(rows, columns=["transaction_id", *CONTENT_COLUMNS])
+                self.conn.executemany("INSERT OR REPLACE INTO loaded (transaction_id, row_hash, event_time) "
+                                      "VALUES (?, ?, ?)",
+                                      zip(df["transaction_id"].astype(str).tolist(), row_hash(df).tolist(),
+                                          _epoch_us(df["event_time"])))
+        keys = self.keys
+        self.bloom = self._rebuild_bloom(max(self.bloom.capacity, 2 * keys))
+        self._set_meta("warehouse", f"{engine.url.render_as_string(hide_password=True)}#{table}")
+        self._save_bloom()
+        logger.info(f"Dedup index {self.path} rebuilt from {table}: {keys:,} keys")
+        return keys
+
+    def compact(self, retention_days: int = DEDUP_INDEX_RETENTION_DAYS) -> int:
+        """
+        Drop keys whose event_time is more than ``retention_days`` before the
+        newest one (they are no longer re-extracted), shrink the store and
+        resize the filter to the remaining keys; returns the number dropped
+        """
+        newest = self.conn.execute("SELECT MAX(event_time) FROM loaded").fetchone()[0]
+        dropped = 0
+        if newest is not None:
+            cutoff = newest - pd.Timedelta(days=retention_days) // pd.Timedelta(microseconds=1)
+            dropped = self.conn.execute("DELETE FROM loaded WHERE event_time < ?", (cutoff,)).rowcount
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+        keys = self.keys
+        self.bloom = self._rebuild_bloom(max(DEDUP_INDEX_CAPACITY, 2 * keys))
+        self._save_bloom()
+        logger.info(f"Dedup index {self.path} compacted: {dropped:,} keys dropped, {keys:,} kept")
+        return dropped
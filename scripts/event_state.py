@@ -0,0 +1,132 @@
+"""
+Persistent per-user event state for cross-run window rules
+
+Window rules (burst activity) only see the rows of the current run, so a
+burst that straddles two runs would be missed. This store keeps every
+user's recent events (transaction_id, user_id, event_time) in an embedded
+SQLite file between runs:
+
+- ``lookup(user_ids)`` returns the stored events of the run's active users
+  with one batched join (a temp table of ids), so the cost follows the
+  number of active users, not the history size
+- ``update(df)`` upserts the run's events keyed on transaction_id (a
+  re-extracted transaction replaces its stored version)
+- ``commit()`` evicts events older than the newest stored event minus
+  ``retention`` (the longest rule window) and makes the run durable
+
+Nothing is written until ``commit()``, which the transform calls only after
+its output file is complete.
+"""
+
+import os
+import sys
+import sqlite3
+import logging
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+# Add scripts directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from schema import STRING_DTYPE, to_event_time
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "./data")
+EVENT_STATE_FILE = os.getenv("EVENT_STATE_FILE", os.path.join(DATA_DIR, "state", "user_events.sqlite"))
+LOOKUP_BATCH = 50_000
+
+STATE_COLUMNS = ["transaction_id", "user_id", "event_time"]
+
+
+class EventStateStore:
+    """
+    Recent events per user, stored in SQLite
+
+    Args:
+        path: SQLite file (created on first use)
+        retention: How long events are kept after the newest stored event
+    """
+
+    def __init__(self, path: str = EVENT_STATE_FILE, retention: pd.Timedelta = pd.Timedelta("10min")):
+        self.path = path
+        self.retention = pd.Timedelta(retention)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS user_events (
+              transaction_id  TEXT PRIMARY KEY,
+              user_id         INTEGER NOT NULL,
+              event_time      INTEGER NOT NULL   -- epoch nanoseconds (UTC)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS user_events_user_time ON user_events (user_id, event_time);
+            CREATE INDEX IF NOT EXISTS user_events_time ON user_events (event_time);
+        """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """Close without committing (pending updates are rolled back)"""
+        self.conn.rollback()
+        self.conn.close()
+
+    def lookup(self, user_ids: Iterable) -> pd.DataFrame:
+        """Stored events of ``user_ids`` (NULL / non-numeric ids are ignored), event_time in EVENT_TIMEZONE"""
+        ids = pd.to_numeric(pd.Series(list(user_ids), dtype=object), errors="coerce").dropna().unique()
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS active_users (user_id INTEGER PRIMARY KEY)")
+        self.conn.execute("DELETE FROM active_users")
+        for start in range(0, len(ids), LOOKUP_BATCH):
+            self.conn.executemany("INSERT OR IGNORE INTO active_users VALUES (?)",
+                                  ((int(v),) for v in ids[start:start + LOOKUP_BATCH]))
+        rows = self.conn.execute("""
+            SELECT e.transaction_id, e.user_id, e.event_time
+            FROM user_events e JOIN active_users a ON a.user_id = e.user_id
+            ORDER BY e.user_id, e.event_time
+        """).fetchall()
+        self.conn.execute("DELETE FROM active_users")
+        df = pd.DataFrame(rows, columns=STATE_COLUMNS)
+        return pd.DataFrame({
+            "transaction_id": df["transaction_id"].astype(STRING_DTYPE),
+            "user_id": df["user_id"].astype("Int64"),
+            "event_time": to_event_time(pd.to_datetime(df["event_time"].astype(np.int64), unit="ns", utc=True)),
+        })
+
+    def update(self, df: pd.DataFrame) -> int:
+        """Upsert the events of ``df`` (rows without user_id are skipped)"""
+        user_ids = pd.to_numeric(df["user_id"], errors="coerce")
+        times = to_event_time(df["event_time"])
+        valid = user_ids.notna().to_numpy() & times.notna().to_numpy()
+        if not valid.any():
+            return 0
+        rows = zip(df["transaction_id"].astype(str).to_numpy()[valid],
+                   user_ids.to_numpy(dtype=float, na_value=np.nan)[valid].astype(np.int64).tolist(),
+                   times.to_numpy(dtype="datetime64[ns]")[valid].view(np.int64).tolist())
+        cur = self.conn.executemany("""
+            INSERT INTO user_events (transaction_id, user_id, event_time) VALUES (?, ?, ?)
+            ON CONFLICT (transaction_id) DO UPDATE SET user_id = excluded.user_id, event_time = excluded.event_time
+        """, rows)
+        return cur.rowcount
+
+    def evict(self) -> int:
+        """Drop events that can no longer fall inside a window"""
+        newest = self.conn.execute("SELECT MAX(event_time) FROM user_events").fetchone()[0]
+        if newest is None:
+            return 0
+        cur = self.conn.execute("DELETE FROM user_events WHERE event_time < ?",
+                                (newest - self.retention.value,))
+        return cur.rowcount
+
+    def commit(self) -> int:
+        """Evict expired events and persist the run; returns the number evicted"""
+        evicted = self.evict()
+        self.conn.commit()
+        events = self.conn.execute("SELECT COUNT(*) FROM user_events").fetchone()[0]
+        logger.info(f"Event state {self.path}: {events} events kept, {evicted} evicted")
+        return evicted
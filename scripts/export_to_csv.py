@@ -1,35 +1,81 @@
 """
 Script untuk export data dari PostgreSQL ke CSV untuk Tableau Public
 Tableau Public tidak bisa connect langsung ke database, jadi perlu export ke CSV
+
+Two modes (``EXPORT_MODE`` or ``--mode``):
+
+- ``full``: every file from scratch: the whole fact table as one
+  ``fact_transactions.csv[.gz]`` plus the seven summaries
+- ``incremental``: the fact table as one Parquet file per day under
+  ``fact_transactions/``, and only the days whose row of the daily rollup
+  (row count, totals, ``updated_at``) changed since the last export are
+  rewritten (days that no longer have rows are removed). A summary file is
+  recomputed only when its rollup tables changed. The watermarks of the
+  last export are kept in ``_export_state.json`` next to the files.
 """
 
 import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from datetime import date, timedelta
+from typing import Dict, Iterable
+
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 
+# Add scripts directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from rollups import ensure_rollups, rollup_table, day_expr
+from intermediate import FrameWriter
+from utils import RunMetrics
+
 load_dotenv()
 
-def export_data():
-    """Export data dari PostgreSQL ke CSV files"""
-    
-    # Connect to database
-    postgres_uri = os.getenv("POSTGRES_URI")
-    if not postgres_uri:
-        print("❌ POSTGRES_URI not found in .env file")
-        return
-    
-    engine = create_engine(postgres_uri)
-    output_dir = os.path.join(os.getenv("DATA_DIR", "./data"), "tableau")
-    os.makedirs(output_dir, exist_ok=True)
-    
-    print("=" * 60)
-    print("Exporting data to CSV for Tableau Public")
-    print("=" * 60)
-    
-    # 1. Export full fact_transactions dengan calculated fields
-    print("\n1. Exporting fact_transactions (full data)...")
-    query_full = """
+FACT_TABLE = "fact_transactions"
+
+# Export full: gzip (default) atau none (CSV biasa, bisa langsung dibuka Tableau Public)
+EXPORT_COMPRESSION = os.getenv("EXPORT_COMPRESSION", "gzip").lower()
+EXPORT_FETCH_ROWS = int(os.getenv("EXPORT_FETCH_ROWS", "50000"))
+EXPORT_PROGRESS_ROWS = int(os.getenv("EXPORT_PROGRESS_ROWS", "500000"))
+# full: tulis ulang semua file; incremental: partisi harian Parquet + summary yang berubah saja
+EXPORT_MODE = os.getenv("EXPORT_MODE", "full").lower()
+EXPORT_PARQUET_COMPRESSION = os.getenv("EXPORT_PARQUET_COMPRESSION", "zstd")
+FACT_PARTITION_DIR = "fact_transactions"
+# Sama dengan load.py: tanpa rollup (0), watermark hari dibaca dari fact table (scan penuh)
+LOAD_ROLLUPS = os.getenv("LOAD_ROLLUPS", "1") == "1"
+EXPORT_STATE_FILE = "_export_state.json"
+
+FRAUD_REASON_LABELS = {
+    "high_amount": "High Amount",
+    "crypto_merchant": "Crypto Merchant",
+    "burst_activity": "Burst Activity",
+}
+
+
+def reason_label(reason) -> str:
+    """Tableau label for a (possibly multi-rule, comma-separated) fraud_reason"""
+    if not isinstance(reason, str) or reason in ("", "no_fraud"):
+        return "No Fraud"
+    return " + ".join(FRAUD_REASON_LABELS.get(r, r.replace("_", " ").title()) for r in reason.split(","))
+
+
+def reason_label_sql(column: str = "fraud_reason") -> str:
+    """SQL version of reason_label (REPLACE only, so it also runs on SQLite)"""
+    expr = column
+    for reason, label in FRAUD_REASON_LABELS.items():
+        expr = f"REPLACE({expr}, '{reason}', '{label}')"
+    return (f"CASE WHEN {column} IS NULL OR {column} = 'no_fraud' THEN 'No Fraud' "
+            f"ELSE REPLACE({expr}, ',', ' + ') END")
+
+
+# Full export + calculated fields untuk Tableau (dijalankan lewat COPY ... TO STDOUT)
+FACT_QUERY = """
     SELECT 
         transaction_id,
         user_id,
@@ -55,139 +101,99 @@ def export_data():
             WHEN is_fraud = 1 THEN 'Fraud'
             ELSE 'Normal'
         END as transaction_status,
-        CASE 
-            WHEN fraud_reason = 'high_amount' THEN 'High Amount'
-            WHEN fraud_reason = 'crypto_merchant' THEN 'Crypto Merchant'
-            WHEN fraud_reason = 'burst_activity' THEN 'Burst Activity'
-            ELSE 'No Fraud'
-        END as fraud_reason_clean,
+        {fraud_reason_clean} as fraud_reason_clean,
         CASE 
             WHEN amount > 50000000 THEN 'High Amount'
             WHEN amount > 10000000 THEN 'Medium Amount'
             ELSE 'Low Amount'
         END as amount_category
-    FROM fact_transactions
-    ORDER BY event_time;
-    """
-    
-    df_full = pd.read_sql(query_full, engine)
-    output_file = os.path.join(output_dir, "fact_transactions.csv")
-    df_full.to_csv(output_file, index=False)
-    print(f"   ✅ Exported {len(df_full):,} rows to {output_file}")
-    
-    # 2. Export daily summary
-    print("\n2. Exporting daily summary...")
-    query_daily = """
+    FROM {table}
+    {where}
+    ORDER BY event_time
+"""
+FACT_COLUMNS = [
+    "transaction_id", "user_id", "account_number", "amount", "currency", "merchant",
+    "transaction_type", "status", "location", "event_time", "source", "is_fraud",
+    "fraud_reason", "ingestion_time",
+]
+CALCULATED_COLUMNS = [
+    "transaction_date", "transaction_hour", "day_of_week", "transaction_month", "transaction_year",
+    "transaction_status", "fraud_reason_clean", "amount_category",
+]
+# Tipe kolom partisi Parquet: sama di semua file supaya folder bisa dibaca sebagai satu dataset
+PARTITION_DTYPES = {
+    "transaction_id": "string", "user_id": "Int64", "account_number": "string", "amount": "float64",
+    "currency": "string", "merchant": "string", "transaction_type": "string", "status": "string",
+    "location": "string", "source": "string", "is_fraud": "int64", "fraud_reason": "string",
+    "transaction_hour": "int64", "day_of_week": "int64", "transaction_month": "int64",
+    "transaction_year": "int64", "transaction_status": "string", "fraud_reason_clean": "string",
+    "amount_category": "string",
+}
+SUMMARY_ROLLUPS = ("daily", "merchant", "user", "fraud_reason", "hourly", "day_of_week", "location")
+
+# Summary 2-8 dibaca dari tabel rollup, bukan GROUP BY penuh atas fact_transactions.
+# Biayanya sebanding dengan jumlah grup (hari, merchant, user, ...), bukan jumlah transaksi.
+SUMMARY_QUERIES = [
+    ("daily_summary.csv", "daily summary", """
     SELECT 
-        DATE(event_time) as transaction_date,
-        COUNT(*) as total_transactions,
-        SUM(CASE WHEN is_fraud = 1 THEN 1 ELSE 0 END) as fraud_count,
-        ROUND(100.0 * SUM(CASE WHEN is_fraud = 1 THEN 1 ELSE 0 END) / COUNT(*), 2) as fraud_rate_pct,
-        SUM(amount) as total_amount,
-        AVG(amount) as avg_amount,
-        MIN(amount) as min_amount,
-        MAX(amount) as max_amount
-    FROM fact_transactions
-    GROUP BY DATE(event_time)
+        transaction_date,
+        total_transactions,
+        fraud_count,
+        ROUND(100.0 * fraud_count / total_transactions, 2) as fraud_rate_pct,
+        total_amount,
+        1.0 * total_amount / total_transactions as avg_amount,
+        min_amount,
+        max_amount
+    FROM {daily}
     ORDER BY transaction_date;
-    """
-    
-    df_daily = pd.read_sql(query_daily, engine)
-    output_file = os.path.join(output_dir, "daily_summary.csv")
-    df_daily.to_csv(output_file, index=False)
-    print(f"   ✅ Exported {len(df_daily):,} rows to {output_file}")
-    
-    # 3. Export merchant summary
-    print("\n3. Exporting merchant summary...")
-    query_merchant = """
+    """),
+    ("merchant_summary.csv", "merchant summary", """
     SELECT 
-        COALESCE(merchant, '(unknown)') as merchant,
-        COUNT(*) as total_transactions,
-        SUM(CASE WHEN is_fraud = 1 THEN 1 ELSE 0 END) as fraud_count,
-        ROUND(100.0 * SUM(CASE WHEN is_fraud = 1 THEN 1 ELSE 0 END) / NULLIF(COUNT(*), 0), 2) as fraud_rate_pct,
-        SUM(amount) as total_amount,
-        AVG(amount) as avg_amount
-    FROM fact_transactions
-    GROUP BY merchant
+        merchant,
+        total_transactions,
+        fraud_count,
+        ROUND(100.0 * fraud_count / NULLIF(total_transactions, 0), 2) as fraud_rate_pct,
+        total_amount,
+        1.0 * total_amount / total_transactions as avg_amount
+    FROM {merchant}
     ORDER BY fraud_rate_pct DESC NULLS LAST;
-    """
-    
-    df_merchant = pd.read_sql(query_merchant, engine)
-    output_file = os.path.join(output_dir, "merchant_summary.csv")
-    df_merchant.to_csv(output_file, index=False)
-    print(f"   ✅ Exported {len(df_merchant):,} rows to {output_file}")
-    
-    # 4. Export user summary
-    print("\n4. Exporting user summary...")
-    query_user = """
+    """),
+    ("user_summary.csv", "user summary", """
     SELECT 
-        user_id,
-        COUNT(*) as total_transactions,
-        SUM(CASE WHEN is_fraud = 1 THEN 1 ELSE 0 END) as fraud_count,
-        ROUND(100.0 * SUM(CASE WHEN is_fraud = 1 THEN 1 ELSE 0 END) / COUNT(*), 2) as fraud_rate_pct,
-        SUM(amount) as total_amount,
-        AVG(amount) as avg_amount
-    FROM fact_transactions
-    GROUP BY user_id
-    HAVING SUM(CASE WHEN is_fraud = 1 THEN 1 ELSE 0 END) > 0
+        NULLIF(user_key, -1) as user_id,
+        total_transactions,
+        fraud_count,
+        ROUND(100.0 * fraud_count / total_transactions, 2) as fraud_rate_pct,
+        total_amount,
+        1.0 * total_amount / total_transactions as avg_amount
+    FROM {user}
+    WHERE fraud_count > 0
     ORDER BY fraud_count DESC
     LIMIT 100;
-    """
-    
-    df_user = pd.read_sql(query_user, engine)
-    output_file = os.path.join(output_dir, "user_summary.csv")
-    df_user.to_csv(output_file, index=False)
-    print(f"   ✅ Exported {len(df_user):,} rows to {output_file}")
-    
-    # 5. Export fraud by reason
-    print("\n5. Exporting fraud by reason...")
-    query_fraud_reason = """
+    """),
+    ("fraud_by_reason.csv", "fraud by reason", """
     SELECT 
-        COALESCE(fraud_reason, 'no_fraud') as fraud_reason,
-        CASE 
-            WHEN fraud_reason = 'high_amount' THEN 'High Amount'
-            WHEN fraud_reason = 'crypto_merchant' THEN 'Crypto Merchant'
-            WHEN fraud_reason = 'burst_activity' THEN 'Burst Activity'
-            ELSE 'No Fraud'
-        END as fraud_reason_clean,
-        COUNT(*) as transaction_count,
-        SUM(amount) as total_amount,
-        AVG(amount) as avg_amount
-    FROM fact_transactions
-    WHERE is_fraud = 1
-    GROUP BY fraud_reason
+        fraud_reason,
+        {fraud_reason_clean} as fraud_reason_clean,
+        total_transactions as transaction_count,
+        total_amount,
+        1.0 * total_amount / total_transactions as avg_amount
+    FROM {fraud_reason}
     ORDER BY transaction_count DESC;
-    """
-    
-    df_fraud_reason = pd.read_sql(query_fraud_reason, engine)
-    output_file = os.path.join(output_dir, "fraud_by_reason.csv")
-    df_fraud_reason.to_csv(output_file, index=False)
-    print(f"   ✅ Exported {len(df_fraud_reason):,} rows to {output_file}")
-    
-    # 6. Export hourly summary
-    print("\n6. Exporting hourly summary...")
-    query_hourly = """
+    """),
+    ("hourly_summary.csv", "hourly summary", """
     SELECT 
-        EXTRACT(HOUR FROM event_time) as transaction_hour,
-        COUNT(*) as total_transactions,
-        SUM(CASE WHEN is_fraud = 1 THEN 1 ELSE 0 END) as fraud_count,
-        ROUND(100.0 * SUM(CASE WHEN is_fraud = 1 THEN 1 ELSE 0 END) / COUNT(*), 2) as fraud_rate_pct
-    FROM fact_transactions
-    GROUP BY EXTRACT(HOUR FROM event_time)
+        transaction_hour,
+        total_transactions,
+        fraud_count,
+        ROUND(100.0 * fraud_count / total_transactions, 2) as fraud_rate_pct
+    FROM {hourly}
     ORDER BY transaction_hour;
-    """
-    
-    df_hourly = pd.read_sql(query_hourly, engine)
-    output_file = os.path.join(output_dir, "hourly_summary.csv")
-    df_hourly.to_csv(output_file, index=False)
-    print(f"   ✅ Exported {len(df_hourly):,} rows to {output_file}")
-    
-    # 7. Export day of week summary
-    print("\n7. Exporting day of week summary...")
-    query_dow = """
+    """),
+    ("day_of_week_summary.csv", "day of week summary", """
     SELECT 
-        EXTRACT(DOW FROM event_time) as day_of_week,
-        CASE EXTRACT(DOW FROM event_time)
+        day_of_week,
+        CASE day_of_week
             WHEN 0 THEN 'Sunday'
             WHEN 1 THEN 'Monday'
             WHEN 2 THEN 'Tuesday'
@@ -196,37 +202,357 @@ def export_data():
             WHEN 5 THEN 'Friday'
             WHEN 6 THEN 'Saturday'
         END as day_name,
-        COUNT(*) as total_transactions,
-        SUM(CASE WHEN is_fraud = 1 THEN 1 ELSE 0 END) as fraud_count,
-        ROUND(100.0 * SUM(CASE WHEN is_fraud = 1 THEN 1 ELSE 0 END) / COUNT(*), 2) as fraud_rate_pct
-    FROM fact_transactions
-    GROUP BY EXTRACT(DOW FROM event_time)
+        total_transactions,
+        fraud_count,
+        ROUND(100.0 * fraud_count / total_transactions, 2) as fraud_rate_pct
+    FROM {day_of_week}
     ORDER BY day_of_week;
-    """
-    
-    df_dow = pd.read_sql(query_dow, engine)
-    output_file = os.path.join(output_dir, "day_of_week_summary.csv")
-    df_dow.to_csv(output_file, index=False)
-    print(f"   ✅ Exported {len(df_dow):,} rows to {output_file}")
-    
-    # 8. Export location summary
-    print("\n8. Exporting location summary...")
-    query_location = """
+    """),
+    ("location_summary.csv", "location summary", """
     SELECT 
-        COALESCE(location, '(unknown)') as location,
-        COUNT(*) as total_transactions,
-        SUM(CASE WHEN is_fraud = 1 THEN 1 ELSE 0 END) as fraud_count,
-        ROUND(100.0 * SUM(CASE WHEN is_fraud = 1 THEN 1 ELSE 0 END) / NULLIF(COUNT(*), 0), 2) as fraud_rate_pct,
-        SUM(amount) as total_amount
-    FROM fact_transactions
-    GROUP BY location
+        location,
+        total_transactions,
+        fraud_count,
+        ROUND(100.0 * fraud_count / NULLIF(total_transactions, 0), 2) as fraud_rate_pct,
+        total_amount
+    FROM {location}
     ORDER BY fraud_rate_pct DESC NULLS LAST;
+    """),
+]
+
+
+class _ProgressFile:
+    """Write-only file wrapper that counts rows/bytes and prints progress"""
+
+    def __init__(self, f, progress_rows: int = EXPORT_PROGRESS_ROWS):
+        self._f = f
+        self.lines = 0
+        self.bytes = 0
+        self._progress_rows = progress_rows
+        self._next_report = progress_rows
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._f.write(data)
+        self.bytes += len(data)
+        self.lines += data.count(b"\n")
+        if self._progress_rows and self.lines >= self._next_report:
+            print(f"   ... {self.lines - 1:,} rows ({self.bytes / 2**20:,.1f} MB)")
+            self._next_report += self._progress_rows
+        return len(data)
+
+
+def _open_output(path: str, compress: bool):
+    if compress:
+        import gzip
+        return gzip.open(path, "wb", compresslevel=6)
+    return open(path, "wb")
+
+
+def add_calculated_fields(df: pd.DataFrame) -> pd.DataFrame:
+    """Same calculated fields as FACT_QUERY, for engines without COPY"""
+    event_time = pd.to_datetime(df["event_time"])
+    df["transaction_date"] = event_time.dt.date
+    df["transaction_hour"] = event_time.dt.hour
+    df["day_of_week"] = (event_time.dt.dayofweek + 1) % 7  # 0 = Minggu, seperti EXTRACT(DOW)
+    df["transaction_month"] = event_time.dt.month
+    df["transaction_year"] = event_time.dt.year
+    df["transaction_status"] = np.where(df["is_fraud"] == 1, "Fraud", "Normal")
+    df["fraud_reason_clean"] = df["fraud_reason"].map(reason_label)
+    amount = pd.to_numeric(df["amount"])
+    df["amount_category"] = np.select([amount > 50_000_000, amount > 10_000_000],
+                                      ["High Amount", "Medium Amount"], "Low Amount")
+    return df
+
+
+def export_fact(engine, output_file: str, table: str = FACT_TABLE,
+                fetch_rows: int = EXPORT_FETCH_ROWS, progress_rows: int = EXPORT_PROGRESS_ROWS) -> int:
     """
+    Stream the whole fact table (with calculated fields) into a CSV / CSV.gz file
+
+    PostgreSQL uses ``COPY (query) TO STDOUT`` straight into the (compressed)
+    file, so neither side materializes the table. Other engines read
+    ``fetch_rows`` rows at a time from a server-side cursor. The file is
+    written to ``<output_file>.tmp`` and renamed when complete.
+
+    Returns:
+        Number of exported rows
+    """
+    tmp = output_file + ".tmp"
+    start = time.perf_counter()
+    try:
+        with _open_output(tmp, output_file.endswith(".gz")) as raw:
+            out = _ProgressFile(raw, progress_rows)
+            if engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2":
+                rows = _copy_fact(engine, table, out)
+            else:
+                rows = _stream_fact(engine, table, out, fetch_rows)
+        os.replace(tmp, output_file)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    seconds = time.perf_counter() - start
+    print(f"   ✅ Exported {rows:,} rows to {output_file} "
+          f"({out.bytes / 2**20:,.1f} MB uncompressed, {seconds:.1f}s)")
+    return rows
+
+
+def _copy_fact(engine, table: str, out: _ProgressFile) -> int:
+    raw_conn = engine.raw_connection()
+    try:
+        with raw_conn.cursor() as cur:
+            query = FACT_QUERY.format(table=table, fraud_reason_clean=reason_label_sql(), where="")
+            cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", out)
+            rows = cur.rowcount
+        raw_conn.commit()
+    finally:
+        raw_conn.close()
+    return rows if rows is not None and rows >= 0 else out.lines - 1
+
+
+def _stream_fact(engine, table: str, out: _ProgressFile, fetch_rows: int) -> int:
+    rows = 0
+    query = text(f"SELECT {', '.join(FACT_COLUMNS)} FROM {table} ORDER BY event_time")
+    with engine.connect().execution_options(stream_results=True) as conn:
+        for chunk in pd.read_sql(query, conn, chunksize=fetch_rows):
+            chunk["user_id"] = chunk["user_id"].astype("Int64")
+            chunk = add_calculated_fields(chunk)
+            out.write(chunk.to_csv(index=False, header=rows == 0))
+            rows += len(chunk)
+    if rows == 0:
+        out.write(",".join(FACT_COLUMNS + CALCULATED_COLUMNS) + "\n")
+    return rows
+
+
+def export_summaries(engine, output_dir: str, table: str = FACT_TABLE, files: Iterable[str] = None) -> dict:
+    """
+    Export summary CSVs 2-8 from the rollup tables; returns rows per file
+
+    Args:
+        files: Only export these file names (default: all seven)
+    """
+    with engine.begin() as conn:
+        # Warehouse lama tanpa rollup: dibuat dan diisi sekali dari fact table
+        ensure_rollups(conn, table)
+
+    names = {name: rollup_table(table, name) for name in SUMMARY_ROLLUPS}
+    files = None if files is None else set(files)
+    exported = {}
+    for i, (file_name, label, query) in enumerate(SUMMARY_QUERIES, start=2):
+        if files is not None and file_name not in files:
+            continue
+        print(f"\n{i}. Exporting {label}...")
+        df = pd.read_sql(query.format(fraud_reason_clean=reason_label_sql(), **names), engine)
+        output_file = os.path.join(output_dir, file_name)
+        df.to_csv(output_file, index=False)
+        exported[file_name] = len(df)
+        print(f"   ✅ Exported {len(df):,} rows to {output_file}")
+    return exported
+
+
+def load_export_state(output_dir: str) -> dict:
+    """Watermarks of the last incremental export ({"fact": {...}, "summaries": {...}})"""
+    path = os.path.join(output_dir, EXPORT_STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_export_state(state: dict, output_dir: str):
+    """Persist the export watermarks atomically"""
+    path = os.path.join(output_dir, EXPORT_STATE_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def partition_path(output_dir: str, day: str) -> str:
+    return os.path.join(output_dir, FACT_PARTITION_DIR, f"{day}.parquet")
+
+
+def fact_watermarks(engine, table: str = FACT_TABLE, use_rollups: bool = LOAD_ROLLUPS) -> Dict[str, dict]:
+    """
+    Watermark per transaction_date
+
+    Read from the daily rollup, which every load and range replace touching
+    a day updates (row count, totals, ``updated_at``), so no fact row is
+    scanned. Without rollups (``LOAD_ROLLUPS=0``) the fact table is grouped
+    instead: row count and latest ingestion_time per day, over all history.
+    """
+    if use_rollups:
+        with engine.begin() as conn:
+            ensure_rollups(conn, table)
+            rows = conn.execute(text(f"""
+                SELECT transaction_date, total_transactions, fraud_count, total_amount, updated_at
+                FROM {rollup_table(table, "daily")}
+            """)).all()
+        return {str(d)[:10]: {"rows": int(n), "fraud": int(f), "amount": str(a), "updated": str(ts)}
+                for d, n, f, a, ts in rows if d is not None}
+    with engine.connect() as conn:
+        day = day_expr(conn)
+        rows = conn.execute(text(f"""
+            SELECT {day}, COUNT(*), MAX(ingestion_time) FROM {table}
+            GROUP BY {day}
+        """)).all()
+    return {str(d)[:10]: {"rows": int(n), "ingested": str(ts)} for d, n, ts in rows if d is not None}
+
+
+def read_fact_day(engine, day: str, table: str = FACT_TABLE) -> pd.DataFrame:
+    """One day of the fact table with the calculated fields"""
+    start = date.fromisoformat(day)
+    params = {"start": start.isoformat(), "end": (start + timedelta(days=1)).isoformat()}
+    # Range scan (bukan DATE(event_time) = ...) supaya index event_time / partisi bulanan terpakai
+    where = "WHERE event_time >= :start AND event_time < :end"
+    if engine.dialect.name == "postgresql":
+        query = FACT_QUERY.format(table=table, fraud_reason_clean=reason_label_sql(), where=where)
+        return pd.read_sql(text(query), engine, params=params)
+    df = pd.read_sql(text(f"SELECT {', '.join(FACT_COLUMNS)} FROM {table} {where} ORDER BY event_time"),
+                     engine, params=params)
+    return add_calculated_fields(df)
+
+
+def export_fact_partition(engine, day: str, output_file: str, table: str = FACT_TABLE) -> int:
+    """Write one day as a compressed Parquet file (via ``.tmp`` + rename); returns its rows"""
+    df = read_fact_day(engine, day, table)
+    for column in ("event_time", "ingestion_time"):
+        df[column] = pd.to_datetime(df[column], utc=True, format="mixed")
+    df["transaction_date"] = pd.to_datetime(df["transaction_date"]).dt.date
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with FrameWriter(output_file, PARTITION_DTYPES, EXPORT_PARQUET_COMPRESSION) as writer:
+        writer.write(df[FACT_COLUMNS + CALCULATED_COLUMNS])
+    return len(df)
+
+
+def export_fact_incremental(engine, output_dir: str, table: str = FACT_TABLE) -> dict:
+    """
+    Rewrite the day partitions whose watermark moved since the last export
+
+    A day is rewritten when its watermark (``fact_watermarks``) differs
+    from the recorded one or when its file is missing. Watermarks are
+    read before the partitions, so rows loaded during the export only make
+    the next export rewrite the day again.
+
+    Returns:
+        Dict with partitions, written, removed and rows (rows written)
+    """
+    state = load_export_state(output_dir)
+    previous = state.setdefault("fact", {})
+    marks = fact_watermarks(engine, table)
+    changed = [day for day in sorted(marks)
+               if previous.get(day) != marks[day] or not os.path.exists(partition_path(output_dir, day))]
+    removed = sorted(set(previous) - set(marks))
+
+    rows = 0
+    for day in changed:
+        rows += export_fact_partition(engine, day, partition_path(output_dir, day), table)
+        # Dicatat per partisi: export yang terputus melanjutkan dari partisi berikutnya
+        previous[day] = marks[day]
+        save_export_state(state, output_dir)
+    for day in removed:
+        if os.path.exists(partition_path(output_dir, day)):
+            os.remove(partition_path(output_dir, day))
+        del previous[day]
+    save_export_state(state, output_dir)
+    print(f"   ✅ Rewrote {len(changed)} of {len(marks)} day partitions ({rows:,} rows), "
+          f"removed {len(removed)}, in {os.path.join(output_dir, FACT_PARTITION_DIR)}")
+    return {"partitions": len(marks), "written": len(changed), "removed": len(removed), "rows": rows}
+
+
+def summary_watermarks(engine, table: str = FACT_TABLE) -> Dict[str, str]:
+    """
+    Input signature of every summary file: its query and the size, totals
+    and latest ``updated_at`` of the rollup tables it reads
+    """
+    with engine.begin() as conn:
+        ensure_rollups(conn, table)
+        marks = {}
+        for name in SUMMARY_ROLLUPS:
+            row = conn.execute(text(f"""
+                SELECT COUNT(*), SUM(total_transactions), SUM(fraud_count), SUM(total_amount), MAX(updated_at)
+                FROM {rollup_table(table, name)}
+            """)).one()
+            marks[name] = [str(v) for v in row]
+    signatures = {}
+    for file_name, _, query in SUMMARY_QUERIES:
+        inputs = {name: marks[name] for name in SUMMARY_ROLLUPS if "{" + name + "}" in query}
+        payload = json.dumps({"query": query, "labels": reason_label_sql(), "inputs": inputs}, sort_keys=True)
+        signatures[file_name] = hashlib.sha256(payload.encode()).hexdigest()
+    return signatures
+
+
+def export_summaries_incremental(engine, output_dir: str, table: str = FACT_TABLE) -> dict:
+    """Recompute only the summary files whose rollup inputs changed; returns rows per exported file"""
+    state = load_export_state(output_dir)
+    previous = state.setdefault("summaries", {})
+    signatures = summary_watermarks(engine, table)
+    changed = [name for name, signature in signatures.items()
+               if previous.get(name) != signature or not os.path.exists(os.path.join(output_dir, name))]
+    exported = export_summaries(engine, output_dir, table, files=changed) if changed else {}
+    state["summaries"] = signatures
+    save_export_state(state, output_dir)
+    print(f"\n   ✅ Recomputed {len(changed)} of {len(signatures)} summary files"
+          + (f" ({', '.join(changed)})" if changed else ""))
+    return exported
+
+
+def export_data(mode: str = EXPORT_MODE):
+    """Export data dari PostgreSQL ke CSV files (mode: full atau incremental)"""
+    
+    # Connect to database
+    postgres_uri = os.getenv("POSTGRES_URI")
+    if not postgres_uri:
+        print("❌ POSTGRES_URI not found in .env file")
+        return
+    
+    engine = create_engine(postgres_uri)
+    output_dir = os.path.join(os.getenv("DATA_DIR", "./data"), "tableau")
+    os.makedirs(output_dir, exist_ok=True)
     
-    df_location = pd.read_sql(query_location, engine)
-    output_file = os.path.join(output_dir, "location_summary.csv")
-    df_location.to_csv(output_file, index=False)
-    print(f"   ✅ Exported {len(df_location):,} rows to {output_file}")
+    print("=" * 60)
+    print("Exporting data to CSV for Tableau Public")
+    print("=" * 60)
+    
+    metrics = RunMetrics("export")
+    if mode == "incremental":
+        with metrics.run():
+            metrics.info["mode"] = mode
+            # 1. Partisi harian fact_transactions yang watermark-nya bergeser
+            print("\n1. Exporting changed fact_transactions day partitions...")
+            with metrics.step("fact_partitions") as step:
+                result = export_fact_incremental(engine, output_dir)
+                step.rows_out = result["rows"]
+                metrics.info.update(partitions=result["partitions"], partitions_written=result["written"])
+
+            # 2-8. Summary yang input rollup-nya berubah
+            with metrics.step("summaries") as step:
+                exported = export_summaries_incremental(engine, output_dir)
+                step.rows_out = sum(exported.values())
+                step.wrote(*(os.path.join(output_dir, name) for name in exported))
+        print("\n" + "=" * 60)
+        print("✅ Incremental export completed!")
+        print("=" * 60)
+        print(f"\n📁 Files exported to: {output_dir}")
+        print(f"\n💡 Tip: Point Tableau at the '{FACT_PARTITION_DIR}/' folder (one Parquet file per day)")
+        print("=" * 60)
+        return
+
+    with metrics.run():
+        # 1. Export full fact_transactions dengan calculated fields (streaming)
+        print("\n1. Exporting fact_transactions (full data)...")
+        output_file = os.path.join(output_dir, "fact_transactions.csv" + (".gz" if EXPORT_COMPRESSION == "gzip" else ""))
+        with metrics.step("fact") as step:
+            step.rows_out = export_fact(engine, output_file)
+            step.wrote(output_file)
+
+        # 2-8. Summary dari tabel rollup (di-maintain incremental oleh load.py)
+        with metrics.step("summaries") as step:
+            exported = export_summaries(engine, output_dir)
+            step.rows_out = sum(exported.values())
+            step.wrote(*(os.path.join(output_dir, name) for name in exported))
     
     # Summary
     print("\n" + "=" * 60)
@@ -234,7 +560,7 @@ def export_data():
     print("=" * 60)
     print(f"\n📁 Files exported to: {output_dir}")
     print("\n📊 Files created:")
-    print("   1. fact_transactions.csv - Full transaction data (for detailed analysis)")
+    print("   1. fact_transactions.csv[.gz] - Full transaction data (for detailed analysis)")
     print("   2. daily_summary.csv - Daily aggregated data (for time series)")
     print("   3. merchant_summary.csv - Merchant aggregated data (for merchant analysis)")
     print("   4. user_summary.csv - User aggregated data (for user analysis)")
@@ -243,8 +569,12 @@ def export_data():
     print("   7. day_of_week_summary.csv - Day of week aggregated data")
     print("   8. location_summary.csv - Location aggregated data")
     print("\n💡 Tip: Use 'fact_transactions.csv' as main data source in Tableau Public")
+    print("   (EXPORT_COMPRESSION=none writes it uncompressed; otherwise gunzip the .gz first)")
     print("=" * 60)
 
 if __name__ == "__main__":
-    export_data()
+    parser = argparse.ArgumentParser(description="Export the warehouse for Tableau")
+    parser.add_argument("--mode", choices=["full", "incremental"], default=EXPORT_MODE,
+                        help="full: rewrite every file; incremental: changed day partitions and summaries only")
+    export_data(parser.parse_args().mode)
 
@@ -0,0 +1,184 @@
+"""
+External (out-of-core) sort for DataFrames that do not fit in memory
+
+Rows are buffered up to ``run_rows``, sorted, and spilled to disk as a
+sorted run made of small pickled blocks. ``sorted_blocks()`` then merges
+the runs back (multi-pass when there are more than ``fan_in`` runs) and
+yields DataFrame blocks in global sort order, so at most roughly
+``fan_in * block_rows`` rows are held in memory while merging.
+
+Sort keys must be NaN-free and totally ordered; callers add a sequence
+column as the last key to make the order deterministic.
+"""
+
+import os
+import shutil
+import tempfile
+import logging
+from typing import Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class SortedRun:
+    """A sorted run stored on disk as a list of pickled blocks"""
+
+    def __init__(self, paths: List[str], rows: int):
+        self.paths = paths
+        self.rows = rows
+
+    def load(self, i: int) -> pd.DataFrame:
+        return pd.read_pickle(self.paths[i])
+
+    def remove(self):
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _le_bound(df: pd.DataFrame, by: Sequence[str], bound: tuple) -> np.ndarray:
+    """Row-wise lexicographic ``key <= bound`` for the key columns ``by``"""
+    le = np.zeros(len(df), dtype=bool)
+    eq = np.ones(len(df), dtype=bool)
+    for col, value in zip(by, bound):
+        values = df[col].to_numpy()
+        le |= eq & (values < value)
+        eq &= values == value
+    return le | eq
+
+
+def _last_key(df: pd.DataFrame, by: Sequence[str]) -> tuple:
+    return tuple(df[col].to_numpy()[-1] for col in by)
+
+
+class ExternalSorter:
+    """
+    Sort an arbitrarily large stream of DataFrames with a bounded memory footprint
+
+    Args:
+        by: Key columns to sort by (lexicographic, ascending)
+        run_rows: Rows buffered in memory before a sorted run is spilled
+        block_rows: Rows per on-disk block (unit of I/O while merging)
+        spill_dir: Parent directory for spill files (default: system temp dir)
+        fan_in: Maximum number of runs merged at once
+    """
+
+    def __init__(self, by: Sequence[str], run_rows: int, block_rows: int,
+                 spill_dir: Optional[str] = None, fan_in: int = 16):
+        if fan_in < 2:
+            raise ValueError("fan_in must be at least 2")
+        self.by = list(by)
+        self.run_rows = max(1, int(run_rows))
+        self.block_rows = max(1, int(block_rows))
+        self.fan_in = fan_in
+        self.spill_dir = spill_dir
+        self._tmpdir = None
+        self._pending: List[pd.DataFrame] = []
+        self._pending_rows = 0
+        self._runs: List[SortedRun] = []
+        self._files = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+
+    @property
+    def tmpdir(self) -> str:
+        if self._tmpdir is None:
+            if self.spill_dir:
+                os.makedirs(self.spill_dir, exist_ok=True)
+            self._tmpdir = tempfile.mkdtemp(prefix="extsort_", dir=self.spill_dir)
+        return self._tmpdir
+
+    def cleanup(self):
+        """Remove all spill files"""
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._tmpdir = None
+        self._runs = []
+        self._pending = []
+        self._pending_rows = 0
+
+    def add(self, df: pd.DataFrame):
+        """Buffer rows; spill a sorted run once ``run_rows`` is reached"""
+        if df.empty:
+            return
+        self._pending.append(df)
+        self._pending_rows += len(df)
+        if self._pending_rows >= self.run_rows:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        df = pd.concat(self._pending, ignore_index=True)
+        self._pending = []
+        self._pending_rows = 0
+        df = df.sort_values(self.by, kind="mergesort", ignore_index=True)
+        self._runs.append(self._write_run([df]))
+        logger.debug(f"Spilled sorted run #{len(self._runs)} ({len(df)} rows)")
+
+    def _write_run(self, blocks) -> SortedRun:
+        paths, rows = [], 0
+        for df in blocks:
+            for start in range(0, len(df), self.block_rows):
+                block = df.iloc[start:start + self.block_rows]
+                path = os.path.join(self.tmpdir, f"block_{self._files:08d}.pkl")
+                self._files += 1
+                block.to_pickle(path)
+                paths.append(path)
+                rows += len(block)
+        return SortedRun(paths, rows)
+
+    def _merge(self, runs: List[SortedRun]) -> Iterator[pd.DataFrame]:
+        """K-way merge of sorted runs, one vectorized batch at a time"""
+        index = [0] * len(runs)
+        heads = [run.load(0) if run.paths else None for run in runs]
+
+        while any(head is not None for head in heads):
+            # Everything <= the smallest "last key" of a run that still has
+            # unread blocks is safe to emit: no later block can sort before it
+            bounds = [
+                _last_key(head, self.by)
+                for run, head, i in zip(runs, heads, index)
+                if head is not None and i + 1 < len(run.paths)
+            ]
+            bound = min(bounds) if bounds else None
+
+            taken = []
+            for r, head in enumerate(heads):
+                if head is None:
+                    continue
+                n = len(head) if bound is None else int(_le_bound(head, self.by, bound).sum())
+                if n:
+                    taken.append(head.iloc[:n])
+                if n == len(head):
+                    index[r] += 1
+                    heads[r] = runs[r].load(index[r]) if index[r] < len(runs[r].paths) else None
+                else:
+                    heads[r] = head.iloc[n:]
+
+            if taken:
+                batch = pd.concat(taken, ignore_index=True)
+                yield batch.sort_values(self.by, kind="mergesort", ignore_index=True)
+
+    def sorted_blocks(self) -> Iterator[pd.DataFrame]:
+        """Yield all added rows in sorted order as a sequence of DataFrames"""
+        self._flush()
+        runs = self._runs
+        while len(runs) > self.fan_in:
+            merged = []
+            for start in range(0, len(runs), self.fan_in):
+                group = runs[start:start + self.fan_in]
+                merged.append(self._write_run(self._merge(group)))
+                for run in group:
+                    run.remove()
+            logger.debug(f"Merge pass: {len(runs)} runs -> {len(merged)} runs")
+            runs = merged
+        self._runs = runs
+        yield from self._merge(runs)
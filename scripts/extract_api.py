@@ -1,35 +1,317 @@
-import os, json, requests
+import os
+import sys
+import time
+import codecs
+import asyncio
+import logging
+import argparse
+from typing import Optional
+import pandas as pd
 from dotenv import load_dotenv
 
+# Add scripts directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from intermediate import stage_file, open_writer
+from utils import JsonArrayParser, RunMetrics, iter_json_array
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 DATA_DIR = os.getenv("DATA_DIR", "./data")
 RAW_DIR = os.path.join(DATA_DIR, "raw")
 API_URL = os.getenv("API_URL", "")
 SRC_FILE = os.path.join(RAW_DIR, "api_transactions.json")
-EXTRACTED_FILE = os.path.join(RAW_DIR, "api_extracted.json")
+# api_extracted.parquet (default) atau api_extracted.json (INTERMEDIATE_FORMAT=legacy)
+EXTRACTED_FILE = stage_file(RAW_DIR, "api_extracted", legacy_ext=".json")
+
+# Paginasi: API_PAGE_SIZE=0 berarti satu request (body di-stream, tanpa paginasi)
+PAGE_SIZE = int(os.getenv("API_PAGE_SIZE", "0"))
+PAGE_PARAM = os.getenv("API_PAGE_PARAM", "page")
+SIZE_PARAM = os.getenv("API_SIZE_PARAM", "page_size")
+FIRST_PAGE = int(os.getenv("API_FIRST_PAGE", "1"))
+CONCURRENCY = int(os.getenv("API_CONCURRENCY", "4"))
+RATE_LIMIT = float(os.getenv("API_RATE_LIMIT", "0"))  # request/detik, 0 = tanpa batas
+RETRIES = int(os.getenv("API_RETRIES", "3"))
+BACKOFF = float(os.getenv("API_BACKOFF", "0.5"))
+TIMEOUT = float(os.getenv("API_TIMEOUT", "30"))
+BATCH_ROWS = int(os.getenv("API_BATCH_ROWS", "10000"))
+CHUNK_BYTES = 64 * 1024
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Tipe tetap supaya setiap batch/halaman punya schema yang sama
+API_DTYPES = {
+    "transaction_id": "string",
+    "user_id": "Int64",
+    "amount": "float64",
+    "currency": "string",
+    "timestamp": "string",
+    "merchant": "string",
+    "status": "string",
+    "location": "string",
+    "source": "string",
+}
+
+
+class RateLimiter:
+    """Space requests so that at most ``rate`` start per second (0 disables)"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self.interval
+
+
+class RetryableError(Exception):
+    """Transient HTTP failure (429/5xx) that should be retried"""
+
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def _retry_after(headers) -> Optional[float]:
+    value = headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+async def _stream_array(resp, chunk_bytes: int = CHUNK_BYTES):
+    """Yield lists of records as the JSON array body arrives"""
+    parser = JsonArrayParser()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    async for chunk in resp.content.iter_chunked(chunk_bytes):
+        items = parser.feed(decoder.decode(chunk))
+        if items:
+            yield items
+    items = parser.feed(decoder.decode(b"", final=True))
+    if items:
+        yield items
+    parser.close()
+
+
+class ApiExtractor:
+    """
+    Fetch an API feed with aiohttp and write records to a stage file as they arrive
+
+    Paginated feeds (``page_size`` > 0) are fetched by ``concurrency`` workers
+    over one pooled session. A page shorter than ``page_size`` marks the end
+    of the feed. Pages are written in page order; at most ``2 * concurrency``
+    fetched pages wait in memory for a slower predecessor. Without pagination
+    the single response body is parsed incrementally and written every
+    ``batch_rows`` records.
+    """
+
+    def __init__(self, url: str, out_path: str, page_size: int = PAGE_SIZE,
+                 concurrency: int = CONCURRENCY, rate_limit: float = RATE_LIMIT,
+                 retries: int = RETRIES, backoff: float = BACKOFF, timeout: float = TIMEOUT,
+                 batch_rows: int = BATCH_ROWS, page_param: str = PAGE_PARAM,
+                 size_param: str = SIZE_PARAM, first_page: int = FIRST_PAGE,
+                 chunk_bytes: int = CHUNK_BYTES):
+        self.url = url
+        self.out_path = out_path
+        self.page_size = page_size
+        self.concurrency = max(1, concurrency)
+        self.rate_limit = rate_limit
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.batch_rows = batch_rows
+        self.page_param = page_param
+        self.size_param = size_param
+        self.first_page = first_page
+        self.chunk_bytes = chunk_bytes
+        self.stats = {"requests": 0, "retries": 0, "pages": 0, "rows": 0}
+
+    def run(self) -> dict:
+        """Run the extract and return request/row stats"""
+        start = time.perf_counter()
+        asyncio.run(self._run())
+        self.stats["seconds"] = round(time.perf_counter() - start, 3)
+        return self.stats
+
+    async def _run(self):
+        import aiohttp
+        self._limiter = RateLimiter(self.rate_limit)
+        self._partial = False
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        # Tanpa batas total: body besar boleh lama, asal tidak macet per read
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout, sock_read=self.timeout)
+        with open_writer(self.out_path, API_DTYPES) as self._writer:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                if self.page_size > 0:
+                    await self._fetch_pages(session)
+                else:
+                    await self._request(session, {}, self._write_stream)
+        self.stats["rows"] = self._writer.rows
+
+    def _write(self, records: list):
+        if records:
+            self._writer.write(pd.DataFrame.from_records(records))
+
+    async def _request(self, session, params: dict, consume):
+        """
+        GET with retry: 429/5xx, connection errors and timeouts are retried with
+        exponential backoff (or the server's Retry-After). ``consume`` reads the
+        response; it is only retried when it has not written anything yet.
+        """
+        import aiohttp
+        attempt = 0
+        while True:
+            await self._limiter.acquire()
+            self.stats["requests"] += 1
+            try:
+                async with session.get(self.url, params=params) as resp:
+                    if resp.status in RETRY_STATUSES:
+                        raise RetryableError(resp.status, _retry_after(resp.headers))
+                    resp.raise_for_status()
+                    return await consume(resp)
+            except (RetryableError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError,
+                    asyncio.TimeoutError) as e:
+                if attempt >= self.retries or self._partial:
+                    raise
+                delay = getattr(e, "retry_after", None)
+                if delay is None:
+                    delay = self.backoff * 2 ** attempt
+                attempt += 1
+                self.stats["retries"] += 1
+                logger.warning(f"retry {attempt}/{self.retries} {params or ''} after {e!r} (sleep {delay:.2f}s)")
+                await asyncio.sleep(delay)
+
+    async def _write_stream(self, resp):
+        batch = []
+        async for items in _stream_array(resp, self.chunk_bytes):
+            batch.extend(items)
+            if len(batch) >= self.batch_rows:
+                self._write(batch)
+                self._partial = True  # sudah ada yang ditulis, tidak bisa diulang
+                batch = []
+        self._write(batch)
+        self.stats["pages"] += 1
+
+    async def _read_page(self, resp) -> list:
+        records = []
+        async for items in _stream_array(resp, self.chunk_bytes):
+            records.extend(items)
+        return records
+
+    async def _fetch_pages(self, session):
+        window = 2 * self.concurrency
+        cond = asyncio.Condition()
+        pending = {}
+        state = {"next_page": self.first_page, "next_write": self.first_page, "last_page": None}
+
+        def finished():
+            return state["last_page"] is not None and state["next_page"] > state["last_page"]
+
+        async def worker():
+            while True:
+                async with cond:
+                    # Jangan terlalu jauh di depan halaman yang belum ditulis
+                    await cond.wait_for(lambda: finished() or
+                                        state["next_page"] < state["next_write"] + window)
+                    if finished():
+                        return
+                    page = state["next_page"]
+                    state["next_page"] += 1
+                params = {self.page_param: page, self.size_param: self.page_size}
+                records = await self._request(session, params, self._read_page)
+                async with cond:
+                    pending[page] = records
+                    if len(records) < self.page_size and (state["last_page"] is None or page < state["last_page"]):
+                        state["last_page"] = page
+                    # Tulis halaman berurutan; halaman setelah last_page dibuang
+                    while state["next_write"] in pending:
+                        if state["last_page"] is not None and state["next_write"] > state["last_page"]:
+                            break
+                        self._write(pending.pop(state["next_write"]))
+                        self.stats["pages"] += 1
+                        state["next_write"] += 1
+                    cond.notify_all()
+
+        tasks = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+
+def extract_api(url: str = API_URL, out_path: str = EXTRACTED_FILE, **options) -> dict:
+    """Extract the API feed into ``out_path`` (or a FrameBuffer); see ApiExtractor for the options"""
+    return ApiExtractor(url, out_path, **options).run()
+
+
+def extract_local(src_file: str = SRC_FILE, out_path: str = EXTRACTED_FILE,
+                  batch_rows: int = BATCH_ROWS) -> int:
+    """Baca file JSON lokal (mock) batch demi batch"""
+    with open_writer(out_path, API_DTYPES) as writer:
+        for records in iter_json_array(src_file, batch_rows):
+            writer.write(pd.DataFrame.from_records(records))
+    return writer.rows
 
 
-os.makedirs(RAW_DIR, exist_ok=True)
+def run(url: str = API_URL, out_path=EXTRACTED_FILE, page_size: int = PAGE_SIZE,
+        concurrency: int = CONCURRENCY, run_id: str = None) -> dict:
+    """
+    Extract stage: the API feed, or the local JSON mock when there is no URL
 
+    Args:
+        out_path: Stage file, or a FrameBuffer that keeps the rows in memory
+        run_id: Run id of the metrics manifest (default ETL_RUN_ID)
 
-if API_URL:
-    print(f"Fetching from API: {API_URL}")
-    resp = requests.get(API_URL, timeout=30)
-    resp.raise_for_status()
-    data = resp.json()
-else:
-    print(f"Reading local file: {SRC_FILE}")
-    with open(SRC_FILE, "r") as f:
-        data = json.load(f)
+    Returns:
+        Dict with mode and rows (plus pages, requests and retries for the API)
+    """
+    if isinstance(out_path, str):
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
 
+    metrics = RunMetrics("extract_api", run_id=run_id)
+    with metrics.run(), metrics.step("extract") as step:
+        if url:
+            print(f"Fetching from API: {url}")
+            stats = extract_api(url, out_path, page_size=page_size, concurrency=concurrency)
+            print(f"   pages={stats['pages']} requests={stats['requests']} retries={stats['retries']} "
+                  f"rows={stats['rows']:,} ({stats['seconds']}s)")
+            metrics.info.update(mode="api", pages=stats["pages"], requests=stats["requests"],
+                                retries=stats["retries"])
+            step.rows_out = stats["rows"]
+        else:
+            print(f"Reading local file: {SRC_FILE}")
+            step.rows_out = extract_local(SRC_FILE, out_path)
+            step.read(SRC_FILE)
+            metrics.info["mode"] = "local"
+        step.rows_in = step.rows_out
+        if isinstance(out_path, str):
+            step.wrote(out_path)
+    return {**metrics.info, "rows": step.rows_out}
 
-# (Optional) Validasi minimal
-assert isinstance(data, list), "API data should be a list of objects"
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract transactions from the API (or the local JSON mock)")
+    parser.add_argument("--url", default=API_URL, help="API endpoint (default: API_URL)")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE,
+                        help="Records per page; 0 = single streamed request")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Concurrent page requests")
+    args = parser.parse_args(argv)
 
-with open(EXTRACTED_FILE, "w") as f:
-    json.dump(data, f, ensure_ascii=False)
+    run(args.url, EXTRACTED_FILE, args.page_size, args.concurrency)
+    print("✅ Extract API →", EXTRACTED_FILE)
 
 
-print("✅ Extract API →", EXTRACTED_FILE)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
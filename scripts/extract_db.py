@@ -1,37 +1,267 @@
 import os
+import sys
+import json
+import argparse
+from datetime import datetime, timedelta
 import pandas as pd
 from dotenv import load_dotenv
 
+# Add scripts directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from intermediate import stage_file, iter_frames, open_writer
+from utils import RunMetrics
+
 
 load_dotenv()
 DATA_DIR = os.getenv("DATA_DIR", "./data")
 RAW_DIR = os.path.join(DATA_DIR, "raw")
+STATE_DIR = os.path.join(DATA_DIR, "state")
 CSV_FILE = os.path.join(RAW_DIR, "db_transactions.csv")
-EXTRACTED_FILE = os.path.join(RAW_DIR, "db_extracted.csv")
+# db_extracted.parquet (default) atau db_extracted.csv (INTERMEDIATE_FORMAT=legacy)
+EXTRACTED_FILE = stage_file(RAW_DIR, "db_extracted")
+WATERMARK_FILE = os.path.join(STATE_DIR, "extract_db_watermark.json")
+# Watermark hasil extract CLI yang belum di-commit (menunggu load sukses)
+PENDING_WATERMARK_FILE = os.path.join(STATE_DIR, "extract_db_watermark.pending.json")
+
+# Mode: "full" (refresh 30 hari terakhir) atau "incremental" (mulai dari high-water mark)
+EXTRACT_DB_MODE = os.getenv("EXTRACT_DB_MODE", "full")
+FULL_REFRESH_DAYS = int(os.getenv("EXTRACT_DB_FULL_REFRESH_DAYS", "30"))
+LOOKBACK_HOURS = float(os.getenv("EXTRACT_DB_LOOKBACK_HOURS", "24"))
+FETCH_ROWS = int(os.getenv("EXTRACT_DB_FETCH_ROWS", "50000"))
+
+COLUMNS = ["id", "user_id", "account_number", "amount", "transaction_type", "date", "location"]
+# Tipe tetap supaya setiap chunk punya schema yang sama
+EXTRACT_DTYPES = {
+    "id": "int64",
+    "user_id": "Int64",
+    "account_number": "string",
+    "amount": "float64",
+    "transaction_type": "string",
+    "date": "datetime64[us]",
+    "location": "string",
+}
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def load_watermark(path: str = WATERMARK_FILE):
+    """Return the persisted high-water mark ({"date", "id"}) or None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
 
+def save_watermark(watermark: dict, path: str = WATERMARK_FILE):
+    """Persist the high-water mark atomically"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(watermark, f, indent=2)
+    os.replace(tmp, path)
+
+
+def next_watermark(watermark: dict, result: dict):
+    """Watermark after an extract (``stream_to_file`` result); None when nothing new was read"""
+    if not result["rows"]:
+        return None
+    new_date = result["max_date"].strftime(DATE_FORMAT)
+    new_id = result["max_id"]
+    if watermark:
+        new_date = max(new_date, watermark["date"])
+        new_id = max(new_id, watermark["id"])
+    return {"date": new_date, "id": int(new_id)}
+
+
+def commit_watermark(watermark: dict, path: str = None):
+    """
+    Persist the watermark of an extract once its rows are loaded
+
+    Called after the load committed: a failed transform or load leaves the
+    old watermark, so the retry reads the same rows again. The watermark
+    never moves backwards.
+    """
+    if not watermark:
+        return None
+    path = path or WATERMARK_FILE
+    current = load_watermark(path)
+    if current:
+        watermark = {"date": max(watermark["date"], current["date"]), "id": max(watermark["id"], current["id"])}
+    save_watermark(watermark, path)
+    return watermark
 
-# Mode A: pakai CSV (mock) — default
-if os.path.exists(CSV_FILE):
-    df = pd.read_csv(CSV_FILE)
-    df.to_csv(EXTRACTED_FILE, index=False)
-    print("✅ Extract DB (CSV mock) →", EXTRACTED_FILE)
-else:
-    # Mode B: contoh koneksi nyata ke MySQL
+
+def _param(name: str, paramstyle: str) -> str:
+    """Placeholder for a named parameter in the driver's paramstyle"""
+    return f"%({name})s" if paramstyle == "pyformat" else f":{name}"
+
+
+def build_query(mode: str, watermark: dict = None, paramstyle: str = "pyformat",
+                now: datetime = None, lookback_hours: float = LOOKBACK_HOURS,
+                full_refresh_days: int = FULL_REFRESH_DAYS):
+    """
+    Build the extract query and its parameters
+
+    full: rows from the last ``full_refresh_days`` days.
+    incremental: rows at or after (watermark date - lookback), which re-reads
+    late updates near the boundary, plus any row with an id above the
+    watermark id (late-arriving rows with an old date). Without a watermark
+    it behaves like full.
+    """
+    now = now or datetime.now()
+    select = f"SELECT {', '.join(COLUMNS)} FROM transactions"
+    if mode == "incremental" and watermark:
+        since = datetime.strptime(watermark["date"], DATE_FORMAT) - timedelta(hours=lookback_hours)
+        query = (f"{select} WHERE date >= {_param('since', paramstyle)}"
+                 f" OR id > {_param('last_id', paramstyle)}")
+        return query, {"since": since.strftime(DATE_FORMAT), "last_id": watermark["id"]}
+    since = now - timedelta(days=full_refresh_days)
+    return f"{select} WHERE date >= {_param('since', paramstyle)}", {"since": since.strftime(DATE_FORMAT)}
+
+
+def build_range_query(start: datetime, end: datetime, paramstyle: str = "pyformat"):
+    """Query and parameters for the rows with ``start <= date < end`` (one backfill unit)"""
+    query = (f"SELECT {', '.join(COLUMNS)} FROM transactions "
+             f"WHERE date >= {_param('start', paramstyle)} AND date < {_param('end', paramstyle)}")
+    return query, {"start": start.strftime(DATE_FORMAT), "end": end.strftime(DATE_FORMAT)}
+
+
+def stream_to_file(conn, query: str, params: dict, out_path: str, fetch_rows: int = FETCH_ROWS) -> dict:
+    """
+    Run the query on a streaming cursor and write each fetchmany() batch as it arrives
+
+    Returns:
+        Dict with rows written and the max date/id seen (None when empty)
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        columns = [d[0] for d in cursor.description]
+        rows, max_date, max_id = 0, None, None
+        with open_writer(out_path, EXTRACT_DTYPES) as writer:
+            while True:
+                batch = cursor.fetchmany(fetch_rows)
+                if not batch:
+                    break
+                df = pd.DataFrame.from_records(batch, columns=columns)
+                writer.write(df)
+                rows += len(df)
+                batch_date = pd.to_datetime(df["date"]).max()
+                batch_id = int(df["id"].max())
+                max_date = batch_date if max_date is None or batch_date > max_date else max_date
+                max_id = batch_id if max_id is None or batch_id > max_id else max_id
+                print(f"   ... {rows:,} rows")
+    finally:
+        cursor.close()
+    return {"rows": rows, "max_date": max_date, "max_id": max_id}
+
+
+def extract_from_db(conn, out_path: str = EXTRACTED_FILE, mode: str = EXTRACT_DB_MODE,
+                    watermark_file: str = WATERMARK_FILE, paramstyle: str = "pyformat",
+                    fetch_rows: int = FETCH_ROWS, now: datetime = None) -> dict:
+    """
+    Extract transactions (full or incremental)
+
+    The watermark file is not touched: the new watermark is returned and
+    saved with ``commit_watermark`` only after the load committed.
+
+    Returns:
+        Dict with rows and watermark (None when no rows were read)
+    """
+    watermark = load_watermark(watermark_file)
+    query, params = build_query(mode, watermark, paramstyle, now)
+    print(f"Extract DB mode={mode} params={params}")
+
+    result = stream_to_file(conn, query, params, out_path, fetch_rows)
+    return {"rows": result["rows"], "watermark": next_watermark(watermark, result)}
+
+
+def extract_range(conn, start: datetime, end: datetime, out_path=EXTRACTED_FILE, paramstyle: str = "pyformat",
+                  fetch_rows: int = FETCH_ROWS) -> int:
+    """Extract the rows of one date range (backfill); the watermark is left alone"""
+    query, params = build_range_query(start, end, paramstyle)
+    return stream_to_file(conn, query, params, out_path, fetch_rows)["rows"]
+
+
+def extract_csv_mock(csv_file: str = CSV_FILE, out_path: str = EXTRACTED_FILE,
+                     fetch_rows: int = FETCH_ROWS) -> int:
+    """Mode A: pakai CSV (mock), ditulis chunk demi chunk"""
+    with open_writer(out_path, EXTRACT_DTYPES) as writer:
+        for df in iter_frames(csv_file, fetch_rows):
+            writer.write(df)
+    return writer.rows
+
+
+def connect_mysql():
+    """Mode B: koneksi nyata ke MySQL (cursor unbuffered = baris di-stream dari server)"""
     import mysql.connector as mysql
-    MYSQL_HOST = os.getenv("MYSQL_HOST")
-    MYSQL_PORT = int(os.getenv("MYSQL_PORT", 3306))
-    MYSQL_USER = os.getenv("MYSQL_USER")
-    MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD")
-    MYSQL_DATABASE = os.getenv("MYSQL_DATABASE")
-
-    conn = mysql.connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER,
-                         password=MYSQL_PASSWORD, database=MYSQL_DATABASE)
-    query = """
-        SELECT id, user_id, account_number, amount, transaction_type, date, location
-        FROM transactions
-        WHERE date >= DATE_SUB(NOW(), INTERVAL 30 DAY);
-    """
-    df = pd.read_sql(query, conn)
-    conn.close()
-    df.to_csv(EXTRACTED_FILE, index=False)
-    print("✅ Extract DB (MySQL) →", EXTRACTED_FILE)
\ No newline at end of file
+    return mysql.connect(host=os.getenv("MYSQL_HOST"), port=int(os.getenv("MYSQL_PORT", 3306)),
+                         user=os.getenv("MYSQL_USER"), password=os.getenv("MYSQL_PASSWORD"),
+                         database=os.getenv("MYSQL_DATABASE"))
+
+
+def run(mode: str = EXTRACT_DB_MODE, out_path=EXTRACTED_FILE, run_id: str = None) -> dict:
+    """
+    Extract stage: the CSV mock when it exists, otherwise MySQL
+
+    Args:
+        mode: "full" or "incremental" (MySQL only)
+        out_path: Stage file, or a FrameBuffer that keeps the rows in memory
+        run_id: Run id of the metrics manifest (default ETL_RUN_ID)
+
+    Returns:
+        Dict with mode, rows and (MySQL) the watermark to commit after the load
+    """
+    if isinstance(out_path, str):
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+
+    metrics = RunMetrics("extract_db", run_id=run_id)
+    with metrics.run(), metrics.step("extract") as step:
+        # Mode A: pakai CSV (mock) — default
+        if os.path.exists(CSV_FILE):
+            metrics.info["mode"] = "csv"
+            step.rows_in = step.rows_out = extract_csv_mock(CSV_FILE, out_path)
+            step.read(CSV_FILE)
+        else:
+            # Mode B: MySQL
+            metrics.info["mode"] = f"mysql-{mode}"
+            conn = connect_mysql()
+            try:
+                result = extract_from_db(conn, out_path, mode)
+            finally:
+                conn.close()
+            step.rows_in = step.rows_out = result["rows"]
+            metrics.info["watermark"] = result["watermark"]
+        if isinstance(out_path, str):
+            step.wrote(out_path)
+    return {**metrics.info, "rows": step.rows_out}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract transactions from the internal database")
+    parser.add_argument("--mode", choices=["full", "incremental"], default=EXTRACT_DB_MODE,
+                        help="full: last 30 days (default); incremental: from the persisted watermark")
+    parser.add_argument("--commit-watermark", action="store_true",
+                        help="Commit the watermark of the last extract (run after load.py succeeded) and exit")
+    args = parser.parse_args(argv)
+
+    if args.commit_watermark:
+        pending = load_watermark(PENDING_WATERMARK_FILE)
+        committed = commit_watermark(pending)
+        if pending:
+            os.remove(PENDING_WATERMARK_FILE)
+        print(f"✅ Watermark committed: {committed}" if committed else "No pending watermark")
+        return
+
+    result = run(args.mode, EXTRACTED_FILE)
+    # Stage terpisah: watermark disimpan sebagai pending, di-commit setelah load sukses
+    if result.get("watermark"):
+        save_watermark(result["watermark"], PENDING_WATERMARK_FILE)
+    if result["mode"] == "csv":
+        print("✅ Extract DB (CSV mock) →", EXTRACTED_FILE)
+    else:
+        print(f"✅ Extract DB (MySQL, {args.mode}) → {EXTRACTED_FILE} (rows={result['rows']})")
+
+
+if __name__ == "__main__":
+    main()
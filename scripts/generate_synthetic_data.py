@@ -1,64 +1,275 @@
-import os, uuid, random, json
-import pandas as pd
-from faker import Faker
+"""
+Generate synthetic API (JSON) and DB (CSV) transactions
+
+Rows are generated with NumPy in chunks, each from its own seed derived from
+(seed, source, chunk index), so the output is identical for any number of
+worker processes. Chunks are formatted in the workers and appended to the
+output files in order; memory is bounded by ``--chunk-rows`` per worker.
+
+Background rows never match a fraud rule (amounts at or below the high
+amount threshold, no crypto merchants). Fraud patterns are injected at
+configurable rates, on disjoint rows:
+
+- high amounts (above ``HIGH_AMOUNT``)
+- crypto merchants (API rows only; the DB feed has no merchant)
+- burst sequences: ``--burst-size`` transactions of one user within one
+  burst window, of which ``burst_size - BURST_MIN_COUNT`` are flagged
+
+The expected number of flagged rows is written to ``generation_manifest.json``
+next to the outputs. It is a lower bound: background rows of a hot user can
+still form an accidental burst.
+
+Usage:
+    python scripts/generate_synthetic_data.py
+    python scripts/generate_synthetic_data.py --api-rows 20000000 --db-rows 10000000 \\
+        --users 500000 --hot-users 0.01 --hot-share 0.3 --workers 8 --start 2024-01-01
+"""
+
+import os
+import json
+import time
+import argparse
 from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
 from dotenv import load_dotenv
 
 
 load_dotenv()
 DATA_DIR = os.getenv("DATA_DIR", "./data")
 RAW_DIR = os.path.join(DATA_DIR, "raw")
-os.makedirs(RAW_DIR, exist_ok=True)
+API_FILE = "api_transactions.json"
+DB_FILE = "db_transactions.csv"
+MANIFEST_FILE = "generation_manifest.json"
+
+MERCHANTS_API = ["Tokopedia", "Shopee", "Alfamart", "GoPay", "OVO", "Bukalapak"]
+MERCHANTS_CRYPTO = ["Binance", "Kraken", "OKX"]
+CITIES = ["Jakarta", "Bali", "Surabaya", "Medan", "Bandung", "Makassar"]
+API_STATUSES = ["completed", "failed", "pending"]
+DB_TYPES = ["debit", "credit"]
 
+# Harus sama dengan config/fraud_rules.yaml
+HIGH_AMOUNT = 50_000_000
+BURST_WINDOW_SECONDS = 600
+BURST_MIN_COUNT = 5
 
-fake = Faker('id_ID')
+USER_ID_BASE = 1000
+DB_ID_BASE = 10_000
+API_MAX_AMOUNT = 1e8
+DB_MAX_AMOUNT = 5e7
+SOURCE_CODES = {"api": 0, "db": 1}
+DB_COLUMNS = ["id", "user_id", "account_number", "amount", "transaction_type", "date", "location"]
 
 
-MERCHANTS_API = ["Tokopedia", "Shopee", "Binance", "Alfamart", "GoPay", "OVO", "Bukalapak"]
-MERCHANTS_DB = ["Indomaret", "Grab", "PLN", "PDAM", "Binance", "Pertamina"]
-CITIES = ["Jakarta", "Bali", "Surabaya", "Medan", "Bandung", "Makassar"]
+def _rng(seed: int, source: str, chunk: int) -> np.random.Generator:
+    return np.random.default_rng([seed, SOURCE_CODES[source], chunk])
+
+
+def _user_ids(rng: np.random.Generator, n: int, users: int, hot_users: float, hot_share: float) -> np.ndarray:
+    """``hot_share`` of the rows go to the first ``hot_users`` fraction of users"""
+    ids = rng.integers(0, users, n)
+    hot = max(1, int(users * hot_users)) if hot_share > 0 else 0
+    if hot:
+        is_hot = rng.random(n) < hot_share
+        ids[is_hot] = rng.integers(0, hot, int(is_hot.sum()))
+    return ids + USER_ID_BASE
+
+
+def _api_ids(index: np.ndarray, seed: int) -> np.ndarray:
+    """Unique, random-looking 12-hex-digit ids (a bijection of the row index mod 2**48)"""
+    mixed = (index.astype(np.uint64) * np.uint64(0x9E3779B97F4B) + np.uint64(seed)) & np.uint64((1 << 48) - 1)
+    return np.char.zfill(np.char.mod("%x", mixed), 12)
+
+
+def generate_chunk(task: dict) -> dict:
+    """
+    Generate and format one chunk
+
+    Args:
+        task: ``source`` ("api"/"db"), ``chunk``, ``offset`` (first row
+            index), ``rows`` and the generation options
+
+    Returns:
+        Dict with the formatted ``text`` and the chunk's injected counts
+    """
+    source, rows = task["source"], task["rows"]
+    rng = _rng(task["seed"], source, task["chunk"])
+    max_amount = API_MAX_AMOUNT if source == "api" else DB_MAX_AMOUNT
+
+    # Burst: urutan transaksi satu user dalam satu window, waktu berbeda dan naik
+    size = task["burst_size"]
+    n_bursts = int(round(rows * task["burst_rate"] / size)) if size > BURST_MIN_COUNT else 0
+    n_bursts = min(n_bursts, rows // size)
+    n_burst_rows = n_bursts * size
+    n_background = rows - n_burst_rows
+
+    span = task["days"] * 86400
+    seconds = rng.integers(0, span, n_background)
+    users = _user_ids(rng, n_background, task["users"], task["hot_users"], task["hot_share"])
+    if n_bursts:
+        step = max(1, (BURST_WINDOW_SECONDS - 1) // size)
+        starts = rng.integers(0, max(1, span - BURST_WINDOW_SECONDS), n_bursts)
+        offsets = np.arange(size) * step + rng.integers(0, step, (n_bursts, size))
+        seconds = np.concatenate([seconds, (starts[:, None] + offsets).ravel()])
+        burst_users = _user_ids(rng, n_bursts, task["users"], task["hot_users"], task["hot_share"])
+        users = np.concatenate([users, np.repeat(burst_users, size)])
+
+    # Background di bawah semua threshold; injeksi pada baris background yang disjoint
+    amounts = rng.uniform(1e4, min(max_amount, HIGH_AMOUNT), rows)
+    picked = rng.permutation(n_background)
+    n_high = min(int(round(rows * task["high_amount_rate"])), n_background)
+    n_crypto = min(int(round(rows * task["crypto_rate"])), n_background - n_high) if source == "api" else 0
+    high_rows = picked[:n_high]
+    amounts[high_rows] = rng.uniform(HIGH_AMOUNT + 1, API_MAX_AMOUNT, n_high)
+    amounts = amounts.round(2)
+
+    times = (np.datetime64(task["start"], "s") + seconds.astype("timedelta64[s]")).astype(str)
+    order = rng.permutation(rows)
+    index = task["offset"] + np.arange(rows)
+    if source == "api":
+        merchants = np.array(MERCHANTS_API, dtype=object)[rng.integers(0, len(MERCHANTS_API), rows)]
+        merchants[picked[n_high:n_high + n_crypto]] = np.array(MERCHANTS_CRYPTO, dtype=object)[
+            rng.integers(0, len(MERCHANTS_CRYPTO), n_crypto)]
+        df = pd.DataFrame({
+            "transaction_id": _api_ids(index, task["seed"]),
+            "user_id": users[order],
+            "amount": amounts[order],
+            "currency": "IDR",
+            "timestamp": times[order],
+            "merchant": merchants[order],
+            "status": np.array(API_STATUSES)[rng.integers(0, len(API_STATUSES), rows)],
+            "location": np.array(CITIES)[rng.integers(0, len(CITIES), rows)],
+            "source": "API",
+        })
+        text = df.to_json(orient="records", double_precision=2)[1:-1]
+    else:
+        df = pd.DataFrame({
+            "id": index + DB_ID_BASE,
+            "user_id": users[order],
+            "account_number": rng.integers(10**9, 10**10, rows).astype(str),
+            "amount": amounts[order],
+            "transaction_type": np.array(DB_TYPES)[rng.integers(0, len(DB_TYPES), rows)],
+            "date": np.char.replace(times[order], "T", " "),
+            "location": np.array(CITIES)[rng.integers(0, len(CITIES), rows)],
+        })
+        text = df.to_csv(index=False, header=task["chunk"] == 0)
+
+    return {
+        "text": text,
+        "rows": rows,
+        "high_amount": n_high,
+        "crypto_merchant": n_crypto,
+        "burst_sequences": n_bursts,
+        "burst_rows": n_burst_rows,
+        "burst_flagged": n_bursts * (size - BURST_MIN_COUNT),
+    }
+
 
+def _tasks(source: str, rows: int, chunk_rows: int, options: dict) -> list:
+    return [{**options, "source": source, "chunk": i, "offset": offset, "rows": min(chunk_rows, rows - offset)}
+            for i, offset in enumerate(range(0, rows, chunk_rows))]
 
-start_date = datetime.now() - timedelta(days=30)
 
+def generate(raw_dir: str = RAW_DIR, api_rows: int = 1200, db_rows: int = 1000, days: int = 30,
+             start: str = None, users: int = 1000, hot_users: float = 0.0, hot_share: float = 0.0,
+             high_amount_rate: float = 0.02, crypto_rate: float = 0.05, burst_rate: float = 0.02,
+             burst_size: int = 8, seed: int = 42, chunk_rows: int = 500_000, workers: int = 1) -> dict:
+    """
+    Write ``api_transactions.json``, ``db_transactions.csv`` and the manifest to ``raw_dir``
 
-# 1) Simulasi transaksi dari API (JSON)
-api_rows = []
-for _ in range(1200):
-    ts = start_date + timedelta(seconds=random.randint(0, 30*24*3600))
-    api_rows.append({
-        "transaction_id": str(uuid.uuid4())[:12],
-        "user_id": random.randint(1000, 2000),
-        "amount": round(random.uniform(1e4, 1e8), 2),
-        "currency": "IDR",
-        "timestamp": ts.isoformat(),
-        "merchant": random.choice(MERCHANTS_API),
-        "status": random.choice(["completed", "failed", "pending"]),
-        "location": random.choice(CITIES),
-        "source": "API"
-    })
+    Args:
+        start: First day (``YYYY-MM-DD``); default ``days`` before today.
+            Pass it explicitly for byte-identical reruns.
+        hot_users: Fraction of users that are hot
+        hot_share: Fraction of rows owned by the hot users
+        *_rate: Fraction of rows carrying each injected fraud pattern
 
+    Returns:
+        The manifest (options, row counts, injected counts, expected fraud rate)
+    """
+    if burst_size <= BURST_MIN_COUNT and burst_rate > 0:
+        raise ValueError(f"burst_size must exceed {BURST_MIN_COUNT} to trigger the burst rule")
+    if start is None:
+        start = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    options = {"days": days, "start": start, "users": users, "hot_users": hot_users, "hot_share": hot_share,
+               "high_amount_rate": high_amount_rate, "crypto_rate": crypto_rate, "burst_rate": burst_rate,
+               "burst_size": burst_size, "seed": seed}
+    os.makedirs(raw_dir, exist_ok=True)
 
-with open(os.path.join(RAW_DIR, "api_transactions.json"), "w") as f:
-    json.dump(api_rows, f, ensure_ascii=False, indent=2)
+    began = time.perf_counter()
+    totals = {}
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        imap = pool.imap if pool else map
+        for source, rows, name in (("api", api_rows, API_FILE), ("db", db_rows, DB_FILE)):
+            counts = dict.fromkeys(["rows", "high_amount", "crypto_merchant", "burst_sequences",
+                                    "burst_rows", "burst_flagged"], 0)
+            with open(os.path.join(raw_dir, name), "w") as f:
+                if source == "api":
+                    f.write("[")
+                first = True
+                for result in imap(generate_chunk, _tasks(source, rows, chunk_rows, options)):
+                    if source == "api" and result["text"]:
+                        f.write(result["text"] if first else "," + result["text"])
+                        first = False
+                    elif source == "db":
+                        f.write(result["text"])
+                    for key in counts:
+                        counts[key] += result[key]
+                if source == "api":
+                    f.write("]")
+                elif not rows:
+                    f.write(",".join(DB_COLUMNS) + "\n")
+            counts["expected_flagged"] = counts["high_amount"] + counts["crypto_merchant"] + counts["burst_flagged"]
+            totals[source] = counts
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
+    total_rows = api_rows + db_rows
+    expected = totals["api"]["expected_flagged"] + totals["db"]["expected_flagged"]
+    manifest = {
+        "options": options,
+        "sources": totals,
+        "rows": total_rows,
+        "expected_flagged": expected,
+        "expected_fraud_rate": round(expected / total_rows, 6) if total_rows else 0.0,
+        "seconds": round(time.perf_counter() - began, 3),
+    }
+    with open(os.path.join(raw_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
 
-# 2) Simulasi transaksi dari DB (CSV)
-db_rows = []
-for _ in range(1000):
-    ts = start_date + timedelta(seconds=random.randint(0, 30*24*3600))
-    db_rows.append({
-        "id": random.randint(10_000, 99_999),
-        "user_id": random.randint(900, 2100),
-        "account_number": str(random.randint(10**9, 10**10-1)),
-        "amount": round(random.uniform(1e4, 5e7), 2),
-        "transaction_type": random.choice(["debit", "credit"]),
-        "date": ts.strftime("%Y-%m-%d %H:%M:%S"),
-        "location": random.choice(CITIES)
-    })
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic API/DB transactions with injected fraud")
+    parser.add_argument("--out-dir", default=RAW_DIR, help="Output directory (default: DATA_DIR/raw)")
+    parser.add_argument("--api-rows", type=int, default=1200)
+    parser.add_argument("--db-rows", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=30, help="Date span")
+    parser.add_argument("--start", help="First day YYYY-MM-DD (default: --days before today)")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--hot-users", type=float, default=0.0, help="Fraction of users that are hot")
+    parser.add_argument("--hot-share", type=float, default=0.0, help="Fraction of rows owned by hot users")
+    parser.add_argument("--high-amount-rate", type=float, default=0.02)
+    parser.add_argument("--crypto-rate", type=float, default=0.05, help="API rows only")
+    parser.add_argument("--burst-rate", type=float, default=0.02, help="Fraction of rows inside burst sequences")
+    parser.add_argument("--burst-size", type=int, default=8, help="Transactions per burst sequence")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-rows", type=int, default=500_000)
+    parser.add_argument("--workers", type=int, default=1, help="Generator processes")
+    args = parser.parse_args(argv)
 
-pd.DataFrame(db_rows).to_csv(os.path.join(RAW_DIR, "db_transactions.csv"), index=False)
+    manifest = generate(args.out_dir, args.api_rows, args.db_rows, args.days, args.start, args.users,
+                        args.hot_users, args.hot_share, args.high_amount_rate, args.crypto_rate,
+                        args.burst_rate, args.burst_size, args.seed, args.chunk_rows, args.workers)
+    print(f"✅ Synthetic datasets generated in {args.out_dir} "
+          f"(api={args.api_rows:,} db={args.db_rows:,} rows, {manifest['seconds']}s)")
+    print(f"   expected fraud ≥ {manifest['expected_flagged']:,} rows ({manifest['expected_fraud_rate']:.2%})")
 
 
-print("✅ Synthetic datasets generated in", RAW_DIR)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
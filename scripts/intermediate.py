@@ -0,0 +1,254 @@
+"""
+Intermediate file formats for handing data between ETL stages
+
+Default is compressed Parquet (typed, columnar). Readers memory-map the file
+and only decode the columns they ask for. Arrow IPC (Feather v2) is available
+for lower CPU cost, and the old JSON/CSV files stay available as the
+``legacy`` format.
+
+Format is selected with ``INTERMEDIATE_FORMAT`` (parquet | arrow | legacy);
+all stages of one run must use the same value.
+
+Stages run in one process by ``pipeline.py`` can skip the file entirely:
+a ``FrameBuffer`` takes the place of the output path and keeps the
+coerced chunks in memory for the next stage (``open_writer`` picks one or
+the other).
+"""
+
+import os
+import sys
+import json
+import logging
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+
+# Add scripts directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils import iter_json_array
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("parquet", "arrow", "legacy")
+EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow"}
+INTERMEDIATE_FORMAT = os.getenv("INTERMEDIATE_FORMAT", "parquet").lower()
+INTERMEDIATE_COMPRESSION = os.getenv("INTERMEDIATE_COMPRESSION", "zstd")
+
+
+def stage_file(directory: str, name: str, fmt: Optional[str] = None, legacy_ext: str = ".csv") -> str:
+    """
+    Path of a stage output/input file for the configured format
+
+    Args:
+        directory: Stage directory (e.g. data/raw)
+        name: File name without extension (e.g. "db_extracted")
+        fmt: Override INTERMEDIATE_FORMAT
+        legacy_ext: Extension used in legacy mode (".csv" or ".json")
+    """
+    fmt = (fmt or INTERMEDIATE_FORMAT).lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown intermediate format '{fmt}', expected one of {FORMATS}")
+    return os.path.join(directory, name + EXTENSIONS.get(fmt, legacy_ext))
+
+
+def _format_of(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        return "parquet"
+    if ext in (".arrow", ".feather"):
+        return "arrow"
+    if ext == ".json":
+        return "json"
+    if ext in (".csv", ".gz"):
+        return "csv"
+    raise ValueError(f"Unsupported intermediate file: {path}")
+
+
+def coerce_dtypes(df: pd.DataFrame, dtypes: Optional[Dict[str, str]]) -> pd.DataFrame:
+    """Cast columns to a fixed dtype mapping so every chunk has the same schema"""
+    if not dtypes:
+        return df
+    return df.astype({c: t for c, t in dtypes.items() if c in df.columns})
+
+
+def read_frame(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Read a whole stage file, projecting ``columns`` when given"""
+    fmt = _format_of(path)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+    if fmt == "arrow":
+        import pyarrow.feather as feather
+        return feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+    if fmt == "json":
+        with open(path, "r") as f:
+            df = pd.DataFrame(json.load(f))
+        return df[[c for c in columns if c in df.columns]] if columns else df
+    return pd.read_csv(path, usecols=columns)
+
+
+def iter_frames(path: str, batch_rows: int, columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """Read a stage file as a sequence of DataFrames of at most ``batch_rows`` rows"""
+    fmt = _format_of(path)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(path, memory_map=True)
+        for batch in pf.iter_batches(batch_size=batch_rows, columns=columns):
+            yield batch.to_pandas()
+    elif fmt == "arrow":
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        table = feather.read_table(path, columns=columns, memory_map=True)
+        for batch in table.to_batches(max_chunksize=batch_rows):
+            yield pa.Table.from_batches([batch]).to_pandas()
+    elif fmt == "json":
+        for records in iter_json_array(path, batch_rows):
+            df = pd.DataFrame(records)
+            yield df[[c for c in columns if c in df.columns]] if columns else df
+    else:
+        for df in pd.read_csv(path, chunksize=batch_rows, usecols=columns):
+            yield df.reset_index(drop=True)
+
+
+class FrameWriter:
+    """
+    Write a stage file chunk by chunk
+
+    Every chunk is coerced to ``dtypes`` (when given) so the columnar schema
+    is fixed by the first chunk. Data goes to ``<path>.tmp`` and is renamed on
+    a clean close, so readers never see a half-written file.
+    """
+
+    def __init__(self, path: str, dtypes: Optional[Dict[str, str]] = None,
+                 compression: str = INTERMEDIATE_COMPRESSION):
+        self.path = path
+        self.fmt = _format_of(path)
+        self.dtypes = dtypes
+        self.compression = compression
+        self.rows = 0
+        self._tmp = path + ".tmp"
+        self._writer = None
+        self._schema = None
+        self._json_first = True
+        self._file = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(commit=exc_type is None)
+
+    def write(self, df: pd.DataFrame):
+        df = coerce_dtypes(df, self.dtypes)
+        if self.fmt in ("parquet", "arrow"):
+            self._write_arrow(df)
+        elif self.fmt == "json":
+            self._write_json(df)
+        else:
+            df.to_csv(self._tmp, mode="w" if self.rows == 0 else "a", header=self.rows == 0, index=False)
+        self.rows += len(df)
+
+    def _write_arrow(self, df: pd.DataFrame):
+        import pyarrow as pa
+        if self._schema is not None:
+            # Kolom yang hilang di chunk ini jadi null, kolom baru diabaikan
+            df = df.reindex(columns=self._schema.names)
+        table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+        if self._writer is None:
+            self._schema = table.schema
+            if self.fmt == "parquet":
+                import pyarrow.parquet as pq
+                self._writer = pq.ParquetWriter(self._tmp, self._schema, compression=self.compression)
+            else:
+                options = pa.ipc.IpcWriteOptions(compression=self.compression)
+                self._writer = pa.ipc.new_file(self._tmp, self._schema, options=options)
+        self._writer.write_table(table)
+
+    def _write_json(self, df: pd.DataFrame):
+        if self._file is None:
+            self._file = open(self._tmp, "w")
+            self._file.write("[")
+        for record in json.loads(df.to_json(orient="records", date_format="iso")):
+            self._file.write(("" if self._json_first else ",") + json.dumps(record, ensure_ascii=False))
+            self._json_first = False
+
+    def close(self, commit: bool = True):
+        if self._closed:
+            return
+        self._closed = True
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self.fmt == "json":
+            if self._file is None:
+                self._file = open(self._tmp, "w")
+                self._file.write("[")
+            self._file.write("]")
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not commit:
+            if os.path.exists(self._tmp):
+                os.remove(self._tmp)
+            return
+        if not os.path.exists(self._tmp):
+            # Tidak ada chunk sama sekali: tulis file kosong dengan kolom dari dtypes
+            empty = pd.DataFrame({c: pd.Series(dtype=t) for c, t in (self.dtypes or {}).items()})
+            if self.fmt in ("parquet", "arrow"):
+                self._write_arrow(empty)
+                self._writer.close()
+                self._writer = None
+            else:
+                empty.to_csv(self._tmp, index=False)
+        os.replace(self._tmp, self.path)
+
+
+def write_frame(df: pd.DataFrame, path: str, dtypes: Optional[Dict[str, str]] = None):
+    """Write a whole DataFrame as one stage file"""
+    with FrameWriter(path, dtypes) as writer:
+        writer.write(df)
+    logger.info(f"Wrote {len(df)} rows to {path}")
+
+
+class FrameBuffer:
+    """
+    In-memory stand-in for a stage file: accepts the chunks a stage would
+    write (coerced to the same dtypes) and hands them over as one DataFrame
+    """
+
+    def __init__(self, dtypes: Optional[Dict[str, str]] = None):
+        self.dtypes = dtypes
+        self.rows = 0
+        self._chunks: List[pd.DataFrame] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(commit=exc_type is None)
+
+    def write(self, df: pd.DataFrame):
+        self._chunks.append(coerce_dtypes(df, self.dtypes))
+        self.rows += len(df)
+
+    def close(self, commit: bool = True):
+        if not commit:
+            self._chunks, self.rows = [], 0
+
+    def frame(self) -> pd.DataFrame:
+        """Everything written so far (columns from ``dtypes`` when nothing was written)"""
+        if not self._chunks:
+            return pd.DataFrame({c: pd.Series(dtype=t) for c, t in (self.dtypes or {}).items()})
+        if len(self._chunks) > 1:
+            self._chunks = [pd.concat(self._chunks, ignore_index=True)]
+        return self._chunks[0]
+
+
+def open_writer(out, dtypes: Optional[Dict[str, str]] = None):
+    """FrameWriter for a path; a FrameBuffer is used as is (taking ``dtypes``)"""
+    if isinstance(out, FrameBuffer):
+        out.dtypes = dtypes if out.dtypes is None else out.dtypes
+        return out
+    return FrameWriter(out, dtypes)
@@ -1,6 +1,10 @@
 import os
+import io
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect, text
 from dotenv import load_dotenv
 import logging
 import sys
@@ -8,112 +12,762 @@ import sys
 # Add scripts directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from utils import setup_logging
+from utils import setup_logging, RunMetrics
+from intermediate import stage_file, read_frame
+from schema import apply_schema, row_hash, to_event_time, to_float, to_storage, memory_usage, memory_report
+from dedup_index import DedupIndex, DEDUP_INDEX_FILE, DEDUP_INDEX_RETENTION_DAYS
+import rollups
+import partitions
 
 # Setup logging
 logger = setup_logging()
 
 load_dotenv()
 POSTGRES_URI = os.getenv("POSTGRES_URI")
-if not POSTGRES_URI:
-    logger.error("POSTGRES_URI is required but not found in environment variables")
-    raise ValueError("POSTGRES_URI is required")
-
-try:
-    engine = create_engine(POSTGRES_URI)
-    logger.info("Database connection established")
-except Exception as e:
-    logger.error(f"Error connecting to database: {e}")
-    raise
-
-# Read processed data
-try:
-    data_file = os.path.join(os.getenv("DATA_DIR", "./data"), "processed", "cleaned_transactions.csv")
-    logger.info(f"Reading processed data from {data_file}...")
-    df = pd.read_csv(data_file)
-    logger.info(f"Data loaded: {len(df)} rows")
-except FileNotFoundError:
-    logger.error(f"Processed data file not found: {data_file}")
-    raise
-except Exception as e:
-    logger.error(f"Error reading processed data: {e}")
-    raise
-
-# Ensure table exists (idempotent if schema sudah dibuat)
-try:
-    logger.info("Creating table if not exists...")
-    with engine.begin() as conn:
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS fact_transactions (
-          transaction_id     VARCHAR(64) PRIMARY KEY,
-          user_id            BIGINT,
-          account_number     VARCHAR(64),
-          amount             NUMERIC(18,2) NOT NULL,
-          currency           VARCHAR(8) DEFAULT 'IDR',
-          merchant           VARCHAR(128),
-          transaction_type   VARCHAR(32),
-          status             VARCHAR(32),
-          location           VARCHAR(64),
-          event_time         TIMESTAMPTZ NOT NULL,
-          source             VARCHAR(16),
-          is_fraud           SMALLINT DEFAULT 0,
-          fraud_reason       VARCHAR(256),
-          ingestion_time     TIMESTAMPTZ DEFAULT NOW()
-        );
-        """))
-    logger.info("Table creation/verification completed")
-except Exception as e:
-    logger.error(f"Error creating table: {e}")
-    raise
-
-# UPSERT using INSERT ... ON CONFLICT
-cols = [
+DATA_FILE = stage_file(os.path.join(os.getenv("DATA_DIR", "./data"), "processed"), "cleaned_transactions")
+
+# Mode: "copy" (COPY ke staging table + satu upsert set-based) atau "insert" (executemany)
+LOAD_MODE = os.getenv("LOAD_MODE", "copy")
+COPY_CHUNK_ROWS = int(os.getenv("LOAD_COPY_CHUNK_ROWS", "100000"))
+
+# Parallel mode: N slice hash(transaction_id), tiap slice di koneksi pool sendiri
+LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", "1"))
+LOAD_BATCH_ROWS = int(os.getenv("LOAD_BATCH_ROWS", "0")) or None
+LOAD_RETRIES = int(os.getenv("LOAD_RETRIES", "2"))
+LOAD_RETRY_DELAY = float(os.getenv("LOAD_RETRY_DELAY", "1.0"))
+
+# Rollup ringkasan Tableau di-update di transaksi load yang sama (0 = nonaktif)
+LOAD_ROLLUPS = os.getenv("LOAD_ROLLUPS", "1") == "1"
+
+# Lewati baris yang sudah ter-load dan tidak berubah (lihat scripts/dedup_index.py; 0 = nonaktif)
+LOAD_DEDUP_INDEX = os.getenv("LOAD_DEDUP_INDEX", "1") == "1"
+
+FACT_TABLE = "fact_transactions"
+
+CHANGE_COUNTS = ["inserted", "updated", "unchanged"]
+
+LOAD_COLUMNS = [
     "transaction_id","user_id","account_number","amount","currency","merchant",
     "transaction_type","status","location","event_time","source","is_fraud","fraud_reason"
 ]
+# Kolom yang ditulis ke warehouse: kolom load + row_hash (dihitung loader, dipakai upsert)
+WRITE_COLUMNS = LOAD_COLUMNS + ["row_hash"]
+NULLABLE_COLUMNS = ["user_id", "account_number", "merchant", "transaction_type", "status", "location", "fraud_reason"]
+
+FACT_COLUMNS_DDL = """
+  transaction_id     VARCHAR(64) NOT NULL,
+  user_id            BIGINT,
+  account_number     VARCHAR(64),
+  amount             NUMERIC(18,2) NOT NULL,
+  currency           VARCHAR(8) DEFAULT 'IDR',
+  merchant           VARCHAR(128),
+  transaction_type   VARCHAR(32),
+  status             VARCHAR(32),
+  location           VARCHAR(64),
+  event_time         TIMESTAMPTZ NOT NULL,
+  source             VARCHAR(16),
+  is_fraud           SMALLINT DEFAULT 0,
+  fraud_reason       VARCHAR(256),
+  row_hash           BIGINT,
+  ingestion_time     TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+"""
+
+
+def get_engine(uri: str = None, pool_size: int = None):
+    """Create the warehouse engine from POSTGRES_URI (pool_size: one connection per load worker)"""
+    uri = uri or POSTGRES_URI
+    if not uri:
+        logger.error("POSTGRES_URI is required but not found in environment variables")
+        raise ValueError("POSTGRES_URI is required")
+    try:
+        pool_kwargs = {"pool_size": pool_size, "max_overflow": 0, "pool_pre_ping": True} if pool_size else {}
+        engine = create_engine(uri, **pool_kwargs)
+        logger.info("Database connection established")
+        return engine
+    except Exception as e:
+        logger.error(f"Error connecting to database: {e}")
+        raise
+
+
+def read_processed(path: str = DATA_FILE) -> pd.DataFrame:
+    """Read processed data (hanya kolom yang di-load; parquet/arrow dibaca via memory-map)"""
+    try:
+        logger.info(f"Reading processed data from {path}...")
+        df = read_frame(path, columns=LOAD_COLUMNS)
+        logger.info(f"Data loaded: {len(df)} rows")
+        return df
+    except FileNotFoundError:
+        logger.error(f"Processed data file not found: {path}")
+        raise
+    except Exception as e:
+        logger.error(f"Error reading processed data: {e}")
+        raise
+
+
+def ensure_table(engine, table: str = FACT_TABLE, with_rollups: bool = LOAD_ROLLUPS):
+    """
+    Ensure table (and its rollup tables) exist (idempotent if schema sudah dibuat)
+
+    On PostgreSQL a new table is created partitioned by month on event_time
+    (FACT_PARTITIONING=monthly) and the upcoming partitions are added.
+    """
+    try:
+        logger.info("Creating table if not exists...")
+        with engine.begin() as conn:
+            exists = inspect(conn).has_table(table)
+            if partitions.partitioning_enabled(conn) and not exists:
+                partitions.create_partitioned_table(conn, table, FACT_COLUMNS_DDL)
+            else:
+                conn.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                  {FACT_COLUMNS_DDL},
+                  PRIMARY KEY (transaction_id)
+                );
+                """))
+            if "row_hash" not in {c["name"] for c in inspect(conn).get_columns(table)}:
+                # Tabel lama: baris tanpa hash dianggap berubah sekali, lalu hash-nya terisi
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN row_hash BIGINT"))
+                logger.info(f"Added row_hash column to {table}")
+            if partitions.is_partitioned(conn, table):
+                partitions.ensure_partitions(conn, table, [])
+            elif partitions.partitioning_enabled(conn):
+                logger.warning(f"{table} is not partitioned; run `python scripts/load.py "
+                               f"--migrate-partitions` to convert it")
+            if with_rollups:
+                rollups.ensure_rollups(conn, table)
+        logger.info("Table creation/verification completed")
+    except Exception as e:
+        logger.error(f"Error creating table: {e}")
+        raise
+
+
+def prepare_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Validate the rows to load, apply the shared compact schema and add their row_hash"""
+    missing_cols = [c for c in LOAD_COLUMNS if c not in df.columns]
+    if missing_cols:
+        error_msg = f"Missing required columns: {missing_cols}"
+        logger.error(error_msg)
+        raise ValueError(error_msg)
+    logger.info(f"DataFrame validation passed. Shape: {df.shape}")
+
+    # Filter hanya kolom yang diperlukan, lalu schema ringkas (amount minor unit, event_time tz-aware)
+    df_load = df[LOAD_COLUMNS]
+    before = memory_usage(df_load)
+    df_load = apply_schema(df_load)
+    for line in memory_report(before, memory_usage(df_load)):
+        logger.info(line)
+    df_load["row_hash"] = row_hash(df_load)
+    return df_load
+
+
+def _upsert_assignments(columns) -> str:
+    # keep PK; ingestion_time ikut maju supaya menandai baris yang berubah di run ini
+    return ",".join([f"{c}=EXCLUDED.{c}" for c in columns if c != "transaction_id"]
+                    + ["ingestion_time=CURRENT_TIMESTAMP"])
+
 
-# Validate DataFrame has required columns
-missing_cols = [c for c in cols if c not in df.columns]
-if missing_cols:
-    error_msg = f"Missing required columns: {missing_cols}"
-    logger.error(error_msg)
-    raise ValueError(error_msg)
-logger.info(f"DataFrame validation passed. Shape: {df.shape}")
+def changed_condition(conn, table: str) -> str:
+    """
+    WHERE of ``ON CONFLICT DO UPDATE``: only rows whose content hash differs
+    are rewritten (unchanged rows produce no new tuple, WAL or dead row)
+    """
+    distinct = "IS DISTINCT FROM" if conn.dialect.name == "postgresql" else "IS NOT"
+    return f"{table}.row_hash {distinct} EXCLUDED.row_hash"
 
-# Filter hanya kolom yang diperlukan
-df_load = df[cols].copy()
 
-# Convert event_time ke datetime jika belum
-if df_load["event_time"].dtype == "object":
-    df_load["event_time"] = pd.to_datetime(df_load["event_time"])
+def upsert_rows(engine, df_load: pd.DataFrame, table: str = FACT_TABLE,
+                with_rollups: bool = LOAD_ROLLUPS) -> dict:
+    """UPSERT using INSERT ... ON CONFLICT (executemany, satu dict per baris)"""
+    with engine.begin() as conn:
+        return _upsert_batch(conn, df_load, table, "insert", with_rollups)
+
+
+def _upsert_rows(conn, df_load: pd.DataFrame, table: str) -> int:
+    """executemany upsert; returns the rows actually inserted or updated"""
+    placeholders = ",".join([f":{c}" for c in WRITE_COLUMNS])
+    insert_sql = text(f"""
+        INSERT INTO {table} ({','.join(WRITE_COLUMNS)})
+        VALUES ({placeholders})
+        ON CONFLICT (transaction_id)
+        DO UPDATE SET {_upsert_assignments(WRITE_COLUMNS)}
+        WHERE {changed_condition(conn, table)};
+    """)
+
+    records = _records(df_load, naive_times=conn.dialect.name != "postgresql")
+    if not records:
+        return 0
+    return conn.execute(insert_sql, records).rowcount
+
+
+def _records(df_load: pd.DataFrame, naive_times: bool = False) -> list:
+    """
+    Rows as dicts for executemany
 
-# Convert is_fraud ke int jika belum
-df_load["is_fraud"] = df_load["is_fraud"].astype(int)
+    Args:
+        naive_times: Send event_time as wall time in EVENT_TIMEZONE (for
+            databases without a time zone type, e.g. SQLite)
+    """
+    # Handle NaN/NA values untuk kolom yang bisa NULL (replace dengan None untuk SQL)
+    df_records = df_load.copy()
+    for col in NULLABLE_COLUMNS:
+        df_records[col] = df_records[col].astype(object).where(pd.notna(df_records[col]), None)
+    df_records["amount"] = to_float(df_records["amount"])
+    event_time = df_records["event_time"]
+    if naive_times and event_time.dt.tz is not None:
+        event_time = event_time.dt.tz_localize(None)
+    # datetime Python biasa (bukan pd.Timestamp) supaya diterima semua driver DB-API
+    df_records["event_time"] = pd.Series(list(event_time.dt.to_pydatetime()), index=df_records.index, dtype=object)
+    return df_records.to_dict(orient="records")
 
-# Handle NaN values untuk kolom yang bisa NULL (replace NaN dengan None untuk SQL)
-for col in ["account_number", "merchant", "transaction_type", "status", "location", "fraud_reason"]:
-    df_load[col] = df_load[col].where(pd.notna(df_load[col]), None)
 
-placeholders = ",".join([f":{c}" for c in cols])
-updates = ",".join([f"{c}=EXCLUDED.{c}" for c in cols if c != "transaction_id"])  # keep PK
+class _CsvStream(io.TextIOBase):
+    """File-like object that renders a DataFrame as CSV slice by slice for COPY"""
 
-insert_sql = text(f"""
-    INSERT INTO fact_transactions ({','.join(cols)})
-    VALUES ({placeholders})
-    ON CONFLICT (transaction_id)
-    DO UPDATE SET {updates};
-""")
+    def __init__(self, df: pd.DataFrame, chunk_rows: int):
+        self._slices = (df.iloc[i:i + chunk_rows] for i in range(0, len(df), chunk_rows))
+        self._buf = ""
+        self._pos = 0
 
-records = df_load.to_dict(orient="records")
+    def readable(self):
+        return True
 
-# Load data to database
-try:
-    logger.info(f"Loading {len(records)} records to database...")
+    def read(self, size=-1):
+        if self._pos >= len(self._buf):
+            chunk = next(self._slices, None)
+            if chunk is None:
+                return ""
+            self._buf = to_storage(chunk).to_csv(index=False, header=False, na_rep="\\N",
+                                                 date_format="%Y-%m-%d %H:%M:%S.%f%z")
+            self._pos = 0
+        end = len(self._buf) if size is None or size < 0 else self._pos + size
+        out = self._buf[self._pos:end]
+        self._pos = end
+        return out
+
+
+def copy_supported(engine) -> bool:
+    """COPY needs PostgreSQL through psycopg2 (cursor.copy_expert)"""
+    return engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2"
+
+
+def copy_upsert(engine, df_load: pd.DataFrame, table: str = FACT_TABLE,
+                chunk_rows: int = COPY_CHUNK_ROWS, with_rollups: bool = LOAD_ROLLUPS) -> dict:
+    """
+    Bulk upsert: COPY rows into a temp staging table, then one set-based
+    INSERT ... SELECT ... ON CONFLICT into the fact table, in one transaction
+    """
     with engine.begin() as conn:
-        conn.execute(insert_sql, records)
-    logger.info(f"✅ Load → fact_transactions (upserted {len(records)} rows)")
-    print(f"✅ Load → fact_transactions (upserted {len(records)} rows)")
-except Exception as e:
-    logger.error(f"Error loading data to database: {e}")
-    raise
+        return _upsert_batch(conn, df_load, table, "copy", with_rollups, chunk_rows)
+
+
+def _create_stage(conn, table: str) -> str:
+    stage = f"stage_{table}"
+    conn.execute(text(f"CREATE TEMP TABLE {stage} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP"))
+    # load_seq menjaga urutan file: kalau ada transaction_id dobel, baris terakhir yang menang
+    conn.execute(text(f"ALTER TABLE {stage} ADD COLUMN load_seq BIGSERIAL"))
+    return stage
+
+
+def _insert_to_stage(conn, df_load: pd.DataFrame, table: str) -> str:
+    """INSERT path for partitioned tables: executemany into the staging table"""
+    stage = _create_stage(conn, table)
+    records = _records(df_load)
+    if records:
+        conn.execute(text(f"INSERT INTO {stage} ({','.join(WRITE_COLUMNS)}) "
+                          f"VALUES ({','.join(':' + c for c in WRITE_COLUMNS)})"), records)
+    return stage
+
+
+def _copy_to_stage(conn, df_load: pd.DataFrame, table: str, chunk_rows: int = COPY_CHUNK_ROWS) -> str:
+    stage = _create_stage(conn, table)
+    col_list = ",".join(WRITE_COLUMNS)
+
+    dbapi_conn = conn.connection.driver_connection
+    with dbapi_conn.cursor() as cur:
+        cur.copy_expert(
+            f"COPY {stage} ({col_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            _CsvStream(df_load[WRITE_COLUMNS], chunk_rows),
+            size=1 << 20,
+        )
+    return stage
+
+
+def _merge_stage(conn, stage: str, table: str, partitioned: bool = False) -> int:
+    """Upsert the staged rows; returns the rows actually inserted or updated"""
+    if partitioned:
+        return partitions.merge_stage(conn, stage, table, WRITE_COLUMNS, changed_condition(conn, table))
+    col_list = ",".join(WRITE_COLUMNS)
+    result = conn.execute(text(f"""
+        INSERT INTO {table} ({col_list})
+        SELECT DISTINCT ON (transaction_id) {col_list}
+        FROM {stage}
+        ORDER BY transaction_id, load_seq DESC
+        ON CONFLICT (transaction_id)
+        DO UPDATE SET {_upsert_assignments(WRITE_COLUMNS)}
+        WHERE {changed_condition(conn, table)};
+    """))
+    return result.rowcount
+
+
+def _stage_keys(conn, df_load: pd.DataFrame) -> str:
+    """Temp table with the batch's transaction_ids (INSERT path has no staging table)"""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("CREATE TEMP TABLE load_keys (transaction_id VARCHAR(64)) ON COMMIT DROP"))
+    else:
+        conn.execute(text("CREATE TEMP TABLE IF NOT EXISTS load_keys (transaction_id VARCHAR(64))"))
+        conn.execute(text("DELETE FROM load_keys"))
+    keys = df_load["transaction_id"].astype(str).unique()
+    if len(keys):
+        conn.execute(text("INSERT INTO load_keys (transaction_id) VALUES (:k)"), [{"k": k} for k in keys])
+    return "SELECT transaction_id FROM load_keys"
+
+
+def _count_existing(conn, table: str, keys_sql: str) -> int:
+    return conn.execute(text(f"SELECT COUNT(*) FROM {table} WHERE transaction_id IN ({keys_sql})")).scalar()
+
+
+def _change_counts(rows: int, existing: int, written: int) -> dict:
+    """
+    Split a batch of ``rows`` distinct ids into inserted / updated / unchanged
+
+    Args:
+        existing: Ids already in the table before the upsert
+        written: Rows the upsert inserted or rewrote (its rowcount)
+    """
+    inserted = rows - existing
+    updated = written - inserted
+    return {"rows": rows, "inserted": inserted, "updated": updated, "unchanged": existing - updated}
+
+
+def _upsert_batch(conn, df_load: pd.DataFrame, table: str, mode: str, with_rollups: bool,
+                  chunk_rows: int = COPY_CHUNK_ROWS) -> dict:
+    """
+    Upsert one batch inside the caller's transaction; with rollups the
+    batch's before/after images are folded into the rollup tables in the
+    same transaction, so a retried batch never double counts
+
+    Returns:
+        Dict with rows (distinct ids), inserted, updated, unchanged and
+        lock_wait_seconds (wait for the rollup lock)
+    """
+    partitioned = partitions.is_partitioned(conn, table)
+    if mode == "copy" or partitioned:
+        # Tabel partisi selalu lewat staging (upsert-nya bukan ON CONFLICT (transaction_id))
+        if mode == "copy":
+            stage = _copy_to_stage(conn, df_load, table, chunk_rows)
+        else:
+            stage = _insert_to_stage(conn, df_load, table)
+        keys_sql = f"SELECT transaction_id FROM {stage}"
+    else:
+        keys_sql = _stage_keys(conn, df_load)
+    # Before image rollup = baris yang sudah ada; tanpa rollup dihitung langsung
+    if with_rollups:
+        existing = rollups.capture_before(conn, table, keys_sql)
+    else:
+        existing = _count_existing(conn, table, keys_sql)
+    if mode == "copy" or partitioned:
+        written = _merge_stage(conn, stage, table, partitioned)
+    else:
+        # Id dobel dalam satu executemany akan konflik dengan dirinya sendiri: baris terakhir yang menang
+        written = _upsert_rows(conn, df_load.drop_duplicates("transaction_id", keep="last"), table)
+    lock_wait = 0.0
+    if with_rollups:
+        # Lock rollup diambil di sini (apply_delta mengambilnya lagi tanpa menunggu) supaya waktu tunggunya tercatat
+        lock_wait = rollups.lock_rollups(conn, table)
+        rollups.apply_delta(conn, table, keys_sql)
+    return {**_change_counts(df_load["transaction_id"].nunique(), existing, written), "lock_wait_seconds": lock_wait}
+
+
+def partition_frame(df: pd.DataFrame, n: int) -> list:
+    """Split rows into n disjoint slices by a stable hash of transaction_id"""
+    if n <= 1:
+        return [df]
+    slot = pd.util.hash_pandas_object(df["transaction_id"].astype(str), index=False).to_numpy() % n
+    return [df.loc[slot == i] for i in range(n)]
+
+
+def _lock_wait(conn, table: str) -> float:
+    """
+    Take the table's ROW EXCLUSIVE lock (the lock INSERT takes anyway) up
+    front and return how long that waited. Slices are disjoint on
+    transaction_id, so workers never wait on each other's row locks; this
+    captures waits behind DDL, TRUNCATE, VACUUM FULL or exports. Workers do
+    wait on each other for the rollup lock, which ``_upsert_batch`` times.
+    """
+    if conn.dialect.name != "postgresql":
+        return 0.0
+    start = time.perf_counter()
+    conn.execute(text(f"LOCK TABLE {table} IN ROW EXCLUSIVE MODE"))
+    return time.perf_counter() - start
+
+
+def _load_slice(engine, worker: int, df_slice: pd.DataFrame, mode: str, table: str,
+                batch_rows: int, retries: int, with_rollups: bool = LOAD_ROLLUPS) -> dict:
+    """Load one slice on its own pooled connection, one transaction per batch"""
+    stats = {"worker": worker, "rows": 0, **dict.fromkeys(CHANGE_COUNTS, 0), "batches": 0, "retries": 0,
+             "seconds": 0.0, "lock_wait_seconds": 0.0}
+    start = time.perf_counter()
+    conn = engine.connect()
+    try:
+        for offset in range(0, len(df_slice), batch_rows):
+            batch = df_slice.iloc[offset:offset + batch_rows]
+            attempt = 0
+            while True:
+                try:
+                    with conn.begin():
+                        lock_wait = _lock_wait(conn, table)
+                        counts = _upsert_batch(conn, batch, table, mode, with_rollups)
+                    break
+                except Exception as e:
+                    attempt += 1
+                    if attempt > retries:
+                        raise
+                    # Batch sebelumnya sudah commit; cukup ulangi batch ini (upsert idempotent)
+                    logger.warning(f"Worker {worker}: batch at row {offset} failed ({e}); "
+                                   f"retry {attempt}/{retries}")
+                    stats["retries"] += 1
+                    conn.invalidate()
+                    conn.close()
+                    time.sleep(LOAD_RETRY_DELAY * attempt)
+                    conn = engine.connect()
+            for key in ("rows", *CHANGE_COUNTS):
+                stats[key] += counts[key]
+            stats["batches"] += 1
+            stats["lock_wait_seconds"] += lock_wait + counts["lock_wait_seconds"]
+    finally:
+        conn.close()
+
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    stats["lock_wait_seconds"] = round(stats["lock_wait_seconds"], 3)
+    stats["rows_per_sec"] = round(stats["rows"] / stats["seconds"], 1) if stats["seconds"] > 0 else float(stats["rows"])
+    logger.info(f"Worker {worker}: {stats['rows']} rows in {stats['batches']} batches, "
+                f"{stats['rows_per_sec']:,.0f} rows/s, lock wait {stats['lock_wait_seconds']:.3f}s")
+    return stats
+
+
+def parallel_load(engine, df_load: pd.DataFrame, mode: str, table: str = FACT_TABLE,
+                  workers: int = LOAD_WORKERS, batch_rows: int = LOAD_BATCH_ROWS,
+                  retries: int = LOAD_RETRIES, with_rollups: bool = LOAD_ROLLUPS) -> list:
+    """
+    Hash-partition rows by transaction_id into ``workers`` slices and load
+    them concurrently. A failed batch is retried on a fresh connection
+    without touching the other slices.
+
+    Returns:
+        Per-worker stats (rows, inserted, updated, unchanged, batches,
+        retries, seconds, rows_per_sec, lock_wait_seconds)
+    """
+    batch_rows = batch_rows or max(1, -(-len(df_load) // max(1, workers)))
+    slices = partition_frame(df_load, workers)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="load") as pool:
+        futures = [pool.submit(_load_slice, engine, i, s, mode, table, batch_rows, retries, with_rollups)
+                   for i, s in enumerate(slices)]
+        results, errors = [], []
+        for i, future in enumerate(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f"Worker {i} failed: {e}")
+                errors.append((i, e))
+    if errors:
+        raise RuntimeError(f"{len(errors)} of {workers} load slices failed: "
+                           f"{[i for i, _ in errors]}") from errors[0][1]
+    return results
+
+
+def load(engine, df: pd.DataFrame, mode: str = LOAD_MODE, table: str = FACT_TABLE,
+         workers: int = LOAD_WORKERS, batch_rows: int = LOAD_BATCH_ROWS,
+         with_rollups: bool = LOAD_ROLLUPS, index: DedupIndex = None) -> dict:
+    """
+    Load processed rows into the fact table
+
+    Args:
+        mode: "copy" (bulk COPY + set-based upsert) or "insert" (executemany).
+            "copy" falls back to "insert" when the engine cannot COPY.
+        workers: Parallel slices/connections; 1 with no batch_rows keeps the
+            single-transaction load
+        batch_rows: Maximum rows per transaction in the partitioned load
+        with_rollups: Maintain the rollup tables from each batch's delta
+        index: Dedup index of loaded rows; rows it has already seen with the
+            same content are skipped, the rest are recorded after the load
+
+    Returns:
+        Dict with mode, rows, inserted / updated / unchanged (rows the
+        upsert left alone because their row_hash matched), skipped (dropped
+        by the dedup index), seconds and rows_per_sec (plus per-worker stats
+        under "workers" for the partitioned load)
+    """
+    df_load = prepare_frame(df)
+    skipped = 0
+    if index is not None:
+        index.bind(engine, table)
+        df_load = index.filter(df_load)
+        skipped = index.stats["skipped"]
+    if engine.dialect.name == "postgresql":
+        # Partisi dibuat sebelum transaksi load (CREATE ... PARTITION OF mengunci tabel induk)
+        with engine.begin() as conn:
+            if partitions.is_partitioned(conn, table):
+                partitions.ensure_partitions(conn, table, partitions.months_of(df_load["event_time"]))
+    if mode == "copy" and not copy_supported(engine):
+        logger.warning(f"COPY not available for {engine.dialect.name}+{engine.dialect.driver}, "
+                       f"falling back to INSERT ... ON CONFLICT")
+        mode = "insert"
+
+    try:
+        logger.info(f"Loading {len(df_load)} records to database (mode={mode})...")
+        start = time.perf_counter()
+        worker_stats = None
+        if df_load.empty:
+            counts = _change_counts(0, 0, 0)
+        elif workers > 1 or batch_rows:
+            worker_stats = parallel_load(engine, df_load, mode, table, workers, batch_rows,
+                                         with_rollups=with_rollups)
+            counts = {key: sum(w[key] for w in worker_stats) for key in ("rows", *CHANGE_COUNTS)}
+        elif mode == "copy":
+            counts = copy_upsert(engine, df_load, table, with_rollups=with_rollups)
+        else:
+            counts = upsert_rows(engine, df_load, table, with_rollups=with_rollups)
+        seconds = time.perf_counter() - start
+    except Exception as e:
+        logger.error(f"Error loading data to database: {e}")
+        raise
+    if index is not None:
+        # Baru dicatat setelah load commit: kalau load gagal, baris di-upsert lagi run berikutnya
+        index.commit()
+
+    rows = counts["rows"]
+    stats = {
+        "mode": mode,
+        **counts,
+        "skipped": skipped,
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(rows / seconds, 1) if seconds > 0 else float(rows),
+    }
+    if worker_stats is not None:
+        stats["workers"] = worker_stats
+        stats["lock_wait_seconds"] = sum(w["lock_wait_seconds"] for w in worker_stats)
+    if "lock_wait_seconds" in stats:
+        stats["lock_wait_seconds"] = round(stats["lock_wait_seconds"], 3)
+    logger.info(f"✅ Load → {table} ({rows} rows: {counts['inserted']} inserted, {counts['updated']} updated, "
+                f"{counts['unchanged']} unchanged; {skipped} skipped by the dedup index; mode={mode}, "
+                f"{stats['rows_per_sec']:,.0f} rows/s)")
+    return stats
+
+
+def _range_param(ts: pd.Timestamp, naive: bool):
+    """Range bound as a driver parameter (wall time in EVENT_TIMEZONE for databases without time zones)"""
+    return (ts.tz_localize(None) if naive else ts).to_pydatetime()
+
+
+def _replace_keys(conn, table: str, batch_keys_sql: str, start, end, source: str) -> str:
+    """
+    Temp table with every transaction_id a range replace removes: the rows
+    of ``source`` with event_time in [start, end) plus the batch's own ids
+    (a transaction that moved in from another day)
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("CREATE TEMP TABLE replace_keys (transaction_id VARCHAR(64) PRIMARY KEY) ON COMMIT DROP"))
+    else:
+        conn.execute(text("CREATE TEMP TABLE IF NOT EXISTS replace_keys (transaction_id VARCHAR(64) PRIMARY KEY)"))
+        conn.execute(text("DELETE FROM replace_keys"))
+    naive = conn.dialect.name != "postgresql"
+    conn.execute(text(f"""
+        INSERT INTO replace_keys (transaction_id)
+        SELECT transaction_id FROM {table}
+        WHERE event_time >= :start AND event_time < :end AND source = :source
+        UNION {batch_keys_sql}
+    """), {"start": _range_param(start, naive), "end": _range_param(end, naive), "source": source})
+    return "SELECT transaction_id FROM replace_keys"
+
+
+def _replace_batch(conn, df_load: pd.DataFrame, table: str, mode: str, start, end, source: str,
+                   with_rollups: bool, chunk_rows: int = COPY_CHUNK_ROWS) -> dict:
+    """
+    Swap one range inside the caller's transaction: delete its rows, insert
+    the batch; rollups get the deleted rows as before image and the batch as
+    after image
+
+    Returns:
+        Dict with rows (distinct ids), deleted and inserted
+    """
+    partitioned = partitions.is_partitioned(conn, table)
+    staged = mode == "copy" or partitioned
+    if staged:
+        if mode == "copy":
+            stage = _copy_to_stage(conn, df_load, table, chunk_rows)
+        else:
+            stage = _insert_to_stage(conn, df_load, table)
+        batch_keys_sql = f"SELECT transaction_id FROM {stage}"
+    else:
+        batch_keys_sql = _stage_keys(conn, df_load)
+    keys_sql = _replace_keys(conn, table, batch_keys_sql, start, end, source)
+    if with_rollups:
+        rollups.capture_before(conn, table, keys_sql)
+    if partitioned:
+        deleted, inserted = partitions.replace_stage(conn, stage, table, WRITE_COLUMNS, keys_sql)
+    else:
+        deleted = conn.execute(text(f"DELETE FROM {table} WHERE transaction_id IN ({keys_sql})")).rowcount
+        if staged:
+            col_list = ",".join(WRITE_COLUMNS)
+            inserted = conn.execute(text(f"""
+                INSERT INTO {table} ({col_list})
+                SELECT DISTINCT ON (transaction_id) {col_list}
+                FROM {stage}
+                ORDER BY transaction_id, load_seq DESC
+            """)).rowcount
+        else:
+            records = _records(df_load.drop_duplicates("transaction_id", keep="last"),
+                               naive_times=conn.dialect.name != "postgresql")
+            if records:
+                conn.execute(text(f"INSERT INTO {table} ({','.join(WRITE_COLUMNS)}) "
+                                  f"VALUES ({','.join(':' + c for c in WRITE_COLUMNS)})"), records)
+            inserted = len(records)
+    if with_rollups:
+        rollups.apply_delta(conn, table, keys_sql)
+    return {"rows": df_load["transaction_id"].nunique(), "deleted": deleted, "inserted": inserted}
+
+
+def replace_range(engine, df: pd.DataFrame, start, end, mode: str = LOAD_MODE, table: str = FACT_TABLE,
+                  source: str = "DB", with_rollups: bool = LOAD_ROLLUPS, retries: int = LOAD_RETRIES) -> dict:
+    """
+    Atomically swap the rows of one time range (backfill) instead of upserting:
+    in one transaction every row of ``source`` with event_time in
+    [start, end) is deleted and ``df`` is bulk inserted. Rows of other
+    sources in the range stay. A batch id that currently lives outside the
+    range is moved (its old row is deleted too).
+
+    The dedup index is not consulted or updated; the backfill clears it.
+
+    Args:
+        start, end: Range bounds (naive values are wall time in EVENT_TIMEZONE)
+        source: ``source`` value of the rows being replaced
+
+    Returns:
+        Dict with mode, rows, deleted, inserted, retries and seconds
+    """
+    df_load = prepare_frame(df)
+    start, end = to_event_time(pd.Series([start, end])).tolist()
+    outside = (df_load["event_time"] < start) | (df_load["event_time"] >= end)
+    if outside.any():
+        raise ValueError(f"{int(outside.sum())} rows are outside the replaced range [{start}, {end})")
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            if partitions.is_partitioned(conn, table):
+                partitions.ensure_partitions(conn, table, partitions.months_of(df_load["event_time"]))
+    if mode == "copy" and not copy_supported(engine):
+        mode = "insert"
+
+    started = time.perf_counter()
+    attempt = 0
+    while True:
+        try:
+            with engine.begin() as conn:
+                counts = _replace_batch(conn, df_load, table, mode, start, end, source, with_rollups)
+            break
+        except Exception as e:
+            attempt += 1
+            if attempt > retries:
+                logger.error(f"Replacing {start} .. {end} failed: {e}")
+                raise
+            # Seluruh replace satu transaksi: diulang dari awal tanpa efek ganda
+            logger.warning(f"Replacing {start} .. {end} failed ({e}); retry {attempt}/{retries}")
+            time.sleep(LOAD_RETRY_DELAY * attempt)
+    stats = {"mode": mode, **counts, "retries": attempt, "seconds": round(time.perf_counter() - started, 3)}
+    logger.info(f"✅ Replaced {table} [{start}, {end}) source={source}: {counts['deleted']} deleted, "
+                f"{counts['inserted']} inserted")
+    return stats
+
+
+def run(df: pd.DataFrame = None, path: str = DATA_FILE, mode: str = LOAD_MODE, workers: int = LOAD_WORKERS,
+        batch_rows: int = LOAD_BATCH_ROWS, dedup_index: bool = LOAD_DEDUP_INDEX, engine=None,
+        run_id: str = None) -> dict:
+    """
+    Load stage: processed rows into fact_transactions
+
+    Args:
+        df: Processed frame handed over in memory; read from ``path`` when missing
+        dedup_index: Skip rows the dedup index has seen unchanged
+        engine: Warehouse engine (default: POSTGRES_URI)
+        run_id: Run id of the metrics manifest (default ETL_RUN_ID)
+
+    Returns:
+        ``load`` stats
+    """
+    engine = engine or get_engine(pool_size=workers if workers > 1 else None)
+    metrics = RunMetrics("load", run_id=run_id)
+    with metrics.run():
+        with metrics.step("read") as step:
+            if df is None:
+                df = read_processed(path)
+                step.read(path)
+            step.rows_out = len(df)
+        ensure_table(engine)
+        with metrics.step("load") as step:
+            step.rows_in = len(df)
+            index = DedupIndex(DEDUP_INDEX_FILE) if dedup_index else None
+            try:
+                stats = load(engine, df, mode, workers=workers, batch_rows=batch_rows, index=index)
+            finally:
+                if index is not None:
+                    index.close()
+            step.rows_out = stats["rows"]
+        metrics.info.update(mode=stats["mode"], workers=workers, skipped=stats["skipped"],
+                            **{key: stats[key] for key in CHANGE_COUNTS},
+                            lock_wait_seconds=stats.get("lock_wait_seconds"))
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load processed transactions into the warehouse")
+    parser.add_argument("--mode", choices=["copy", "insert"], default=LOAD_MODE,
+                        help="copy: COPY into staging + set-based upsert (default); insert: executemany upsert")
+    parser.add_argument("--workers", type=int, default=LOAD_WORKERS,
+                        help="Parallel slices, each on its own pooled connection")
+    parser.add_argument("--batch-size", type=int, default=LOAD_BATCH_ROWS,
+                        help="Maximum rows per transaction in the partitioned load")
+    parser.add_argument("--rebuild-rollups", action="store_true",
+                        help="Recompute the rollup tables from fact_transactions and exit")
+    parser.add_argument("--migrate-partitions", action="store_true",
+                        help="Convert an existing heap fact_transactions into monthly partitions and exit")
+    parser.add_argument("--no-dedup-index", action="store_true", default=not LOAD_DEDUP_INDEX,
+                        help="Upsert every row instead of skipping rows the dedup index has seen unchanged")
+    parser.add_argument("--rebuild-dedup-index", action="store_true",
+                        help="Recompute the dedup index from fact_transactions and exit")
+    parser.add_argument("--compact-dedup-index", action="store_true",
+                        help=f"Drop dedup index keys older than DEDUP_INDEX_RETENTION_DAYS "
+                             f"({DEDUP_INDEX_RETENTION_DAYS}) and exit")
+    args = parser.parse_args(argv)
+
+    engine = get_engine(pool_size=args.workers if args.workers > 1 else None)
+    if args.migrate_partitions:
+        with engine.begin() as conn:
+            rows = partitions.migrate_to_partitioned(conn, FACT_TABLE, FACT_COLUMNS_DDL)
+        print(f"✅ fact_transactions partitioned by month ({rows} rows moved)")
+        return
+    if args.rebuild_rollups:
+        ensure_table(engine)
+        with engine.begin() as conn:
+            rollups.rebuild_rollups(conn, FACT_TABLE)
+        print("✅ Rollups rebuilt from fact_transactions")
+        return
+    if args.rebuild_dedup_index:
+        ensure_table(engine)
+        with DedupIndex(DEDUP_INDEX_FILE) as index:
+            keys = index.rebuild(engine, FACT_TABLE)
+        print(f"✅ Dedup index rebuilt from fact_transactions ({keys} keys)")
+        return
+    if args.compact_dedup_index:
+        with DedupIndex(DEDUP_INDEX_FILE) as index:
+            dropped = index.compact()
+            keys = index.keys
+        print(f"✅ Dedup index compacted ({dropped} keys dropped, {keys} kept)")
+        return
+    stats = run(path=DATA_FILE, mode=args.mode, workers=args.workers, batch_rows=args.batch_size,
+                dedup_index=not args.no_dedup_index, engine=engine)
+    print(f"✅ Load → fact_transactions ({stats['inserted']} inserted, {stats['updated']} updated, "
+          f"{stats['unchanged']} unchanged, {stats['skipped']} skipped by the dedup index, "
+          f"{stats['rows_per_sec']:,.0f} rows/s)")
+
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+Monthly range partitioning of fact_transactions on event_time (PostgreSQL)
+
+A partitioned table's primary key must contain the partition key, so the
+fact table's key becomes (transaction_id, event_time). To keep upserts
+keyed on transaction_id alone, a small registry table ``<table>_keys``
+(transaction_id PRIMARY KEY, event_time) records where every transaction
+currently lives. The loader merges a batch in four steps:
+
+1. dedup the staging rows (last row per transaction_id wins)
+2. delete the old version of rows whose event_time moved (registry lookup)
+3. INSERT ... ON CONFLICT (transaction_id, event_time) DO UPDATE
+4. upsert the registry
+
+``replace_stage`` swaps a batch in instead (backfill): the rows of the
+given keys are deleted through the registry and the batch inserted.
+
+Partitions are named ``<table>_pYYYYMM``. They are created for every
+month present in a load, plus ``PARTITION_MONTHS_AHEAD`` upcoming months,
+before the load transactions start (creating a partition locks the parent).
+Months are taken from event_time in EVENT_TIMEZONE and the bounds are
+written with that zone's UTC offset, so they do not depend on the session
+time zone. A DEFAULT partition ``<table>_pdefault`` catches rows no monthly
+partition covers (e.g. a month created by a concurrent load after the
+partitions were prepared); ``ensure_partitions`` moves such rows into the
+month partition once it is created.
+"""
+
+import os
+import sys
+import logging
+from datetime import date
+from typing import Iterable, List
+
+import pandas as pd
+from sqlalchemy import text
+
+# Add scripts directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from schema import EVENT_TIMEZONE, to_event_time
+
+logger = logging.getLogger(__name__)
+
+# "monthly" (default di PostgreSQL) atau "none" (heap table biasa)
+FACT_PARTITIONING = os.getenv("FACT_PARTITIONING", "monthly").lower()
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+
+
+def keys_table(table: str) -> str:
+    """Registry table mapping transaction_id -> event_time"""
+    return f"{table}_keys"
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month.year:04d}{month.month:02d}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_pdefault"
+
+
+def month_start(month: date) -> str:
+    """First instant of ``month`` in EVENT_TIMEZONE, with explicit UTC offset (partition bound)"""
+    start = pd.Timestamp(month).tz_localize(EVENT_TIMEZONE, nonexistent="shift_forward")
+    return start.isoformat(sep=" ")
+
+
+def _add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def months_of(event_time: pd.Series) -> List[date]:
+    """Distinct month starts covered by a series of timestamps (wall time in EVENT_TIMEZONE)"""
+    periods = to_event_time(event_time).dropna().dt.tz_localize(None).dt.to_period("M").unique()
+    return sorted(date(p.year, p.month, 1) for p in periods)
+
+
+def upcoming_months(ahead: int = PARTITION_MONTHS_AHEAD, today: date = None) -> List[date]:
+    """The current month and ``ahead`` months after it"""
+    today = today or date.today()
+    first = date(today.year, today.month, 1)
+    return [_add_months(first, i) for i in range(ahead + 1)]
+
+
+def partitioning_enabled(engine_or_conn) -> bool:
+    return FACT_PARTITIONING == "monthly" and engine_or_conn.dialect.name == "postgresql"
+
+
+def is_partitioned(conn, table: str) -> bool:
+    """True when ``table`` is a partitioned (parent) table"""
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.relname = :table AND pg_table_is_visible(c.oid)
+        )
+    """), {"table": table}).scalar()
+
+
+def create_partitioned_table(conn, table: str, columns_ddl: str):
+    """
+    Create the partitioned parent, its key registry and indexes
+
+    Args:
+        columns_ddl: Column definitions (without the primary key)
+    """
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+          {columns_ddl},
+          PRIMARY KEY (transaction_id, event_time)
+        ) PARTITION BY RANGE (event_time)
+    """))
+    _create_keys_table(conn, table)
+    create_indexes(conn, table)
+
+
+def _create_keys_table(conn, table: str):
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {keys_table(table)} (
+          transaction_id  VARCHAR(64) PRIMARY KEY,
+          event_time      TIMESTAMPTZ NOT NULL
+        )
+    """))
+
+
+def create_indexes(conn, table: str):
+    """BRIN on event_time (tiny, fits append-mostly time data) + B-tree for per-user lookups"""
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {table}_event_time_brin ON {table} USING BRIN (event_time)"))
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {table}_user_time_idx ON {table} (user_id, event_time)"))
+
+
+def ensure_partitions(conn, table: str, months: Iterable[date], name_table: str = None) -> List[str]:
+    """
+    Create missing monthly partitions for ``months`` and the upcoming months,
+    plus the DEFAULT partition
+
+    Rows of a new month that already sit in the DEFAULT partition are moved
+    into it in the same transaction.
+
+    Args:
+        name_table: Table name used for partition names (default ``table``)
+
+    Returns:
+        Names of the partitions that were created
+    """
+    wanted = sorted(set(months) | set(upcoming_months()))
+    existing = set(conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = :table AND pg_table_is_visible(p.oid)
+    """), {"table": table}).scalars())
+    created = []
+    default = default_partition_name(name_table or table)
+    if default not in existing:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {default} PARTITION OF {table} DEFAULT"))
+        created.append(default)
+    for month in wanted:
+        name = partition_name(name_table or table, month)
+        if name in existing:
+            continue
+        lo, hi = month_start(month), month_start(_add_months(month, 1))
+        # Baris bulan ini yang terlanjur masuk DEFAULT harus keluar dulu, kalau tidak CREATE gagal
+        in_month = "event_time >= CAST(:lo AS TIMESTAMPTZ) AND event_time < CAST(:hi AS TIMESTAMPTZ)"
+        conn.execute(text(f"CREATE TEMP TABLE partition_move ON COMMIT DROP AS "
+                          f"SELECT * FROM {default} WHERE {in_month}"), {"lo": lo, "hi": hi})
+        conn.execute(text(f"DELETE FROM {default} WHERE {in_month}"), {"lo": lo, "hi": hi})
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table}
+            FOR VALUES FROM ('{lo}') TO ('{hi}')
+        """))
+        moved = conn.execute(text(f"INSERT INTO {table} SELECT * FROM partition_move")).rowcount
+        conn.execute(text("DROP TABLE partition_move"))
+        if moved:
+            logger.info(f"Moved {moved} rows from {default} into {name}")
+        created.append(name)
+    if created:
+        logger.info(f"Created partitions: {created}")
+    return created
+
+
+def merge_stage(conn, stage: str, table: str, columns: List[str], changed: str = None) -> int:
+    """
+    Upsert staged rows (with load_seq) into a partitioned table, keyed on transaction_id
+
+    Args:
+        changed: Condition on ``table`` / ``EXCLUDED`` a conflicting row must
+            meet to be rewritten (default: always rewrite)
+
+    Returns:
+        Rows inserted or rewritten
+    """
+    col_list = ",".join(columns)
+    keys = keys_table(table)
+    conn.execute(text(f"""
+        CREATE TEMP TABLE merge_{table} ON COMMIT DROP AS
+        SELECT DISTINCT ON (transaction_id) {col_list}
+        FROM {stage}
+        ORDER BY transaction_id, load_seq DESC
+    """))
+    # Baris yang pindah bulan/waktu: versi lama dihapus dulu dari partisi lamanya
+    conn.execute(text(f"""
+        DELETE FROM {table} f
+        USING {keys} k JOIN merge_{table} m ON m.transaction_id = k.transaction_id
+        WHERE f.transaction_id = k.transaction_id
+          AND f.event_time = k.event_time
+          AND k.event_time <> m.event_time
+    """))
+    updates = ",".join(f"{c}=EXCLUDED.{c}" for c in columns if c not in ("transaction_id", "event_time"))
+    result = conn.execute(text(f"""
+        INSERT INTO {table} ({col_list})
+        SELECT {col_list} FROM merge_{table}
+        ON CONFLICT (transaction_id, event_time)
+        DO UPDATE SET {updates},ingestion_time=CURRENT_TIMESTAMP
+        {f"WHERE {changed}" if changed else ""}
+    """))
+    conn.execute(text(f"""
+        INSERT INTO {keys} (transaction_id, event_time)
+        SELECT transaction_id, event_time FROM merge_{table}
+        ON CONFLICT (transaction_id) DO UPDATE SET event_time = EXCLUDED.event_time
+        WHERE {keys}.event_time <> EXCLUDED.event_time
+    """))
+    return result.rowcount
+
+
+def replace_stage(conn, stage: str, table: str, columns: List[str], keys_sql: str) -> tuple:
+    """
+    Delete every row (and registry entry) whose transaction_id is returned
+    by ``keys_sql``, then insert the staged rows (last load_seq per id)
+
+    Returns:
+        (rows deleted, rows inserted)
+    """
+    col_list = ",".join(columns)
+    keys = keys_table(table)
+    # Registry menunjuk partisi tiap baris: delete cukup menyentuh partisi yang berisi key-nya
+    deleted = conn.execute(text(f"""
+        DELETE FROM {table} f
+        USING {keys} k
+        WHERE k.transaction_id IN ({keys_sql})
+          AND f.transaction_id = k.transaction_id
+          AND f.event_time = k.event_time
+    """)).rowcount
+    conn.execute(text(f"DELETE FROM {keys} WHERE transaction_id IN ({keys_sql})"))
+    inserted = conn.execute(text(f"""
+        INSERT INTO {table} ({col_list})
+        SELECT DISTINCT ON (transaction_id) {col_list}
+        FROM {stage}
+        ORDER BY transaction_id, load_seq DESC
+    """)).rowcount
+    conn.execute(text(f"""
+        INSERT INTO {keys} (transaction_id, event_time)
+        SELECT DISTINCT ON (transaction_id) transaction_id, event_time
+        FROM {stage}
+        ORDER BY transaction_id, load_seq DESC
+    """))
+    return deleted, inserted
+
+
+def migrate_to_partitioned(conn, table: str, columns_ddl: str) -> int:
+    """
+    Convert an existing heap fact table into the partitioned layout in one
+    transaction (takes an exclusive lock; run in a maintenance window)
+
+    Returns:
+        Number of rows moved
+    """
+    if is_partitioned(conn, table):
+        return 0
+    new = f"{table}_part"
+    conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+    conn.execute(text(f"""
+        CREATE TABLE {new} (
+          {columns_ddl},
+          CONSTRAINT {table}_pkey_part PRIMARY KEY (transaction_id, event_time)
+        ) PARTITION BY RANGE (event_time)
+    """))
+    months = [pd.Timestamp(m).date() for m in conn.execute(text(
+        f"SELECT DISTINCT date_trunc('month', event_time AT TIME ZONE :tz)::date FROM {table}"),
+        {"tz": EVENT_TIMEZONE}).scalars()]
+    ensure_partitions(conn, new, months, name_table=table)
+    columns = ", ".join(conn.execute(text("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = :table AND table_schema = current_schema()
+        ORDER BY ordinal_position
+    """), {"table": table}).scalars())
+    rows = conn.execute(text(f"INSERT INTO {new} ({columns}) SELECT {columns} FROM {table}")).rowcount
+    conn.execute(text(f"DROP TABLE {table}"))
+    conn.execute(text(f"ALTER TABLE {new} RENAME TO {table}"))
+    conn.execute(text(f"ALTER TABLE {table} RENAME CONSTRAINT {table}_pkey_part TO {table}_pkey"))
+    _create_keys_table(conn, table)
+    conn.execute(text(f"""
+        INSERT INTO {keys_table(table)} (transaction_id, event_time)
+        SELECT transaction_id, event_time FROM {table}
+        ON CONFLICT (transaction_id) DO UPDATE SET event_time = EXCLUDED.event_time
+    """))
+    create_indexes(conn, table)
+    logger.info(f"Migrated {rows} rows of {table} into monthly partitions")
+    return rows
@@ -0,0 +1,392 @@
+"""
+In-process ETL pipeline runner
+
+Runs the stages as functions in one interpreter instead of one process
+per stage::
+
+    extract_api ─┐
+                 ├─> transform ─> load
+    extract_db  ─┘
+
+A stage starts as soon as the stages it depends on have finished, on a
+thread pool, so the two extracts (network / database bound) run
+concurrently. With ``handoff="memory"`` the extracts write into
+``FrameBuffer``s and the transform hands its flagged frame straight to the
+load: no stage files are written or re-read, and pandas/SQLAlchemy are
+imported once. ``handoff="files"`` keeps the stage files between stages
+(needed by the chunked and parallel transform modes, which stream from
+disk). A frame is dropped as soon as every stage that reads it is done.
+
+Every stage writes its own run manifest under the shared run id; the
+runner adds a ``pipeline`` manifest with each stage's start/end offsets and
+the critical path (the chain of dependent stages that set the wall time).
+
+Stage outputs are kept in a content-addressed cache (``stage_cache.py``):
+a stage whose fingerprint (code, options, source files, upstream outputs)
+matches an earlier successful run is skipped and its cached output used,
+so a rerun resumes at the first stage whose inputs changed. Remote sources
+(API, MySQL) cannot be fingerprinted before they are fetched; their
+extracts are reused only by a rerun with the same run id (an Airflow
+retry). ``force`` reruns stages regardless of the cache.
+
+Usable from Airflow (``dags/financial_etl_dag.py`` calls ``run_pipeline``)
+and as a CLI::
+
+    python scripts/pipeline.py [--handoff memory|files] [--transform-mode memory] [--force]
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Iterable, List, Tuple, Union
+
+from dotenv import load_dotenv
+from sqlalchemy.engine import make_url
+
+# Add scripts directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils import setup_logging, RunMetrics
+from intermediate import FrameBuffer
+from schema import EVENT_TIMEZONE
+from stage_cache import STAGE_CACHE_DIR, StageCache, code_version, file_digest, fingerprint
+import extract_api as api_stage
+import extract_db as db_stage
+import transform as transform_stage
+import load as load_stage
+
+# Setup logging
+logger = setup_logging()
+
+load_dotenv()
+# "memory": frame diserahkan antar stage di memori; "files": lewat file stage seperti script terpisah
+PIPELINE_HANDOFF = os.getenv("PIPELINE_HANDOFF", "memory")
+# Thread untuk stage yang siap jalan bersamaan (dua extract)
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "2"))
+# Stage yang fingerprint-nya sama dengan run sukses sebelumnya dilewati (output diambil dari cache)
+PIPELINE_CACHE = os.getenv("PIPELINE_CACHE", "1") == "1"
+
+# Stage cache dipakai bersama thread stage; restore output upstream cukup sekali
+_RESTORE_LOCK = threading.Lock()
+
+
+def _extract_api(inputs: dict, options: dict) -> dict:
+    out = FrameBuffer() if options["handoff"] == "memory" else api_stage.EXTRACTED_FILE
+    result = api_stage.run(out_path=out, run_id=options["run_id"])
+    if isinstance(out, FrameBuffer):
+        result["frame"] = out.frame()
+    else:
+        result["path"] = out
+    return result
+
+
+def _extract_db(inputs: dict, options: dict) -> dict:
+    out = FrameBuffer() if options["handoff"] == "memory" else db_stage.EXTRACTED_FILE
+    result = db_stage.run(options["extract_db_mode"], out_path=out, run_id=options["run_id"])
+    if isinstance(out, FrameBuffer):
+        result["frame"] = out.frame()
+    else:
+        result["path"] = out
+    return result
+
+
+def _transform(inputs: dict, options: dict) -> dict:
+    memory = options["handoff"] == "memory"
+    result = transform_stage.run(
+        options["transform_mode"],
+        api=inputs["extract_api"].get("frame"), db=inputs["extract_db"].get("frame"),
+        out_path=None if memory else transform_stage.OUT_FILE,
+        event_state=options["event_state"], run_id=options["run_id"])
+    if not memory:
+        result["path"] = transform_stage.OUT_FILE
+    return result
+
+
+def _load(inputs: dict, options: dict) -> dict:
+    return load_stage.run(inputs["transform"].get("frame"), load_stage.DATA_FILE, mode=options["load_mode"],
+                          workers=options["load_workers"], dedup_index=options["dedup_index"],
+                          run_id=options["run_id"])
+
+
+# Stage -> (stage yang harus selesai dulu, fungsi); urutan dict = urutan topologis
+STAGES = {
+    "extract_api": ([], _extract_api),
+    "extract_db": ([], _extract_db),
+    "transform": (["extract_api", "extract_db"], _transform),
+    "load": (["transform"], _load),
+}
+
+
+def _api_sources(options: dict) -> dict:
+    if api_stage.API_URL:
+        # Feed remote baru bisa di-hash setelah diambil: hanya rerun dengan run id yang sama memakai cache
+        return {"url": api_stage.API_URL, "page_size": api_stage.PAGE_SIZE, "run_id": options["run_id"]}
+    return {"source": file_digest(api_stage.SRC_FILE)}
+
+
+def _db_sources(options: dict) -> dict:
+    if os.path.exists(db_stage.CSV_FILE):
+        return {"source": file_digest(db_stage.CSV_FILE)}
+    return {"mysql": f"{os.getenv('MYSQL_HOST')}:{os.getenv('MYSQL_PORT', 3306)}/{os.getenv('MYSQL_DATABASE')}",
+            "run_id": options["run_id"]}
+
+
+def _transform_sources(options: dict) -> dict:
+    return {"rules": file_digest(transform_stage.FRAUD_RULES_FILE), "timezone": EVENT_TIMEZONE}
+
+
+def _load_sources(options: dict) -> dict:
+    uri = load_stage.POSTGRES_URI
+    return {"warehouse": make_url(uri).render_as_string(hide_password=True) if uri else None,
+            "table": load_stage.FACT_TABLE}
+
+
+# Input di luar graph stage yang ikut fingerprint (file sumber, config, target warehouse)
+SOURCES = {
+    "extract_api": _api_sources,
+    "extract_db": _db_sources,
+    "transform": _transform_sources,
+    "load": _load_sources,
+}
+
+
+def critical_path(seconds: Dict[str, float], deps: Dict[str, List[str]]) -> Tuple[List[str], float]:
+    """
+    Longest chain of dependent stages by duration
+
+    Args:
+        seconds: Duration of every stage that ran
+        deps: Upstream stages of every stage (in topological order)
+
+    Returns:
+        Stage names along the path and its total seconds
+    """
+    finish, previous = {}, {}
+    for name, upstream in deps.items():
+        if name not in seconds:
+            continue
+        before = max((d for d in upstream if d in finish), key=finish.get, default=None)
+        finish[name] = seconds[name] + (finish[before] if before else 0.0)
+        previous[name] = before
+    if not finish:
+        return [], 0.0
+    # Seri (stage 0 detik): ambil stage paling hilir supaya path sampai ujung
+    name = max(reversed(list(finish)), key=finish.get)
+    total = finish[name]
+    path = []
+    while name:
+        path.append(name)
+        name = previous[name]
+    return path[::-1], total
+
+
+def _identity(info: dict):
+    """What downstream fingerprints see of a stage: its output digests, or its key without outputs"""
+    return {name: o["digest"] for name, o in info["outputs"].items()} or info["key"]
+
+
+def _materialize(cache: StageCache, result: dict):
+    """Bring a cached upstream output back (frame in memory / stage file on disk) for a stage that runs"""
+    info = result.get("cache") or {}
+    with _RESTORE_LOCK:
+        if not info.get("hit") or info.get("restored"):
+            return
+        if "frame" in info["outputs"]:
+            result["frame"] = cache.load_frame(info["outputs"]["frame"])
+        if "path" in info["outputs"]:
+            cache.restore(info["outputs"]["path"], result["path"])
+        info["restored"] = True
+
+
+def _run_stage(name: str, fn, inputs: dict, options: dict, cache: StageCache = None,
+               force: bool = False, code: str = None) -> dict:
+    """Run one stage, or take its result from the stage cache when its fingerprint matches"""
+    if cache is None:
+        return fn(inputs, options)
+    key = fingerprint(name, {
+        "code": code,
+        "options": {k: v for k, v in options.items() if k != "run_id"},
+        "sources": SOURCES[name](options) if name in SOURCES else {},
+        "inputs": {d: _identity(r["cache"]) for d, r in inputs.items()},
+    })
+    entry = None if force else cache.get(key)
+    if entry is not None:
+        logger.info(f"Stage {name} skipped: cached output {key[:12]} (rows={entry['result'].get('rows')})")
+        return {**entry["result"], "cache": {"key": key, "hit": True, "outputs": entry["outputs"]}}
+
+    for upstream in inputs.values():
+        _materialize(cache, upstream)
+    result = fn(inputs, options)
+    outputs = {}
+    if "frame" in result:
+        outputs["frame"] = cache.put_frame(result["frame"])
+    if "path" in result:
+        outputs["path"] = cache.put_file(result["path"])
+    cache.put(key, name, {k: v for k, v in result.items() if k != "frame"}, outputs)
+    result["cache"] = {"key": key, "hit": False, "outputs": outputs}
+    return result
+
+
+def _timed(fn, args: tuple, start: float) -> Tuple[dict, float, float]:
+    began = time.perf_counter() - start
+    result = fn(*args)
+    return result, began, time.perf_counter() - start
+
+
+def run_pipeline(handoff: str = PIPELINE_HANDOFF, transform_mode: str = transform_stage.TRANSFORM_MODE,
+                 extract_db_mode: str = db_stage.EXTRACT_DB_MODE, load_mode: str = load_stage.LOAD_MODE,
+                 load_workers: int = load_stage.LOAD_WORKERS, event_state: bool = transform_stage.TRANSFORM_EVENT_STATE,
+                 dedup_index: bool = load_stage.LOAD_DEDUP_INDEX, stages: Dict[str, tuple] = None,
+                 workers: int = PIPELINE_WORKERS, run_id: str = None, cache: bool = PIPELINE_CACHE,
+                 force: Union[bool, Iterable[str]] = False, cache_dir: str = None) -> dict:
+    """
+    Run the pipeline stages in dependency order, independent stages concurrently
+
+    Args:
+        handoff: "memory" (frames passed between stages) or "files" (stage files)
+        stages: Stage graph (default STAGES)
+        run_id: Run id shared by every stage manifest (default ETL_RUN_ID)
+        cache: Skip stages whose fingerprint matches a cached output
+        force: True, or the names of stages to run even when cached (their
+            cache entries are refreshed)
+        cache_dir: Stage cache directory (default STAGE_CACHE_DIR)
+
+    Returns:
+        Dict with per-stage results (without frames) and timings, the
+        critical path and its seconds, and the wall time
+    """
+    if handoff not in ("memory", "files"):
+        raise ValueError(f"Unknown handoff '{handoff}', expected 'memory' or 'files'")
+    if handoff == "memory" and transform_mode != "memory":
+        logger.warning(f"transform mode '{transform_mode}' streams from stage files; using handoff=files")
+        handoff = "files"
+    stages = stages or STAGES
+    forced = set(stages) if force is True else set(force or ())
+    if forced - set(stages):
+        raise ValueError(f"Unknown stages to force: {sorted(forced - set(stages))}")
+    stage_cache = StageCache(cache_dir or STAGE_CACHE_DIR) if cache else None
+    code = code_version() if cache else None
+    metrics = RunMetrics("pipeline", run_id=run_id)
+    options = {"handoff": handoff, "transform_mode": transform_mode, "extract_db_mode": extract_db_mode,
+               "load_mode": load_mode, "load_workers": load_workers, "event_state": event_state,
+               "dedup_index": dedup_index, "run_id": metrics.run_id}
+    deps = {name: upstream for name, (upstream, _) in stages.items()}
+    consumers = {name: [n for n, upstream in deps.items() if name in upstream] for name in stages}
+
+    results, timings = {}, {}
+    start = time.perf_counter()
+    with metrics.run():
+        logger.info(f"Pipeline {metrics.run_id} starting (handoff={handoff}, stages={list(stages)})")
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="stage") as pool:
+            pending, running = dict(stages), {}
+            while pending or running:
+                for name in [n for n, (upstream, _) in pending.items() if all(d in results for d in upstream)]:
+                    upstream, fn = pending.pop(name)
+                    inputs = {d: results[d] for d in upstream}
+                    args = (name, fn, inputs, options, stage_cache, name in forced, code)
+                    running[pool.submit(_timed, _run_stage, args, start)] = name
+                if not running:
+                    raise ValueError(f"Stages {list(pending)} depend on stages that are not defined")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name], began, ended = future.result()
+                    except Exception as e:
+                        logger.error(f"Stage {name} failed: {e}")
+                        for other in running:
+                            other.cancel()
+                        raise
+                    timings[name] = {"start": round(began, 3), "end": round(ended, 3),
+                                     "seconds": round(ended - began, 3)}
+                    if stage_cache is not None:
+                        timings[name]["cached"] = results[name]["cache"]["hit"]
+                    logger.info(f"Stage {name} finished in {ended - began:.2f}s "
+                                f"(rows={results[name].get('rows')})")
+                    # Frame upstream dilepas begitu semua pembacanya selesai
+                    for d in deps[name]:
+                        if all(c in results for c in consumers[d]):
+                            results[d].pop("frame", None)
+        # Semua stage (termasuk load) sukses: baru watermark extract DB boleh maju
+        watermark = results.get("extract_db", {}).get("watermark")
+        if watermark:
+            metrics.info["watermark"] = db_stage.commit_watermark(watermark, db_stage.WATERMARK_FILE)
+        wall = time.perf_counter() - start
+        path, path_seconds = critical_path({n: t["seconds"] for n, t in timings.items()}, deps)
+        metrics.info.update(handoff=handoff, stages=timings, critical_path=path,
+                            critical_path_seconds=round(path_seconds, 3))
+        if stage_cache is not None:
+            metrics.info["cached"] = [n for n, t in timings.items() if t["cached"]]
+            with metrics.step("cache_evict"):
+                metrics.info["cache_evicted"] = stage_cache.evict()
+        for line in critical_path_report(timings, path, path_seconds, wall):
+            logger.info(line)
+
+    return {
+        "run_id": metrics.run_id,
+        "handoff": handoff,
+        "results": {n: {**{k: v for k, v in r.items() if k not in ("frame", "cache")},
+                        "cached": bool(r.get("cache", {}).get("hit"))} for n, r in results.items()},
+        "timings": timings,
+        "critical_path": path,
+        "critical_path_seconds": round(path_seconds, 3),
+        "wall_seconds": round(wall, 3),
+    }
+
+
+def critical_path_report(timings: Dict[str, dict], path: List[str], path_seconds: float, wall: float) -> List[str]:
+    """Log lines: every stage's start/end offsets (critical ones starred), then the path"""
+    lines = [f"pipeline wall time {wall:.2f}s"]
+    width = max((len(n) for n in timings), default=0)
+    for name, t in timings.items():
+        mark = (" *" if name in path else "") + (" (cached)" if t.get("cached") else "")
+        lines.append(f"  {name:<{width}}  {t['start']:7.2f}s -> {t['end']:7.2f}s  ({t['seconds']:.2f}s){mark}")
+    sequential = sum(t["seconds"] for t in timings.values())
+    lines.append(f"critical path: {' -> '.join(path)} = {path_seconds:.2f}s "
+                 f"(stages run one after another: {sequential:.2f}s)")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run extract, transform and load in one process")
+    parser.add_argument("--handoff", choices=["memory", "files"], default=PIPELINE_HANDOFF,
+                        help="memory: pass frames between stages (default); files: write/read stage files")
+    parser.add_argument("--transform-mode", choices=["memory", "chunked", "parallel"],
+                        default=transform_stage.TRANSFORM_MODE,
+                        help="Transform mode (chunked/parallel imply --handoff files)")
+    parser.add_argument("--extract-db-mode", choices=["full", "incremental"], default=db_stage.EXTRACT_DB_MODE,
+                        help="DB extract mode (MySQL only)")
+    parser.add_argument("--load-mode", choices=["copy", "insert"], default=load_stage.LOAD_MODE,
+                        help="Load mode")
+    parser.add_argument("--load-workers", type=int, default=load_stage.LOAD_WORKERS,
+                        help="Parallel load slices")
+    parser.add_argument("--no-event-state", dest="event_state", action="store_false",
+                        default=transform_stage.TRANSFORM_EVENT_STATE,
+                        help="Do not seed window rules from (or update) the per-user event state")
+    parser.add_argument("--no-dedup-index", dest="dedup_index", action="store_false",
+                        default=load_stage.LOAD_DEDUP_INDEX,
+                        help="Upsert every row instead of skipping rows the dedup index has seen unchanged")
+    parser.add_argument("--run-id", default=None,
+                        help="Run id (default ETL_RUN_ID); a rerun with the same id reuses remote extracts")
+    parser.add_argument("--no-cache", dest="cache", action="store_false", default=PIPELINE_CACHE,
+                        help="Run every stage without reading or writing the stage cache")
+    parser.add_argument("--force", action="store_true",
+                        help="Run every stage even when its output is cached (entries are refreshed)")
+    parser.add_argument("--force-stage", action="append", default=[], choices=list(STAGES), metavar="STAGE",
+                        help="Run this stage even when cached (repeatable)")
+    args = parser.parse_args(argv)
+
+    summary = run_pipeline(args.handoff, args.transform_mode, args.extract_db_mode, args.load_mode,
+                           args.load_workers, args.event_state, args.dedup_index, run_id=args.run_id,
+                           cache=args.cache, force=args.force or args.force_stage)
+    cached = [n for n, r in summary["results"].items() if r["cached"]]
+    print(f"✅ Pipeline {summary['run_id']} done in {summary['wall_seconds']:.2f}s "
+          f"(critical path {' -> '.join(summary['critical_path'])}: {summary['critical_path_seconds']:.2f}s"
+          + (f", cached: {', '.join(cached)})" if cached else ")"))
+
+
+if __name__ == "__main__":
+    main()
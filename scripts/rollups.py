@@ -0,0 +1,251 @@
+"""
+Incrementally maintained summary (rollup) tables for the Tableau exports
+
+Each rollup keeps COUNT / fraud count / SUM(amount) per group (daily also
+keeps MIN/MAX amount). ``load.py`` updates them inside every load
+transaction from the rows of that batch only:
+
+1. ``capture_before``: copy the current fact rows of the batch's
+   transaction_ids (the before image) into a temp delta table with sign -1
+2. the fact upsert runs
+3. ``apply_delta``: copy the same rows again (the after image, sign +1)
+   and add ``SUM(sign * ...)`` per group to every rollup
+
+Updated rows therefore move from their old group to their new one, which
+covers fraud-flag, amount, merchant and event_time changes. Daily MIN/MAX
+cannot be subtracted: new values are merged with LEAST/GREATEST, and a day
+is re-read from the fact table only when a removed amount was its current
+minimum or maximum.
+
+Works on PostgreSQL and SQLite (used by the tests).
+"""
+
+import logging
+import time
+from datetime import timedelta
+
+import pandas as pd
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+DELTA_TABLE = "rollup_delta"
+DELTA_COLUMNS = ["event_time", "user_id", "merchant", "location", "amount", "is_fraud", "fraud_reason"]
+
+# name -> (key column, key type, key expression, filter)
+ROLLUPS = {
+    "daily": ("transaction_date", "DATE", "{day}", None),
+    "merchant": ("merchant", "VARCHAR(128)", "COALESCE(merchant, '(unknown)')", None),
+    # user_id NULL disimpan sebagai -1 (kolom PK tidak boleh NULL)
+    "user": ("user_key", "BIGINT", "COALESCE(user_id, -1)", None),
+    "hourly": ("transaction_hour", "SMALLINT", "{hour}", None),
+    "day_of_week": ("day_of_week", "SMALLINT", "{dow}", None),
+    "location": ("location", "VARCHAR(64)", "COALESCE(location, '(unknown)')", None),
+    "fraud_reason": ("fraud_reason", "VARCHAR(256)", "COALESCE(fraud_reason, 'no_fraud')", "is_fraud = 1"),
+}
+MINMAX_ROLLUPS = ("daily",)
+
+_DATE_PARTS = {
+    "postgresql": {
+        "day": "CAST(event_time AS DATE)",
+        "hour": "CAST(EXTRACT(HOUR FROM event_time) AS SMALLINT)",
+        "dow": "CAST(EXTRACT(DOW FROM event_time) AS SMALLINT)",
+    },
+    "sqlite": {
+        "day": "DATE(event_time)",
+        "hour": "CAST(strftime('%H', event_time) AS INTEGER)",
+        "dow": "CAST(strftime('%w', event_time) AS INTEGER)",
+    },
+}
+
+
+def rollup_table(table: str, name: str) -> str:
+    """Name of rollup ``name`` for fact table ``table`` (e.g. fact_transactions_rollup_daily)"""
+    return f"{table}_rollup_{name}"
+
+
+def _key_expr(conn, name: str) -> str:
+    parts = _DATE_PARTS.get(conn.dialect.name, _DATE_PARTS["postgresql"])
+    return ROLLUPS[name][2].format(**parts)
+
+
+def day_expr(conn) -> str:
+    """SQL expression of a fact row's transaction_date (the daily rollup key)"""
+    return _key_expr(conn, "daily")
+
+
+def _least(conn) -> tuple:
+    if conn.dialect.name == "sqlite":
+        return "MIN", "MAX"
+    return "LEAST", "GREATEST"
+
+
+def _create_rollup(conn, table: str, name: str):
+    key, key_type, _, _ = ROLLUPS[name]
+    minmax = ("min_amount NUMERIC(18,2), max_amount NUMERIC(18,2),"
+              if name in MINMAX_ROLLUPS else "")
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {rollup_table(table, name)} (
+          {key}               {key_type} PRIMARY KEY,
+          total_transactions  BIGINT NOT NULL,
+          fraud_count         BIGINT NOT NULL,
+          total_amount        NUMERIC(20,2) NOT NULL,
+          {minmax}
+          updated_at          TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+
+
+def ensure_rollups(conn, table: str) -> bool:
+    """
+    Create missing rollup tables; when any was missing they are rebuilt
+    from the fact table so an existing warehouse starts consistent
+
+    Returns:
+        True when the rollups were (re)built
+    """
+    existing = set(inspect(conn).get_table_names())
+    missing = [n for n in ROLLUPS if rollup_table(table, n) not in existing]
+    for name in ROLLUPS:
+        _create_rollup(conn, table, name)
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{rollup_table(table, 'user')}_fraud "
+                      f"ON {rollup_table(table, 'user')} (fraud_count)"))
+    if missing:
+        logger.info(f"Building rollups {missing} for {table} from the fact table")
+        rebuild_rollups(conn, table)
+        return True
+    return False
+
+
+def rebuild_rollups(conn, table: str):
+    """Recompute every rollup with a full GROUP BY over the fact table"""
+    for name, (key, _, _, where) in ROLLUPS.items():
+        rt = rollup_table(table, name)
+        expr = _key_expr(conn, name)
+        minmax_cols = ", min_amount, max_amount" if name in MINMAX_ROLLUPS else ""
+        minmax_vals = ", MIN(amount), MAX(amount)" if name in MINMAX_ROLLUPS else ""
+        conn.execute(text(f"DELETE FROM {rt}"))
+        conn.execute(text(f"""
+            INSERT INTO {rt} ({key}, total_transactions, fraud_count, total_amount{minmax_cols})
+            SELECT {expr}, COUNT(*), SUM(is_fraud), SUM(amount){minmax_vals}
+            FROM {table}
+            {f"WHERE {where}" if where else ""}
+            GROUP BY {expr}
+        """))
+
+
+def _delta_table(conn):
+    columns = """
+        sign SMALLINT, event_time TIMESTAMPTZ, user_id BIGINT, merchant VARCHAR(128),
+        location VARCHAR(64), amount NUMERIC(18,2), is_fraud SMALLINT, fraud_reason VARCHAR(256)
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(f"CREATE TEMP TABLE {DELTA_TABLE} ({columns}) ON COMMIT DROP"))
+    else:
+        conn.execute(text(f"CREATE TEMP TABLE IF NOT EXISTS {DELTA_TABLE} ({columns})"))
+        conn.execute(text(f"DELETE FROM {DELTA_TABLE}"))
+
+
+def _copy_image(conn, table: str, keys_sql: str, sign: int) -> int:
+    cols = ", ".join(DELTA_COLUMNS)
+    result = conn.execute(text(f"""
+        INSERT INTO {DELTA_TABLE} (sign, {cols})
+        SELECT {sign}, {cols} FROM {table}
+        WHERE transaction_id IN ({keys_sql})
+    """))
+    return result.rowcount
+
+
+def capture_before(conn, table: str, keys_sql: str) -> int:
+    """
+    Record the current version of the batch's rows before the upsert
+
+    Args:
+        keys_sql: SELECT returning the batch's transaction_ids (staging table)
+
+    Returns:
+        Number of existing rows (rows that the upsert will update)
+    """
+    _delta_table(conn)
+    return _copy_image(conn, table, keys_sql, -1)
+
+
+def lock_rollups(conn, table: str) -> float:
+    """
+    Take the transaction-level lock that serializes rollup updates
+    (PostgreSQL advisory lock) and return how long that waited
+
+    Parallel load workers queue here until the previous holder commits.
+    Taking it again in the same transaction returns at once.
+    """
+    if conn.dialect.name != "postgresql":
+        return 0.0
+    start = time.perf_counter()
+    # Serialisasi update rollup antar worker paralel (cegah deadlock antar grup)
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": f"rollup:{table}"})
+    return time.perf_counter() - start
+
+
+def apply_delta(conn, table: str, keys_sql: str) -> int:
+    """
+    Add the batch's after image and fold the delta into every rollup
+
+    Must run in the same transaction as ``capture_before`` and the upsert.
+
+    Returns:
+        Number of rows in the after image
+    """
+    after = _copy_image(conn, table, keys_sql, 1)
+    lock_rollups(conn, table)
+
+    lo, hi = _least(conn)
+    for name, (key, _, _, where) in ROLLUPS.items():
+        rt = rollup_table(table, name)
+        expr = _key_expr(conn, name)
+        cols = f"{key}, total_transactions, fraud_count, total_amount"
+        vals = f"{expr}, SUM(sign), SUM(sign * is_fraud), SUM(sign * amount)"
+        sets = [f"{c} = {rt}.{c} + EXCLUDED.{c}" for c in ("total_transactions", "fraud_count", "total_amount")]
+        if name in MINMAX_ROLLUPS:
+            cols += ", min_amount, max_amount"
+            vals += ", MIN(CASE WHEN sign = 1 THEN amount END), MAX(CASE WHEN sign = 1 THEN amount END)"
+            sets += [f"min_amount = COALESCE({lo}({rt}.min_amount, EXCLUDED.min_amount), "
+                     f"{rt}.min_amount, EXCLUDED.min_amount)",
+                     f"max_amount = COALESCE({hi}({rt}.max_amount, EXCLUDED.max_amount), "
+                     f"{rt}.max_amount, EXCLUDED.max_amount)"]
+        sets.append("updated_at = CURRENT_TIMESTAMP")
+        # "WHERE 1 = 1" wajib di SQLite untuk INSERT ... SELECT ... ON CONFLICT
+        conn.execute(text(f"""
+            INSERT INTO {rt} ({cols})
+            SELECT {vals} FROM {DELTA_TABLE}
+            WHERE {where or "1 = 1"}
+            GROUP BY {expr}
+            ORDER BY {expr}
+            ON CONFLICT ({key}) DO UPDATE SET {", ".join(sets)}
+        """))
+        conn.execute(text(f"DELETE FROM {rt} WHERE total_transactions = 0"))
+
+    _refresh_minmax(conn, table)
+    return after
+
+
+def _refresh_minmax(conn, table: str):
+    """Re-read MIN/MAX for days that lost their current minimum or maximum"""
+    rt = rollup_table(table, "daily")
+    day = _key_expr(conn, "daily")
+    days = conn.execute(text(f"""
+        SELECT r.transaction_date
+        FROM {rt} r
+        JOIN (SELECT {day} AS d, MIN(amount) AS lo, MAX(amount) AS hi
+              FROM {DELTA_TABLE} WHERE sign = -1 GROUP BY {day}) x
+          ON r.transaction_date = x.d
+        WHERE x.lo <= r.min_amount OR x.hi >= r.max_amount
+    """)).scalars().all()
+    for value in days:
+        d = pd.Timestamp(value).date()
+        # Range scan (bukan DATE(event_time) = ...) supaya index event_time terpakai
+        lo, hi = conn.execute(text(f"""
+            SELECT MIN(amount), MAX(amount) FROM {table}
+            WHERE event_time >= :start AND event_time < :end
+        """), {"start": d.isoformat(), "end": (d + timedelta(days=1)).isoformat()}).one()
+        conn.execute(text(f"UPDATE {rt} SET min_amount = :lo, max_amount = :hi WHERE transaction_date = :d"),
+                     {"lo": lo, "hi": hi, "d": d.isoformat()})
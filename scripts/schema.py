@@ -0,0 +1,194 @@
+"""
+Shared schema of in-memory transaction frames
+
+Every stage that holds transactions in memory (transform, data quality,
+load, online scoring) applies the same compact dtypes with
+``apply_schema``:
+
+- currency, merchant, transaction_type, status, location and source are
+  ``category``: one small integer code per row plus one copy of every
+  distinct value
+- transaction_id and account_number are Arrow-backed strings
+- user_id is nullable Int32 (Int64 when an id does not fit), is_fraud int8
+- amount is fixed-point int64 minor units (``AMOUNT_SCALE`` per currency
+  unit, the two decimals of NUMERIC(18,2)) in an Arrow int64 column. Only
+  amount uses that dtype, so ``to_float`` can tell a scaled column from a
+  plain numeric one.
+- event_time is tz-aware ``datetime64[us, EVENT_TIMEZONE]``: naive input is
+  read as wall time in EVENT_TIMEZONE, aware input is converted. A wall time
+  that occurs twice (the hour repeated when DST ends) is read as the first
+  occurrence, a skipped one is shifted forward.
+
+Stage files keep the storage form (``to_storage``): amount as float major
+units and categories written as plain strings, so every chunk has the same
+columnar schema whatever categories it happened to contain.
+
+``row_hash`` is a 64-bit hash of a row's content columns taken in this
+canonical form, so a row read back from the warehouse hashes the same as
+the row that was loaded.
+"""
+
+import os
+import logging
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+# Zona waktu event_time; input tanpa zona dianggap wall time di zona ini
+EVENT_TIMEZONE = os.getenv("EVENT_TIMEZONE", "UTC")
+AMOUNT_SCALE = 100  # minor unit per unit mata uang (2 desimal)
+
+AMOUNT_DTYPE = pd.ArrowDtype(pa.int64())
+EVENT_TIME_DTYPE = pd.DatetimeTZDtype("us", EVENT_TIMEZONE)
+STRING_DTYPE = pd.StringDtype("pyarrow")
+
+CATEGORY_COLUMNS = ["currency", "merchant", "transaction_type", "status", "location", "source"]
+STRING_COLUMNS = ["transaction_id", "account_number"]
+# Kolom isi baris (semua kolom load kecuali key) yang masuk row_hash
+CONTENT_COLUMNS = ["user_id", "account_number", "amount", "currency", "merchant", "transaction_type",
+                   "status", "location", "event_time", "source", "is_fraud", "fraud_reason"]
+
+INT32_MIN, INT32_MAX = np.iinfo(np.int32).min, np.iinfo(np.int32).max
+MB = 1024 * 1024
+
+
+def to_event_time(values, format: str = None) -> pd.Series:
+    """
+    Parse ``values`` into EVENT_TIME_DTYPE (unparseable -> NaT)
+
+    Args:
+        format: Passed to ``pd.to_datetime`` (e.g. "mixed" for per-request input)
+    """
+    if values is None:
+        return None
+    times = values
+    if not pd.api.types.is_datetime64_any_dtype(times):
+        try:
+            times = pd.to_datetime(values, errors="coerce", format=format)
+        except ValueError:
+            # Offset zona campuran: samakan ke UTC dulu
+            times = pd.to_datetime(values, errors="coerce", format=format, utc=True)
+    times = pd.Series(times) if not isinstance(times, pd.Series) else times
+    if times.dt.tz is None:
+        localized = times.dt.tz_localize(EVENT_TIMEZONE, ambiguous="NaT", nonexistent="shift_forward")
+        ambiguous = localized.isna() & times.notna()
+        if ambiguous.any():
+            # Jam yang terulang saat DST berakhir: pakai kemunculan pertama, jangan jadi NaT
+            logger.warning(f"{int(ambiguous.sum())} event times are ambiguous in {EVENT_TIMEZONE} "
+                           f"(DST fall-back); read as the first occurrence")
+            localized = times.dt.tz_localize(EVENT_TIMEZONE, ambiguous=True, nonexistent="shift_forward")
+        times = localized
+    return times.dt.tz_convert(EVENT_TIMEZONE).astype(EVENT_TIME_DTYPE)
+
+
+def to_minor_units(values) -> pd.Series:
+    """Amounts as int64 minor units in AMOUNT_DTYPE (rounded half to even; NULL stays NULL)"""
+    if isinstance(values, pd.Series) and values.dtype == AMOUNT_DTYPE:
+        return values
+    amount = pd.to_numeric(values, errors="coerce").astype(float)
+    return (amount * AMOUNT_SCALE).round().astype(AMOUNT_DTYPE)
+
+
+def to_float(values: pd.Series) -> np.ndarray:
+    """Numeric values as float64 (NULL / non-numeric -> NaN); minor-unit amounts in major units"""
+    if values.dtype == AMOUNT_DTYPE:
+        return values.to_numpy(dtype=float, na_value=np.nan) / AMOUNT_SCALE
+    return pd.to_numeric(values, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+
+def _user_ids(values: pd.Series) -> pd.Series:
+    if values.dtype == "Int32":
+        return values
+    ids = pd.to_numeric(values, errors="coerce")
+    fits = ids.dropna().between(INT32_MIN, INT32_MAX).all()
+    return ids.astype("Int32" if fits else "Int64")
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cast the schema columns present in ``df`` to their compact dtypes
+
+    Columns that already have their compact dtype are left alone, so applying
+    the schema again (e.g. after a concat widened some columns) only converts
+    what changed. ``df`` itself is not modified.
+    """
+    df = df.copy(deep=False)
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    for col in STRING_COLUMNS:
+        if col in df.columns and df[col].dtype != STRING_DTYPE:
+            df[col] = df[col].astype(STRING_DTYPE)
+    if "user_id" in df.columns:
+        df["user_id"] = _user_ids(df["user_id"])
+    if "amount" in df.columns:
+        df["amount"] = to_minor_units(df["amount"])
+    if "event_time" in df.columns and df["event_time"].dtype != EVENT_TIME_DTYPE:
+        df["event_time"] = to_event_time(df["event_time"])
+    if "is_fraud" in df.columns and df["is_fraud"].dtype != np.int8:
+        df["is_fraud"] = df["is_fraud"].astype(np.int8)
+    return df
+
+
+def to_storage(df: pd.DataFrame) -> pd.DataFrame:
+    """Storage form for stage files: amount back to float major units"""
+    if "amount" in df.columns and df["amount"].dtype == AMOUNT_DTYPE:
+        df = df.assign(amount=to_float(df["amount"]))
+    return df
+
+
+def memory_usage(df: pd.DataFrame) -> Dict[str, int]:
+    """Deep memory of every column in bytes"""
+    return df.memory_usage(deep=True, index=False).to_dict()
+
+
+def memory_summary(before: Dict[str, int], after: Dict[str, int]) -> dict:
+    """Total MB before and after compaction"""
+    return {"before_mb": round(sum(before.values()) / MB, 2), "after_mb": round(sum(after.values()) / MB, 2)}
+
+
+def memory_report(before: Dict[str, int], after: Dict[str, int]) -> List[str]:
+    """Log lines: the total, then every column whose size changed (largest saving first)"""
+    total_before, total_after = sum(before.values()), sum(after.values())
+    saved = 1 - total_after / total_before if total_before else 0.0
+    lines = [f"schema memory: {total_before / MB:.1f}MB -> {total_after / MB:.1f}MB ({saved:.0%} smaller)"]
+    changed = [c for c in after if c in before and after[c] != before[c]]
+    for col in sorted(changed, key=lambda c: after[c] - before[c]):
+        lines.append(f"  {col}: {before[col] / MB:.2f}MB -> {after[col] / MB:.2f}MB")
+    return lines
+
+
+def id_hash(values: pd.Series) -> np.ndarray:
+    """Stable 64-bit hash of every transaction_id (uint64, same in every process and run)"""
+    # categorize=False: id hampir semuanya unik, factorize dulu hanya menambah biaya
+    return pd.util.hash_array(values.astype(object).fillna("").to_numpy(dtype=object), categorize=False)
+
+
+def _column_hash(values: pd.Series) -> np.ndarray:
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        return pd.util.hash_array(values.to_numpy(dtype="datetime64[us]").view(np.int64))
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        return pd.util.hash_array(values.to_numpy(dtype=np.int64, na_value=np.iinfo(np.int64).min))
+    # Teks: NULL dibedakan dari string kosong
+    text = values.astype(object).to_numpy(dtype=object)
+    text = np.where(pd.isna(text), "\x1e", text).astype(object)
+    return pd.util.hash_array(text, categorize=values.name not in STRING_COLUMNS)
+
+
+def row_hash(df: pd.DataFrame) -> np.ndarray:
+    """
+    64-bit content hash of every row (int64, fits BIGINT / SQLite INTEGER)
+
+    Taken over CONTENT_COLUMNS after ``apply_schema``: amount in minor units
+    and event_time as a UTC instant, so the hash does not depend on how the
+    row was stored (float or NUMERIC amount, naive or aware timestamps).
+    """
+    df = apply_schema(df[CONTENT_COLUMNS])
+    hashes = np.zeros(len(df), dtype=np.uint64)
+    for col in CONTENT_COLUMNS:
+        hashes = (hashes * np.uint64(0x100000001B3)) ^ _column_hash(df[col])
+    return hashes.view(np.int64)
@@ -0,0 +1,323 @@
+"""
+Online fraud scoring service
+
+Scores single transactions (normalized schema, as written by transform.py)
+with the same rules as the batch transform (config/fraud_rules.yaml):
+
+    POST /score   {"transaction_id": "...", "user_id": 1, "amount": 60000000,
+                   "merchant": "Binance", "event_time": "2024-01-01T10:00:00", ...}
+    ->            {"transaction_id": "...", "is_fraud": 1,
+                   "fraud_reason": "high_amount,crypto_merchant"}
+    GET  /health  service and per-rule stats
+
+Concurrent requests are micro-batched: the first queued request waits at
+most ``SCORING_MAX_WAIT_MS`` for others (up to ``SCORING_MAX_BATCH``), then
+the whole batch is evaluated with the vectorized rule engine. Window rules
+use per-user sliding windows kept in memory, optionally warmed from the
+transform's event state. Events outside the longest window are evicted.
+
+Usage:
+    python scripts/scoring_service.py --port 8080
+"""
+
+import os
+import sys
+import time
+import json
+import asyncio
+import logging
+import argparse
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+# Add scripts directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils import setup_logging
+from rule_engine import FRAUD_RULES_FILE, RuleEngine, load_rules
+from event_state import EVENT_STATE_FILE, EventStateStore
+from schema import apply_schema, to_event_time
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+SCORING_HOST = os.getenv("SCORING_HOST", "0.0.0.0")
+SCORING_PORT = int(os.getenv("SCORING_PORT", "8080"))
+SCORING_MAX_BATCH = int(os.getenv("SCORING_MAX_BATCH", "256"))
+SCORING_MAX_WAIT_MS = float(os.getenv("SCORING_MAX_WAIT_MS", "2"))
+# Sapu user yang window-nya sudah kosong setiap N batch
+SCORING_SWEEP_BATCHES = 1000
+
+REQUIRED_FIELDS = ("transaction_id", "amount", "event_time")
+RECORD_FIELDS = [
+    "transaction_id", "user_id", "account_number", "amount", "currency", "merchant",
+    "transaction_type", "status", "location", "event_time", "source",
+]
+
+
+class UserWindows:
+    """
+    Recent event times per user, for window rules keyed on (user_id, event_time)
+
+    Each user keeps a sorted list of (time_ns, transaction_id) no older than
+    ``retention`` before that user's newest event, plus a transaction_id ->
+    time_ns map so a resent transaction replaces its earlier entry (also
+    when it comes back with a different event_time).
+    """
+
+    def __init__(self, retention: pd.Timedelta):
+        self.retention = pd.Timedelta(retention).value
+        self.events: Dict[int, list] = {}
+        self.ids: Dict[int, Dict[str, int]] = {}
+        self.newest = 0
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self.events
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def count(self, user_id, t: int, window: int, transaction_id: str) -> int:
+        """Events of ``user_id`` in ``[t - window, t)``, ignoring ``transaction_id`` itself"""
+        events = self.events.get(user_id)
+        if not events:
+            return 0
+        lo = bisect_left(events, (t - window,))
+        hi = bisect_left(events, (t,))
+        # Transaksi yang dikirim ulang tidak menghitung dirinya sendiri
+        previous = self.ids.get(user_id, {}).get(transaction_id)
+        return (hi - lo) - int(previous is not None and t - window <= previous < t)
+
+    def add(self, user_id, t: int, transaction_id: str):
+        events = self.events.setdefault(user_id, [])
+        ids = self.ids.setdefault(user_id, {})
+        previous = ids.get(transaction_id)
+        if previous != t:
+            if previous is not None:
+                # Kirim ulang dengan waktu lain: entri lama diganti, bukan ditambah
+                del events[bisect_left(events, (previous, transaction_id))]
+            insort(events, (t, transaction_id))
+            ids[transaction_id] = t
+        cutoff = events[-1][0] - self.retention
+        if events[0][0] < cutoff:
+            expired = bisect_left(events, (cutoff,))
+            for _, old_id in events[:expired]:
+                del ids[old_id]
+            del events[:expired]
+        self.newest = max(self.newest, t)
+
+    def sweep(self) -> int:
+        """Drop users whose newest event is outside every window; returns users dropped"""
+        cutoff = self.newest - self.retention
+        idle = [u for u, events in self.events.items() if not events or events[-1][0] < cutoff]
+        for user_id in idle:
+            del self.events[user_id]
+            self.ids.pop(user_id, None)
+        return len(idle)
+
+
+class ScoringService:
+    """
+    Micro-batching scorer around a RuleEngine
+
+    Args:
+        rules: Compiled fraud rules (window rules must be keyed on user_id/event_time)
+        max_batch: Most requests evaluated together
+        max_wait_ms: How long the first request of a batch waits for company
+        state: Event state used to warm a user's window on first sight
+    """
+
+    def __init__(self, rules: RuleEngine, max_batch: int = SCORING_MAX_BATCH,
+                 max_wait_ms: float = SCORING_MAX_WAIT_MS, state: Optional[EventStateStore] = None):
+        unsupported = [r.name for r in rules.window_rules if (r.key, r.time) != ("user_id", "event_time")]
+        if unsupported:
+            raise ValueError(f"Scoring only supports window rules on (user_id, event_time): {unsupported}")
+        self.rules = rules
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+        self.state = state
+        self.windows = UserWindows(rules.max_window)
+        self.stats = {"requests": 0, "batches": 0, "max_batch": 0}
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._batcher())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def score(self, record: dict) -> dict:
+        """Queue one transaction and wait for its result"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((record, future))
+        return await future
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                results = self.score_batch([record for record, _ in batch])
+            except Exception as e:
+                logger.exception("Scoring batch failed")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def score_batch(self, records: List[dict]) -> List[dict]:
+        """Score records in arrival order and add them to the user windows"""
+        df = pd.DataFrame.from_records(records).reindex(columns=RECORD_FIELDS)
+        df["amount"] = pd.to_numeric(df["amount"], errors="coerce").abs()
+        df["event_time"] = to_event_time(df["event_time"], format="mixed")
+        df = apply_schema(df)  # schema yang sama dengan transform
+        user_ids = pd.to_numeric(df["user_id"], errors="coerce").to_numpy(dtype=float)
+        times = df["event_time"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+        tx_ids = df["transaction_id"].astype(str).to_numpy()
+
+        if self.state is not None:
+            self._warm([int(u) for u in set(user_ids[~np.isnan(user_ids)]) if int(u) not in self.windows])
+
+        # Window dihitung berurutan: request lebih awal di batch ikut terhitung
+        window_rules = self.rules.window_rules
+        counts = {rule.name: np.zeros(len(df), dtype=np.int64) for rule in window_rules}
+        for i, (user_id, t, tx_id) in enumerate(zip(user_ids, times, tx_ids)):
+            if np.isnan(user_id):
+                continue
+            user_id = int(user_id)
+            for rule in window_rules:
+                counts[rule.name][i] = self.windows.count(user_id, t, rule.window.value, tx_id)
+            self.windows.add(user_id, t, tx_id)
+
+        flags = self.rules.evaluate(df, counts)
+        reasons = self.rules.reasons(flags)
+
+        self.stats["requests"] += len(records)
+        self.stats["batches"] += 1
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(records))
+        if self.stats["batches"] % SCORING_SWEEP_BATCHES == 0:
+            self.windows.sweep()
+        return [{"transaction_id": tx_id, "is_fraud": int(flag != 0), "fraud_reason": reason}
+                for tx_id, flag, reason in zip(tx_ids, flags, reasons)]
+
+    def _warm(self, user_ids: List[int]):
+        """Load the stored events of users seen for the first time (one batched lookup)"""
+        if not user_ids:
+            return
+        history = self.state.lookup(user_ids)
+        times = history["event_time"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+        for user_id, t, tx_id in zip(history["user_id"], times, history["transaction_id"]):
+            self.windows.add(int(user_id), int(t), str(tx_id))
+        for user_id in user_ids:
+            self.windows.events.setdefault(user_id, [])
+
+
+def validate_record(record) -> Optional[str]:
+    """Error message for an unusable request body, None when it can be scored"""
+    if not isinstance(record, dict):
+        return "body must be a JSON object"
+    missing = [f for f in REQUIRED_FIELDS if record.get(f) in (None, "")]
+    if missing:
+        return f"missing fields: {missing}"
+    try:
+        float(record["amount"])
+    except (TypeError, ValueError):
+        return "amount must be numeric"
+    try:
+        if pd.isna(pd.to_datetime(record["event_time"], errors="coerce")):
+            return "event_time is not a valid timestamp"
+    except (TypeError, ValueError):
+        return "event_time is not a valid timestamp"
+    return None
+
+
+def make_app(service: ScoringService):
+    """aiohttp application exposing /score and /health"""
+    from aiohttp import web
+
+    async def score(request):
+        try:
+            record = await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return web.json_response({"error": "invalid JSON"}, status=400)
+        error = validate_record(record)
+        if error:
+            return web.json_response({"error": error}, status=400)
+        return web.json_response(await service.score(record))
+
+    async def health(request):
+        return web.json_response({
+            "status": "ok",
+            "users": len(service.windows),
+            **service.stats,
+            "rules": service.rules.stats,
+        })
+
+    async def on_startup(app):
+        await service.start()
+
+    async def on_cleanup(app):
+        await service.stop()
+
+    app = web.Application()
+    app.router.add_post("/score", score)
+    app.router.add_get("/health", health)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Online fraud scoring service")
+    parser.add_argument("--host", default=SCORING_HOST)
+    parser.add_argument("--port", type=int, default=SCORING_PORT)
+    parser.add_argument("--max-batch", type=int, default=SCORING_MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=SCORING_MAX_WAIT_MS)
+    parser.add_argument("--rules", default=FRAUD_RULES_FILE, help="Fraud rules file")
+    parser.add_argument("--warm-state", action="store_true",
+                        help=f"Warm user windows from the transform's event state ({EVENT_STATE_FILE})")
+    args = parser.parse_args(argv)
+
+    from aiohttp import web
+    setup_logging()
+    rules = load_rules(args.rules)
+    state = EventStateStore(EVENT_STATE_FILE, rules.max_window) if args.warm_state else None
+    service = ScoringService(rules, args.max_batch, args.max_wait_ms, state)
+    logger.info(f"Scoring service on {args.host}:{args.port} "
+                f"(max_batch={args.max_batch}, max_wait={args.max_wait_ms}ms, rules={rules.names})")
+    start = time.perf_counter()
+    try:
+        web.run_app(make_app(service), host=args.host, port=args.port, print=None)
+    finally:
+        if state is not None:
+            state.close()
+        logger.info(f"Scored {service.stats['requests']} requests in {service.stats['batches']} batches "
+                    f"({time.perf_counter() - start:.0f}s up)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Content-addressed cache of stage outputs for resumable reruns
+
+Every stage run by ``pipeline.py`` gets a fingerprint: a SHA-256 over the
+stage name, the code version (all of ``scripts/*.py``), the run options and
+the identity of its inputs (content digests of source files and of the
+upstream outputs). When a later run computes the same fingerprint the
+stage is skipped and its cached output is used instead, so a retry after a
+failed load starts at the load, and a stage whose inputs did not change is
+not run again. Because downstream fingerprints use the *content* of the
+upstream outputs, a re-extract that returns the same data still hits the
+cache for the transform.
+
+Layout under ``STAGE_CACHE_DIR``::
+
+    objects/ab/abcdef....parquet  output files, named by the SHA-256 of their bytes
+    entries/<fingerprint>.json   stage result + the objects it produced
+
+Identical outputs of different runs share one object. Entries are written
+only after a stage succeeded. ``evict()`` keeps the cache size under
+``STAGE_CACHE_MAX_MB`` by dropping the least recently used entries (an
+entry's mtime is refreshed on every hit) and deleting objects no entry
+refers to.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import hashlib
+import logging
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+# Add scripts directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from intermediate import read_frame, write_frame
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "./data")
+STAGE_CACHE_DIR = os.getenv("STAGE_CACHE_DIR", os.path.join(DATA_DIR, "cache"))
+# Batas total ukuran cache; entry paling lama tidak dipakai dibuang duluan
+STAGE_CACHE_MAX_MB = float(os.getenv("STAGE_CACHE_MAX_MB", "2048"))
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+READ_BYTES = 1 << 20
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's bytes"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def code_version(directory: str = SCRIPTS_DIR) -> str:
+    """
+    Digest of every ``*.py`` under ``directory``: any code change
+    invalidates every stage (stages import each other's helpers)
+    """
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(directory, "*.py"))):
+        digest.update(os.path.basename(path).encode())
+        digest.update(file_digest(path).encode())
+    return digest.hexdigest()
+
+
+def fingerprint(stage: str, parts: dict) -> str:
+    """SHA-256 over a stage name and JSON-serialisable fingerprint parts"""
+    payload = json.dumps({"stage": stage, **parts}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class StageCache:
+    """
+    Stage outputs keyed by fingerprint, stored as content-addressed objects
+
+    Args:
+        root: Cache directory (created on first use)
+        max_mb: Cache size kept by ``evict()``
+    """
+
+    def __init__(self, root: str = STAGE_CACHE_DIR, max_mb: float = STAGE_CACHE_MAX_MB):
+        self.root = root
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.objects_dir = os.path.join(root, "objects")
+        self.entries_dir = os.path.join(root, "entries")
+        self.tmp_dir = os.path.join(root, "tmp")
+        for directory in (self.objects_dir, self.entries_dir, self.tmp_dir):
+            os.makedirs(directory, exist_ok=True)
+
+    def object_path(self, output: dict) -> str:
+        """Object file of an output description (digest + the stage file's extension, for the readers)"""
+        return os.path.join(self.objects_dir, output["digest"][:2], output["digest"] + output["suffix"])
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.entries_dir, key + ".json")
+
+    def get(self, key: str) -> Optional[dict]:
+        """Entry stored under ``key`` (None on a miss or when an object is gone)"""
+        path = self._entry_path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if not all(os.path.exists(self.object_path(o)) for o in entry["outputs"].values()):
+            logger.warning(f"Stage cache entry {key[:12]} lost an object; dropping it")
+            os.remove(path)
+            return None
+        os.utime(path)
+        return entry
+
+    def _add_object(self, tmp: str, suffix: str) -> dict:
+        output = {"digest": file_digest(tmp), "suffix": suffix}
+        path = self.object_path(output)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(tmp)
+        else:
+            os.replace(tmp, path)
+        return {**output, "bytes": os.path.getsize(path)}
+
+    def _tmp_path(self, suffix: str) -> str:
+        return os.path.join(self.tmp_dir, f"{os.getpid()}-{time.monotonic_ns()}{suffix}")
+
+    def put_file(self, path: str) -> dict:
+        """Copy a stage file into the cache; returns its object description"""
+        suffix = os.path.splitext(path)[1]
+        tmp = self._tmp_path(suffix)
+        shutil.copyfile(path, tmp)
+        return self._add_object(tmp, suffix)
+
+    def put_frame(self, df: pd.DataFrame) -> dict:
+        """Store a frame as a Parquet object; returns its object description"""
+        tmp = self._tmp_path(".parquet")
+        write_frame(df, tmp)
+        return self._add_object(tmp, ".parquet")
+
+    def put(self, key: str, stage: str, result: dict, outputs: Dict[str, dict]) -> dict:
+        """Record a successful stage run: its result and the objects it produced"""
+        entry = {"stage": stage, "created": time.time(), "result": result, "outputs": outputs}
+        tmp = self._tmp_path(".json")
+        with open(tmp, "w") as f:
+            json.dump(entry, f, default=str)
+        os.replace(tmp, self._entry_path(key))
+        return entry
+
+    def load_frame(self, output: dict) -> pd.DataFrame:
+        return read_frame(self.object_path(output))
+
+    def restore(self, output: dict, path: str):
+        """Put a cached object back at ``path`` (hard link when possible)"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        try:
+            os.link(self.object_path(output), tmp)
+        except OSError:
+            shutil.copyfile(self.object_path(output), tmp)
+        # Writer stage selalu ganti file lewat rename, jadi object yang di-link tidak ikut berubah
+        os.replace(tmp, path)
+
+    def _entries(self) -> List[tuple]:
+        """(stat, path, entry) of every entry, most recently used first"""
+        entries = []
+        for path in glob.glob(os.path.join(self.entries_dir, "*.json")):
+            try:
+                with open(path) as f:
+                    entries.append((os.stat(path), path, json.load(f)))
+            except (FileNotFoundError, ValueError):
+                continue
+        return sorted(entries, key=lambda e: e[0].st_mtime, reverse=True)
+
+    def evict(self, max_bytes: int = None) -> dict:
+        """
+        Drop least recently used entries until they and the objects they keep
+        fit in ``max_bytes``, then delete unreferenced objects and stale temp
+        files
+
+        Returns:
+            Dict with entries and objects removed, bytes freed and bytes kept
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        kept, kept_bytes, dropped = set(), 0, 0
+        for st, path, entry in self._entries():
+            objects = {os.path.basename(self.object_path(o)): o["bytes"] for o in entry["outputs"].values()}
+            # Entry tanpa object (load) tetap dihitung ukurannya supaya ikut tergusur
+            extra = st.st_size + sum(size for name, size in objects.items() if name not in kept)
+            if kept_bytes + extra > max_bytes:
+                os.remove(path)
+                dropped += 1
+                continue
+            kept.update(objects)
+            kept_bytes += extra
+
+        removed, freed = 0, 0
+        for path in glob.glob(os.path.join(self.objects_dir, "*", "*")):
+            if os.path.basename(path) not in kept:
+                freed += os.path.getsize(path)
+                os.remove(path)
+                removed += 1
+        # Sisa tulisan yang terputus (proses mati di tengah put)
+        for path in glob.glob(os.path.join(self.tmp_dir, "*")):
+            if time.time() - os.path.getmtime(path) > 3600:
+                os.remove(path)
+        stats = {"entries": dropped, "objects": removed, "bytes_freed": freed, "bytes_kept": kept_bytes}
+        if dropped or removed:
+            logger.info(f"Stage cache evicted {dropped} entries / {removed} objects "
+                        f"({freed / 1e6:.1f} MB), {kept_bytes / 1e6:.1f} MB kept")
+        return stats
+
+    def clear(self) -> dict:
+        """Remove every entry and object"""
+        return self.evict(max_bytes=0)
@@ -1,5 +1,11 @@
-import os, json
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+import numpy as np
 from dotenv import load_dotenv
 import logging
 import sys
@@ -7,8 +13,14 @@ import sys
 # Add scripts directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from utils import setup_logging
-from data_quality import check_data_quality, validate_transaction_data
+from utils import setup_logging, RunMetrics
+from data_quality import QualityProfile
+from external_sort import ExternalSorter
+from rule_engine import FRAUD_RULES_FILE, load_rules
+from event_state import EVENT_STATE_FILE, EventStateStore
+from intermediate import stage_file, read_frame, iter_frames, write_frame, FrameWriter
+from schema import EVENT_TIME_DTYPE, apply_schema, to_event_time, to_storage, memory_usage, memory_summary, \
+    memory_report
 
 # Setup logging
 logger = setup_logging()
@@ -17,131 +29,670 @@ load_dotenv()
 DATA_DIR = os.getenv("DATA_DIR", "./data")
 RAW_DIR = os.path.join(DATA_DIR, "raw")
 PROC_DIR = os.path.join(DATA_DIR, "processed")
-os.makedirs(PROC_DIR, exist_ok=True)
-
-logger.info("Starting Transform process...")
-
-# Read API
-try:
-    logger.info("Reading API data...")
-    with open(os.path.join(RAW_DIR, "api_extracted.json"), "r") as f:
-        api = pd.DataFrame(json.load(f))
-    logger.info(f"API data loaded: {len(api)} rows")
-except FileNotFoundError:
-    logger.error(f"API file not found: {os.path.join(RAW_DIR, 'api_extracted.json')}")
-    raise
-except Exception as e:
-    logger.error(f"Error reading API data: {e}")
-    raise
-
-# Read DB
-try:
-    logger.info("Reading DB data...")
-    db = pd.read_csv(os.path.join(RAW_DIR, "db_extracted.csv"))
-    logger.info(f"DB data loaded: {len(db)} rows")
-except FileNotFoundError:
-    logger.error(f"DB file not found: {os.path.join(RAW_DIR, 'db_extracted.csv')}")
-    raise
-except Exception as e:
-    logger.error(f"Error reading DB data: {e}")
-    raise
-
-# Normalize schema API
-api_df = pd.DataFrame({
-    "transaction_id": api.get("transaction_id"),
-    "user_id": api.get("user_id"),
-    "account_number": None,
-    "amount": api.get("amount"),
-    "currency": api.get("currency", "IDR"),
-    "merchant": api.get("merchant"),
-    "transaction_type": None,
-    "status": api.get("status"),
-    "location": api.get("location"),
-    "event_time": pd.to_datetime(api.get("timestamp"), errors="coerce"),
-    "source": "API"
-})
-
-# Normalize schema DB
-db_df = pd.DataFrame({
-    "transaction_id": db["id"].astype(str),
-    "user_id": db["user_id"],
-    "account_number": db["account_number"].astype(str),
-    "amount": db["amount"],
-    "currency": "IDR",
-    "merchant": None,
-    "transaction_type": db["transaction_type"],
-    "status": None,
-    "location": db["location"],
-    "event_time": pd.to_datetime(db["date"], errors="coerce"),
-    "source": "DB"
-})
-
-# Union (schema aligned)
-all_df = pd.concat([api_df, db_df], ignore_index=True)
-
-# Basic cleaning
-all_df = all_df.dropna(subset=["event_time", "amount"])  # buang yang fatal
-all_df["amount"] = all_df["amount"].astype(float).abs()
-all_df = all_df.drop_duplicates(subset=["transaction_id"], keep="last")
-
-# ---- Fraud rules (baseline) ----
-all_df["is_fraud"] = 0
-all_df["fraud_reason"] = None
-
-# 1) Amount di atas 50 juta IDR
-mask_high = all_df["amount"] > 50_000_000
-all_df.loc[mask_high, ["is_fraud", "fraud_reason"]] = [1, "high_amount"]
-
-# 2) Merchant crypto (API)
-mask_crypto = all_df["merchant"].fillna("").str.contains(r"binance|crypto|kraken|okx", case=False, regex=True)
-all_df.loc[mask_crypto, ["is_fraud", "fraud_reason"]] = [1, "crypto_merchant"]
-
-# 3) Burst activity: >=5 transaksi per user per 10 menit
-# Sort by user_id and event_time untuk memastikan monotonic per group
-all_df_sorted = all_df.sort_values(["user_id", "event_time"]).copy()
-
-# Set index event_time untuk rolling window (harus sorted per group)
-all_df_indexed = all_df_sorted.set_index("event_time").copy()
-
-# Hitung rolling count per user (10 menit window)
-# Pastikan index sudah sorted per group sebelum rolling
-burst = (all_df_indexed
-         .groupby("user_id")["transaction_id"]
-         .rolling("10min", closed="left")
-         .count()
-         .reset_index(name="tx_in_10m"))
-
-# Merge kembali ke dataframe asli berdasarkan user_id dan event_time
-all_df = all_df.merge(burst[["user_id", "event_time", "tx_in_10m"]], on=["user_id", "event_time"], how="left")
-all_df["tx_in_10m"] = all_df["tx_in_10m"].fillna(0).astype(int)
-
-# Flag burst activity (hanya jika belum di-flag sebagai fraud)
-mask_burst = all_df["tx_in_10m"] >= 5
-all_df.loc[mask_burst & (all_df["is_fraud"] == 0), ["is_fraud", "fraud_reason"]] = [1, "burst_activity"]
-
-# Drop kolom helper sebelum output
-all_df = all_df.drop(columns=["tx_in_10m"], errors="ignore")
-
-# Data quality check
-try:
-    logger.info("Performing data quality checks...")
-    quality_results = check_data_quality(all_df)
-    logger.info(f"Data quality check completed: {quality_results['checks']}")
-    
-    # Validate transaction data
-    validate_transaction_data(all_df)
-    logger.info("Transaction data validation passed")
-except Exception as e:
-    logger.error(f"Data quality check failed: {e}")
-    raise
-
-# Output
-try:
-    OUT_FILE = os.path.join(PROC_DIR, "cleaned_transactions.csv")
-    all_df.to_csv(OUT_FILE, index=False)
-    logger.info(f"✅ Transform → {OUT_FILE} (rows={len(all_df)})")
-    print("✅ Transform →", OUT_FILE, "rows=", len(all_df))
-except Exception as e:
-    logger.error(f"Error saving output file: {e}")
-    raise
 
+# Format file antar stage mengikuti INTERMEDIATE_FORMAT (default parquet)
+API_FILE = stage_file(RAW_DIR, "api_extracted", legacy_ext=".json")
+DB_FILE = stage_file(RAW_DIR, "db_extracted")
+OUT_FILE = stage_file(PROC_DIR, "cleaned_transactions")
+
+# Mode: "memory" (default), "chunked" (external sort, memory-bounded) atau "parallel" (process pool)
+TRANSFORM_MODE = os.getenv("TRANSFORM_MODE", "memory")
+TRANSFORM_MEMORY_MB = int(os.getenv("TRANSFORM_MEMORY_MB", "512"))
+TRANSFORM_SPILL_DIR = os.getenv("TRANSFORM_SPILL_DIR") or None
+# Mode parallel: jumlah proses dan bucket user (bucket tetap -> urutan output tidak tergantung worker)
+TRANSFORM_WORKERS = int(os.getenv("TRANSFORM_WORKERS", "0")) or os.cpu_count() or 1
+TRANSFORM_BUCKETS = int(os.getenv("TRANSFORM_BUCKETS", "64"))
+# Event user dari run sebelumnya ikut dihitung di window rule (burst lintas batas run)
+TRANSFORM_EVENT_STATE = os.getenv("TRANSFORM_EVENT_STATE", "1") == "1"
+
+# Rule fraud dideklarasikan di config/fraud_rules.yaml, dikompilasi sekali saat import
+FRAUD_RULES = load_rules(FRAUD_RULES_FILE)
+
+OUTPUT_COLUMNS = [
+    "transaction_id", "user_id", "account_number", "amount", "currency", "merchant",
+    "transaction_type", "status", "location", "event_time", "source", "is_fraud", "fraud_reason"
+]
+
+# Tipe tetap untuk output supaya schema kolumnar sama di setiap chunk
+# (bentuk storage: amount float, teks string; frame di memori memakai schema.apply_schema)
+OUTPUT_DTYPES = {
+    "transaction_id": "string",
+    "user_id": "Int64",
+    "account_number": "string",
+    "amount": "float64",
+    "currency": "string",
+    "merchant": "string",
+    "transaction_type": "string",
+    "status": "string",
+    "location": "string",
+    "event_time": EVENT_TIME_DTYPE,
+    "source": "string",
+    "is_fraud": "int64",
+    "fraud_reason": "string",
+}
+
+# Schema file shard di mode parallel (kolom hasil normalisasi + key internal)
+SHARD_DTYPES = {
+    **{c: t for c, t in OUTPUT_DTYPES.items() if c not in ("is_fraud", "fraud_reason")},
+    "_seq": "int64",
+    "_hist": "bool",
+    "_tkey": "string",
+    "_ukey": "float64",
+}
+
+# Perkiraan kasar memori per baris setelah normalisasi (object strings, pandas overhead)
+BYTES_PER_ROW_ESTIMATE = 1024
+SORT_FAN_IN = 16
+
+
+def read_api(path: str = API_FILE) -> pd.DataFrame:
+    """Read extracted API data"""
+    try:
+        logger.info("Reading API data...")
+        api = read_frame(path)
+        logger.info(f"API data loaded: {len(api)} rows")
+        return api
+    except FileNotFoundError:
+        logger.error(f"API file not found: {path}")
+        raise
+    except Exception as e:
+        logger.error(f"Error reading API data: {e}")
+        raise
+
+
+def read_db(path: str = DB_FILE) -> pd.DataFrame:
+    """Read extracted DB data"""
+    try:
+        logger.info("Reading DB data...")
+        db = read_frame(path)
+        logger.info(f"DB data loaded: {len(db)} rows")
+        return db
+    except FileNotFoundError:
+        logger.error(f"DB file not found: {path}")
+        raise
+    except Exception as e:
+        logger.error(f"Error reading DB data: {e}")
+        raise
+
+
+def normalize_api(api: pd.DataFrame) -> pd.DataFrame:
+    """Normalize schema API"""
+    return pd.DataFrame({
+        "transaction_id": api.get("transaction_id"),
+        "user_id": api.get("user_id"),
+        "account_number": None,
+        "amount": api.get("amount"),
+        "currency": api.get("currency", "IDR"),
+        "merchant": api.get("merchant"),
+        "transaction_type": None,
+        "status": api.get("status"),
+        "location": api.get("location"),
+        "event_time": to_event_time(api.get("timestamp")),
+        "source": "API"
+    })
+
+
+def normalize_db(db: pd.DataFrame) -> pd.DataFrame:
+    """Normalize schema DB"""
+    return pd.DataFrame({
+        "transaction_id": db["id"].astype(str),
+        "user_id": db["user_id"],
+        "account_number": db["account_number"].astype(str),
+        "amount": db["amount"],
+        "currency": "IDR",
+        "merchant": None,
+        "transaction_type": db["transaction_type"],
+        "status": None,
+        "location": db["location"],
+        "event_time": to_event_time(db["date"]),
+        "source": "DB"
+    })
+
+
+def clean_transactions(all_df: pd.DataFrame) -> pd.DataFrame:
+    """Basic cleaning (tanpa dedup, supaya bisa dipakai per chunk)"""
+    fatal = all_df["event_time"].isna() | all_df["amount"].isna()
+    if fatal.any():
+        logger.warning(f"Dropping {int(fatal.sum())} rows without a valid event_time or amount")
+    all_df = all_df[~fatal]  # buang yang fatal
+    all_df = all_df.copy()
+    all_df["amount"] = all_df["amount"].astype(float).abs()
+    return all_df
+
+
+def apply_fraud_rules(all_df: pd.DataFrame, rules=None, counts=None) -> pd.DataFrame:
+    """
+    Apply the fraud rules to a fully deduplicated batch
+
+    Args:
+        rules: RuleEngine to use (default: FRAUD_RULES)
+        counts: Precomputed window counts per window rule (see RuleEngine.evaluate)
+    """
+    return (rules or FRAUD_RULES).apply(all_df, counts)
+
+
+def log_rule_stats(rules=None):
+    """Log per-rule hit counts and evaluation time"""
+    for line in (rules or FRAUD_RULES).report():
+        logger.info(line)
+
+
+def history_rows(state: EventStateStore, user_ids) -> pd.DataFrame:
+    """Events of earlier runs for ``user_ids``, marked with ``_hist`` (never written out)"""
+    history = state.lookup(user_ids)
+    history["_hist"] = True
+    return history
+
+
+def transform(api: pd.DataFrame, db: pd.DataFrame, state: EventStateStore = None,
+              metrics: RunMetrics = None) -> pd.DataFrame:
+    """
+    In-memory transform: normalize, union, clean, dedup and flag fraud
+
+    Args:
+        state: Event state of earlier runs; its events count in window rules.
+            Only read here, the caller updates it once the output is written.
+        metrics: Records the normalize/history/dedup/burst/rules steps
+    """
+    metrics = metrics or RunMetrics("transform", enabled=False)
+    with metrics.step("normalize") as step:
+        step.rows_in = len(api) + len(db)
+        # Union (schema aligned)
+        all_df = pd.concat([normalize_api(api), normalize_db(db)], ignore_index=True)
+        all_df = clean_transactions(all_df)
+        before = memory_usage(all_df)
+        all_df = apply_schema(all_df)
+        after = memory_usage(all_df)
+        for line in memory_report(before, after):
+            logger.info(line)
+        metrics.info["memory"] = memory_summary(before, after)
+        step.rows_out = len(all_df)
+    if state is not None:
+        with metrics.step("history") as step:
+            step.rows_in = len(all_df)
+            # Event lama ditaruh paling depan: versi run ini menang saat dedup
+            all_df = pd.concat([history_rows(state, all_df["user_id"].unique()), all_df.assign(_hist=False)],
+                               ignore_index=True)[[*all_df.columns, "_hist"]]
+            all_df = apply_schema(all_df)  # concat melebarkan user_id Int32 -> Int64
+            step.rows_out = len(all_df)
+    with metrics.step("dedup") as step:
+        step.rows_in = len(all_df)
+        all_df = all_df.drop_duplicates(subset=["transaction_id"], keep="last")
+        step.rows_out = len(all_df)
+
+    FRAUD_RULES.reset_stats()
+    with metrics.step("burst") as step:
+        step.rows_in = len(all_df)
+        counts = FRAUD_RULES.window_counts(all_df)
+        hist = all_df.pop("_hist").to_numpy(dtype=bool) if state is not None else None
+        if hist is not None:
+            counts = {name: values[~hist] for name, values in counts.items()}
+            all_df = all_df.loc[~hist].copy()
+        step.rows_out = len(all_df)
+    with metrics.step("rules") as step:
+        step.rows_in = len(all_df)
+        all_df = apply_schema(apply_fraud_rules(all_df, counts=counts))
+        step.rows_out = len(all_df)
+    metrics.info["flagged"] = int(all_df["is_fraud"].sum())
+    log_rule_stats()
+    return all_df
+
+
+def run_quality_checks(all_df: pd.DataFrame = None, profile: QualityProfile = None):
+    """
+    Data quality check from one profiling pass
+
+    Args:
+        profile: Merged profile of the written rows (chunked/parallel mode);
+            profiled from ``all_df`` when missing
+    """
+    try:
+        logger.info("Performing data quality checks...")
+        profile = profile or QualityProfile.of(all_df)
+        quality_results = profile.results()
+        logger.info(f"Data quality check completed: {quality_results['checks']}")
+
+        # Validate transaction data
+        profile.validate()
+        logger.info("Transaction data validation passed")
+    except Exception as e:
+        logger.error(f"Data quality check failed: {e}")
+        raise
+
+
+# ---- Chunked (memory-bounded) mode ----
+
+def _rows_for_budget(memory_budget_mb: float) -> int:
+    """Rows per in-memory chunk for a given memory budget"""
+    # Faktor 4: chunk + hasil sort + concat sementara saat spill/merge
+    return max(1000, int(memory_budget_mb * 1024 * 1024 / (BYTES_PER_ROW_ESTIMATE * 4)))
+
+
+def _iter_normalized_chunks(api_path: str, db_path: str, chunk_rows: int):
+    """Read both sources in chunks and normalize them (API rows first, like the union)"""
+    logger.info(f"Reading API data in chunks of {chunk_rows} rows...")
+    for api in iter_frames(api_path, chunk_rows):
+        yield normalize_api(api)
+
+    logger.info(f"Reading DB data in chunks of {chunk_rows} rows...")
+    for db in iter_frames(db_path, chunk_rows):
+        yield normalize_db(db)
+
+
+def _check_user_window_rules(mode: str):
+    """Chunked/parallel modes see each user's rows together, so window rules must be per user"""
+    unsupported = [r.name for r in FRAUD_RULES.window_rules if (r.key, r.time) != ("user_id", "event_time")]
+    if unsupported:
+        raise ValueError(f"{mode} mode only supports window rules on (user_id, event_time): {unsupported}")
+
+
+def _iter_keyed_chunks(api_path: str, db_path: str, chunk_rows: int, state: EventStateStore = None):
+    """
+    Normalized, cleaned chunks with the sort/shard keys used by chunked and parallel mode
+
+    Adds ``_seq`` (input order, for keep="last"), ``_hist``, ``_tkey``
+    (transaction_id) and ``_ukey`` (numeric user_id, NULL -> inf). With a
+    ``state``, each user's earlier events are added once, in the chunk where
+    the user first appears, with negative ``_seq`` so dedup prefers this
+    run's version.
+    """
+    seq = hist_seq = 0
+    seen_users = set()
+    for chunk in _iter_normalized_chunks(api_path, db_path, chunk_rows):
+        chunk["_seq"] = np.arange(seq, seq + len(chunk), dtype=np.int64)
+        seq += len(chunk)
+        chunk = clean_transactions(chunk)
+        chunk["_hist"] = False
+        if state is not None:
+            new_users = set(chunk["user_id"].dropna().unique()) - seen_users
+            seen_users |= new_users
+            history = history_rows(state, new_users)
+            # seq negatif: selalu lebih tua dari baris run ini
+            history["_seq"] = -np.arange(hist_seq + 1, hist_seq + len(history) + 1, dtype=np.int64)
+            hist_seq += len(history)
+            chunk = pd.concat([history, chunk], ignore_index=True) if len(history) else chunk
+        chunk["_tkey"] = chunk["transaction_id"].astype(str)
+        chunk["_ukey"] = pd.to_numeric(chunk["user_id"], errors="coerce").astype(float).fillna(np.inf)
+        yield chunk
+    logger.info(f"Normalized {seq} rows" + (f" (+{hist_seq} events from earlier runs)" if state else ""))
+
+
+def _flag_user_sorted(frame: pd.DataFrame, start: int) -> pd.DataFrame:
+    """
+    Flag ``frame[start:]`` of a frame sorted by (_ukey, event_time, _seq)
+
+    Rows before ``start`` (carried from the previous block) only count in
+    the windows. Earlier-run events (``_hist``) are dropped from the output.
+    """
+    ukeys = frame["_ukey"].to_numpy()
+    times = frame["event_time"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+    counts = FRAUD_RULES.sorted_window_counts(ukeys, times)
+    block = frame.iloc[start:]
+    hist = block["_hist"].to_numpy(dtype=bool)
+    for name, values in counts.items():
+        values[np.isinf(ukeys)] = 0  # user_id kosong tidak punya window
+        counts[name] = values[start:][~hist]
+
+    out = block.loc[~hist].drop(columns=["_seq", "_tkey", "_ukey", "_hist"])
+    return apply_fraud_rules(out, counts=counts)[OUTPUT_COLUMNS]
+
+
+def transform_chunked(api_path: str = API_FILE, db_path: str = DB_FILE, out_path: str = OUT_FILE,
+                      memory_budget_mb: float = TRANSFORM_MEMORY_MB, spill_dir: str = None,
+                      chunk_rows: int = None, state: EventStateStore = None,
+                      profile: QualityProfile = None) -> int:
+    """
+    Memory-bounded transform using two external sorts
+
+    Pass 1 sorts normalized rows by (transaction_id, seq) so ``keep="last"``
+    dedup is a streaming scan. Pass 2 sorts the survivors by
+    (user_id, event_time, seq) so window rules (keyed on user_id and
+    event_time) only need a small carry of the previous block. Produces the
+    same rows and flags as ``transform()``, ordered by (user_id, event_time)
+    instead of input order.
+
+    Args:
+        chunk_rows: Override the chunk size derived from ``memory_budget_mb``
+        state: Event state of earlier runs. Events of each user are looked up
+            once, in the chunk where the user first appears, and go through
+            dedup as the oldest version. Written rows are added to the state;
+            the caller commits it.
+        profile: Quality profile that every written block is merged into
+
+    Returns:
+        Number of rows written
+    """
+    _check_user_window_rules("Chunked")
+    max_window = FRAUD_RULES.max_window
+    FRAUD_RULES.reset_stats()
+
+    chunk_rows = chunk_rows or _rows_for_budget(memory_budget_mb)
+    block_rows = max(1, chunk_rows // (SORT_FAN_IN + 1))
+    logger.info(f"Chunked transform: budget={memory_budget_mb}MB, chunk_rows={chunk_rows}, block_rows={block_rows}")
+
+    with ExternalSorter(["_tkey", "_seq"], chunk_rows, block_rows, spill_dir, SORT_FAN_IN) as by_id, \
+            ExternalSorter(["_ukey", "event_time", "_seq"], chunk_rows, block_rows, spill_dir, SORT_FAN_IN) as by_user:
+
+        # Pass 1: normalize + clean per chunk, spill runs sorted by transaction_id
+        for chunk in _iter_keyed_chunks(api_path, db_path, chunk_rows, state):
+            by_id.add(chunk)
+
+        # Dedup: keep the last row (highest seq) of every transaction_id
+        carry = None
+        for block in by_id.sorted_blocks():
+            if carry is not None:
+                block = pd.concat([carry, block], ignore_index=True)
+            keys = block["_tkey"].to_numpy()
+            keep = np.append(keys[1:] != keys[:-1], False)
+            carry = block.iloc[[-1]]
+            by_user.add(block.loc[keep])
+        if carry is not None:
+            by_user.add(carry)
+        by_id.cleanup()
+
+        # Pass 2: fraud rules in (user_id, event_time) order, written block by block
+        with FrameWriter(out_path, OUTPUT_DTYPES) as writer:
+            window = pd.DataFrame()
+            for block in by_user.sorted_blocks():
+                frame = pd.concat([window, block], ignore_index=True) if len(window) else block
+                out = _flag_user_sorted(frame, len(frame) - len(block))
+
+                # Simpan event user terakhir yang masih masuk window terpanjang untuk block berikutnya
+                last_user, last_time = frame["_ukey"].iloc[-1], frame["event_time"].iloc[-1]
+                window = frame.loc[(frame["_ukey"] == last_user) & (frame["event_time"] >= last_time - max_window)]
+
+                writer.write(out)
+                if state is not None:
+                    state.update(out)
+                if profile is not None:
+                    profile.merge(QualityProfile.of(out, profile.sample_rate))
+            if profile is not None and not writer.rows:
+                # Tanpa block sama sekali: profil tetap tahu kolom output
+                profile.merge(QualityProfile.of(pd.DataFrame(columns=OUTPUT_COLUMNS), profile.sample_rate))
+
+    log_rule_stats()
+    return writer.rows
+
+
+# ---- Parallel (sharded) mode ----
+
+def _hash_shard(values: np.ndarray, n: int) -> np.ndarray:
+    """Stable hash partition (same result in every process and run)"""
+    return (pd.util.hash_array(values) % np.uint64(n)).astype(np.int64)
+
+
+def _dedup_shard(path: str, out_path: str, buckets: int) -> list:
+    """
+    Worker, phase 1: keep the last version of every transaction_id in one
+    transaction shard, then sort the survivors by user bucket
+
+    Returns:
+        Row offsets of each bucket in ``out_path`` (``buckets + 1`` values)
+    """
+    import pyarrow.feather as feather
+    df = read_frame(path)
+    os.remove(path)
+    df = df.sort_values("_seq", kind="mergesort").drop_duplicates("_tkey", keep="last")
+    df["_bucket"] = _hash_shard(df["_ukey"].to_numpy(), buckets)
+    df = df.sort_values("_bucket", kind="mergesort", ignore_index=True)
+    feather.write_feather(df, out_path, compression="uncompressed")
+    return np.searchsorted(df["_bucket"].to_numpy(), np.arange(buckets + 1)).tolist()
+
+
+def _flag_bucket(sources: list, out_path: str, sample_rate: float = None) -> dict:
+    """
+    Worker, phase 2: apply the fraud rules to one user bucket
+
+    Args:
+        sources: (file, start, stop) row ranges of the bucket in every phase-1
+            file; the files are memory-mapped, so only the bucket is read
+        sample_rate: Quality profile sample rate (None: no profile)
+
+    Returns:
+        Rows written, this bucket's rule stats and quality profile
+    """
+    import pyarrow.feather as feather
+    frames = []
+    for path, start, stop in sources:
+        if stop > start:
+            table = feather.read_table(path, memory_map=True)
+            frames.append(table.slice(start, stop - start).to_pandas())
+    FRAUD_RULES.reset_stats()
+    if frames:
+        frame = pd.concat(frames, ignore_index=True).drop(columns="_bucket")
+        frame = frame.sort_values(["_ukey", "event_time", "_seq"], kind="mergesort", ignore_index=True)
+        out = _flag_user_sorted(frame, 0)
+    else:
+        out = pd.DataFrame(columns=OUTPUT_COLUMNS)
+    write_frame(out, out_path, OUTPUT_DTYPES)
+    quality = QualityProfile.of(out, sample_rate) if sample_rate is not None else None
+    return {"rows": len(out), "stats": FRAUD_RULES.stats, "quality": quality}
+
+
+def transform_parallel(api_path: str = API_FILE, db_path: str = DB_FILE, out_path: str = OUT_FILE,
+                       workers: int = TRANSFORM_WORKERS, buckets: int = TRANSFORM_BUCKETS,
+                       spill_dir: str = None, chunk_rows: int = None,
+                       state: EventStateStore = None, timings: dict = None,
+                       profile: QualityProfile = None) -> int:
+    """
+    Multi-process transform sharded by user
+
+    1. split (this process): normalized rows are hash-partitioned by
+       transaction_id into one Arrow file per worker
+    2. dedup (pool): every worker keeps the last version of its
+       transactions and orders the survivors by user bucket
+       (hash of user_id into ``buckets``)
+    3. rules (pool): one task per bucket reads its row ranges from the
+       memory-mapped phase-2 files, sorts by (user_id, event_time) and
+       applies the rules; largest buckets are scheduled first
+    4. merge (this process): bucket outputs are appended in bucket order
+
+    Data moves between processes only as files; tasks receive paths and
+    row offsets. The output is ordered by (bucket, user_id, event_time),
+    which does not depend on ``workers``. A single heavy user cannot be
+    split, so its bucket bounds the runtime of step 3.
+
+    Args:
+        workers: Processes in the pool
+        buckets: Number of user buckets (fixed, keeps the output order stable)
+        state: Event state of earlier runs (see transform_chunked)
+        timings: Filled with the seconds spent in every step when given
+        profile: Quality profile that every bucket's profile is merged into
+
+    Returns:
+        Number of rows written
+    """
+    _check_user_window_rules("Parallel")
+    FRAUD_RULES.reset_stats()
+    workers = max(1, workers)
+    chunk_rows = chunk_rows or _rows_for_budget(TRANSFORM_MEMORY_MB)
+    if spill_dir:
+        os.makedirs(spill_dir, exist_ok=True)
+    tmpdir = tempfile.mkdtemp(prefix="transform_shards_", dir=spill_dir)
+    timings = {} if timings is None else timings
+    try:
+        start = time.perf_counter()
+        shard_paths = [os.path.join(tmpdir, f"split_{i:03d}.arrow") for i in range(workers)]
+        writers = [FrameWriter(path, SHARD_DTYPES, compression=None) for path in shard_paths]
+        for chunk in _iter_keyed_chunks(api_path, db_path, chunk_rows, state):
+            shard = _hash_shard(chunk["_tkey"].to_numpy(dtype=object), workers)
+            for i, writer in enumerate(writers):
+                writer.write(chunk.loc[shard == i])
+        for writer in writers:
+            writer.close()
+        timings["split"] = time.perf_counter() - start
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            start = time.perf_counter()
+            dedup_paths = [os.path.join(tmpdir, f"dedup_{i:03d}.arrow") for i in range(workers)]
+            offsets = list(pool.map(_dedup_shard, shard_paths, dedup_paths, [buckets] * workers))
+            timings["dedup"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            sources = [[(path, offs[b], offs[b + 1]) for path, offs in zip(dedup_paths, offsets)]
+                       for b in range(buckets)]
+            bucket_paths = [os.path.join(tmpdir, f"bucket_{b:04d}.arrow") for b in range(buckets)]
+            # Bucket terbesar dijadwalkan duluan supaya tidak jadi ekor di akhir
+            order = sorted(range(buckets), key=lambda b: -sum(stop - st for _, st, stop in sources[b]))
+            sample_rate = profile.sample_rate if profile is not None else None
+            futures = {b: pool.submit(_flag_bucket, sources[b], bucket_paths[b], sample_rate) for b in order}
+            results = {b: future.result() for b, future in futures.items()}
+            timings["rules"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for b in range(buckets):
+            FRAUD_RULES.merge_stats(results[b]["stats"])
+            if profile is not None:
+                profile.merge(results[b]["quality"])
+        with FrameWriter(out_path, OUTPUT_DTYPES) as writer:
+            for path in bucket_paths:
+                for out in iter_frames(path, chunk_rows):
+                    writer.write(out)
+                    if state is not None:
+                        state.update(out)
+        timings["merge"] = time.perf_counter() - start
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    sizes = [r["rows"] for r in results.values()]
+    logger.info(f"Parallel transform: workers={workers}, buckets={buckets}, "
+                f"largest bucket={max(sizes) / max(1, sum(sizes)):.1%} of rows, "
+                + ", ".join(f"{k}={v:.2f}s" for k, v in timings.items()))
+    log_rule_stats()
+    return writer.rows
+
+
+def run(mode: str = TRANSFORM_MODE, api: pd.DataFrame = None, db: pd.DataFrame = None,
+        out_path: str = OUT_FILE, memory_budget_mb: float = TRANSFORM_MEMORY_MB,
+        spill_dir: str = TRANSFORM_SPILL_DIR, workers: int = TRANSFORM_WORKERS,
+        event_state: bool = TRANSFORM_EVENT_STATE, run_id: str = None) -> dict:
+    """
+    Transform stage: extracted API + DB rows to the flagged output
+
+    Args:
+        mode: "memory", "chunked" or "parallel" (the last two stream from the
+            stage files and always write ``out_path``)
+        api, db: Extracted frames handed over in memory (memory mode); read
+            from API_FILE / DB_FILE when missing
+        out_path: Output stage file; None (memory mode) skips the file and
+            returns the flagged frame under "frame" for the load stage
+        event_state: Seed window rules from (and update) the per-user event state
+        run_id: Run id of the metrics manifest (default ETL_RUN_ID)
+
+    Returns:
+        Dict with mode and rows (plus "frame" when ``out_path`` is None)
+    """
+    if mode != "memory" and (out_path is None or api is not None or db is not None):
+        raise ValueError(f"transform mode '{mode}' reads and writes stage files; in-memory handoff "
+                         f"needs mode 'memory'")
+    if out_path is not None:
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    logger.info("Starting Transform process...")
+
+    metrics = RunMetrics("transform", run_id=run_id)
+    metrics.info["mode"] = mode
+    result = {"mode": mode}
+    profile = QualityProfile()  # chunked/parallel: digabung per block selama transform
+    state = EventStateStore(EVENT_STATE_FILE, FRAUD_RULES.max_window) if event_state else None
+    try:
+        with metrics.run():
+            if mode == "chunked":
+                with metrics.step("transform_chunked") as step:
+                    step.read(API_FILE, DB_FILE)
+                    try:
+                        rows = transform_chunked(API_FILE, DB_FILE, out_path, memory_budget_mb,
+                                                 spill_dir, state=state, profile=profile)
+                    except FileNotFoundError as e:
+                        logger.error(f"Input file not found: {e.filename}")
+                        raise
+                    step.rows_out = rows
+                    step.wrote(out_path)
+                with metrics.step("quality") as step:
+                    step.rows_in = step.rows_out = rows
+                    run_quality_checks(profile=profile)
+                logger.info(f"✅ Transform (chunked) → {out_path} (rows={rows})")
+            elif mode == "parallel":
+                with metrics.step("transform_parallel") as step:
+                    step.read(API_FILE, DB_FILE)
+                    timings = {}
+                    try:
+                        rows = transform_parallel(API_FILE, DB_FILE, out_path, workers,
+                                                  spill_dir=spill_dir, state=state, timings=timings,
+                                                  profile=profile)
+                    except FileNotFoundError as e:
+                        logger.error(f"Input file not found: {e.filename}")
+                        raise
+                    step.rows_out = rows
+                    step.wrote(out_path)
+                with metrics.step("quality") as step:
+                    step.rows_in = step.rows_out = rows
+                    run_quality_checks(profile=profile)
+                metrics.info["phase_seconds"] = {k: round(v, 4) for k, v in timings.items()}
+                logger.info(f"✅ Transform (parallel) → {out_path} (rows={rows})")
+            else:
+                with metrics.step("read") as step:
+                    if api is None:
+                        api = read_api(API_FILE)
+                        step.read(API_FILE)
+                    if db is None:
+                        db = read_db(DB_FILE)
+                        step.read(DB_FILE)
+                    step.rows_out = len(api) + len(db)
+                all_df = transform(api, db, state, metrics)
+                del api, db
+                rows = len(all_df)
+                with metrics.step("quality") as step:
+                    step.rows_in = step.rows_out = rows
+                    run_quality_checks(all_df)
+
+                if out_path is None:
+                    # Handoff di memori: load menerima frame ringkas langsung, tanpa file
+                    result["frame"] = all_df[OUTPUT_COLUMNS]
+                else:
+                    with metrics.step("write") as step:
+                        step.rows_in = rows
+                        try:
+                            write_frame(to_storage(all_df[OUTPUT_COLUMNS]), out_path, OUTPUT_DTYPES)
+                            logger.info(f"✅ Transform → {out_path} (rows={rows})")
+                        except Exception as e:
+                            logger.error(f"Error saving output file: {e}")
+                            raise
+                        step.rows_out = rows
+                        step.wrote(out_path)
+                if state is not None:
+                    state.update(all_df)
+
+            # State hanya maju setelah file output selesai ditulis (atau frame diserahkan)
+            if state is not None:
+                with metrics.step("event_state"):
+                    state.commit()
+    finally:
+        if state is not None:
+            state.close()
+    result["rows"] = rows
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transform extracted transactions and flag fraud")
+    parser.add_argument("--mode", choices=["memory", "chunked", "parallel"], default=TRANSFORM_MODE,
+                        help="memory: load everything (default); chunked: external sort with a memory budget; "
+                             "parallel: process pool sharded by user_id")
+    parser.add_argument("--memory-budget-mb", type=float, default=TRANSFORM_MEMORY_MB,
+                        help="Approximate memory budget for chunked mode")
+    parser.add_argument("--spill-dir", default=TRANSFORM_SPILL_DIR,
+                        help="Directory for sorted runs / shard files (default: system temp)")
+    parser.add_argument("--workers", type=int, default=TRANSFORM_WORKERS,
+                        help="Processes in parallel mode (default: CPU count)")
+    parser.add_argument("--no-event-state", dest="event_state", action="store_false",
+                        default=TRANSFORM_EVENT_STATE,
+                        help="Do not seed window rules from (or update) the per-user event state")
+    args = parser.parse_args(argv)
+
+    result = run(args.mode, out_path=OUT_FILE, memory_budget_mb=args.memory_budget_mb,
+                 spill_dir=args.spill_dir, workers=args.workers, event_state=args.event_state)
+    print("✅ Transform →", OUT_FILE, "rows=", result["rows"])
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,16 @@
 Utility functions for ETL pipeline
 """
 
+import json
 import logging
 import os
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional
+from typing import Iterator, List, Optional
 
 # Setup logging
 def setup_logging(log_file: Optional[str] = None):
@@ -60,3 +66,341 @@ def log_execution_time(func):
     
     return wrapper
 
+
+class JsonArrayParser:
+    """
+    Incremental parser for a top-level JSON array
+
+    Text is fed in arbitrary pieces (file reads, HTTP chunks); every call to
+    ``feed`` returns the elements completed so far. Only the unfinished tail
+    of the last element is kept between calls.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._started = False
+        self.done = False
+
+    def feed(self, text: str) -> list:
+        buf = self._buf + text
+        pos = 0
+        items = []
+        if not self._started:
+            buf = buf.lstrip()
+            if not buf:
+                self._buf = ""
+                return items
+            if buf[0] != "[":
+                raise ValueError("input does not contain a JSON array")
+            self._started = True
+            pos = 1
+        while not self.done:
+            # Skip separators between elements
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                break
+            if buf[pos] == "]":
+                self.done = True
+                pos += 1
+                break
+            try:
+                obj, end = self._decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break  # elemen belum lengkap, tunggu potongan berikutnya
+            if end == len(buf) and not isinstance(obj, (dict, list, str)):
+                break  # angka/literal di ujung buffer bisa saja masih terpotong
+            items.append(obj)
+            pos = end
+        self._buf = buf[pos:]
+        return items
+
+    def close(self):
+        """Raise if the array was not terminated"""
+        if not self.done:
+            raise ValueError("truncated JSON array")
+
+
+def iter_json_array(path: str, batch_size: int, read_size: int = 1 << 20) -> Iterator[List[dict]]:
+    """
+    Iterate over a top-level JSON array of objects in batches
+
+    The file is decoded incrementally, so memory is bounded by
+    ``batch_size`` records plus one read buffer instead of the whole file.
+    """
+    parser = JsonArrayParser()
+    batch = []
+    with open(path, "r") as f:
+        while not parser.done:
+            text = f.read(read_size)
+            if not text:
+                break
+            for obj in parser.feed(text):
+                batch.append(obj)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+    try:
+        parser.close()
+    except ValueError:
+        raise ValueError(f"{path} does not contain a complete JSON array")
+    if batch:
+        yield batch
+
+
+# ---- Run metrics ----
+
+STEP_FIELDS = ["wall_seconds", "cpu_seconds", "peak_rss_mb", "rows_in", "rows_out", "bytes_read", "bytes_written"]
+
+# Step yang sedang berjalan di proses ini (semua RunMetrics, semua thread): (run, step)
+_ACTIVE_STEPS: List[tuple] = []
+_ACTIVE_LOCK = threading.Lock()
+
+
+def _read_hwm_mb() -> Optional[float]:
+    """Peak RSS since the last reset (Linux VmHWM), None when unavailable"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_hwm() -> bool:
+    """Reset VmHWM so the next reading covers one step only (Linux >= 4.0)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb() -> float:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _cpu_seconds() -> float:
+    """CPU time of this process plus its finished child processes (process pools)"""
+    import resource
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def file_size(path: str) -> int:
+    """Size of ``path`` in bytes (0 when missing)"""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class StepMetrics:
+    """Counters of one step; the caller fills rows and bytes, wall/CPU/RSS are measured"""
+
+    def __init__(self, name: str, parent: Optional[str] = None):
+        self.name = name
+        self.parent = parent
+        self.rows_in = None
+        self.rows_out = None
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_rss_mb = 0.0
+        # True saat step stage lain berjalan bersamaan di proses yang sama:
+        # CPU dan peak RSS proses ikut terhitung di semua step itu
+        self.shared = False
+
+    def read(self, *paths: str):
+        """Count the size of input files as bytes read"""
+        self.bytes_read += sum(file_size(p) for p in paths)
+
+    def wrote(self, *paths: str):
+        """Count the size of output files as bytes written"""
+        self.bytes_written += sum(file_size(p) for p in paths)
+
+    def to_dict(self) -> dict:
+        result = {"name": self.name, "parent": self.parent}
+        for field in STEP_FIELDS:
+            value = getattr(self, field)
+            result[field] = round(value, 4) if isinstance(value, float) else value
+        result["shared"] = self.shared
+        rows = self.rows_out if self.rows_out is not None else self.rows_in
+        result["rows_per_sec"] = round(rows / self.wall_seconds, 1) if rows and self.wall_seconds > 0 else None
+        return result
+
+
+class RunMetrics:
+    """
+    Step-level metrics of one stage run
+
+    Every step records wall time, CPU time (including finished child
+    processes), peak RSS, rows in/out and bytes read/written::
+
+        metrics = RunMetrics("transform")
+        with metrics.step("read") as step:
+            df = read_frame(path)
+            step.read(path)
+            step.rows_out = len(df)
+        metrics.write()
+
+    Peak RSS is per step on Linux (VmHWM is reset when a step starts; a
+    nested step's peak also counts for its parents), elsewhere it is the
+    process peak so far. CPU time and peak RSS are process-wide: when steps
+    of other stages run at the same time in this process (the threads of
+    ``pipeline.py``), VmHWM is not reset and the overlapping steps are marked
+    ``shared`` (their figures include the other stages). ``write`` stores a JSON run manifest under
+    ``METRICS_DIR/runs`` (default ``DATA_DIR/metrics``) and a Prometheus
+    textfile-collector file under ``PROMETHEUS_TEXTFILE_DIR``. All stages of
+    one pipeline run share ``ETL_RUN_ID`` when it is set; ``ETL_METRICS=0``
+    disables writing.
+    """
+
+    def __init__(self, stage: str, run_id: Optional[str] = None, metrics_dir: Optional[str] = None,
+                 textfile_dir: Optional[str] = None, enabled: Optional[bool] = None):
+        self.stage = stage
+        self.started_at = datetime.now()
+        self.run_id = run_id or os.getenv("ETL_RUN_ID") or f"{self.started_at:%Y%m%dT%H%M%S}-{os.getpid()}"
+        # Dibaca saat run dibuat (setelah load_dotenv di script), bukan saat import
+        self.metrics_dir = (metrics_dir or os.getenv("METRICS_DIR")
+                            or os.path.join(os.getenv("DATA_DIR", "./data"), "metrics"))
+        # Direktori textfile collector node_exporter (--collector.textfile.directory)
+        self.textfile_dir = (textfile_dir or os.getenv("PROMETHEUS_TEXTFILE_DIR")
+                             or os.path.join(self.metrics_dir, "prometheus"))
+        self.enabled = os.getenv("ETL_METRICS", "1") == "1" if enabled is None else enabled
+        self.steps: List[StepMetrics] = []
+        self.info = {}
+        self._active: List[StepMetrics] = []
+        self._start = time.perf_counter()
+        self._cpu_start = _cpu_seconds()
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[StepMetrics]:
+        """Measure one step (steps may nest; each is reported on its own)"""
+        step = StepMetrics(name, self._active[-1].name if self._active else None)
+        with _ACTIVE_LOCK:
+            others = [s for run, s in _ACTIVE_STEPS if run is not self]
+            for other in others:
+                other.shared = True
+            step.shared = bool(others)
+            hwm = _read_hwm_mb()
+            for parent in self._active:
+                parent.peak_rss_mb = max(parent.peak_rss_mb, hwm or 0.0)
+            # Reset VmHWM berlaku untuk seluruh proses: hanya kalau tidak ada step stage lain yang jalan
+            per_step = hwm is not None and not others and _reset_hwm()
+            _ACTIVE_STEPS.append((self, step))
+        self._active.append(step)
+        self.steps.append(step)
+        start, cpu_start = time.perf_counter(), _cpu_seconds()
+        try:
+            yield step
+        finally:
+            step.wall_seconds = time.perf_counter() - start
+            step.cpu_seconds = _cpu_seconds() - cpu_start
+            with _ACTIVE_LOCK:
+                _ACTIVE_STEPS.remove((self, step))
+                peak = _read_hwm_mb() if per_step else _peak_rss_mb()
+            step.peak_rss_mb = max(step.peak_rss_mb, peak or 0.0)
+            self._active.pop()
+            for parent in self._active:
+                parent.peak_rss_mb = max(parent.peak_rss_mb, step.peak_rss_mb)
+            logging.getLogger(__name__).info(
+                f"[{self.stage}] step {name}: {step.wall_seconds:.3f}s wall, {step.cpu_seconds:.3f}s cpu, "
+                f"peak {step.peak_rss_mb:.0f}MB, rows {step.rows_in}→{step.rows_out}"
+                + (" (shared with concurrent stages)" if step.shared else ""))
+
+    def manifest(self, status: str) -> dict:
+        top = [s for s in self.steps if s.parent is None]  # step bersarang tidak dihitung dua kali
+        return {
+            "run_id": self.run_id,
+            "stage": self.stage,
+            "status": status,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+            "wall_seconds": round(time.perf_counter() - self._start, 4),
+            "cpu_seconds": round(_cpu_seconds() - self._cpu_start, 4),
+            # Reset VmHWM per step juga menurunkan ru_maxrss, jadi ambil maksimum semua step
+            "peak_rss_mb": round(max([_peak_rss_mb(), *(s.peak_rss_mb for s in self.steps)]), 1),
+            # cpu_seconds / peak_rss_mb juga mencakup stage lain yang jalan bersamaan di proses ini
+            "shared": any(s.shared for s in self.steps),
+            "bytes_read": sum(s.bytes_read for s in top),
+            "bytes_written": sum(s.bytes_written for s in top),
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "info": self.info,
+            "steps": [s.to_dict() for s in self.steps],
+        }
+
+    def prometheus(self, manifest: dict) -> str:
+        """Prometheus text exposition of ``manifest`` (gauges of the latest run)"""
+        stage = manifest["stage"]
+        lines = []
+
+        def gauge(name: str, help_text: str, samples: list):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                if value is not None:
+                    label_text = ",".join(f'{k}="{v}"' for k, v in {"stage": stage, **labels}.items())
+                    lines.append(f"{name}{{{label_text}}} {value}")
+
+        gauge("etl_run_success", "1 when the latest run succeeded", [({}, int(manifest["status"] == "success"))])
+        gauge("etl_run_last_timestamp_seconds", "Finish time of the latest run",
+              [({}, round(datetime.fromisoformat(manifest["finished_at"]).timestamp()))])
+        gauge("etl_run_wall_seconds", "Wall time of the latest run", [({}, manifest["wall_seconds"])])
+        gauge("etl_run_cpu_seconds", "CPU time of the latest run", [({}, manifest["cpu_seconds"])])
+        gauge("etl_run_peak_rss_bytes", "Peak RSS of the latest run",
+              [({}, int(manifest["peak_rss_mb"] * 1024 * 1024))])
+        steps = manifest["steps"]
+        for field, help_text in (("wall_seconds", "Wall time per step"),
+                                 ("cpu_seconds", "CPU time per step"),
+                                 ("rows_in", "Rows into each step"),
+                                 ("rows_out", "Rows out of each step"),
+                                 ("bytes_read", "Bytes read per step"),
+                                 ("bytes_written", "Bytes written per step"),
+                                 ("rows_per_sec", "Throughput per step")):
+            gauge(f"etl_step_{field}", help_text, [({"step": s["name"]}, s[field]) for s in steps])
+        gauge("etl_step_peak_rss_bytes", "Peak RSS per step",
+              [({"step": s["name"]}, int(s["peak_rss_mb"] * 1024 * 1024)) for s in steps])
+        return "\n".join(lines) + "\n"
+
+    def write(self, status: str = "success") -> Optional[dict]:
+        """Write the run manifest and the Prometheus textfile; returns the manifest"""
+        if not self.enabled:
+            return None
+        manifest = self.manifest(status)
+        try:
+            runs_dir = os.path.join(self.metrics_dir, "runs")
+            os.makedirs(runs_dir, exist_ok=True)
+            path = os.path.join(runs_dir, f"{self.run_id}_{self.stage}.json")
+            with open(path, "w") as f:
+                json.dump(manifest, f, indent=2)
+            # Ditulis ke file sementara lalu rename: collector tidak pernah membaca file setengah jadi
+            os.makedirs(self.textfile_dir, exist_ok=True)
+            prom_path = os.path.join(self.textfile_dir, f"etl_{self.stage}.prom")
+            with open(prom_path + ".tmp", "w") as f:
+                f.write(self.prometheus(manifest))
+            os.replace(prom_path + ".tmp", prom_path)
+        except OSError as e:
+            # Metrics tidak boleh menggagalkan pipeline
+            logging.getLogger(__name__).warning(f"Could not write run metrics: {e}")
+            return manifest
+        logging.getLogger(__name__).info(f"Run metrics → {path}")
+        return manifest
+
+    @contextmanager
+    def run(self) -> Iterator["RunMetrics"]:
+        """Write the metrics when the block ends, with status failed on an exception"""
+        try:
+            yield self
+        except BaseException:
+            self.write("failed")
+            raise
+        self.write("success")
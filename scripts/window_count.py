@@ -0,0 +1,111 @@
+"""
+Sort-based sliding-window counter for the burst activity rule
+
+Works on one array sorted by (key, time): for every row it counts earlier
+rows of the same key whose time falls in ``[t - window, t)`` (pandas
+``rolling(window, closed="left")`` semantics: rows with the same timestamp
+do not count each other). Everything is vectorized NumPy and the result is
+positional, so there is no groupby and no join back to the frame.
+"""
+
+import numpy as np
+
+
+def window_counts(keys: np.ndarray, times: np.ndarray, window: int) -> np.ndarray:
+    """
+    Count prior events per key inside a left-closed time window
+
+    Args:
+        keys: Group key per row (e.g. user id codes), rows grouped contiguously
+        times: int64 timestamps, ascending within each key
+        window: Window length in the same unit as ``times``
+
+    Returns:
+        int64 array with the number of rows j of the same key where
+        ``times[i] - window <= times[j] < times[i]``
+    """
+    keys = np.asarray(keys)
+    times = np.asarray(times, dtype=np.int64)
+    n = len(times)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    idx = np.arange(n, dtype=np.int64)
+    new_group = np.empty(n, dtype=bool)
+    new_group[0] = True
+    np.not_equal(keys[1:], keys[:-1], out=new_group[1:])
+    new_run = new_group.copy()
+    new_run[1:] |= times[1:] != times[:-1]
+
+    # Start of each row's key group and of its run of identical timestamps
+    group_start = np.maximum.accumulate(np.where(new_group, idx, 0))
+    run_start = np.maximum.accumulate(np.where(new_run, idx, 0))
+    lower = times - window
+
+    # First index in [group_start, run_start] with times >= lower.
+    # Gallop backwards from run_start (windows usually hold few events) ...
+    lo = group_start.copy()
+    hi = run_start.copy()
+    active = np.flatnonzero(lo < hi)
+    step = 1
+    while active.size:
+        probe = run_start[active] - step
+        inside = probe > lo[active]
+        below = times[np.where(inside, probe, lo[active])] < lower[active]
+        lo[active] = np.where(inside & below, probe + 1, lo[active])
+        hi[active] = np.where(inside & ~below, probe, hi[active])
+        active = active[inside & ~below]
+        step <<= 1
+
+    # ... then bisect inside the bracket that was found
+    active = np.flatnonzero(lo < hi)
+    while active.size:
+        l, h = lo[active], hi[active]
+        mid = (l + h) >> 1
+        below = times[mid] < lower[active]
+        lo[active] = np.where(below, mid + 1, l)
+        hi[active] = np.where(below, h, mid)
+        active = active[lo[active] < hi[active]]
+
+    return run_start - lo
+
+
+def _sort_order(codes: np.ndarray, times: np.ndarray, window: int) -> np.ndarray:
+    """Row order sorting by (codes, times)"""
+    tmin = int(times.min())
+    span = int(times.max()) - tmin
+    # Timestamps are usually whole seconds/millis; scale down so that
+    # (code, time) packs into one int64 and a single argsort does the job
+    tick = 1
+    for candidate in (10**9, 10**6, 10**3):
+        if window % candidate == 0 and not ((times - tmin) % candidate).any():
+            tick = candidate
+            break
+    width = span // tick + 1
+    if int(codes.max()) < (2**62) // width:
+        return np.argsort(codes.astype(np.int64) * width + (times - tmin) // tick)
+    return np.lexsort((times, codes))
+
+
+def window_counts_by_key(codes: np.ndarray, times: np.ndarray, window: int) -> np.ndarray:
+    """
+    ``window_counts`` for rows in any order
+
+    Args:
+        codes: Non-negative integer key codes (e.g. from ``pd.factorize``);
+            rows with a negative code (missing key) get a count of 0
+        times: int64 timestamps
+        window: Window length in the same unit as ``times``
+
+    Returns:
+        Counts aligned with the input rows
+    """
+    codes = np.asarray(codes)
+    times = np.asarray(times, dtype=np.int64)
+    counts = np.zeros(len(times), dtype=np.int64)
+    if len(times) == 0:
+        return counts
+    order = _sort_order(codes, times, window)
+    counts[order] = window_counts(codes[order], times[order], window)
+    counts[codes < 0] = 0
+    return counts
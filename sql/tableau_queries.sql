@@ -1,5 +1,12 @@
 -- SQL Queries untuk Tableau Dashboard
 -- File ini berisi query-query yang berguna untuk visualisasi di Tableau
+--
+-- Query 1-7 menghitung ulang dari fact_transactions (referensi). Hasil yang sama
+-- tersedia murah di tabel rollup fact_transactions_rollup_* (dibaca oleh
+-- scripts/export_to_csv.py), misalnya:
+--   SELECT transaction_date, total_transactions, fraud_count,
+--          ROUND(100.0 * fraud_count / total_transactions, 2) AS fraud_rate_pct
+--   FROM fact_transactions_rollup_daily ORDER BY transaction_date;
 
 -- ============================================
 -- 1. DAILY SUMMARY
@@ -246,11 +253,12 @@ SELECT
         WHEN is_fraud = 1 THEN 'Fraud'
         ELSE 'Normal'
     END as transaction_status,
+    -- fraud_reason bisa berisi beberapa rule: 'high_amount,crypto_merchant'
     CASE 
-        WHEN fraud_reason = 'high_amount' THEN 'High Amount'
-        WHEN fraud_reason = 'crypto_merchant' THEN 'Crypto Merchant'
-        WHEN fraud_reason = 'burst_activity' THEN 'Burst Activity'
-        ELSE 'No Fraud'
+        WHEN fraud_reason IS NULL THEN 'No Fraud'
+        ELSE REPLACE(REPLACE(REPLACE(REPLACE(fraud_reason,
+            'high_amount', 'High Amount'), 'crypto_merchant', 'Crypto Merchant'),
+            'burst_activity', 'Burst Activity'), ',', ' + ')
     END as fraud_reason_clean,
     CASE 
         WHEN amount > 50000000 THEN 'High Amount'
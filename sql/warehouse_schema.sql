@@ -1,5 +1,9 @@
+-- Fact table dipartisi per bulan pada event_time (partisi dibuat otomatis oleh
+-- scripts/load.py: bulan yang ada di data + PARTITION_MONTHS_AHEAD bulan ke depan).
+-- PK partisi wajib memuat event_time; keunikan transaction_id dijaga oleh
+-- fact_transactions_keys, yang dipakai loader untuk upsert per transaction_id.
 CREATE TABLE IF NOT EXISTS fact_transactions (
-  transaction_id     VARCHAR(64) PRIMARY KEY,
+  transaction_id     VARCHAR(64) NOT NULL,
   user_id            BIGINT,
   account_number     VARCHAR(64),
   amount             NUMERIC(18,2) NOT NULL,
@@ -12,11 +16,39 @@ CREATE TABLE IF NOT EXISTS fact_transactions (
   source             VARCHAR(16),              -- API / DB
   is_fraud           SMALLINT DEFAULT 0,
   fraud_reason       VARCHAR(256),             -- alasan flag
-  ingestion_time     TIMESTAMPTZ DEFAULT NOW()
+  row_hash           BIGINT,                   -- hash isi baris (scripts/schema.py), upsert lewati yang sama
+  ingestion_time     TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (transaction_id, event_time)
+) PARTITION BY RANGE (event_time);
+
+CREATE TABLE IF NOT EXISTS fact_transactions_keys (
+  transaction_id     VARCHAR(64) PRIMARY KEY,
+  event_time         TIMESTAMPTZ NOT NULL      -- partisi tempat baris berada
 );
 
+-- Contoh partisi (nama: fact_transactions_pYYYYMM)
+-- CREATE TABLE fact_transactions_p202501 PARTITION OF fact_transactions
+--   FOR VALUES FROM ('2025-01-01 00:00:00') TO ('2025-02-01 00:00:00');
+
 
--- Indeks untuk query performa
-CREATE INDEX IF NOT EXISTS idx_fact_tx_user_time ON fact_transactions (user_id, event_time);
+-- Indeks untuk query performa (dibuat per partisi secara otomatis)
+CREATE INDEX IF NOT EXISTS fact_transactions_event_time_brin ON fact_transactions USING BRIN (event_time);
+CREATE INDEX IF NOT EXISTS fact_transactions_user_time_idx ON fact_transactions (user_id, event_time);
 CREATE INDEX IF NOT EXISTS idx_fact_tx_merchant ON fact_transactions (merchant);
-CREATE INDEX IF NOT EXISTS idx_fact_tx_is_fraud ON fact_transactions (is_fraud);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_fact_tx_is_fraud ON fact_transactions (is_fraud);
+
+
+-- Rollup ringkasan untuk Tableau (di-maintain incremental oleh scripts/load.py,
+-- dibuat otomatis kalau belum ada; lihat scripts/rollups.py)
+CREATE TABLE IF NOT EXISTS fact_transactions_rollup_daily (
+  transaction_date    DATE PRIMARY KEY,
+  total_transactions  BIGINT NOT NULL,
+  fraud_count         BIGINT NOT NULL,
+  total_amount        NUMERIC(20,2) NOT NULL,
+  min_amount          NUMERIC(18,2),
+  max_amount          NUMERIC(18,2),
+  updated_at          TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+);
+-- fact_transactions_rollup_{merchant, user, hourly, day_of_week, location, fraud_reason}
+-- punya kolom yang sama tanpa min/max, dengan key: merchant, user_key (user_id, NULL = -1),
+-- transaction_hour, day_of_week, location, fraud_reason (hanya baris is_fraud = 1).
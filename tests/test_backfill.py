@@ -0,0 +1,149 @@
+"""
+Unit tests for backfill.py (day-by-day rebuild of the DB rows)
+
+The backfill reads a multi-day CSV mock and replaces days in a SQLite
+warehouse.
+"""
+
+import json
+
+import pytest
+import numpy as np
+import pandas as pd
+from datetime import date
+from sqlalchemy import create_engine, text
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scripts import backfill
+
+# Modul stage seperti yang diimpor backfill (lewat sys.path scripts/), supaya monkeypatch kena
+db_stage, tr, ld = backfill.db_stage, backfill.transform_stage, backfill.load_stage
+START = pd.Timestamp("2024-03-01")
+
+
+def write_db_source(path, n=600, days=4, seed=3):
+    """DB mock over ``days`` days with unique ids and bursts around midnight"""
+    rng = np.random.default_rng(seed)
+    times = [START + pd.Timedelta(seconds=int(s)) for s in rng.permutation(days * 86400)[:n]]
+    users = list(rng.integers(1, 4, n))
+    # Burst user 9 yang melewati tengah malam: hanya terdeteksi dengan lookback hari sebelumnya
+    for day in range(1, days):
+        for minute in range(-4, 3):
+            times.append(START + pd.Timedelta(days=day, minutes=minute, seconds=30))
+            users.append(9)
+    db = pd.DataFrame({
+        "id": range(50_000, 50_000 + len(times)),
+        "user_id": users,
+        "account_number": "1234567890",
+        "amount": rng.uniform(1e4, 6e7, len(times)).round(2),
+        "transaction_type": rng.choice(["debit", "credit"], len(times)),
+        "date": [t.strftime("%Y-%m-%d %H:%M:%S") for t in times],
+        "location": "Bali",
+    })
+    db.to_csv(path, index=False)
+    return db
+
+
+@pytest.fixture
+def warehouse(tmp_path, monkeypatch):
+    """CSV mock, SQLite warehouse, checkpoint and dedup index under tmp_path"""
+    write_db_source(tmp_path / "db.csv")
+    monkeypatch.setenv("METRICS_DIR", str(tmp_path / "metrics"))
+    monkeypatch.setattr(db_stage, "CSV_FILE", str(tmp_path / "db.csv"))
+    monkeypatch.setattr(ld, "POSTGRES_URI", f"sqlite:///{tmp_path / 'wh.db'}")
+    monkeypatch.setattr(ld, "DEDUP_INDEX_FILE", str(tmp_path / "state" / "loaded.sqlite"))
+    monkeypatch.setattr(backfill, "BACKFILL_CHECKPOINT_DIR", str(tmp_path / "state" / "backfill"))
+    return create_engine(ld.POSTGRES_URI)
+
+
+def expected_rows(first: date, last: date) -> pd.DataFrame:
+    """The full-history transform of the CSV mock, restricted to [first, last]"""
+    full = tr.transform(backfill.FrameBuffer(backfill.api_stage.API_DTYPES).frame(), backfill.read_csv_source())
+    lo, hi = pd.Timestamp(first, tz=full["event_time"].dt.tz), pd.Timestamp(last, tz=full["event_time"].dt.tz)
+    return full[(full["event_time"] >= lo) & (full["event_time"] < hi + pd.Timedelta(days=1))]
+
+
+def fetch(engine, where="1 = 1"):
+    with engine.connect() as conn:
+        df = pd.read_sql(text(f"SELECT transaction_id, amount, source, is_fraud FROM fact_transactions "
+                              f"WHERE {where} ORDER BY transaction_id"), conn)
+    return df.astype({"amount": float, "is_fraud": bool})
+
+
+def test_backfill_rebuilds_days_and_keeps_the_rest(warehouse):
+    """Days match a full-history transform (bursts across midnight included); API rows and other days stay"""
+    want = expected_rows(date(2024, 3, 2), date(2024, 3, 3))
+    assert want["is_fraud"].any()
+    outside = expected_rows(date(2024, 3, 4), date(2024, 3, 4))
+    stale = want.head(30).assign(transaction_id=lambda d: "old-" + d["transaction_id"])
+    api = want.head(10).assign(transaction_id=lambda d: "api-" + d["transaction_id"], source="API")
+    ld.ensure_table(warehouse)
+    ld.load(warehouse, pd.concat([outside, stale, api])[tr.OUTPUT_COLUMNS], "insert", workers=1)
+
+    result = backfill.backfill(date(2024, 3, 2), date(2024, 3, 3), workers=1, mode="insert")
+    assert result["days"] == result["done"] == 2 and result["deleted"] == len(stale)
+    assert result["rows"] == result["inserted"] == len(want)
+
+    got = fetch(warehouse, "source = 'DB' AND transaction_id NOT IN (SELECT transaction_id FROM fact_transactions "
+                           "WHERE event_time >= '2024-03-04')")
+    expected = want.sort_values("transaction_id")[["transaction_id", "amount", "source", "is_fraud"]] \
+        .reset_index(drop=True).astype({"transaction_id": str, "amount": float, "source": str, "is_fraud": bool})
+    got["amount"] = (got["amount"] * 100).round()  # transform menyimpan amount dalam sen
+    pd.testing.assert_frame_equal(got.astype({"transaction_id": str, "source": str}), expected)
+    assert len(fetch(warehouse, "source = 'API'")) == len(api)
+    assert len(fetch(warehouse, "event_time >= '2024-03-04'")) == len(outside)
+
+    checkpoint = json.load(open(result["checkpoint"]))
+    assert sorted(checkpoint["days"]) == ["2024-03-02", "2024-03-03"]
+
+
+def test_failed_day_resumes_from_checkpoint(warehouse, monkeypatch):
+    """Days before a failure are checkpointed; the rerun only does the rest"""
+    run_day, calls = backfill.run_day, []
+
+    def flaky(day, *args, **kwargs):
+        calls.append(day)
+        if day == date(2024, 3, 3):
+            raise RuntimeError("warehouse down")
+        return run_day(day, *args, **kwargs)
+
+    monkeypatch.setattr(backfill, "run_day", flaky)
+    with pytest.raises(RuntimeError, match="1 backfill days failed") as failure:
+        backfill.backfill(date(2024, 3, 2), date(2024, 3, 4), workers=1, mode="insert")
+    assert isinstance(failure.value.__cause__, RuntimeError)
+    assert calls == [date(2024, 3, 2), date(2024, 3, 3)]  # setelah gagal tidak ada hari baru
+
+    calls.clear()
+    monkeypatch.setattr(backfill, "run_day", lambda day, *a, **k: calls.append(day) or run_day(day, *a, **k))
+    result = backfill.backfill(date(2024, 3, 2), date(2024, 3, 4), workers=1, mode="insert")
+    assert calls == [date(2024, 3, 3), date(2024, 3, 4)]
+    assert result["skipped"] == 1 and result["done"] == 2
+    assert len(fetch(warehouse)) == len(expected_rows(date(2024, 3, 2), date(2024, 3, 4)))
+
+    calls.clear()
+    backfill.backfill(date(2024, 3, 2), date(2024, 3, 4), workers=1, mode="insert", restart=True)
+    assert len(calls) == 3
+
+
+def test_process_pool_matches_sequential(warehouse, tmp_path):
+    backfill.backfill(date(2024, 3, 1), date(2024, 3, 4), workers=2, mode="insert")
+    pooled = fetch(warehouse)
+    want = expected_rows(date(2024, 3, 1), date(2024, 3, 4))
+    assert pooled["transaction_id"].tolist() == sorted(want["transaction_id"])
+    assert pooled["is_fraud"].sum() == want["is_fraud"].sum()
+
+    # Dedup index yang sudah ada dikosongkan: baris hasil backfill tidak tercatat di sana
+    with backfill.DedupIndex(ld.DEDUP_INDEX_FILE) as index:
+        assert index.rebuild(warehouse, ld.FACT_TABLE) == len(pooled)
+    backfill.backfill(date(2024, 3, 1), date(2024, 3, 1), workers=2, mode="insert", restart=True)
+    with backfill.DedupIndex(ld.DEDUP_INDEX_FILE) as index:
+        assert index.keys == 0
+    pd.testing.assert_frame_equal(fetch(warehouse), pooled)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
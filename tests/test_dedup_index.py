@@ -0,0 +1,112 @@
+"""
+Unit tests for dedup_index.py (cross-run index of loaded transactions)
+
+Runs on SQLite; the PostgreSQL variant needs TEST_POSTGRES_URI.
+"""
+
+import pytest
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scripts import load as ld
+from scripts.dedup_index import BloomFilter, DedupIndex
+from scripts.schema import id_hash
+from tests.test_rollups import transactions, engine, assert_matches_rebuild, TEST_TABLE  # noqa: F401
+
+
+def load(engine, df, index):
+    mode = "copy" if engine.dialect.name == "postgresql" else "insert"
+    return ld.load(engine, df, mode, TEST_TABLE, workers=1, index=index)
+
+
+def count(engine):
+    with engine.connect() as conn:
+        return conn.execute(text(f"SELECT COUNT(*) FROM {TEST_TABLE}")).scalar()
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(10_000, 0.01)
+    added = id_hash(pd.Series([f"tx-{i}" for i in range(10_000)]))
+    bloom.add(added)
+    assert bloom.might_contain(added).all()
+    others = bloom.might_contain(id_hash(pd.Series([f"other-{i}" for i in range(10_000)])))
+    assert others.mean() < 0.03
+
+
+def test_second_run_skips_unchanged_rows(engine, tmp_path):
+    path = str(tmp_path / "index.sqlite")
+    df = transactions(60)
+    with DedupIndex(path) as index:
+        stats = load(engine, df, index)
+    assert (stats["rows"], stats["skipped"]) == (60, 0)
+
+    # Window berikutnya: 50 baris lama (2 berubah) + 10 baris baru
+    again = pd.concat([df.iloc[10:], transactions(10, seed=1, offset=100)], ignore_index=True)
+    again.loc[0, "amount"] += 1
+    again.loc[1, "merchant"] = None if again.loc[1, "merchant"] else "Shopee"
+    with DedupIndex(path) as index:
+        stats = load(engine, again, index)
+        assert index.stats["new"] == 10 and index.stats["changed"] == 2
+    assert (stats["rows"], stats["skipped"]) == (12, 48)
+    assert count(engine) == 70
+    assert_matches_rebuild(engine)
+
+    with DedupIndex(path) as index:
+        assert load(engine, again, index)["skipped"] == 60
+
+
+def test_failed_load_is_not_recorded(engine, tmp_path, monkeypatch):
+    path = str(tmp_path / "index.sqlite")
+    df = transactions(20)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("connection lost")
+    monkeypatch.setattr(ld, "upsert_rows", fail)
+    monkeypatch.setattr(ld, "copy_upsert", fail)
+    with DedupIndex(path) as index:
+        with pytest.raises(RuntimeError):
+            load(engine, df, index)
+    monkeypatch.undo()
+
+    with DedupIndex(path) as index:
+        assert index.keys == 0
+        assert load(engine, df, index)["rows"] == 20
+
+
+def test_rebuild_from_warehouse_and_reset(engine, tmp_path):
+    df = transactions(40)
+    load(engine, df, None)
+    path = str(tmp_path / "index.sqlite")
+    with DedupIndex(path) as index:
+        assert index.rebuild(engine, TEST_TABLE) == 40
+    # Bloom filter tersimpan dan dipakai lagi; hash dari warehouse sama dengan hash frame
+    assert os.path.exists(path + ".bloom")
+    with DedupIndex(path) as index:
+        assert load(engine, df, index)["skipped"] == 40
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM {TEST_TABLE}"))
+    with DedupIndex(path) as index:
+        stats = load(engine, df, index)
+    assert (stats["rows"], stats["skipped"]) == (40, 0)
+    assert count(engine) == 40
+
+
+def test_compact_drops_old_keys(tmp_path):
+    path = str(tmp_path / "index.sqlite")
+    df = ld.prepare_frame(transactions(30))
+    df["event_time"] = pd.Timestamp("2024-03-01", tz="UTC") - pd.to_timedelta(np.arange(30) * 3, unit="D")
+    with DedupIndex(path, capacity=16) as index:
+        index.filter(df)
+        index.commit()
+        assert index.bloom.capacity >= 30
+        assert index.compact(retention_days=45) == 14
+        assert index.keys == 16
+        kept = index.filter(df)
+    assert kept["transaction_id"].tolist() == df["transaction_id"].tolist()[16:]
@@ -0,0 +1,145 @@
+"""
+Unit tests for the streaming full export and the incremental export in
+export_to_csv.py
+
+SQLite exercises the server-side-cursor path; the COPY path needs
+TEST_POSTGRES_URI.
+"""
+
+import pytest
+import pandas as pd
+from sqlalchemy import create_engine, inspect
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scripts import load as ld
+from scripts import export_to_csv as exp
+from tests.test_rollups import transactions, drop_all, TEST_TABLE, TEST_POSTGRES_URI
+
+CALCULATED = ["transaction_date", "transaction_hour", "day_of_week", "transaction_month",
+              "transaction_year", "transaction_status", "fraud_reason_clean", "amount_category"]
+
+
+def export_incremental(engine, out):
+    return (exp.export_fact_incremental(engine, str(out), table=TEST_TABLE),
+            exp.export_summaries_incremental(engine, str(out), table=TEST_TABLE))
+
+
+def mtimes(out):
+    return {p.name: p.stat().st_mtime_ns for p in list(out.glob("*.csv")) + list(out.glob("*/*.parquet"))}
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def engine(request, tmp_path):
+    if request.param == "sqlite":
+        engine = create_engine(f"sqlite:///{tmp_path / 'warehouse.db'}")
+    else:
+        if not TEST_POSTGRES_URI:
+            pytest.skip("TEST_POSTGRES_URI not set")
+        engine = create_engine(TEST_POSTGRES_URI)
+    drop_all(engine)
+    ld.ensure_table(engine, TEST_TABLE, with_rollups=False)
+    yield engine
+    drop_all(engine)
+
+
+def test_export_fact_streams_compressed_csv(engine, tmp_path, capsys):
+    """All rows are exported in event_time order with the calculated fields, in small fetches"""
+    df = transactions(120)
+    df.loc[0, "amount"] = 60_000_000
+    df.loc[0, "is_fraud"] = 1
+    df.loc[0, "fraud_reason"] = "high_amount"
+    df.loc[1, "is_fraud"] = 1
+    df.loc[1, "fraud_reason"] = "crypto_merchant,burst_activity"
+    ld.load(engine, df, mode="insert", table=TEST_TABLE, with_rollups=False)
+
+    out = str(tmp_path / "fact_transactions.csv.gz")
+    rows = exp.export_fact(engine, out, table=TEST_TABLE, fetch_rows=25, progress_rows=50)
+
+    result = pd.read_csv(out)
+    assert rows == len(result) == 120
+    assert list(result.columns) == exp.FACT_COLUMNS + CALCULATED
+    assert pd.to_datetime(result["event_time"], utc=True, format="mixed").is_monotonic_increasing
+    first = result.set_index("transaction_id").loc["tx-0"]
+    assert first["amount_category"] == "High Amount"
+    assert first["fraud_reason_clean"] == "High Amount"
+    assert first["transaction_status"] == "Fraud"
+    assert result.set_index("transaction_id").loc["tx-1", "fraud_reason_clean"] == "Crypto Merchant + Burst Activity"
+    expected_dow = (pd.Timestamp(df.loc[0, "event_time"]).dayofweek + 1) % 7
+    assert first["day_of_week"] == expected_dow
+    assert "... " in capsys.readouterr().out
+    assert not os.path.exists(out + ".tmp")
+
+
+def test_export_fact_empty_table_writes_header(engine, tmp_path):
+    """An empty table still produces a CSV with the full header"""
+    out = str(tmp_path / "fact_transactions.csv")
+    assert exp.export_fact(engine, out, table=TEST_TABLE) == 0
+    assert list(pd.read_csv(out).columns) == exp.FACT_COLUMNS + CALCULATED
+
+
+def test_incremental_export_rewrites_changed_days_only(engine, tmp_path):
+    """Only days whose daily rollup row moved are rewritten; summaries follow their rollups"""
+    ld.ensure_table(engine, TEST_TABLE)
+    df = transactions(120)
+    ld.load(engine, df, mode="insert", table=TEST_TABLE)
+    out = tmp_path / "tableau"
+    out.mkdir()
+
+    fact, summaries = export_incremental(engine, out)
+    days = sorted(df["event_time"].dt.date.astype(str).unique())
+    assert fact == {"partitions": len(days), "written": len(days), "removed": 0, "rows": 120}
+    assert len(summaries) == len(exp.SUMMARY_QUERIES)
+    result = pd.read_parquet(out / exp.FACT_PARTITION_DIR)
+    assert len(result) == 120 and list(result.columns) == exp.FACT_COLUMNS + CALCULATED
+    assert sorted(p.stem for p in (out / exp.FACT_PARTITION_DIR).glob("*.parquet")) == days
+    day0 = pd.read_parquet(exp.partition_path(str(out), days[0]))
+    assert set(day0["transaction_id"]) == set(df.loc[df["event_time"].dt.date.astype(str) == days[0], "transaction_id"])
+
+    before = mtimes(out)
+    fact, summaries = export_incremental(engine, out)
+    assert fact["written"] == 0 and summaries == {}
+    assert mtimes(out) == before
+
+    # Satu transaksi normal di hari kedua berubah: hanya partisi itu yang ditulis ulang;
+    # fraud_by_reason hanya membaca baris fraud, jadi tidak dihitung ulang
+    row = df[(df["event_time"].dt.date.astype(str) == days[1]) & (df["is_fraud"] == 0)].iloc[[0]]
+    ld.load(engine, row.assign(amount=1.0), mode="insert", table=TEST_TABLE)
+    fact, summaries = export_incremental(engine, out)
+    assert fact["written"] == 1 and fact["rows"] == (df["event_time"].dt.date.astype(str) == days[1]).sum()
+    assert "fraud_by_reason.csv" not in summaries and "daily_summary.csv" in summaries
+    changed = {name for name, mtime in mtimes(out).items() if before[name] != mtime}
+    assert changed == {f"{days[1]}.parquet"} | set(summaries)
+    updated = pd.read_parquet(exp.partition_path(str(out), days[1])).set_index("transaction_id")
+    assert updated.loc[row["transaction_id"].iloc[0], "amount"] == 1.0
+
+    # Hari yang tidak punya baris lagi (dikosongkan lewat replace, jadi rollup ikut): file partisinya dihapus
+    last = pd.Timestamp(days[-1])
+    ld.replace_range(engine, df.iloc[:0], last, last + pd.Timedelta(days=1), mode="insert", table=TEST_TABLE,
+                     source="API")
+    fact, _ = export_incremental(engine, out)
+    assert fact["removed"] == 1 and fact["written"] == 0
+    assert not os.path.exists(exp.partition_path(str(out), days[-1]))
+    assert len(pd.read_parquet(out / exp.FACT_PARTITION_DIR)) == (df["event_time"] < pd.Timestamp(days[-1])).sum()
+
+
+def test_fact_watermarks_without_rollups_group_the_fact_table(engine):
+    """LOAD_ROLLUPS=0: the day watermarks come from the fact table and no rollup table is created"""
+    df = transactions(80)
+    ld.load(engine, df, mode="insert", table=TEST_TABLE, with_rollups=False)
+    counts = df["event_time"].dt.date.astype(str).value_counts().to_dict()
+
+    marks = exp.fact_watermarks(engine, TEST_TABLE, use_rollups=False)
+    assert {day: mark["rows"] for day, mark in marks.items()} == counts
+    assert not inspect(engine).has_table(exp.rollup_table(TEST_TABLE, "daily"))
+
+    # Dengan rollup: hari dan jumlah baris sama, dibaca dari rollup harian
+    marks = exp.fact_watermarks(engine, TEST_TABLE, use_rollups=True)
+    assert {day: mark["rows"] for day, mark in marks.items()} == counts
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
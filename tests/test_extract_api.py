@@ -0,0 +1,159 @@
+"""
+Unit tests for extract_api.py (a local HTTP server stands in for the API)
+"""
+
+import pytest
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scripts import extract_api as ex
+from scripts.intermediate import read_frame
+from scripts.utils import JsonArrayParser
+
+
+def api_records(n):
+    return [{"transaction_id": f"tx-{i}", "user_id": 1000 + i % 13, "amount": 1000.5 * i,
+             "currency": "IDR", "timestamp": f"2024-01-01T10:{i % 60:02d}:00",
+             "merchant": "Tokopedia", "status": "completed", "location": "Jakarta Selatan", "source": "API"}
+            for i in range(n)]
+
+
+class MockApi(BaseHTTPRequestHandler):
+    records = []
+    failures = {}      # page -> list of status codes to return before succeeding
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            query = parse_qs(urlparse(self.path).query)
+            if "page" in query:
+                page, size = int(query["page"][0]), int(query["page_size"][0])
+                time.sleep(0.01 * (page % 3))  # halaman selesai tidak berurutan
+                failures = cls.failures.get(page)
+                if failures:
+                    status = failures.pop(0)
+                    self.send_response(status)
+                    if status == 429:
+                        self.send_header("Retry-After", "0")
+                    self.end_headers()
+                    return
+                body = cls.records[(page - 1) * size:page * size]
+            else:
+                body = cls.records
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api_server():
+    MockApi.records = api_records(1000)
+    MockApi.failures = {}
+    MockApi.in_flight = MockApi.max_in_flight = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockApi)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/transactions"
+    server.shutdown()
+    server.server_close()
+
+
+def test_json_array_parser_handles_split_input():
+    """Elements split anywhere (inside numbers, strings, multi-byte text) come out whole"""
+    text = json.dumps([{"a": 1, "city": "Yogyakarta ☕"}, 12345, "x,]", [1, 2]])
+    parser = JsonArrayParser()
+    items = []
+    for ch in text:
+        items.extend(parser.feed(ch))
+    parser.close()
+    assert items == json.loads(text)
+
+    truncated = JsonArrayParser()
+    truncated.feed(text[:-5])
+    with pytest.raises(ValueError):
+        truncated.close()
+
+
+def test_paginated_extract_in_order_with_retries(api_server, tmp_path):
+    """Pages are fetched concurrently (bounded), retried on 429/5xx and written in page order"""
+    MockApi.failures = {3: [503], 5: [429, 500]}
+    out = str(tmp_path / "api_extracted.parquet")
+    stats = ex.extract_api(api_server, out, page_size=37, concurrency=3, backoff=0.01, chunk_bytes=256)
+
+    df = read_frame(out)
+    assert stats["rows"] == len(df) == 1000
+    assert list(df["transaction_id"]) == [f"tx-{i}" for i in range(1000)]
+    assert stats["pages"] == 28
+    assert stats["retries"] == 3
+    assert str(df["user_id"].dtype) == "Int64"
+    assert 1 < MockApi.max_in_flight <= 3
+
+
+def test_unpaginated_stream_written_in_batches(api_server, tmp_path):
+    """A single large response is parsed chunk by chunk and written every batch_rows records"""
+    out = str(tmp_path / "api_extracted.json")
+    stats = ex.extract_api(api_server, out, page_size=0, batch_rows=100, chunk_bytes=512)
+
+    assert stats["requests"] == 1
+    with open(out) as f:
+        assert json.load(f)[-1]["transaction_id"] == "tx-999"
+    assert stats["rows"] == 1000
+
+
+def test_retries_exhausted_leave_no_file(api_server, tmp_path):
+    """A page that keeps failing aborts the extract without a partial output file"""
+    MockApi.failures = {2: [503] * 5}
+    out = str(tmp_path / "api_extracted.parquet")
+    with pytest.raises(ex.RetryableError):
+        ex.extract_api(api_server, out, page_size=100, concurrency=2, retries=2, backoff=0.01)
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_rate_limit_spaces_requests(api_server, tmp_path):
+    """rate_limit caps how many requests start per second"""
+    MockApi.records = api_records(50)
+    start = time.perf_counter()
+    stats = ex.extract_api(api_server, str(tmp_path / "out.parquet"), page_size=10,
+                           concurrency=4, rate_limit=40)
+
+    assert stats["rows"] == 50
+    # >= 6 request (5 halaman penuh + 1 halaman kosong) dengan jarak 25 ms
+    assert time.perf_counter() - start >= (stats["requests"] - 1) / 40 * 0.9
+
+
+def test_local_file_mode(tmp_path):
+    """Without API_URL the local JSON mock is copied in batches"""
+    src = tmp_path / "api_transactions.json"
+    src.write_text(json.dumps(api_records(25)))
+    out = str(tmp_path / "api_extracted.parquet")
+
+    assert ex.extract_local(str(src), out, batch_rows=10) == 25
+    assert read_frame(out)["amount"].iloc[-1] == pytest.approx(1000.5 * 24)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,113 @@
+"""
+Unit tests for extract_db.py (SQLite stands in for MySQL)
+"""
+
+import pytest
+import pandas as pd
+import sqlite3
+import sys
+import os
+from datetime import datetime
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scripts import extract_db as ex
+from scripts.intermediate import read_frame
+
+NOW = datetime(2024, 3, 31, 12, 0, 0)
+
+
+@pytest.fixture
+def source_db():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("""
+        CREATE TABLE transactions (
+            id INTEGER PRIMARY KEY, user_id INTEGER, account_number TEXT,
+            amount REAL, transaction_type TEXT, date TEXT, location TEXT
+        )
+    """)
+    rows = [(i, 1000 + i % 7, str(10**9 + i), 1000.0 * i, "debit",
+             (pd.Timestamp("2024-03-01") + pd.Timedelta(hours=12 * i)).strftime("%Y-%m-%d %H:%M:%S"), "Bali")
+            for i in range(1, 51)]
+    insert_rows(conn, rows)
+    yield conn
+    conn.close()
+
+
+def insert_rows(conn, rows):
+    conn.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+
+
+def test_full_refresh_streams_last_30_days(source_db, tmp_path):
+    """Full mode keeps the 30-day window and writes in fetchmany batches"""
+    out = str(tmp_path / "db_extracted.parquet")
+    result = ex.extract_from_db(source_db, out, mode="full", watermark_file=str(tmp_path / "wm.json"),
+                                paramstyle="named", fetch_rows=7, now=NOW)
+
+    df = read_frame(out)
+    assert result["rows"] == len(df) == 50
+    assert df["date"].min() >= pd.Timestamp("2024-03-01 12:00")
+    assert str(df["account_number"].dtype) == "string"
+
+
+def test_incremental_uses_watermark_and_lookback(source_db, tmp_path):
+    """Second run only re-reads the lookback window, new rows and late rows with new ids"""
+    out = str(tmp_path / "db_extracted.parquet")
+    wm = str(tmp_path / "wm.json")
+    first = ex.extract_from_db(source_db, out, mode="incremental", watermark_file=wm,
+                               paramstyle="named", fetch_rows=10, now=NOW)
+    assert first == {"rows": 50, "watermark": {"date": "2024-03-26 00:00:00", "id": 50}}
+    # Belum di-commit (load belum sukses): extract berikutnya membaca ulang baris yang sama
+    assert ex.load_watermark(wm) is None
+    assert ex.extract_from_db(source_db, out, mode="incremental", watermark_file=wm,
+                              paramstyle="named", now=NOW)["rows"] == 50
+    ex.commit_watermark(first["watermark"], wm)
+
+    insert_rows(source_db, [
+        (51, 1, "x", 10.0, "credit", "2024-03-27 08:00:00", "Bali"),   # baris baru
+        (52, 2, "y", 20.0, "credit", "2024-03-02 08:00:00", "Bali"),   # terlambat, tanggal lama
+    ])
+    second = ex.extract_from_db(source_db, out, mode="incremental", watermark_file=wm,
+                                paramstyle="named", fetch_rows=10, now=NOW)
+
+    ids = sorted(read_frame(out)["id"])
+    # lookback 24 jam dari 2024-03-26 00:00 -> id 48..50 ikut dibaca ulang
+    assert ids == [48, 49, 50, 51, 52]
+    assert second == {"rows": 5, "watermark": {"date": "2024-03-27 08:00:00", "id": 52}}
+    ex.commit_watermark(second["watermark"], wm)
+    assert ex.load_watermark(wm) == {"date": "2024-03-27 08:00:00", "id": 52}
+    # Commit watermark lama (misalnya hasil cache) tidak memundurkan watermark
+    ex.commit_watermark(first["watermark"], wm)
+    assert ex.load_watermark(wm) == {"date": "2024-03-27 08:00:00", "id": 52}
+
+
+def test_incremental_without_new_rows_keeps_watermark(source_db, tmp_path):
+    """An empty extract writes an empty file and leaves the watermark alone"""
+    wm = str(tmp_path / "wm.json")
+    ex.save_watermark({"date": "2030-01-01 00:00:00", "id": 999}, wm)
+
+    result = ex.extract_from_db(source_db, str(tmp_path / "out.csv"), mode="incremental",
+                                watermark_file=wm, paramstyle="named", now=NOW)
+
+    assert result == {"rows": 0, "watermark": None}
+    assert list(pd.read_csv(tmp_path / "out.csv").columns) == ex.COLUMNS
+    assert ex.load_watermark(wm)["id"] == 999
+
+
+def test_range_extract_leaves_watermark(source_db, tmp_path):
+    """A backfill unit reads [start, end) only and does not move the watermark"""
+    wm = str(tmp_path / "wm.json")
+    ex.save_watermark({"date": "2024-03-20 00:00:00", "id": 40}, wm)
+    out = str(tmp_path / "day.parquet")
+    rows = ex.extract_range(source_db, datetime(2024, 3, 5), datetime(2024, 3, 6), out, paramstyle="named")
+
+    df = read_frame(out)
+    assert rows == len(df) == 2
+    assert sorted(df["date"].dt.strftime("%Y-%m-%d %H:%M")) == ["2024-03-05 00:00", "2024-03-05 12:00"]
+    assert ex.load_watermark(wm) == {"date": "2024-03-20 00:00:00", "id": 40}
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,59 @@
+"""
+Unit tests for generate_synthetic_data.py
+"""
+
+import json
+import sys
+import os
+
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scripts import generate_synthetic_data as gen
+from scripts import transform as tr
+from scripts.extract_api import extract_local
+from scripts.extract_db import extract_csv_mock
+
+
+def read_bytes(directory):
+    return [open(os.path.join(directory, name), "rb").read() for name in (gen.API_FILE, gen.DB_FILE)]
+
+
+def test_generate_is_reproducible_across_workers(tmp_path):
+    options = dict(api_rows=5000, db_rows=3000, start="2024-01-01", hot_users=0.01, hot_share=0.3,
+                   chunk_rows=1000)
+    gen.generate(str(tmp_path / "one"), workers=1, **options)
+    gen.generate(str(tmp_path / "two"), workers=2, **options)
+    assert read_bytes(tmp_path / "one") == read_bytes(tmp_path / "two")
+
+    gen.generate(str(tmp_path / "seed"), workers=1, seed=7, **options)
+    assert read_bytes(tmp_path / "one") != read_bytes(tmp_path / "seed")
+
+
+def test_generate_injects_expected_fraud(tmp_path):
+    raw = str(tmp_path)
+    manifest = gen.generate(raw, api_rows=8000, db_rows=4000, start="2024-01-01", users=5000,
+                            high_amount_rate=0.03, crypto_rate=0.04, burst_rate=0.05, chunk_rows=3000)
+    with open(os.path.join(raw, gen.MANIFEST_FILE)) as f:
+        assert json.load(f)["expected_flagged"] == manifest["expected_flagged"]
+
+    extract_local(os.path.join(raw, gen.API_FILE), os.path.join(raw, "api.parquet"))
+    extract_csv_mock(os.path.join(raw, gen.DB_FILE), os.path.join(raw, "db.parquet"))
+    df = tr.transform(tr.read_api(os.path.join(raw, "api.parquet")), tr.read_db(os.path.join(raw, "db.parquet")))
+
+    assert len(df) == 12000  # id unik, tidak ada yang hilang saat dedup
+    api, db = manifest["sources"]["api"], manifest["sources"]["db"]
+    reasons = df["fraud_reason"].value_counts()
+    assert reasons["high_amount"] == api["high_amount"] + db["high_amount"] == 360
+    assert reasons["crypto_merchant"] == api["crypto_merchant"] == 320
+    # Background bisa menambah burst kebetulan, tapi tidak pernah mengurangi
+    burst = api["burst_flagged"] + db["burst_flagged"]
+    assert burst <= reasons["burst_activity"] <= burst * 1.1
+    assert manifest["expected_fraud_rate"] == pytest.approx(df["is_fraud"].mean(), abs=0.005)
+
+
+def test_generate_rejects_burst_below_rule_minimum(tmp_path):
+    with pytest.raises(ValueError, match="burst_size"):
+        gen.generate(str(tmp_path), burst_size=gen.BURST_MIN_COUNT)
@@ -0,0 +1,79 @@
+"""
+Unit tests for intermediate.py
+"""
+
+import pytest
+import pandas as pd
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scripts.intermediate import stage_file, read_frame, iter_frames, write_frame, FrameWriter
+
+DTYPES = {"transaction_id": "string", "user_id": "Int64", "amount": "float64", "event_time": "datetime64[us]"}
+
+
+def sample_frame(n=10):
+    return pd.DataFrame({
+        "transaction_id": [str(i) for i in range(n)],
+        "user_id": [100 + i for i in range(n)],
+        "amount": [1000.5 * i for i in range(n)],
+        "event_time": pd.date_range("2024-01-01", periods=n, freq="min"),
+    })
+
+
+def test_stage_file_extensions(tmp_path):
+    """Format decides the file extension; legacy keeps the old json/csv names"""
+    assert stage_file(str(tmp_path), "db_extracted", "parquet").endswith("db_extracted.parquet")
+    assert stage_file(str(tmp_path), "db_extracted", "arrow").endswith("db_extracted.arrow")
+    assert stage_file(str(tmp_path), "api_extracted", "legacy", legacy_ext=".json").endswith("api_extracted.json")
+    with pytest.raises(ValueError):
+        stage_file(str(tmp_path), "x", "xml")
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_columnar_roundtrip_keeps_types(tmp_path, fmt):
+    """Columnar files keep dtypes and support column projection"""
+    path = stage_file(str(tmp_path), "cleaned", fmt)
+    write_frame(sample_frame(), path, DTYPES)
+
+    df = read_frame(path)
+    assert pd.api.types.is_datetime64_any_dtype(df["event_time"])
+    assert str(df["user_id"].dtype) == "Int64"
+
+    projected = read_frame(path, columns=["transaction_id", "amount"])
+    assert list(projected.columns) == ["transaction_id", "amount"]
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow", "legacy"])
+def test_frame_writer_chunks(tmp_path, fmt):
+    """Chunks with missing values still share one schema; reading back in batches works"""
+    path = stage_file(str(tmp_path), "cleaned", fmt)
+    first = sample_frame(5)
+    second = sample_frame(5)
+    second["user_id"] = None
+    with FrameWriter(path, DTYPES) as writer:
+        writer.write(first)
+        writer.write(second)
+
+    assert writer.rows == 10
+    batches = list(iter_frames(path, batch_rows=4))
+    assert sum(len(b) for b in batches) == 10
+    assert read_frame(path)["user_id"].isna().sum() == 5
+
+
+def test_frame_writer_discards_on_error(tmp_path):
+    """A failed write never leaves a partial file behind"""
+    path = stage_file(str(tmp_path), "cleaned", "parquet")
+    with pytest.raises(RuntimeError):
+        with FrameWriter(path, DTYPES) as writer:
+            writer.write(sample_frame())
+            raise RuntimeError("boom")
+
+    assert os.listdir(tmp_path) == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,366 @@
+"""
+Unit tests for load.py
+
+The INSERT path runs against SQLite. The COPY path needs PostgreSQL and only
+runs when TEST_POSTGRES_URI points at a scratch database.
+"""
+
+import threading
+import time
+
+import pytest
+import pandas as pd
+from datetime import date
+from sqlalchemy import create_engine, text
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scripts import load as ld
+from scripts import partitions
+from scripts import rollups
+from scripts.rollups import ROLLUPS, rollup_table
+from tests.test_rollups import transactions, engine, assert_matches_rebuild, TEST_TABLE as ROLLUP_TABLE  # noqa: F401
+
+TEST_POSTGRES_URI = os.getenv("TEST_POSTGRES_URI")
+TEST_TABLE = "test_fact_transactions"
+
+
+def processed_frame(n=5, fraud_reason=None):
+    return pd.DataFrame({
+        "transaction_id": [f"tx-{i}" for i in range(n)],
+        "user_id": pd.array([1000 + i for i in range(n - 1)] + [None], dtype="Int64"),
+        "account_number": [None] * n,
+        "amount": [1500.25 * (i + 1) for i in range(n)],
+        "currency": "IDR",
+        "merchant": ["Tokopedia, Tbk", "Binance"] + ['OVO "pay"'] * (n - 2),
+        "transaction_type": None,
+        "status": "completed",
+        "location": "Jakarta",
+        "event_time": pd.date_range("2024-01-01 10:00", periods=n, freq="min"),
+        "source": "API",
+        "is_fraud": [0, 1] + [0] * (n - 2),
+        "fraud_reason": [None, fraud_reason or "crypto_merchant"] + [None] * (n - 2),
+    })
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'warehouse.db'}")
+    ld.ensure_table(engine, TEST_TABLE)
+    return engine
+
+
+@pytest.fixture
+def pg_engine():
+    if not TEST_POSTGRES_URI:
+        pytest.skip("TEST_POSTGRES_URI not set")
+    engine = create_engine(TEST_POSTGRES_URI)
+    drop_pg_tables(engine)
+    ld.ensure_table(engine, TEST_TABLE)
+    yield engine
+    drop_pg_tables(engine)
+
+
+def drop_pg_tables(engine):
+    with engine.begin() as conn:
+        for name in [TEST_TABLE, f"{TEST_TABLE}_keys"] + [rollup_table(TEST_TABLE, n) for n in ROLLUPS]:
+            conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+
+
+def fetch(engine):
+    with engine.connect() as conn:
+        return pd.read_sql(text(f"SELECT * FROM {TEST_TABLE} ORDER BY transaction_id"), conn)
+
+
+def test_prepare_frame_missing_columns():
+    """Rows without all load columns are rejected"""
+    with pytest.raises(ValueError):
+        ld.prepare_frame(processed_frame().drop(columns=["event_time"]))
+
+
+def test_copy_falls_back_to_insert(sqlite_engine):
+    """Engines without COPY use the INSERT ... ON CONFLICT path"""
+    stats = ld.load(sqlite_engine, processed_frame(), mode="copy", table=TEST_TABLE)
+
+    assert stats["mode"] == "insert"
+    assert stats["rows"] == 5
+    assert stats["rows_per_sec"] > 0
+    assert len(fetch(sqlite_engine)) == 5
+
+
+def test_insert_upsert_updates_existing(sqlite_engine):
+    """Re-loading the same transaction_id updates instead of duplicating"""
+    ld.load(sqlite_engine, processed_frame(), mode="insert", table=TEST_TABLE)
+    ld.load(sqlite_engine, processed_frame(fraud_reason="high_amount"), mode="insert", table=TEST_TABLE)
+
+    result = fetch(sqlite_engine)
+    assert len(result) == 5
+    assert result.loc[1, "fraud_reason"] == "high_amount"
+
+
+def changed_batch(df):
+    """Same rows with one amount changed, the last row dropped and two new rows"""
+    again = pd.concat([df.iloc[:-1], processed_frame(len(df) + 2).iloc[len(df):]], ignore_index=True)
+    again.loc[2, "amount"] += 0.01
+    return again
+
+
+def ingestion_times(engine):
+    with engine.connect() as conn:
+        return dict(conn.execute(text(f"SELECT transaction_id, ingestion_time FROM {TEST_TABLE}")).all())
+
+
+def test_upsert_skips_unchanged_rows(sqlite_engine):
+    """Only rows whose row_hash differs are rewritten; counts are reported separately"""
+    df = processed_frame(10)
+    stats = ld.load(sqlite_engine, df, mode="insert", table=TEST_TABLE)
+    assert (stats["inserted"], stats["updated"], stats["unchanged"]) == (10, 0, 0)
+    with sqlite_engine.begin() as conn:
+        conn.execute(text(f"UPDATE {TEST_TABLE} SET ingestion_time = '2000-01-01 00:00:00'"))
+
+    stats = ld.load(sqlite_engine, changed_batch(df), mode="insert", table=TEST_TABLE, batch_rows=4)
+    assert (stats["rows"], stats["inserted"], stats["updated"], stats["unchanged"]) == (11, 2, 1, 8)
+    times = ingestion_times(sqlite_engine)
+    assert [t for t, v in sorted(times.items()) if v != "2000-01-01 00:00:00"] == ["tx-10", "tx-11", "tx-2"]
+    stored = fetch(sqlite_engine).set_index("transaction_id")["row_hash"]
+    expected = ld.prepare_frame(changed_batch(df)).set_index("transaction_id")["row_hash"]
+    assert stored[expected.index].tolist() == expected.tolist()
+
+
+def test_row_hash_column_added_to_existing_table(tmp_path):
+    """A table created before row_hash gets the column; its rows count as updated once"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        ddl = ld.FACT_COLUMNS_DDL.replace("  row_hash           BIGINT,\n", "")
+        conn.execute(text(f"CREATE TABLE {TEST_TABLE} ({ddl}, PRIMARY KEY (transaction_id))"))
+    rows = ld._records(ld.prepare_frame(processed_frame()).drop(columns="row_hash"), naive_times=True)
+    with engine.begin() as conn:
+        conn.execute(text(f"INSERT INTO {TEST_TABLE} ({','.join(ld.LOAD_COLUMNS)}) "
+                          f"VALUES ({','.join(':' + c for c in ld.LOAD_COLUMNS)})"), rows)
+
+    ld.ensure_table(engine, TEST_TABLE, with_rollups=False)
+    stats = ld.load(engine, processed_frame(), mode="insert", table=TEST_TABLE, with_rollups=False)
+    assert (stats["updated"], stats["unchanged"]) == (5, 0)
+    stats = ld.load(engine, processed_frame(), mode="insert", table=TEST_TABLE, with_rollups=False)
+    assert (stats["updated"], stats["unchanged"]) == (0, 5)
+
+
+@pytest.mark.parametrize("mode", ["copy", "insert"])
+def test_partitioned_upsert_skips_unchanged_rows(pg_engine, mode):
+    """The staged merge only rewrites changed rows (no new tuples for the rest)"""
+    df = processed_frame(30)
+    ld.load(pg_engine, df, mode=mode, table=TEST_TABLE)
+    before = ingestion_times(pg_engine)
+
+    stats = ld.load(pg_engine, changed_batch(df), mode=mode, table=TEST_TABLE, workers=2, batch_rows=8)
+    assert (stats["rows"], stats["inserted"], stats["updated"], stats["unchanged"]) == (31, 2, 1, 28)
+    after = ingestion_times(pg_engine)
+    assert sorted(t for t in before if after[t] != before[t]) == ["tx-2"]
+    with pg_engine.connect() as conn:
+        daily = pd.read_sql(text(f"SELECT * FROM {rollup_table(TEST_TABLE, 'daily')}"), conn)
+    assert daily["total_transactions"].sum() == 32
+
+
+def test_copy_upsert_matches_insert(pg_engine):
+    """COPY + set-based upsert stores the same rows as the executemany path"""
+    df = processed_frame(50)
+    ld.load(pg_engine, df, mode="insert", table=TEST_TABLE)
+    expected = fetch(pg_engine).drop(columns=["ingestion_time"])
+
+    with pg_engine.begin() as conn:
+        conn.execute(text(f"TRUNCATE {TEST_TABLE}"))
+    stats = ld.load(pg_engine, df, mode="copy", table=TEST_TABLE)
+    assert stats["mode"] == "copy"
+    assert stats["rows"] == 50
+    pd.testing.assert_frame_equal(fetch(pg_engine).drop(columns=["ingestion_time"]), expected)
+
+    # Upsert: konflik di-update, duplikat di dalam batch -> baris terakhir menang
+    again = pd.concat([processed_frame(50, fraud_reason="high_amount"), processed_frame(2)], ignore_index=True)
+    ld.load(pg_engine, again, mode="copy", table=TEST_TABLE)
+    result = fetch(pg_engine)
+    assert len(result) == 50
+    assert result.loc[result["transaction_id"] == "tx-1", "fraud_reason"].item() == "crypto_merchant"
+
+
+def test_partition_frame_is_disjoint_and_stable():
+    """Every row lands in exactly one slice, always the same one"""
+    df = processed_frame(200)
+    slices = ld.partition_frame(df, 4)
+
+    assert sum(len(s) for s in slices) == 200
+    assert set().union(*[set(s["transaction_id"]) for s in slices]) == set(df["transaction_id"])
+    again = ld.partition_frame(df.iloc[::-1], 4)
+    assert [set(s["transaction_id"]) for s in slices] == [set(s["transaction_id"]) for s in again]
+
+
+def test_batched_load_retries_failed_batch(sqlite_engine, monkeypatch):
+    """A failing batch is retried on its own; committed batches are not redone"""
+    calls = {"n": 0}
+    original = ld._upsert_rows
+
+    def flaky(conn, df_load, table):
+        calls["n"] += 1
+        if calls["n"] == 2:
+            raise RuntimeError("connection reset")
+        return original(conn, df_load, table)
+
+    monkeypatch.setattr(ld, "_upsert_rows", flaky)
+    monkeypatch.setattr(ld, "LOAD_RETRY_DELAY", 0)
+    stats = ld.load(sqlite_engine, processed_frame(5), mode="insert", table=TEST_TABLE, workers=1, batch_rows=2)
+
+    worker = stats["workers"][0]
+    assert worker["batches"] == 3
+    assert worker["retries"] == 1
+    assert calls["n"] == 4
+    assert len(fetch(sqlite_engine)) == 5
+
+
+def test_parallel_copy_load(pg_engine):
+    """Parallel slices on pooled connections load every row once and report per-worker stats"""
+    engine = ld.get_engine(TEST_POSTGRES_URI, pool_size=3)
+    stats = ld.load(engine, processed_frame(300), mode="copy", table=TEST_TABLE, workers=3, batch_rows=40)
+
+    assert stats["rows"] == 300
+    assert len(stats["workers"]) == 3
+    assert all(w["rows_per_sec"] > 0 and w["lock_wait_seconds"] >= 0 for w in stats["workers"])
+    assert len(fetch(pg_engine)) == 300
+
+
+def test_parallel_load_reports_rollup_lock_wait(pg_engine):
+    """Waiting for the rollup advisory lock counts as lock wait"""
+    holder = pg_engine.connect()
+    tx = holder.begin()
+    rollups.lock_rollups(holder, TEST_TABLE)
+    stats = {}
+    loader = threading.Thread(target=lambda: stats.update(
+        ld.load(pg_engine, processed_frame(20), mode="insert", table=TEST_TABLE, workers=1, batch_rows=20)))
+    loader.start()
+    try:
+        # Lepas lock baru setelah worker benar-benar menunggu advisory lock
+        with pg_engine.connect() as probe:
+            for _ in range(200):
+                if probe.execute(text("SELECT count(*) FROM pg_locks "
+                                      "WHERE locktype = 'advisory' AND NOT granted")).scalar():
+                    break
+                time.sleep(0.05)
+        time.sleep(0.5)
+        tx.commit()
+    finally:
+        loader.join()
+        holder.close()
+    assert stats["workers"][0]["lock_wait_seconds"] >= 0.4
+    assert stats["lock_wait_seconds"] >= 0.4
+
+
+def partition_of(engine, transaction_id):
+    with engine.connect() as conn:
+        return conn.execute(text(f"SELECT tableoid::regclass::text FROM {TEST_TABLE} "
+                                 f"WHERE transaction_id = :t"), {"t": transaction_id}).scalars().all()
+
+
+def test_partitioned_table_with_brin(pg_engine):
+    """New PostgreSQL tables are partitioned by month with upcoming partitions and a BRIN index"""
+    with pg_engine.connect() as conn:
+        assert partitions.is_partitioned(conn, TEST_TABLE)
+        indexes = conn.execute(text("SELECT indexdef FROM pg_indexes WHERE tablename = :t"),
+                               {"t": TEST_TABLE}).scalars().all()
+        children = conn.execute(text("SELECT inhrelid::regclass::text FROM pg_inherits "
+                                     "WHERE inhparent = CAST(:t AS regclass)"), {"t": TEST_TABLE}).scalars().all()
+    assert any("brin" in d.lower() and "event_time" in d for d in indexes)
+    upcoming = {partitions.partition_name(TEST_TABLE, m) for m in partitions.upcoming_months()}
+    assert upcoming <= set(children)
+
+
+@pytest.mark.parametrize("mode", ["copy", "insert"])
+def test_partitioned_upsert_keyed_on_transaction_id(pg_engine, mode):
+    """Upserts stay keyed on transaction_id, also when a row moves to another month"""
+    df = processed_frame(20)
+    ld.load(pg_engine, df, mode=mode, table=TEST_TABLE)
+    assert partition_of(pg_engine, "tx-3") == [f"{TEST_TABLE}_p202401"]
+
+    moved = df.iloc[[3, 4]].copy()
+    moved.loc[moved.index[0], "event_time"] = pd.Timestamp("2024-02-15 09:00")
+    moved.loc[moved.index[1], "fraud_reason"] = "high_amount"
+    ld.load(pg_engine, moved, mode=mode, table=TEST_TABLE, workers=2, batch_rows=1)
+
+    result = fetch(pg_engine)
+    assert len(result) == 20
+    assert partition_of(pg_engine, "tx-3") == [f"{TEST_TABLE}_p202402"]
+    assert result.loc[result["transaction_id"] == "tx-4", "fraud_reason"].item() == "high_amount"
+    with pg_engine.connect() as conn:
+        keys = conn.execute(text(f"SELECT count(*) FROM {TEST_TABLE}_keys")).scalar()
+        daily = pd.read_sql(text(f"SELECT * FROM {rollup_table(TEST_TABLE, 'daily')} ORDER BY 1"), conn)
+    assert keys == 20
+    assert daily["total_transactions"].tolist() == [19, 1]
+
+
+def test_partition_bounds_ignore_session_time_zone(pg_engine, monkeypatch):
+    """Bounds carry the EVENT_TIMEZONE offset; rows of a month without a partition wait in DEFAULT"""
+    drop_pg_tables(pg_engine)
+    jakarta = create_engine(TEST_POSTGRES_URI, connect_args={"options": "-c timezone=Asia/Jakarta"})
+    ld.ensure_table(jakarta, TEST_TABLE)
+    df = processed_frame(3)
+    df["event_time"] = pd.to_datetime(["2024-01-31 23:30", "2024-02-01 00:30", "2019-06-10 12:00"])
+    # Bulan 2019-06 belum punya partisi (mis. dibuat load lain sesudah partisi disiapkan)
+    monkeypatch.setattr(ld.partitions, "months_of", lambda times: [date(2024, 1, 1), date(2024, 2, 1)])
+    ld.load(jakarta, df, mode="insert", table=TEST_TABLE)
+    assert partition_of(jakarta, "tx-0") == [f"{TEST_TABLE}_p202401"]
+    assert partition_of(jakarta, "tx-1") == [f"{TEST_TABLE}_p202402"]
+    assert partition_of(jakarta, "tx-2") == [f"{TEST_TABLE}_pdefault"]
+
+    with jakarta.begin() as conn:
+        assert partitions.ensure_partitions(conn, TEST_TABLE, [date(2019, 6, 1)]) == [f"{TEST_TABLE}_p201906"]
+    assert partition_of(jakarta, "tx-2") == [f"{TEST_TABLE}_p201906"]
+    assert len(fetch(jakarta)) == 3
+    jakarta.dispose()
+
+
+def test_migrate_heap_table_to_partitions(pg_engine):
+    """An existing heap table is converted in place, keeping every row"""
+    drop_pg_tables(pg_engine)
+    with pg_engine.begin() as conn:
+        conn.execute(text(f"CREATE TABLE {TEST_TABLE} ({ld.FACT_COLUMNS_DDL}, PRIMARY KEY (transaction_id))"))
+    ld.load(pg_engine, processed_frame(30), mode="copy", table=TEST_TABLE, with_rollups=False)
+
+    with pg_engine.begin() as conn:
+        assert partitions.migrate_to_partitioned(conn, TEST_TABLE, ld.FACT_COLUMNS_DDL) == 30
+        assert partitions.is_partitioned(conn, TEST_TABLE)
+    ld.load(pg_engine, processed_frame(35), mode="copy", table=TEST_TABLE, with_rollups=False)
+    assert len(fetch(pg_engine)) == 35
+
+
+@pytest.mark.parametrize("mode", ["copy", "insert"])
+def test_replace_range_swaps_one_day(engine, mode):
+    """The day's DB rows are replaced by the batch in one transaction; API rows, other days and rollups stay right"""
+    df = transactions(120)
+    df.loc[::2, "source"] = "DB"
+    ld.load(engine, df, "insert", ROLLUP_TABLE, workers=1)
+    start, end = pd.Timestamp("2024-01-02"), pd.Timestamp("2024-01-03")
+    in_day = (df["event_time"] >= start) & (df["event_time"] < end)
+    day_db = df[in_day & (df["source"] == "DB")]
+
+    batch = day_db.iloc[1:].copy()  # baris pertama hilang dari sumber
+    batch.loc[batch.index[0], "amount"] = 123.45
+    moved = df[~in_day & (df["source"] == "DB")].iloc[[0]].assign(event_time=start + pd.Timedelta(hours=1))
+    batch = pd.concat([batch, moved, moved.assign(amount=7.0)])  # id dobel: baris terakhir menang
+    stats = ld.replace_range(engine, batch, start, end, mode, ROLLUP_TABLE)
+
+    expected = pd.concat([df.drop(index=day_db.index.union(moved.index)),
+                          batch.drop_duplicates("transaction_id", keep="last")])
+    assert stats["deleted"] == len(day_db) + 1 and stats["inserted"] == len(day_db) == stats["rows"]
+    with engine.connect() as conn:
+        got = pd.read_sql(text(f"SELECT transaction_id, amount, source FROM {ROLLUP_TABLE} "
+                               f"ORDER BY transaction_id"), conn)
+    want = expected.sort_values("transaction_id")[["transaction_id", "amount", "source"]].reset_index(drop=True)
+    pd.testing.assert_frame_equal(got.astype({"amount": float}), want, check_exact=False)
+    assert_matches_rebuild(engine)
+
+    with pytest.raises(ValueError, match="outside the replaced range"):
+        ld.replace_range(engine, df[~in_day].head(3), start, end, mode, ROLLUP_TABLE)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
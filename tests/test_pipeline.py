@@ -0,0 +1,209 @@
+"""
+Unit tests for pipeline.py (in-process runner)
+
+The end-to-end runs extract the small mock files of test_transform and load
+into SQLite.
+"""
+
+import time
+
+import pytest
+import pandas as pd
+from sqlalchemy import create_engine, text
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scripts import pipeline
+from tests.test_transform import make_raw_files
+
+# Modul stage seperti yang diimpor pipeline (lewat sys.path scripts/), supaya monkeypatch kena
+api_stage, db_stage = pipeline.api_stage, pipeline.db_stage
+tr, ld = pipeline.transform_stage, pipeline.load_stage
+
+
+@pytest.fixture
+def stage_paths(tmp_path, monkeypatch):
+    """Point every stage at tmp_path (mock sources, stage files, SQLite warehouse)"""
+    api_src, db_src = make_raw_files(tmp_path)
+    raw, proc = tmp_path / "raw", tmp_path / "processed"
+    monkeypatch.setenv("METRICS_DIR", str(tmp_path / "metrics"))
+    monkeypatch.setattr(api_stage, "SRC_FILE", str(api_src))
+    monkeypatch.setattr(api_stage, "EXTRACTED_FILE", str(raw / "api_extracted.parquet"))
+    monkeypatch.setattr(db_stage, "CSV_FILE", str(db_src))
+    monkeypatch.setattr(db_stage, "EXTRACTED_FILE", str(raw / "db_extracted.parquet"))
+    monkeypatch.setattr(tr, "API_FILE", str(raw / "api_extracted.parquet"))
+    monkeypatch.setattr(tr, "DB_FILE", str(raw / "db_extracted.parquet"))
+    monkeypatch.setattr(tr, "OUT_FILE", str(proc / "cleaned_transactions.parquet"))
+    monkeypatch.setattr(ld, "DATA_FILE", str(proc / "cleaned_transactions.parquet"))
+    monkeypatch.setattr(ld, "DEDUP_INDEX_FILE", str(tmp_path / "state" / "loaded.sqlite"))
+    monkeypatch.setattr(pipeline, "STAGE_CACHE_DIR", str(tmp_path / "cache"))
+    return tmp_path
+
+
+def warehouse(tmp_path, name):
+    engine = create_engine(f"sqlite:///{tmp_path / name}")
+    with engine.connect() as conn:
+        return pd.read_sql(text("SELECT * FROM fact_transactions ORDER BY transaction_id"), conn) \
+            .drop(columns=["ingestion_time"])
+
+
+def run(tmp_path, monkeypatch, handoff, name, **kwargs):
+    monkeypatch.setattr(ld, "POSTGRES_URI", f"sqlite:///{tmp_path / name}")
+    return pipeline.run_pipeline(handoff, transform_mode="memory", load_mode="insert", load_workers=1,
+                                 event_state=False, dedup_index=False, run_id=f"run-{handoff}", **kwargs)
+
+
+def count_calls(monkeypatch, calls):
+    """Count the stage runs that actually execute (cache hits do not call them)"""
+    for name, module in [("extract_api", api_stage), ("extract_db", db_stage), ("transform", tr), ("load", ld)]:
+        def counted(*args, _run=module.run, _name=name, **kwargs):
+            calls.append(_name)
+            return _run(*args, **kwargs)
+        monkeypatch.setattr(module, "run", counted)
+
+
+def test_memory_handoff_matches_files(stage_paths, monkeypatch):
+    """Frames passed in memory load the same rows as the stage-file chain, without writing stage files"""
+    memory = run(stage_paths, monkeypatch, "memory", "memory.db")
+    assert not os.path.exists(tr.OUT_FILE) and not os.path.exists(api_stage.EXTRACTED_FILE)
+    files = run(stage_paths, monkeypatch, "files", "files.db")
+    assert os.path.exists(tr.OUT_FILE)
+
+    pd.testing.assert_frame_equal(warehouse(stage_paths, "memory.db"), warehouse(stage_paths, "files.db"))
+    assert memory["results"]["load"]["inserted"] == files["results"]["load"]["inserted"] > 0
+    assert all("frame" not in r for r in memory["results"].values())
+    assert memory["critical_path"][-2:] == ["transform", "load"]
+    assert os.path.exists(stage_paths / "metrics" / "runs" / "run-memory_pipeline.json")
+    assert os.path.exists(stage_paths / "metrics" / "runs" / "run-memory_transform.json")
+
+
+def test_independent_stages_run_concurrently(monkeypatch, tmp_path):
+    """Stages without dependencies overlap; the critical path follows the slowest chain"""
+    monkeypatch.setenv("ETL_METRICS", "0")
+    seen = {}
+
+    def sleeper(seconds, rows):
+        def stage(inputs, options):
+            time.sleep(seconds)
+            seen.update({name: "frame" in result for name, result in inputs.items()})
+            return {"rows": rows, "frame": pd.DataFrame({"x": range(rows)})}
+        return stage
+
+    stages = {
+        "a": ([], sleeper(0.3, 1)),
+        "b": ([], sleeper(0.1, 2)),
+        "c": (["a", "b"], sleeper(0.1, 3)),
+        "d": (["c"], sleeper(0.0, 4)),
+    }
+    summary = pipeline.run_pipeline("memory", transform_mode="memory", stages=stages, cache=False)
+    assert summary["wall_seconds"] < 0.5 + 0.05
+    assert summary["timings"]["b"]["start"] < summary["timings"]["a"]["end"]
+    assert summary["critical_path"] == ["a", "c", "d"]
+    assert seen == {"a": True, "b": True, "c": True}
+
+    assert pipeline.critical_path({"a": 1.0, "b": 2.0, "c": 0.5}, {n: s[0] for n, s in stages.items()}) \
+        == (["b", "c"], 2.5)
+
+
+def test_failed_stage_stops_downstream(monkeypatch):
+    monkeypatch.setenv("ETL_METRICS", "0")
+    ran = []
+
+    def fail(inputs, options):
+        raise RuntimeError("extract failed")
+
+    stages = {
+        "a": ([], fail),
+        "b": (["a"], lambda inputs, options: ran.append("b") or {}),
+    }
+    with pytest.raises(RuntimeError, match="extract failed"):
+        pipeline.run_pipeline("memory", transform_mode="memory", stages=stages, cache=False)
+    assert ran == []
+
+
+
+def test_db_watermark_committed_only_after_load(monkeypatch, tmp_path):
+    """A failed load leaves the DB watermark where it was; a successful run commits it"""
+    monkeypatch.setenv("ETL_METRICS", "0")
+    monkeypatch.setattr(db_stage, "WATERMARK_FILE", str(tmp_path / "wm.json"))
+    watermark = {"date": "2024-03-26 00:00:00", "id": 50}
+
+    def load_fails(inputs, options):
+        raise RuntimeError("warehouse down")
+
+    stages = {
+        "extract_db": ([], lambda inputs, options: {"rows": 50, "watermark": watermark}),
+        "load": (["extract_db"], load_fails),
+    }
+    with pytest.raises(RuntimeError, match="warehouse down"):
+        pipeline.run_pipeline("memory", transform_mode="memory", stages=stages, cache=False)
+    assert db_stage.load_watermark(db_stage.WATERMARK_FILE) is None
+
+    stages["load"] = (["extract_db"], lambda inputs, options: {"rows": 50})
+    pipeline.run_pipeline("memory", transform_mode="memory", stages=stages, cache=False)
+    assert db_stage.load_watermark(db_stage.WATERMARK_FILE) == watermark
+
+@pytest.mark.parametrize("handoff", ["memory", "files"])
+def test_rerun_resumes_at_failed_stage(stage_paths, monkeypatch, handoff):
+    """A retry after a failed load takes extract/transform outputs from the cache"""
+    fresh = run(stage_paths, monkeypatch, handoff, "fresh.db", cache=False)
+    calls = []
+    count_calls(monkeypatch, calls)
+    load_run = ld.run
+    monkeypatch.setattr(ld, "run", lambda *a, **k: (_ for _ in ()).throw(RuntimeError("warehouse down")))
+    with pytest.raises(RuntimeError, match="warehouse down"):
+        run(stage_paths, monkeypatch, handoff, "retry.db")
+    assert sorted(calls) == ["extract_api", "extract_db", "transform"]
+
+    # Stage file hilang di antara run: diambil lagi dari cache untuk load
+    for path in (api_stage.EXTRACTED_FILE, db_stage.EXTRACTED_FILE, tr.OUT_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+    monkeypatch.setattr(ld, "run", load_run)
+    calls.clear()
+    summary = run(stage_paths, monkeypatch, handoff, "retry.db")
+    assert calls == ["load"]
+    assert sorted(n for n, r in summary["results"].items() if r["cached"]) == ["extract_api", "extract_db", "transform"]
+    assert summary["results"]["transform"]["rows"] == fresh["results"]["transform"]["rows"]
+    pd.testing.assert_frame_equal(warehouse(stage_paths, "retry.db"), warehouse(stage_paths, "fresh.db"))
+
+    calls.clear()
+    summary = run(stage_paths, monkeypatch, handoff, "retry.db")
+    assert calls == [] and all(t["cached"] for t in summary["timings"].values())
+
+
+def test_changed_source_and_force(stage_paths, monkeypatch):
+    """Only stages downstream of a changed input rerun; force reruns cached stages"""
+    run(stage_paths, monkeypatch, "memory", "wh.db")
+    calls = []
+    count_calls(monkeypatch, calls)
+
+    # Output transform identik -> load tetap cache hit
+    run(stage_paths, monkeypatch, "memory", "wh.db", force=["transform"])
+    assert calls == ["transform"]
+
+    calls.clear()
+    db_src = pd.read_csv(db_stage.CSV_FILE)
+    row = db_src["id"].drop_duplicates(keep=False).index[0]
+    db_src.loc[row, "amount"] = 99_000_000.0
+    db_src.to_csv(db_stage.CSV_FILE, index=False)
+    run(stage_paths, monkeypatch, "memory", "wh.db")
+    assert calls == ["extract_db", "transform", "load"]
+    engine = create_engine(f"sqlite:///{stage_paths / 'wh.db'}")
+    with engine.connect() as conn:
+        amount = conn.execute(text("SELECT amount FROM fact_transactions WHERE transaction_id = :t"),
+                              {"t": str(db_src.loc[row, "id"])}).scalar()
+    assert amount == 99_000_000.0
+
+    calls.clear()
+    run(stage_paths, monkeypatch, "memory", "wh.db", force=True)
+    assert sorted(calls) == ["extract_api", "extract_db", "load", "transform"]
+    with pytest.raises(ValueError, match="Unknown stages"):
+        run(stage_paths, monkeypatch, "memory", "wh.db", force=["extract"])
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
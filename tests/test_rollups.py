@@ -0,0 +1,142 @@
+"""
+Unit tests for rollups.py (incremental summary tables maintained by load.py)
+
+Incremental results are compared with a full rebuild of the same rollups.
+Runs on SQLite; the PostgreSQL variant needs TEST_POSTGRES_URI.
+"""
+
+import pytest
+import pandas as pd
+import numpy as np
+from sqlalchemy import create_engine, text
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scripts import load as ld
+from scripts import rollups
+from scripts import export_to_csv
+
+TEST_POSTGRES_URI = os.getenv("TEST_POSTGRES_URI")
+TEST_TABLE = "test_rollup_fact"
+
+
+def transactions(n=60, seed=0, offset=0):
+    rng = np.random.default_rng(seed)
+    fraud = rng.random(n) < 0.3
+    return pd.DataFrame({
+        "transaction_id": [f"tx-{offset + i}" for i in range(n)],
+        "user_id": pd.array([None if i % 17 == 0 else 1000 + i % 5 for i in range(n)], dtype="Int64"),
+        "account_number": None,
+        "amount": np.round(rng.uniform(1e4, 1e8, n), 2),
+        "currency": "IDR",
+        "merchant": rng.choice(["Tokopedia", "Binance", None], n),
+        "transaction_type": None,
+        "status": "completed",
+        "location": rng.choice(["Jakarta", "Bali", None], n),
+        "event_time": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 4 * 86400, n), unit="s"),
+        "source": "API",
+        "is_fraud": fraud.astype(int),
+        "fraud_reason": np.where(fraud, rng.choice(["high_amount", "crypto_merchant"], n), None),
+    })
+
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def engine(request, tmp_path):
+    if request.param == "sqlite":
+        engine = create_engine(f"sqlite:///{tmp_path / 'warehouse.db'}")
+    else:
+        if not TEST_POSTGRES_URI:
+            pytest.skip("TEST_POSTGRES_URI not set")
+        engine = ld.get_engine(TEST_POSTGRES_URI, pool_size=3)
+    drop_all(engine)
+    ld.ensure_table(engine, TEST_TABLE)
+    yield engine
+    drop_all(engine)
+
+
+def drop_all(engine):
+    with engine.begin() as conn:
+        for name in rollups.ROLLUPS:
+            conn.execute(text(f"DROP TABLE IF EXISTS {rollups.rollup_table(TEST_TABLE, name)}"))
+        conn.execute(text(f"DROP TABLE IF EXISTS {TEST_TABLE}"))
+        conn.execute(text(f"DROP TABLE IF EXISTS {TEST_TABLE}_keys"))
+
+
+def snapshot(engine):
+    frames = {}
+    with engine.connect() as conn:
+        for name, (key, *_rest) in rollups.ROLLUPS.items():
+            df = pd.read_sql(text(f"SELECT * FROM {rollups.rollup_table(TEST_TABLE, name)} ORDER BY {key}"), conn)
+            df = df.drop(columns=["updated_at"])
+            df[key] = df[key].astype(str)
+            frames[name] = df.astype({c: float for c in df.columns if c != key})
+    return frames
+
+
+def assert_matches_rebuild(engine):
+    incremental = snapshot(engine)
+    with engine.begin() as conn:
+        rollups.rebuild_rollups(conn, TEST_TABLE)
+    rebuilt = snapshot(engine)
+    for name in rollups.ROLLUPS:
+        pd.testing.assert_frame_equal(incremental[name], rebuilt[name], check_exact=False, obj=name)
+
+
+def test_rollups_follow_inserts_and_updates(engine):
+    """Inserts, fraud-flag flips, amount/day moves and min/max removals keep rollups exact"""
+    mode = "copy" if engine.dialect.name == "postgresql" else "insert"
+    base = transactions(60)
+    ld.load(engine, base, mode=mode, table=TEST_TABLE)
+    assert_matches_rebuild(engine)
+
+    changed = base.iloc[:25].copy()
+    changed["is_fraud"] = 1 - changed["is_fraud"]
+    changed["fraud_reason"] = np.where(changed["is_fraud"] == 1, "burst_activity", None)
+    changed.loc[changed.index[:5], "event_time"] += pd.Timedelta(days=1)
+    # Hapus min/max harian lama: amount jadi nilai tengah
+    day_min = base.groupby(base["event_time"].dt.date)["amount"].idxmin()
+    changed = pd.concat([changed, base.loc[day_min].assign(amount=5e7)])
+    batch = pd.concat([changed, transactions(20, seed=1, offset=1000)], ignore_index=True)
+    ld.load(engine, batch, mode=mode, table=TEST_TABLE, workers=2, batch_rows=7)
+    assert_matches_rebuild(engine)
+
+    total = snapshot(engine)["daily"]["total_transactions"].sum()
+    assert total == 80
+
+
+def test_rollups_built_for_existing_fact_table(engine):
+    """Adding rollups to a populated warehouse backfills them once"""
+    ld.load(engine, transactions(30), mode="insert", table=TEST_TABLE, with_rollups=False)
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE {rollups.rollup_table(TEST_TABLE, 'daily')}"))
+        assert rollups.ensure_rollups(conn, TEST_TABLE)
+
+    assert snapshot(engine)["daily"]["total_transactions"].sum() == 30
+    assert_matches_rebuild(engine)
+
+
+def test_export_summaries_read_rollups(engine, tmp_path):
+    """Exported daily summary matches the fact data"""
+    df = transactions(40)
+    df.loc[df["is_fraud"] == 1, "fraud_reason"] = "crypto_merchant,burst_activity"
+    df.loc[df.index[df["is_fraud"] == 1][:3], "fraud_reason"] = "high_amount"
+    ld.load(engine, df, mode="insert", table=TEST_TABLE)
+
+    exported = export_to_csv.export_summaries(engine, str(tmp_path), table=TEST_TABLE)
+    daily = pd.read_csv(tmp_path / "daily_summary.csv")
+
+    assert exported["daily_summary.csv"] == df["event_time"].dt.date.nunique()
+    assert daily["total_transactions"].sum() == 40
+    assert daily["fraud_count"].sum() == df["is_fraud"].sum()
+    assert daily["max_amount"].max() == pytest.approx(df["amount"].max())
+    reasons = pd.read_csv(tmp_path / "fraud_by_reason.csv").set_index("fraud_reason")
+    assert reasons.loc["crypto_merchant,burst_activity", "fraud_reason_clean"] == "Crypto Merchant + Burst Activity"
+    user = pd.read_csv(tmp_path / "user_summary.csv")
+    assert (user["fraud_count"] > 0).all()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,91 @@
+"""
+Unit tests for schema.py (compact transaction schema)
+"""
+
+import sys
+import os
+
+import numpy as np
+import pandas as pd
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scripts import schema
+from scripts import transform as tr
+
+
+def raw_frame(n=2000):
+    rng = np.random.default_rng(3)
+    return pd.DataFrame({
+        "transaction_id": [f"tx-{i}" for i in range(n)],
+        "user_id": rng.integers(1, 500, n).astype(float),
+        "account_number": [None] * n,
+        "amount": rng.integers(1, 10_000_000, n) / 100,
+        "currency": "IDR",
+        "merchant": rng.choice(["Tokopedia", "Shopee", "Binance"], n),
+        "transaction_type": None,
+        "status": rng.choice(["success", "failed"], n),
+        "location": rng.choice(["Jakarta", "Bandung", "Surabaya"], n),
+        "event_time": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 86400, n), unit="s"),
+        "source": "API",
+    })
+
+
+def test_apply_schema_compacts_and_is_idempotent():
+    df = raw_frame()
+    compact = schema.apply_schema(df)
+
+    assert isinstance(compact["merchant"].dtype, pd.CategoricalDtype)
+    assert compact["transaction_id"].dtype == schema.STRING_DTYPE
+    assert str(compact["user_id"].dtype) == "Int32"
+    assert compact["amount"].dtype == schema.AMOUNT_DTYPE
+    assert compact["event_time"].dtype == schema.EVENT_TIME_DTYPE
+    # Minor unit persis, tanpa galat float
+    assert compact["amount"].tolist() == (df["amount"] * 100).round().astype(np.int64).tolist()
+    np.testing.assert_array_equal(schema.to_float(compact["amount"]), df["amount"].to_numpy())
+    assert compact["event_time"].dt.tz_localize(None).equals(df["event_time"].astype("datetime64[us]"))
+
+    pd.testing.assert_frame_equal(schema.apply_schema(compact), compact)
+    pd.testing.assert_frame_equal(schema.apply_schema(schema.to_storage(compact)), compact)
+    assert sum(schema.memory_usage(compact).values()) < sum(schema.memory_usage(df).values()) / 2
+
+
+def test_apply_schema_widens_ids_and_converts_time_zones():
+    df = pd.DataFrame({
+        "user_id": [1, 2 ** 40, None],
+        "amount": ["10.5", "abc", None],
+        "event_time": ["2024-01-01T10:00:00+07:00", "2024-01-01T10:00:00Z", "not a date"],
+    })
+    compact = schema.apply_schema(df)
+    assert str(compact["user_id"].dtype) == "Int64"
+    assert compact["amount"].tolist()[0] == 1050 and compact["amount"].isna().tolist() == [False, True, True]
+    assert compact["event_time"].tolist()[:2] == [pd.Timestamp("2024-01-01 03:00", tz="UTC"),
+                                                  pd.Timestamp("2024-01-01 10:00", tz="UTC")]
+    assert pd.isna(compact["event_time"].iloc[2])
+
+
+def test_ambiguous_wall_times_are_kept(monkeypatch, caplog):
+    """The hour repeated when DST ends is read as its first occurrence and logged, not turned into NaT"""
+    monkeypatch.setattr(schema, "EVENT_TIMEZONE", "Europe/Berlin")
+    monkeypatch.setattr(schema, "EVENT_TIME_DTYPE", pd.DatetimeTZDtype("us", "Europe/Berlin"))
+    times = schema.to_event_time(pd.Series(["2024-10-27 02:30:00", "2024-10-27 04:00:00", "2024-03-31 02:30:00"]))
+    assert times.notna().all()
+    assert times.dt.tz_convert("UTC").tolist() == [pd.Timestamp("2024-10-27 00:30", tz="UTC"),
+                                                   pd.Timestamp("2024-10-27 03:00", tz="UTC"),
+                                                   pd.Timestamp("2024-03-31 01:00", tz="UTC")]
+    assert "1 event times are ambiguous" in caplog.text
+
+
+def test_transform_output_uses_compact_schema():
+    api = pd.DataFrame({
+        "transaction_id": ["a1", "a2"], "user_id": [1, 2], "amount": [60_000_000.0, 1000.25],
+        "currency": "IDR", "merchant": ["Binance", "Shopee"], "status": "success", "location": "Jakarta",
+        "timestamp": ["2024-01-01 10:00:00", "2024-01-01 10:05:00"],
+    })
+    db = pd.DataFrame(columns=["id", "user_id", "account_number", "amount", "transaction_type", "date", "location"])
+    out = tr.transform(api, db)
+    assert out["is_fraud"].dtype == np.int8
+    assert out["amount"].tolist() == [6_000_000_000, 100_025]
+    assert out["fraud_reason"].tolist() == ["high_amount,crypto_merchant", None]
+    assert schema.to_storage(out)["amount"].tolist() == [60_000_000.0, 1000.25]
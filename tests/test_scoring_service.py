@@ -0,0 +1,141 @@
+"""
+Unit tests for scoring_service.py (online scoring with the batch fraud rules)
+"""
+
+import pytest
+import pandas as pd
+import numpy as np
+import asyncio
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scripts import scoring_service as ss
+from scripts import transform as tr
+from scripts.event_state import EventStateStore
+from scripts.rule_engine import load_rules
+
+
+def normalized_rows(n=300, seed=3):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "transaction_id": [f"tx-{i}" for i in range(n)],
+        "user_id": rng.integers(1, 4, n),
+        "amount": rng.uniform(1e4, 8e7, n).round(2),
+        "merchant": rng.choice(["Tokopedia", "Binance", "OVO"], n),
+        "event_time": pd.Timestamp("2024-01-01") + pd.to_timedelta(np.sort(rng.integers(0, 3 * 3600, n)), unit="s"),
+    })
+    df.loc[::29, "user_id"] = None
+    return df
+
+
+def records(df):
+    out = df.astype({"event_time": str}).astype(object).where(df.notna(), None).to_dict(orient="records")
+    for record in out:
+        if record["user_id"] is not None:
+            record["user_id"] = int(record["user_id"])
+    return out
+
+
+def test_concurrent_requests_are_micro_batched_and_match_batch_rules():
+    """Requests in event_time order get the same flags as the batch transform, in few batches"""
+    df = normalized_rows()
+    expected = tr.apply_fraud_rules(df.copy())
+
+    async def run():
+        service = ss.ScoringService(load_rules(), max_batch=64, max_wait_ms=5)
+        await service.start()
+        try:
+            results = await asyncio.gather(*(service.score(r) for r in records(df)))
+        finally:
+            await service.stop()
+        return service, results
+
+    service, results = asyncio.run(run())
+
+    assert [r["transaction_id"] for r in results] == df["transaction_id"].tolist()
+    assert [r["fraud_reason"] for r in results] == expected["fraud_reason"].tolist()
+    assert [r["is_fraud"] for r in results] == expected["is_fraud"].tolist()
+    assert expected["fraud_reason"].str.contains("burst_activity").any()
+    assert service.stats["batches"] <= len(df) // 64 + 1
+    assert service.stats["max_batch"] == 64
+
+
+def test_user_windows_evict_and_ignore_resubmitted_transaction():
+    """A resubmitted transaction does not count itself; old events leave the window"""
+    windows = ss.UserWindows(pd.Timedelta("10min"))
+    minute = pd.Timedelta("1min").value
+    for i in range(5):
+        windows.add(7, i * minute, f"t{i}")
+    windows.add(7, 4 * minute, "t4")
+
+    assert windows.count(7, 5 * minute, 10 * minute, "t5") == 5
+    assert windows.count(7, 4 * minute, 10 * minute, "t4") == 4
+    windows.add(7, 30 * minute, "t30")
+    assert windows.events[7] == [(30 * minute, "t30")]
+    windows.add(8, 60 * minute, "u1")
+    assert windows.sweep() == 1 and 7 not in windows
+
+
+def test_user_windows_replace_resent_transaction_with_new_time():
+    """A transaction resent with a different event_time moves instead of counting twice"""
+    windows = ss.UserWindows(pd.Timedelta("10min"))
+    minute = pd.Timedelta("1min").value
+    for i in range(3):
+        windows.add(7, i * minute, f"t{i}")
+    windows.add(7, 5 * minute, "t1")
+
+    assert windows.events[7] == [(0, "t0"), (2 * minute, "t2"), (5 * minute, "t1")]
+    assert windows.count(7, 6 * minute, 10 * minute, "t9") == 3
+    assert windows.count(7, 6 * minute, 10 * minute, "t1") == 2
+    windows.add(7, 20 * minute, "t3")
+    assert windows.events[7] == [(20 * minute, "t3")] and windows.ids[7] == {"t3": 20 * minute}
+
+
+def test_service_warms_windows_from_event_state(tmp_path):
+    """A burst that started before the service came up is still detected"""
+    state = EventStateStore(str(tmp_path / "user_events.sqlite"))
+    earlier = pd.DataFrame({"transaction_id": [f"old-{i}" for i in range(4)], "user_id": 9,
+                            "event_time": pd.date_range("2024-01-01 01:55", periods=4, freq="1min")})
+    state.update(earlier)
+    state.commit()
+    service = ss.ScoringService(load_rules(), state=state)
+
+    result = service.score_batch([
+        {"transaction_id": "new-1", "user_id": 9, "amount": 1000, "event_time": "2024-01-01 02:00:00"},
+        {"transaction_id": "new-2", "user_id": 9, "amount": 1000, "event_time": "2024-01-01 02:01:00"},
+    ])
+    state.close()
+
+    assert [r["fraud_reason"] for r in result] == [None, "burst_activity"]
+
+
+def test_http_score_and_health():
+    """POST /score returns the flags; bad bodies get 400; /health reports stats"""
+    from aiohttp.test_utils import TestClient, TestServer
+
+    async def run():
+        service = ss.ScoringService(load_rules(), max_wait_ms=1)
+        async with TestClient(TestServer(ss.make_app(service))) as client:
+            resp = await client.post("/score", json={
+                "transaction_id": "x1", "user_id": 1, "amount": 60_000_000,
+                "merchant": "Binance", "event_time": "2024-01-01T10:00:00"})
+            scored = (resp.status, await resp.json())
+            bad = await client.post("/score", json={"transaction_id": "x2", "amount": "abc",
+                                                    "event_time": "2024-01-01"})
+            missing = await client.post("/score", data=b"{not json")
+            health = await (await client.get("/health")).json()
+        return scored, bad.status, missing.status, health
+
+    scored, bad, missing, health = asyncio.run(run())
+
+    assert scored == (200, {"transaction_id": "x1", "is_fraud": 1, "fraud_reason": "high_amount,crypto_merchant"})
+    assert bad == 400 and missing == 400
+    assert health["requests"] == 1
+    assert health["rules"]["high_amount"]["hits"] == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -4,13 +4,57 @@ Unit tests for transform.py
 
 import pytest
 import pandas as pd
+import numpy as np
+import json
 import sys
 import os
 
 # Add parent directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-from scripts.data_quality import check_data_quality, validate_transaction_data
+from scripts.data_quality import QualityProfile, check_data_quality, validate_transaction_data
+from scripts.external_sort import ExternalSorter
+from scripts.utils import iter_json_array
+from scripts.window_count import window_counts, window_counts_by_key
+from scripts.rule_engine import RuleEngine, load_rules
+from scripts.event_state import EventStateStore
+from scripts.intermediate import read_frame, open_writer
+from scripts.extract_api import API_DTYPES
+from scripts.extract_db import EXTRACT_DTYPES
+from scripts.schema import to_storage
+from scripts import transform as tr
+
+
+def make_raw_files(tmp_path, n_api=400, n_db=300, seed=7):
+    """Write small api/db extracts with duplicates, bursts and fraud cases"""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2024-01-01")
+    # Detik unik per baris supaya tidak ada (user_id, event_time) kembar
+    seconds = rng.permutation(4 * 3600)[:n_api + n_db]
+    api = pd.DataFrame({
+        "transaction_id": [f"api-{i}" for i in rng.integers(0, n_api * 0.8, n_api)],
+        "user_id": rng.integers(1, 6, n_api),
+        "amount": rng.uniform(-1e7, 8e7, n_api).round(2),
+        "currency": "IDR",
+        "timestamp": [(start + pd.Timedelta(seconds=int(s))).isoformat() for s in seconds[:n_api]],
+        "merchant": rng.choice(["Tokopedia", "Binance", "OVO"], n_api),
+        "status": "completed",
+        "location": "Jakarta",
+    })
+    api.loc[5::37, "timestamp"] = "not-a-date"
+    db = pd.DataFrame({
+        "id": rng.integers(10_000, 10_200, n_db),
+        "user_id": rng.integers(1, 6, n_db),
+        "account_number": rng.integers(10**9, 10**10, n_db).astype(str),
+        "amount": rng.uniform(1e4, 6e7, n_db).round(2),
+        "transaction_type": rng.choice(["debit", "credit"], n_db),
+        "date": [(start + pd.Timedelta(seconds=int(s))).strftime("%Y-%m-%d %H:%M:%S") for s in seconds[n_api:]],
+        "location": "Bali",
+    })
+    api_path, db_path = tmp_path / "api_extracted.json", tmp_path / "db_extracted.csv"
+    api_path.write_text(json.dumps(api.to_dict(orient="records")))
+    db.to_csv(db_path, index=False)
+    return api_path, db_path
 
 
 def test_check_data_quality():
@@ -59,6 +103,331 @@ def test_validate_transaction_data_missing_columns():
         validate_transaction_data(df)
 
 
+def same_quality(a, b):
+    """Quality results match (amount mean up to float summation order)"""
+    mean_a = a["checks"]["ranges"]["amount"].pop("mean")
+    mean_b = b["checks"]["ranges"]["amount"].pop("mean")
+    return a == b and mean_a == pytest.approx(mean_b)
+
+
+def test_quality_profile_merges_chunks():
+    """Profiles of chunks merge into the profile of the whole frame, including cross-chunk duplicates"""
+    rng = np.random.default_rng(5)
+    n = 3000
+    df = pd.DataFrame({
+        "transaction_id": [f"tx-{i}" for i in rng.integers(0, 2500, n)],
+        "user_id": pd.array(np.where(rng.random(n) < 0.05, None, rng.integers(1, 50, n)), dtype="Int64"),
+        "amount": rng.uniform(-100, 1e6, n).round(2),
+        "event_time": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 86400, n), unit="s"),
+    })
+    whole = QualityProfile.of(df)
+    merged = QualityProfile()
+    for start in range(0, n, 700):
+        merged.merge(QualityProfile.of(df.iloc[start:start + 700]))
+
+    expected = check_data_quality(df)
+    assert expected["checks"]["duplicates"]["count"] == int(df["transaction_id"].duplicated().sum())
+    assert same_quality(merged.results(), expected) and same_quality(whole.results(), check_data_quality(df))
+    assert expected["checks"]["ranges"]["amount"]["negative_count"] == int((df["amount"] < 0).sum())
+    assert expected["checks"]["nulls"]["columns_with_nulls"] == {"user_id": int(df["user_id"].isna().sum())}
+
+    # Sampling melacak id yang sama di setiap chunk: estimasi duplikat tetap dekat
+    sampled = QualityProfile(sample_rate=0.25)
+    for start in range(0, n, 700):
+        sampled.merge(QualityProfile.of(df.iloc[start:start + 700], sample_rate=0.25))
+    result = sampled.results()["checks"]["duplicates"]
+    assert result["sampled"] and result["count"] == pytest.approx(expected["checks"]["duplicates"]["count"], rel=0.2)
+    with pytest.raises(ValueError):
+        merged.merge(sampled)
+
+
+def test_quality_profile_merges_empty_chunks():
+    """Merging only empty chunks keeps their columns, so a day without new data still validates"""
+    empty = pd.DataFrame({"transaction_id": pd.Series(dtype="string"), "user_id": pd.Series(dtype="Int64"),
+                          "amount": pd.Series(dtype="float64"), "event_time": pd.Series(dtype="datetime64[us]")})
+    merged = QualityProfile()
+    merged.merge(QualityProfile.of(empty)).merge(QualityProfile.of(empty))
+
+    assert merged.rows == 0 and merged.columns == list(empty.columns)
+    assert merged.nulls == {col: 0 for col in empty.columns}
+    assert merged.validate()
+    assert merged.results(["nulls", "duplicates"])["checks"]["duplicates"]["count"] == 0
+
+    merged.merge(QualityProfile.of(pd.DataFrame({"transaction_id": ["tx-1"], "user_id": [1], "amount": [None],
+                                                 "event_time": [pd.Timestamp("2024-01-01")]})))
+    assert merged.rows == 1 and merged.nulls["amount"] == 1
+
+
+@pytest.mark.parametrize("mode", ["chunked", "parallel"])
+def test_transform_run_on_empty_stage_files(tmp_path, monkeypatch, mode):
+    """Empty (typed) extracts give an empty output instead of failing the quality step"""
+    api_path, db_path = str(tmp_path / "api_extracted.parquet"), str(tmp_path / "db_extracted.parquet")
+    with open_writer(api_path, API_DTYPES), open_writer(db_path, EXTRACT_DTYPES):
+        pass
+    monkeypatch.setenv("METRICS_DIR", str(tmp_path / "metrics"))
+    monkeypatch.setattr(tr, "API_FILE", api_path)
+    monkeypatch.setattr(tr, "DB_FILE", db_path)
+
+    out_path = str(tmp_path / "cleaned.parquet")
+    result = tr.run(mode=mode, out_path=out_path, spill_dir=str(tmp_path / "spill"), workers=2, event_state=False)
+
+    assert result["rows"] == 0
+    assert list(read_frame(out_path).columns) == tr.OUTPUT_COLUMNS
+
+
+def test_iter_json_array_batches(tmp_path):
+    """JSON array is streamed in batches, even across read buffer boundaries"""
+    path = tmp_path / "data.json"
+    records = [{"id": i, "text": "x" * (i % 7)} for i in range(25)]
+    path.write_text(json.dumps(records, indent=2))
+
+    batches = list(iter_json_array(str(path), batch_size=10, read_size=16))
+
+    assert [len(b) for b in batches] == [10, 10, 5]
+    assert sum(batches, []) == records
+
+
+def test_external_sorter_multi_pass(tmp_path):
+    """Many small runs are merged back into one globally sorted stream"""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"k": rng.integers(0, 20, 500), "seq": np.arange(500)})
+
+    with ExternalSorter(["k", "seq"], run_rows=30, block_rows=7, spill_dir=str(tmp_path), fan_in=3) as sorter:
+        for start in range(0, len(df), 45):
+            sorter.add(df.iloc[start:start + 45])
+        out = pd.concat(list(sorter.sorted_blocks()), ignore_index=True)
+
+    expected = df.sort_values(["k", "seq"], ignore_index=True)
+    pd.testing.assert_frame_equal(out, expected)
+
+
+def test_transform_chunked_matches_memory(tmp_path):
+    """Chunked mode gives the same rows, dedup and fraud flags as the in-memory path"""
+    api_path, db_path = make_raw_files(tmp_path)
+    out_path = tmp_path / "cleaned.csv"
+
+    expected = tr.transform(tr.read_api(str(api_path)), tr.read_db(str(db_path)))
+    profile = QualityProfile()
+    rows = tr.transform_chunked(str(api_path), str(db_path), str(out_path),
+                                spill_dir=str(tmp_path / "spill"), chunk_rows=60, profile=profile)
+
+    to_storage(expected).to_csv(tmp_path / "expected.csv", index=False)
+    assert rows == len(expected)
+    assert expected["fraud_reason"].eq("burst_activity").any()
+    checks = ["nulls", "duplicates", "ranges"]
+    assert same_quality(profile.results(checks), check_data_quality(expected, checks))
+
+    def canonical(path):
+        df = pd.read_csv(path)
+        return df.sort_values("transaction_id", ignore_index=True)
+
+    pd.testing.assert_frame_equal(canonical(out_path), canonical(tmp_path / "expected.csv"))
+
+
+def test_transform_parallel_matches_memory(tmp_path):
+    """Parallel mode gives the same rows and flags as the in-memory path, in an order independent of workers"""
+    api_path, db_path = make_raw_files(tmp_path)
+    expected = tr.transform(tr.read_api(str(api_path)), tr.read_db(str(db_path)))
+
+    outputs = {}
+    for workers in (1, 3):
+        out_path = str(tmp_path / f"cleaned_{workers}.parquet")
+        profile = QualityProfile()
+        rows = tr.transform_parallel(str(api_path), str(db_path), out_path, workers=workers, buckets=8,
+                                     spill_dir=str(tmp_path / "spill"), chunk_rows=60, profile=profile)
+        outputs[workers] = read_frame(out_path)
+        assert rows == len(expected)
+        assert profile.results(["duplicates"]) == check_data_quality(expected, ["duplicates"])
+        assert profile.rows == rows
+
+    pd.testing.assert_frame_equal(outputs[1], outputs[3])
+    result = outputs[3].sort_values("transaction_id", ignore_index=True)
+    expected = expected.sort_values("transaction_id", ignore_index=True)
+    assert result["transaction_id"].tolist() == expected["transaction_id"].tolist()
+    assert result["fraud_reason"].fillna("").tolist() == expected["fraud_reason"].fillna("").tolist()
+    assert os.listdir(tmp_path / "spill") == []
+
+
+def test_window_counts_matches_rolling():
+    """Window engine keeps rolling("10min", closed="left") semantics, including tied timestamps"""
+    rng = np.random.default_rng(1)
+    n = 3000
+    df = pd.DataFrame({
+        "user_id": rng.integers(0, 40, n),
+        # Resolusi menit supaya banyak timestamp kembar
+        "event_time": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 600, n), unit="min"),
+        "transaction_id": np.arange(n).astype(str),
+    }).sort_values(["user_id", "event_time"], kind="mergesort", ignore_index=True)
+
+    expected = (df.set_index("event_time")
+                .groupby("user_id")["transaction_id"]
+                .rolling("10min", closed="left")
+                .count()
+                .fillna(0)
+                .astype(int)
+                .to_numpy())
+    times = df["event_time"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+    result = window_counts(df["user_id"].to_numpy(), times, pd.Timedelta("10min").value)
+
+    np.testing.assert_array_equal(result, expected)
+
+    # Unsorted input: packed-key fast path and lexsort fallback (odd ns offsets) agree
+    shuffle = rng.permutation(n)
+    codes = df["user_id"].to_numpy()[shuffle]
+    for offset in (0, 1):
+        shuffled_times = times[shuffle] + offset * (np.arange(n) % 2) * (2**58)
+        by_key = window_counts_by_key(codes, shuffled_times, pd.Timedelta("10min").value)
+        if offset == 0:
+            np.testing.assert_array_equal(by_key, expected[shuffle])
+        order = np.lexsort((shuffled_times, codes))
+        np.testing.assert_array_equal(by_key[order], window_counts(codes[order], shuffled_times[order],
+                                                                   pd.Timedelta("10min").value))
+
+
+def test_burst_rule_with_tied_timestamps():
+    """Events sharing a timestamp are not duplicated and do not count each other"""
+    times = ["2024-01-01 10:00", "2024-01-01 10:01", "2024-01-01 10:02", "2024-01-01 10:03",
+             "2024-01-01 10:04", "2024-01-01 10:05", "2024-01-01 10:05", "2024-01-01 10:20"]
+    df = pd.DataFrame({
+        "transaction_id": [str(i) for i in range(len(times))],
+        "user_id": [1] * len(times),
+        "amount": 1000.0,
+        "merchant": "OVO",
+        "event_time": pd.to_datetime(times),
+    })
+
+    out = tr.apply_fraud_rules(df.copy())
+
+    assert len(out) == len(df)
+    assert out["fraud_reason"].tolist() == [None] * 5 + ["burst_activity"] * 2 + [None]
+
+
+def test_rule_engine_keeps_every_reason():
+    """A row hit by several rules keeps all reasons, in rule order, and stats count each hit"""
+    df = pd.DataFrame({
+        "transaction_id": ["1", "2", "3", "4"],
+        "user_id": [1, 2, 3, None],
+        "amount": [60_000_000.0, 60_000_000.0, 1000.0, np.nan],
+        "merchant": ["Binance", "OVO", "KRAKEN Pro", None],
+        "event_time": pd.to_datetime(["2024-01-01"] * 4),
+    })
+    rules = load_rules()
+
+    flags = rules.evaluate(df)
+    out = rules.apply(df.copy())
+
+    assert flags.tolist() == [0b011, 0b001, 0b010, 0]
+    assert out["fraud_reason"].tolist() == ["high_amount,crypto_merchant", "high_amount", "crypto_merchant", None]
+    assert out["is_fraud"].tolist() == [1, 1, 1, 0]
+    assert rules.stats["high_amount"]["hits"] == 4
+    assert rules.stats["crypto_merchant"]["rows"] == 8
+    assert rules.stats["burst_activity"]["seconds"] > 0
+    assert len(rules.report()) == 3
+
+    # Stats dari worker digabung lewat merge_stats
+    merged = load_rules()
+    merged.merge_stats(rules.stats)
+    merged.merge_stats(rules.stats)
+    assert merged.stats["high_amount"]["hits"] == 8 and merged.stats["crypto_merchant"]["rows"] == 16
+
+
+def test_rule_engine_config_validation():
+    """Unknown rule types, operators, duplicates and missing parameters are rejected"""
+    good = {"name": "big", "type": "threshold", "column": "amount", "op": ">=", "value": 10}
+    assert RuleEngine([good]).evaluate(pd.DataFrame({"amount": [9, 10]})).tolist() == [0, 1]
+
+    for rules in ([{**good, "type": "ml"}], [{**good, "op": "=>"}], [good, good],
+                  [{"name": "p", "type": "pattern", "column": "merchant"}]):
+        with pytest.raises(ValueError):
+            RuleEngine(rules)
+
+
+def api_events(times, ids, user_id=1):
+    return pd.DataFrame({
+        "transaction_id": ids,
+        "user_id": user_id,
+        "amount": 1000.0,
+        "currency": "IDR",
+        "timestamp": times,
+        "merchant": "OVO",
+        "status": "completed",
+        "location": "Jakarta",
+    })
+
+
+EMPTY_DB = pd.DataFrame(columns=["id", "user_id", "account_number", "amount", "transaction_type", "date", "location"])
+
+
+def test_event_state_detects_burst_across_runs(tmp_path):
+    """Events of the previous run count in the burst window; re-extracted rows are not counted twice"""
+    path = str(tmp_path / "state" / "user_events.sqlite")
+    first = api_events(["2024-01-01 01:55", "2024-01-01 01:56", "2024-01-01 01:57", "2024-01-01 01:58"],
+                       ["a1", "a2", "a3", "a4"])
+    with EventStateStore(path, tr.FRAUD_RULES.max_window) as state:
+        assert tr.transform(first, EMPTY_DB, state)["is_fraud"].sum() == 0
+        state.update(first.assign(event_time=pd.to_datetime(first["timestamp"])))
+        state.commit()
+
+    # a4 diekstrak ulang (lookback) di run kedua
+    second = api_events(["2024-01-01 01:58", "2024-01-01 02:01", "2024-01-01 02:02", "2024-01-01 02:06"],
+                        ["a4", "b1", "b2", "b3"])
+    assert tr.transform(second, EMPTY_DB)["is_fraud"].sum() == 0
+    with EventStateStore(path, tr.FRAUD_RULES.max_window) as state:
+        out = tr.transform(second, EMPTY_DB, state)
+        state.update(out)
+        state.commit()
+        assert out["transaction_id"].tolist() == ["a4", "b1", "b2", "b3"]
+        assert out["fraud_reason"].tolist() == [None, None, "burst_activity", "burst_activity"]
+
+        # Hanya event dalam 10 menit sebelum event terbaru yang disimpan
+        kept = state.lookup([1, 2])
+        assert kept["transaction_id"].tolist() == ["a2", "a3", "a4", "b1", "b2", "b3"]
+
+
+def test_event_state_chunked_matches_memory(tmp_path):
+    """Chunked mode seeded from the event state flags the same rows as the in-memory path"""
+    api_path, db_path = make_raw_files(tmp_path)
+    api = tr.read_api(str(api_path))
+    db = tr.read_db(str(db_path))
+    earlier = api.iloc[:150].copy()
+    earlier["transaction_id"] = "old-" + earlier["transaction_id"]
+    earlier["timestamp"] = pd.to_datetime(earlier["timestamp"], errors="coerce") - pd.Timedelta("4h")
+    earlier = earlier.dropna(subset=["timestamp"])
+    # Run sebelumnya berakhir tepat saat run ini mulai
+    earlier["timestamp"] += (pd.to_datetime(api["timestamp"], errors="coerce").min()
+                             - earlier["timestamp"].max() - pd.Timedelta("1s"))
+
+    def seeded_state(name):
+        state = EventStateStore(str(tmp_path / name), tr.FRAUD_RULES.max_window)
+        state.update(earlier.assign(event_time=earlier["timestamp"]))
+        state.commit()
+        return state
+
+    with seeded_state("memory.sqlite") as state:
+        expected = tr.transform(api, db, state)
+    assert expected["is_fraud"].sum() > tr.transform(api, db)["is_fraud"].sum()
+    to_storage(expected).to_csv(tmp_path / "expected.csv", index=False)
+
+    def canonical(path):
+        df = pd.read_csv(path)
+        return df.sort_values("transaction_id", ignore_index=True)
+
+    for mode in ("chunked", "parallel"):
+        out_path = tmp_path / f"{mode}.csv"
+        with seeded_state(f"{mode}.sqlite") as state:
+            if mode == "chunked":
+                tr.transform_chunked(str(api_path), str(db_path), str(out_path),
+                                     spill_dir=str(tmp_path / "spill"), chunk_rows=60, state=state)
+            else:
+                tr.transform_parallel(str(api_path), str(db_path), str(out_path), workers=2, buckets=4,
+                                      spill_dir=str(tmp_path / "spill"), chunk_rows=60, state=state)
+            state.commit()
+            stored = len(state.lookup(range(1, 6)))
+
+        pd.testing.assert_frame_equal(canonical(out_path), canonical(tmp_path / "expected.csv"), obj=mode)
+        assert 0 < stored < len(earlier) + len(expected)
+
+
 if __name__ == "__main__":
     pytest.main([__file__])
 
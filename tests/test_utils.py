@@ -0,0 +1,107 @@
+"""
+Unit tests for utils.py (run metrics)
+"""
+
+import json
+import threading
+import sys
+import os
+
+import numpy as np
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from scripts import utils
+from scripts.utils import RunMetrics
+
+
+def test_run_metrics_writes_manifest_and_textfile(tmp_path):
+    src = tmp_path / "in.bin"
+    src.write_bytes(b"x" * 1000)
+    metrics = RunMetrics("transform", run_id="run-1", metrics_dir=str(tmp_path / "metrics"))
+    with metrics.run():
+        with metrics.step("read") as step:
+            step.read(str(src))
+            step.rows_out = 10
+        with metrics.step("rules") as step:
+            step.rows_in = 10
+            with metrics.step("burst") as inner:
+                buf = np.ones(8 * 1024 * 1024)  # 64MB, terlihat di peak RSS
+                inner.rows_in = inner.rows_out = 10
+                del buf
+            step.rows_out = 10
+
+    with open(tmp_path / "metrics" / "runs" / "run-1_transform.json") as f:
+        manifest = json.load(f)
+    assert manifest["status"] == "success"
+    assert [(s["name"], s["parent"]) for s in manifest["steps"]] == [
+        ("read", None), ("rules", None), ("burst", "rules")]
+    steps = {s["name"]: s for s in manifest["steps"]}
+    assert steps["read"]["bytes_read"] == 1000 and manifest["bytes_read"] == 1000
+    assert steps["burst"]["peak_rss_mb"] >= 60
+    # Peak step bersarang juga berlaku untuk parent-nya
+    assert steps["rules"]["peak_rss_mb"] >= steps["burst"]["peak_rss_mb"]
+    assert steps["rules"]["wall_seconds"] >= steps["burst"]["wall_seconds"]
+
+    prom = (tmp_path / "metrics" / "prometheus" / "etl_transform.prom").read_text()
+    assert 'etl_run_success{stage="transform"} 1' in prom
+    assert 'etl_step_bytes_read{stage="transform",step="read"} 1000' in prom
+    assert "# TYPE etl_step_wall_seconds gauge" in prom
+    assert not (tmp_path / "metrics" / "prometheus" / "etl_transform.prom.tmp").exists()
+
+
+def test_run_metrics_marks_failed_runs(tmp_path):
+    metrics = RunMetrics("load", run_id="run-2", metrics_dir=str(tmp_path))
+    with pytest.raises(RuntimeError):
+        with metrics.run(), metrics.step("load"):
+            raise RuntimeError("boom")
+    with open(tmp_path / "runs" / "run-2_load.json") as f:
+        assert json.load(f)["status"] == "failed"
+    assert 'etl_run_success{stage="load"} 0' in (tmp_path / "prometheus" / "etl_load.prom").read_text()
+
+    disabled = RunMetrics("load", run_id="run-3", metrics_dir=str(tmp_path), enabled=False)
+    with disabled.run():
+        pass
+    assert not (tmp_path / "runs" / "run-3_load.json").exists()
+
+
+def test_concurrent_stages_do_not_reset_each_others_peak(tmp_path, monkeypatch):
+    """Overlapping steps of two stages (threads) never reset VmHWM and are marked shared"""
+    resets = []
+    monkeypatch.setattr(utils, "_reset_hwm", lambda: resets.append(threading.current_thread().name) or True)
+    started, done = threading.Barrier(2), threading.Event()
+
+    def stage(name, first):
+        metrics = RunMetrics(name, run_id="run-4", metrics_dir=str(tmp_path))
+        with metrics.run():
+            if first:
+                with metrics.step("fetch"):
+                    started.wait()
+                    done.wait()
+            else:
+                started.wait()
+                with metrics.step("fetch"):
+                    pass
+                done.set()
+
+    threads = [threading.Thread(target=stage, args=(name, first), name=name)
+               for name, first in [("extract_api", True), ("extract_db", False)]]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Hanya step pertama (saat belum ada step lain) yang me-reset VmHWM
+    assert resets == ["extract_api"]
+    for name in ("extract_api", "extract_db"):
+        with open(tmp_path / "runs" / f"run-4_{name}.json") as f:
+            manifest = json.load(f)
+        assert manifest["shared"] and manifest["steps"][0]["shared"]
+
+    solo = RunMetrics("load", run_id="run-5", metrics_dir=str(tmp_path))
+    with solo.run(), solo.step("load"):
+        pass
+    with open(tmp_path / "runs" / "run-5_load.json") as f:
+        assert json.load(f)["shared"] is False